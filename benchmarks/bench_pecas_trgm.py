@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+"""
+Benchmark da busca por substring na tabela pecas
+
+Compara o plano e o tempo de execução do filtro antigo
+(descricao ILIKE '%termo%', varredura sequencial) com o filtro sem
+acentos servido pelo índice trigram idx_pecas_descricao_trgm
+(f_unaccent(descricao) ILIKE f_unaccent('%termo%')).
+
+Uso:
+    DATABASE_URL=postgresql://... python benchmarks/bench_pecas_trgm.py [termo ...]
+
+Requer sql_scripts/03_derived_structures_v5.sql aplicado.
+"""
+
+import os
+import sys
+import json
+import statistics
+
+import psycopg2
+
+DEFAULT_TERMS = ["valvula", "filtro de ar", "oleo", "parafuso", "vela"]
+RUNS = 5
+
+QUERIES = {
+    "antes": "SELECT codigo_material FROM pecas WHERE descricao ILIKE %s",
+    "depois": "SELECT codigo_material FROM pecas WHERE f_unaccent(descricao) ILIKE f_unaccent(%s)",
+}
+
+
+def plan_nodes(plan):
+    """Percorre o plano JSON devolvendo (tipo do nó, índice usado)"""
+    nodes = [(plan["Node Type"], plan.get("Index Name"))]
+    for child in plan.get("Plans", []):
+        nodes.extend(plan_nodes(child))
+    return nodes
+
+
+def explain(cur, sql, term):
+    cur.execute("EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) " + sql, (f"%{term}%",))
+    result = cur.fetchone()[0]
+    if isinstance(result, str):
+        result = json.loads(result)
+    return result[0]
+
+
+def bench_term(cur, term):
+    print(f"\nTermo: {term!r}")
+    for label, sql in QUERIES.items():
+        timings = []
+        for _ in range(RUNS):
+            report = explain(cur, sql, term)
+            timings.append(report["Execution Time"])
+        plan = report["Plan"]
+        nodes = " -> ".join(
+            f"{node} ({index})" if index else node for node, index in plan_nodes(plan)
+        )
+        print(f"  {label:7s} linhas={plan['Actual Rows']:<6d} "
+              f"mediana={statistics.median(timings):8.3f} ms  "
+              f"buffers={plan.get('Shared Hit Blocks', 0) + plan.get('Shared Read Blocks', 0):<6d} "
+              f"plano: {nodes}")
+
+
+def main():
+    dsn = os.getenv("DATABASE_URL")
+    if not dsn:
+        print("❌ DATABASE_URL não definido no ambiente")
+        return 1
+
+    terms = sys.argv[1:] or DEFAULT_TERMS
+    with psycopg2.connect(dsn) as conn:
+        with conn.cursor() as cur:
+            cur.execute("ANALYZE pecas")
+            for term in terms:
+                bench_term(cur, term)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
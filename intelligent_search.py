@@ -5,7 +5,6 @@ Sistema de Busca Inteligente para Produtos STIHL
 import os
 import json
 import re
-import psycopg2
 import openai
 from typing import Dict, List, Any, Optional, Tuple
 from datetime import datetime
@@ -13,6 +12,10 @@ import logging
 from dataclasses import dataclass
 from enum import Enum
 
+from src.services.analytics_sink import emit_search_event, search_event
+from src.utils.db_pool import connection
+from src.utils.pagination import decode_cursor, encode_cursor
+
 # Configurar logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -35,6 +38,7 @@ class SearchQuery:
     limit: int = 20
     offset: int = 0
     user_context: Optional[Dict[str, Any]] = None
+    cursor: Optional[str] = None  # keyset (faixa de preço); substitui offset
 
 @dataclass
 class SearchResult:
@@ -97,8 +101,13 @@ class IntelligentSearchEngine:
     def search(self, query: SearchQuery) -> SearchResult:
         """
         Executa uma busca inteligente
+
+        Raises:
+            CursorError: query.cursor inválido ou de outra consulta
         """
         start_time = datetime.now()
+        cursor_scope = f"legacy:price_range:{query.query_text}"
+        after = decode_cursor(query.cursor, cursor_scope)
         
         try:
             logger.info(f"Executando busca: {query.query_text}")
@@ -114,7 +123,7 @@ class IntelligentSearchEngine:
             elif query.search_type == SearchType.CATEGORY_SEARCH:
                 results = self._search_categories(query)
             elif query.search_type == SearchType.PRICE_RANGE:
-                results = self._search_by_price_range(query)
+                results = self._search_by_price_range(query, after)
             elif query.search_type == SearchType.TECHNICAL_SPECS:
                 results = self._search_by_specs(query)
             elif query.search_type == SearchType.RECOMMENDATION:
@@ -128,6 +137,12 @@ class IntelligentSearchEngine:
             
             # Gerar sugestões
             suggestions = self._generate_suggestions(query, results)
+
+            # Página cheia na faixa de preço: cursor da próxima (preço, id)
+            next_cursor = None
+            if query.search_type == SearchType.PRICE_RANGE and results and len(results) >= query.limit:
+                last = results[-1]
+                next_cursor = encode_cursor(cursor_scope, [str(last['price_value']), str(last['id'])])
             
             return SearchResult(
                 success=True,
@@ -138,6 +153,7 @@ class IntelligentSearchEngine:
                 metadata={
                     'query_type': query.search_type.value,
                     'filters_applied': query.filters,
+                    'next_cursor': next_cursor,
                     'timestamp': datetime.now().isoformat()
                 }
             )
@@ -335,61 +351,58 @@ class IntelligentSearchEngine:
         Busca produtos usando a função SQL inteligente
         """
         try:
-            conn = psycopg2.connect(self.database_url)
-            cursor = conn.cursor()
-            
-            # Preparar parâmetros para a função SQL
-            search_text = query.query_text
-            category_filter = query.filters.get('category')
-            min_price = query.filters.get('min', query.filters.get('min_price'))
-            max_price = query.filters.get('max', query.filters.get('max_price'))
-            min_power = query.filters.get('power_kw', query.filters.get('min_power'))
-            max_power = query.filters.get('max_power')
-            
-            # Chamar função SQL de busca inteligente
-            cursor.execute("""
-                SELECT * FROM intelligent_product_search(
-                    p_search_text := %s,
-                    p_category_filter := %s,
-                    p_min_price := %s,
-                    p_max_price := %s,
-                    p_min_power := %s,
-                    p_max_power := %s,
-                    p_limit := %s,
-                    p_offset := %s
-                )
-            """, (
-                search_text,
-                category_filter,
-                min_price,
-                max_price,
-                min_power,
-                max_power,
-                query.limit,
-                query.offset
-            ))
-            
-            results = cursor.fetchall()
-            
-            # Converter resultados para dicionários
-            columns = [desc[0] for desc in cursor.description]
-            products = []
-            
-            for row in results:
-                product = dict(zip(columns, row))
-                # Converter tipos especiais para JSON serializável
-                for key, value in product.items():
-                    if hasattr(value, 'isoformat'):  # datetime
-                        product[key] = value.isoformat()
-                    elif isinstance(value, (list, dict)):  # JSON fields
-                        product[key] = value
-                products.append(product)
-            
-            cursor.close()
-            conn.close()
-            
-            return products
-            
+            with connection(self.database_url) as conn:
+                cursor = conn.cursor()
+            
+                # Preparar parâmetros para a função SQL
+                search_text = query.query_text
+                category_filter = query.filters.get('category')
+                min_price = query.filters.get('min', query.filters.get('min_price'))
+                max_price = query.filters.get('max', query.filters.get('max_price'))
+                min_power = query.filters.get('power_kw', query.filters.get('min_power'))
+                max_power = query.filters.get('max_power')
+            
+                # Chamar função SQL de busca inteligente
+                cursor.execute("""
+                    SELECT * FROM intelligent_product_search(
+                        p_search_text := %s,
+                        p_category_filter := %s,
+                        p_min_price := %s,
+                        p_max_price := %s,
+                        p_min_power := %s,
+                        p_max_power := %s,
+                        p_limit := %s,
+                        p_offset := %s
+                    )
+                """, (
+                    search_text,
+                    category_filter,
+                    min_price,
+                    max_price,
+                    min_power,
+                    max_power,
+                    query.limit,
+                    query.offset
+                ))
+            
+                results = cursor.fetchall()
+            
+                # Converter resultados para dicionários
+                columns = [desc[0] for desc in cursor.description]
+                products = []
+            
+                for row in results:
+                    product = dict(zip(columns, row))
+                    # Converter tipos especiais para JSON serializável
+                    for key, value in product.items():
+                        if hasattr(value, 'isoformat'):  # datetime
+                            product[key] = value.isoformat()
+                        elif isinstance(value, (list, dict)):  # JSON fields
+                            product[key] = value
+                    products.append(product)
+            
+                return products
+
         except Exception as e:
             logger.error(f"Erro na busca de produtos: {e}")
             return []
@@ -399,66 +412,74 @@ class IntelligentSearchEngine:
         Busca categorias
         """
         try:
-            conn = psycopg2.connect(self.database_url)
-            cursor = conn.cursor()
-            
-            cursor.execute("""
-                SELECT * FROM get_categories_hierarchy()
-                WHERE name ILIKE %s OR description ILIKE %s
-                ORDER BY level, sort_order
-                LIMIT %s OFFSET %s
-            """, (
-                f"%{query.query_text}%",
-                f"%{query.query_text}%",
-                query.limit,
-                query.offset
-            ))
-            
-            results = cursor.fetchall()
-            columns = [desc[0] for desc in cursor.description]
-            categories = [dict(zip(columns, row)) for row in results]
+            with connection(self.database_url) as conn:
+                cursor = conn.cursor()
             
-            cursor.close()
-            conn.close()
-            
-            return categories
+                cursor.execute("""
+                    SELECT * FROM get_categories_hierarchy()
+                    WHERE name ILIKE %s OR description ILIKE %s
+                    ORDER BY level, sort_order
+                    LIMIT %s OFFSET %s
+                """, (
+                    f"%{query.query_text}%",
+                    f"%{query.query_text}%",
+                    query.limit,
+                    query.offset
+                ))
+            
+                results = cursor.fetchall()
+                columns = [desc[0] for desc in cursor.description]
+                categories = [dict(zip(columns, row)) for row in results]
             
+                return categories
+
         except Exception as e:
             logger.error(f"Erro na busca de categorias: {e}")
             return []
     
-    def _search_by_price_range(self, query: SearchQuery) -> List[Dict[str, Any]]:
+    def _search_by_price_range(self, query: SearchQuery,
+                               after: Optional[List[str]] = None) -> List[Dict[str, Any]]:
         """
         Busca por faixa de preço
+
+        Com ``after`` (preço, id do último item entregue) a página começa
+        depois dele (keyset) em vez de pular ``offset`` linhas.
         """
         try:
-            conn = psycopg2.connect(self.database_url)
-            cursor = conn.cursor()
-            
-            min_price = query.filters.get('min', 0)
-            max_price = query.filters.get('max', 999999)
-            
-            cursor.execute("""
-                SELECT p.*, pr.price_value, c.name as category_name
-                FROM products p
-                JOIN pricing pr ON p.id = pr.product_id
-                JOIN categories c ON p.category_id = c.id
-                WHERE pr.is_active = true 
-                AND pr.price_type = 'suggested_retail'
-                AND pr.price_value BETWEEN %s AND %s
-                ORDER BY pr.price_value
-                LIMIT %s OFFSET %s
-            """, (min_price, max_price, query.limit, query.offset))
-            
-            results = cursor.fetchall()
-            columns = [desc[0] for desc in cursor.description]
-            products = [dict(zip(columns, row)) for row in results]
+            with connection(self.database_url) as conn:
+                cursor = conn.cursor()
+            
+                min_price = query.filters.get('min', 0)
+                max_price = query.filters.get('max', 999999)
+            
+                keyset = ""
+                params: List[Any] = [min_price, max_price]
+                if after is not None:
+                    keyset = "AND (pr.price_value, p.id) > (%s, %s)"
+                    params.extend(after)
+                    offset = 0
+                else:
+                    offset = query.offset
             
-            cursor.close()
-            conn.close()
+                cursor.execute(f"""
+                    SELECT p.*, pr.price_value, c.name as category_name
+                    FROM products p
+                    JOIN pricing pr ON p.id = pr.product_id
+                    JOIN categories c ON p.category_id = c.id
+                    WHERE pr.is_active = true 
+                    AND pr.price_type = 'suggested_retail'
+                    AND pr.price_value BETWEEN %s AND %s
+                    {keyset}
+                    ORDER BY pr.price_value, p.id
+                    LIMIT %s OFFSET %s
+                """, params + [query.limit, offset])
             
-            return products
+                results = cursor.fetchall()
+                columns = [desc[0] for desc in cursor.description]
+                products = [dict(zip(columns, row)) for row in results]
             
+                return products
+
         except Exception as e:
             logger.error(f"Erro na busca por preço: {e}")
             return []
@@ -468,50 +489,47 @@ class IntelligentSearchEngine:
         Busca por especificações técnicas
         """
         try:
-            conn = psycopg2.connect(self.database_url)
-            cursor = conn.cursor()
-            
-            # Construir condições WHERE dinamicamente
-            conditions = []
-            params = []
-            
-            if 'power_kw' in query.filters:
-                conditions.append("ts.power_kw >= %s")
-                params.append(query.filters['power_kw'])
+            with connection(self.database_url) as conn:
+                cursor = conn.cursor()
             
-            if 'power_hp' in query.filters:
-                conditions.append("ts.power_hp >= %s")
-                params.append(query.filters['power_hp'])
+                # Construir condições WHERE dinamicamente
+                conditions = []
+                params = []
             
-            if 'weight_kg' in query.filters:
-                conditions.append("ts.weight_kg <= %s")
-                params.append(query.filters['weight_kg'])
+                if 'power_kw' in query.filters:
+                    conditions.append("ts.power_kw >= %s")
+                    params.append(query.filters['power_kw'])
             
-            if 'displacement_cc' in query.filters:
-                conditions.append("ts.displacement_cc >= %s")
-                params.append(query.filters['displacement_cc'])
+                if 'power_hp' in query.filters:
+                    conditions.append("ts.power_hp >= %s")
+                    params.append(query.filters['power_hp'])
             
-            where_clause = " AND ".join(conditions) if conditions else "1=1"
+                if 'weight_kg' in query.filters:
+                    conditions.append("ts.weight_kg <= %s")
+                    params.append(query.filters['weight_kg'])
             
-            cursor.execute(f"""
-                SELECT p.*, ts.*, c.name as category_name
-                FROM products p
-                JOIN technical_specifications ts ON p.id = ts.product_id
-                JOIN categories c ON p.category_id = c.id
-                WHERE {where_clause}
-                ORDER BY ts.power_kw DESC
-                LIMIT %s OFFSET %s
-            """, params + [query.limit, query.offset])
+                if 'displacement_cc' in query.filters:
+                    conditions.append("ts.displacement_cc >= %s")
+                    params.append(query.filters['displacement_cc'])
             
-            results = cursor.fetchall()
-            columns = [desc[0] for desc in cursor.description]
-            products = [dict(zip(columns, row)) for row in results]
+                where_clause = " AND ".join(conditions) if conditions else "1=1"
             
-            cursor.close()
-            conn.close()
+                cursor.execute(f"""
+                    SELECT p.*, ts.*, c.name as category_name
+                    FROM products p
+                    JOIN technical_specifications ts ON p.id = ts.product_id
+                    JOIN categories c ON p.category_id = c.id
+                    WHERE {where_clause}
+                    ORDER BY ts.power_kw DESC
+                    LIMIT %s OFFSET %s
+                """, params + [query.limit, query.offset])
             
-            return products
+                results = cursor.fetchall()
+                columns = [desc[0] for desc in cursor.description]
+                products = [dict(zip(columns, row)) for row in results]
             
+                return products
+
         except Exception as e:
             logger.error(f"Erro na busca por especificações: {e}")
             return []
@@ -521,37 +539,34 @@ class IntelligentSearchEngine:
         Obtém recomendações de produtos
         """
         try:
-            conn = psycopg2.connect(self.database_url)
-            cursor = conn.cursor()
-            
-            # Se há um produto específico, buscar similares
-            if 'product_id' in query.filters:
-                cursor.execute("""
-                    SELECT * FROM get_product_recommendations(%s, %s)
-                """, (query.filters['product_id'], query.limit))
-            else:
-                # Recomendações gerais baseadas em popularidade e avaliações
-                cursor.execute("""
-                    SELECT p.*, pr.price_value, c.name as category_name,
-                           ts.power_kw, ts.weight_kg
-                    FROM products p
-                    JOIN pricing pr ON p.id = pr.product_id
-                    JOIN categories c ON p.category_id = c.id
-                    LEFT JOIN technical_specifications ts ON p.id = ts.product_id
-                    WHERE p.status = 'active' AND pr.is_active = true
-                    ORDER BY pr.price_value, ts.power_kw DESC
-                    LIMIT %s OFFSET %s
-                """, (query.limit, query.offset))
-            
-            results = cursor.fetchall()
-            columns = [desc[0] for desc in cursor.description]
-            products = [dict(zip(columns, row)) for row in results]
-            
-            cursor.close()
-            conn.close()
-            
-            return products
+            with connection(self.database_url) as conn:
+                cursor = conn.cursor()
+            
+                # Se há um produto específico, buscar similares
+                if 'product_id' in query.filters:
+                    cursor.execute("""
+                        SELECT * FROM get_product_recommendations(%s, %s)
+                    """, (query.filters['product_id'], query.limit))
+                else:
+                    # Recomendações gerais baseadas em popularidade e avaliações
+                    cursor.execute("""
+                        SELECT p.*, pr.price_value, c.name as category_name,
+                               ts.power_kw, ts.weight_kg
+                        FROM products p
+                        JOIN pricing pr ON p.id = pr.product_id
+                        JOIN categories c ON p.category_id = c.id
+                        LEFT JOIN technical_specifications ts ON p.id = ts.product_id
+                        WHERE p.status = 'active' AND pr.is_active = true
+                        ORDER BY pr.price_value, ts.power_kw DESC
+                        LIMIT %s OFFSET %s
+                    """, (query.limit, query.offset))
+            
+                results = cursor.fetchall()
+                columns = [desc[0] for desc in cursor.description]
+                products = [dict(zip(columns, row)) for row in results]
             
+                return products
+
         except Exception as e:
             logger.error(f"Erro ao obter recomendações: {e}")
             return []
@@ -605,32 +620,28 @@ class IntelligentSearchEngine:
         Obtém detalhes completos de um produto
         """
         try:
-            conn = psycopg2.connect(self.database_url)
-            cursor = conn.cursor()
+            with connection(self.database_url) as conn:
+                cursor = conn.cursor()
             
-            cursor.execute("""
-                SELECT * FROM get_product_by_code(%s)
-            """, (product_id,))
+                cursor.execute("""
+                    SELECT * FROM get_product_by_code(%s)
+                """, (product_id,))
             
-            result = cursor.fetchone()
+                result = cursor.fetchone()
             
-            if result:
-                columns = [desc[0] for desc in cursor.description]
-                product = dict(zip(columns, result))
+                if result:
+                    columns = [desc[0] for desc in cursor.description]
+                    product = dict(zip(columns, result))
                 
-                # Converter tipos especiais
-                for key, value in product.items():
-                    if hasattr(value, 'isoformat'):
-                        product[key] = value.isoformat()
+                    # Converter tipos especiais
+                    for key, value in product.items():
+                        if hasattr(value, 'isoformat'):
+                            product[key] = value.isoformat()
                 
-                cursor.close()
-                conn.close()
-                return product
-            
-            cursor.close()
-            conn.close()
-            return None
+                    return product
             
+                return None
+
         except Exception as e:
             logger.error(f"Erro ao obter detalhes do produto: {e}")
             return None
@@ -640,58 +651,55 @@ class IntelligentSearchEngine:
         Obtém analytics das buscas realizadas
         """
         try:
-            conn = psycopg2.connect(self.database_url)
-            cursor = conn.cursor()
-            
-            # Consultas mais populares
-            cursor.execute("""
-                SELECT query_type, COUNT(*) as count
-                FROM query_metrics
-                WHERE created_at >= NOW() - INTERVAL '30 days'
-                GROUP BY query_type
-                ORDER BY count DESC
-                LIMIT 10
-            """)
-            
-            popular_queries = cursor.fetchall()
-            
-            # Tempo médio de resposta
-            cursor.execute("""
-                SELECT AVG(execution_time_ms) as avg_time,
-                       MIN(execution_time_ms) as min_time,
-                       MAX(execution_time_ms) as max_time
-                FROM query_metrics
-                WHERE created_at >= NOW() - INTERVAL '7 days'
-            """)
-            
-            performance_stats = cursor.fetchone()
-            
-            # Produtos mais buscados
-            cursor.execute("""
-                SELECT p.name, COUNT(*) as search_count
-                FROM query_metrics qm
-                JOIN products p ON (qm.query_parameters->>'product_id')::uuid = p.id
-                WHERE qm.created_at >= NOW() - INTERVAL '30 days'
-                GROUP BY p.name
-                ORDER BY search_count DESC
-                LIMIT 10
-            """)
-            
-            popular_products = cursor.fetchall()
-            
-            cursor.close()
-            conn.close()
-            
-            return {
-                'popular_queries': [{'type': row[0], 'count': row[1]} for row in popular_queries],
-                'performance': {
-                    'avg_time_ms': float(performance_stats[0]) if performance_stats[0] else 0,
-                    'min_time_ms': performance_stats[1] or 0,
-                    'max_time_ms': performance_stats[2] or 0
-                },
-                'popular_products': [{'name': row[0], 'count': row[1]} for row in popular_products]
-            }
+            with connection(self.database_url) as conn:
+                cursor = conn.cursor()
+            
+                # Consultas mais populares
+                cursor.execute("""
+                    SELECT details->>'query_type' AS query_type, ROUND(SUM(1.0 / sample_rate))::BIGINT as count
+                    FROM search_analytics_v5
+                    WHERE source = 'legacy' AND occurred_at >= NOW() - INTERVAL '30 days'
+                    GROUP BY 1
+                    ORDER BY count DESC
+                    LIMIT 10
+                """)
+            
+                popular_queries = cursor.fetchall()
             
+                # Tempo médio de resposta
+                cursor.execute("""
+                    SELECT AVG(response_time_ms) as avg_time,
+                           MIN(response_time_ms) as min_time,
+                           MAX(response_time_ms) as max_time
+                    FROM search_analytics_v5
+                    WHERE source = 'legacy' AND occurred_at >= NOW() - INTERVAL '7 days'
+                """)
+            
+                performance_stats = cursor.fetchone()
+            
+                # Produtos mais buscados
+                cursor.execute("""
+                    SELECT p.name, ROUND(SUM(1.0 / sa.sample_rate))::BIGINT as search_count
+                    FROM search_analytics_v5 sa
+                    JOIN products p ON (sa.details->>'product_id')::uuid = p.id
+                    WHERE sa.source = 'legacy' AND sa.occurred_at >= NOW() - INTERVAL '30 days'
+                    GROUP BY p.name
+                    ORDER BY search_count DESC
+                    LIMIT 10
+                """)
+            
+                popular_products = cursor.fetchall()
+            
+                return {
+                    'popular_queries': [{'type': row[0], 'count': row[1]} for row in popular_queries],
+                    'performance': {
+                        'avg_time_ms': float(performance_stats[0]) if performance_stats[0] else 0,
+                        'min_time_ms': performance_stats[1] or 0,
+                        'max_time_ms': performance_stats[2] or 0
+                    },
+                    'popular_products': [{'name': row[0], 'count': row[1]} for row in popular_products]
+                }
+
         except Exception as e:
             logger.error(f"Erro ao obter analytics: {e}")
             return {}
@@ -699,37 +707,23 @@ class IntelligentSearchEngine:
     def log_search_query(self, query: SearchQuery, result: SearchResult):
         """
         Registra consulta de busca para analytics
+        
+        Enfileira o evento no sink de analytics (gravação em lote em
+        search_analytics_v5, em segundo plano); não abre conexão.
         """
         try:
-            conn = psycopg2.connect(self.database_url)
-            cursor = conn.cursor()
-            
-            # Preparar parâmetros da consulta
-            query_params = {
-                'query_text': query.query_text,
-                'filters': query.filters,
-                'limit': query.limit,
-                'offset': query.offset
-            }
-            
-            cursor.execute("""
-                INSERT INTO query_metrics (
-                    query_type, query_parameters, execution_time_ms, 
-                    result_count, user_id, session_id
-                ) VALUES (%s, %s, %s, %s, %s, %s)
-            """, (
-                query.search_type.value,
-                json.dumps(query_params),
-                result.query_time_ms,
-                result.total_count,
-                query.user_context.get('user_id') if query.user_context else None,
-                query.user_context.get('session_id') if query.user_context else None
+            user_context = query.user_context or {}
+            emit_search_event(search_event(
+                'legacy', query.query_text, result.total_count, result.query_time_ms,
+                details={
+                    'query_type': query.search_type.value,
+                    'filters': query.filters,
+                    'limit': query.limit,
+                    'offset': query.offset,
+                    'user_id': user_context.get('user_id'),
+                    'session_id': user_context.get('session_id'),
+                }
             ))
-            
-            conn.commit()
-            cursor.close()
-            conn.close()
-            
+
         except Exception as e:
             logger.error(f"Erro ao registrar consulta: {e}")
-
@@ -5,6 +5,8 @@ API de Busca Inteligente para Produtos STIHL
 import json
 from flask import Blueprint, request, jsonify
 from src.models.intelligent_search import IntelligentSearchEngine, SearchQuery, SearchType
+from src.services.autocomplete import suggest
+from src.utils.pagination import CursorError
 import logging
 
 # Configurar logging
@@ -42,7 +44,8 @@ def search_products():
             "model": "string"
         },
         "limit": number (default: 20),
-        "offset": number (default: 0)
+        "offset": number (default: 0),
+        "cursor": "string - metadata.next_cursor da página anterior (faixa de preço)"
     }
     """
     try:
@@ -68,6 +71,7 @@ def search_products():
             filters=data.get('filters', {}),
             limit=data.get('limit', 20),
             offset=data.get('offset', 0),
+            cursor=data.get('cursor'),
             user_context={
                 'user_id': request.headers.get('X-User-ID'),
                 'session_id': request.headers.get('X-Session-ID'),
@@ -77,7 +81,10 @@ def search_products():
         
         # Executar busca
         search_engine = get_search_engine()
-        result = search_engine.search(query)
+        try:
+            result = search_engine.search(query)
+        except CursorError as e:
+            return jsonify({'success': False, 'error': str(e)}), 400
         
         # Registrar consulta para analytics
         search_engine.log_search_query(query, result)
@@ -115,6 +122,7 @@ def search_products_get():
     - category: filtro de categoria
     - min_price, max_price: faixa de preço
     - limit, offset: paginação
+    - cursor: metadata.next_cursor da página anterior (faixa de preço)
     """
     try:
         query_text = request.args.get('q', '')
@@ -156,6 +164,7 @@ def search_products_get():
             filters=filters,
             limit=int(request.args.get('limit', 20)),
             offset=int(request.args.get('offset', 0)),
+            cursor=request.args.get('cursor'),
             user_context={
                 'user_id': request.headers.get('X-User-ID'),
                 'session_id': request.headers.get('X-Session-ID'),
@@ -165,7 +174,10 @@ def search_products_get():
         
         # Executar busca
         search_engine = get_search_engine()
-        result = search_engine.search(query)
+        try:
+            result = search_engine.search(query)
+        except CursorError as e:
+            return jsonify({'success': False, 'error': str(e)}), 400
         
         # Registrar consulta
         search_engine.log_search_query(query, result)
@@ -337,40 +349,8 @@ def get_search_suggestions():
                 'suggestions': []
             })
         
-        # Sugestões básicas baseadas em padrões comuns
-        suggestions = []
-        
-        # Sugestões de modelos
-        if 'ms' in partial_text.lower():
-            suggestions.extend([
-                'MS 162 motosserra',
-                'MS 172 motosserra',
-                'MS 250 motosserra',
-                'MS 260 motosserra'
-            ])
-        
-        # Sugestões de categorias
-        if any(word in partial_text.lower() for word in ['moto', 'serra']):
-            suggestions.extend([
-                'motosserra elétrica',
-                'motosserra a combustão',
-                'motosserra para poda',
-                'motosserra profissional'
-            ])
-        
-        # Sugestões de preço
-        if any(word in partial_text.lower() for word in ['barato', 'preço', 'até']):
-            suggestions.extend([
-                'até R$ 1000',
-                'até R$ 2000',
-                'até R$ 3000'
-            ])
-        
-        # Filtrar sugestões que contenham o texto parcial
-        filtered_suggestions = [
-            s for s in suggestions 
-            if partial_text.lower() in s.lower()
-        ][:10]
+        # Mesmo índice de prefixos do catálogo usado por /api/search/suggest
+        filtered_suggestions = [item['texto'] for item in suggest(partial_text, 10)]
         
         return jsonify({
             'success': True,
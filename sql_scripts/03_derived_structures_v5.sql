@@ -0,0 +1,906 @@
+-- =====================================================
+-- Estruturas Derivadas do Catálogo para Sistema STIHL AI v5
+-- =====================================================
+-- Este script cria tabelas e índices derivados dos dados importados,
+-- reconstruídos a cada importação, usados pelos caminhos de busca
+-- quentes no lugar de varreduras ILIKE nas tabelas base.
+--
+-- Requer as extensões pg_trgm e unaccent (disponíveis no Supabase).
+--
+-- Pré-requisitos:
+-- 1. Tabelas criadas e dados importados (01 e 05)
+--
+-- Ordem de execução recomendada:
+-- 1. 01_create_tables_v5.sql
+-- 2. 05_import_csv_data_v5.sql
+-- 3. 02_create_functions_v5.sql
+-- 4. 03_derived_structures_v5.sql (este arquivo)
+-- 5. 04_security_rls_v5.sql
+--
+-- Após uma nova importação (05), execute:
+--   SELECT * FROM rebuild_catalog_derived_v5();
+-- =====================================================
+
+-- =====================================================
+-- SEÇÃO 1: BUSCA SEM ACENTOS E POR SUBSTRING
+-- =====================================================
+
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+CREATE EXTENSION IF NOT EXISTS unaccent;
+
+-- unaccent() é STABLE (depende do search_path) e não pode ser usada em
+-- índices. O invólucro fixa schema e dicionário e é IMMUTABLE; o schema
+-- da extensão é detectado (public local, extensions no Supabase).
+DO $$
+DECLARE
+    ext_schema TEXT;
+BEGIN
+    SELECT n.nspname INTO ext_schema
+    FROM pg_extension e
+    JOIN pg_namespace n ON n.oid = e.extnamespace
+    WHERE e.extname = 'unaccent';
+
+    EXECUTE format($f$
+        CREATE OR REPLACE FUNCTION f_unaccent(TEXT)
+        RETURNS TEXT AS
+        $body$ SELECT %1$I.unaccent(%2$L::regdictionary, $1) $body$
+        LANGUAGE sql IMMUTABLE PARALLEL SAFE STRICT
+    $f$, ext_schema, ext_schema || '.unaccent');
+END $$;
+
+-- Índices trigram sem acentos para ILIKE '%termo%' nas colunas pesquisáveis:
+--   WHERE f_unaccent(descricao) ILIKE f_unaccent('%oleo%')
+CREATE INDEX IF NOT EXISTS idx_ms_descricao_trgm ON ms USING gin(f_unaccent(descricao) gin_trgm_ops);
+CREATE INDEX IF NOT EXISTS idx_ms_codigo_trgm ON ms USING gin(codigo_material gin_trgm_ops);
+
+CREATE INDEX IF NOT EXISTS idx_rocadeiras_descricao_trgm ON rocadeiras_e_impl USING gin(f_unaccent(descricao) gin_trgm_ops);
+CREATE INDEX IF NOT EXISTS idx_rocadeiras_codigo_trgm ON rocadeiras_e_impl USING gin(codigo_material gin_trgm_ops);
+
+CREATE INDEX IF NOT EXISTS idx_produtos_bateria_descricao_trgm ON produtos_a_bateria USING gin(f_unaccent(descricao) gin_trgm_ops);
+CREATE INDEX IF NOT EXISTS idx_produtos_bateria_codigo_trgm ON produtos_a_bateria USING gin(codigo_material gin_trgm_ops);
+
+CREATE INDEX IF NOT EXISTS idx_pecas_descricao_trgm ON pecas USING gin(f_unaccent(descricao) gin_trgm_ops);
+CREATE INDEX IF NOT EXISTS idx_pecas_modelos_trgm ON pecas USING gin(f_unaccent(modelos) gin_trgm_ops);
+CREATE INDEX IF NOT EXISTS idx_pecas_codigo_trgm ON pecas USING gin(codigo_material gin_trgm_ops);
+
+CREATE INDEX IF NOT EXISTS idx_acessorios_descricao_trgm ON acessorios USING gin(f_unaccent(descricao) gin_trgm_ops);
+CREATE INDEX IF NOT EXISTS idx_acessorios_modelos_trgm ON acessorios USING gin(f_unaccent(modelos) gin_trgm_ops);
+CREATE INDEX IF NOT EXISTS idx_acessorios_codigo_trgm ON acessorios USING gin(codigo_material gin_trgm_ops);
+
+CREATE INDEX IF NOT EXISTS idx_sabres_descricao_trgm ON sabres_correntes_pinhoes_limas USING gin(f_unaccent(descricao) gin_trgm_ops);
+CREATE INDEX IF NOT EXISTS idx_sabres_modelos_trgm ON sabres_correntes_pinhoes_limas USING gin(f_unaccent(modelos_maquinas) gin_trgm_ops);
+CREATE INDEX IF NOT EXISTS idx_sabres_codigo_trgm ON sabres_correntes_pinhoes_limas USING gin(codigo_material gin_trgm_ops);
+
+CREATE INDEX IF NOT EXISTS idx_ferramentas_descricao_trgm ON ferramentas USING gin(f_unaccent(descricao) gin_trgm_ops);
+CREATE INDEX IF NOT EXISTS idx_ferramentas_modelos_trgm ON ferramentas USING gin(f_unaccent(modelos) gin_trgm_ops);
+CREATE INDEX IF NOT EXISTS idx_ferramentas_codigo_trgm ON ferramentas USING gin(codigo_material gin_trgm_ops);
+
+CREATE INDEX IF NOT EXISTS idx_epis_descricao_trgm ON epis USING gin(f_unaccent(descricao) gin_trgm_ops);
+CREATE INDEX IF NOT EXISTS idx_epis_codigo_trgm ON epis USING gin(codigo_material gin_trgm_ops);
+
+-- =====================================================
+-- SEÇÃO 2: NORMALIZAÇÃO DE MODELOS
+-- =====================================================
+
+-- Extrai modelos canônicos de um campo livre de compatibilidade.
+-- "MS 182 210 230" e "MS310 361 362" herdam a família do token anterior;
+-- "MSA220.0" vira "MSA220" e "HT131-PMN" vira "HT131".
+-- Espelha extract_models() em src/services/text_normalizer.py.
+CREATE OR REPLACE FUNCTION extract_models_v5(p_text TEXT)
+RETURNS TEXT[] AS $$
+DECLARE
+    tok TEXT;
+    family TEXT := NULL;
+    m TEXT[];
+    model TEXT;
+    result TEXT[] := ARRAY[]::TEXT[];
+BEGIN
+    FOREACH tok IN ARRAY regexp_split_to_array(COALESCE(p_text, ''), '[\s;,]+') LOOP
+        CONTINUE WHEN tok = '';
+        m := regexp_match(upper(tok), '^([A-Z]{1,4})-?([0-9]{2,4})(?:\.0)?([A-Z]{0,3})(?:-[A-Z0-9]+)?$');
+        IF m IS NOT NULL THEN
+            family := m[1];
+            model := m[1] || m[2] || m[3];
+        ELSIF tok ~ '^[A-Z]{2,4}$' THEN
+            family := tok;
+            CONTINUE;
+        ELSIF family IS NOT NULL AND tok ~ '^[0-9]{2,4}(\.0)?$' THEN
+            model := family || split_part(tok, '.', 1);
+        ELSE
+            family := NULL;
+            CONTINUE;
+        END IF;
+        IF NOT model = ANY(result) THEN
+            result := result || model;
+        END IF;
+    END LOOP;
+    RETURN result;
+END;
+$$ LANGUAGE plpgsql IMMUTABLE PARALLEL SAFE;
+
+-- "ms 250", "MS-250" e "MS250.0" -> "MS250"
+CREATE OR REPLACE FUNCTION canonical_model_v5(p_model TEXT)
+RETURNS TEXT AS $$
+    SELECT COALESCE((extract_models_v5(upper(p_model)))[1], upper(trim(p_model)));
+$$ LANGUAGE sql IMMUTABLE PARALLEL SAFE;
+
+-- Índices GIN por expressão para consultas ad hoc nas tabelas base:
+--   WHERE extract_models_v5(modelos) @> ARRAY['MS250']
+CREATE INDEX IF NOT EXISTS idx_pecas_modelos_canonicos ON pecas USING gin(extract_models_v5(modelos));
+CREATE INDEX IF NOT EXISTS idx_acessorios_modelos_canonicos ON acessorios USING gin(extract_models_v5(modelos));
+CREATE INDEX IF NOT EXISTS idx_sabres_modelos_canonicos ON sabres_correntes_pinhoes_limas USING gin(extract_models_v5(modelos_maquinas));
+CREATE INDEX IF NOT EXISTS idx_ferramentas_modelos_canonicos ON ferramentas USING gin(extract_models_v5(modelos));
+CREATE INDEX IF NOT EXISTS idx_cj_corte_fs_modelos_canonicos ON cj_corte_fs USING gin(extract_models_v5(modelo));
+
+-- =====================================================
+-- SEÇÃO 3: ÍNDICE DE COMPATIBILIDADE POR MODELO
+-- =====================================================
+
+-- Uma linha por (produto, modelo canônico), com descrição e preço
+-- desnormalizados para que "o que serve na MS 250" seja uma única
+-- varredura de intervalo no índice, já na ordem de preço.
+CREATE TABLE IF NOT EXISTS product_compatibility_v5 (
+    modelo_canonico VARCHAR(20) NOT NULL,
+    source_table VARCHAR(50) NOT NULL,
+    codigo_material VARCHAR(40) NOT NULL,
+    descricao TEXT,
+    preco_real DECIMAL(12,2),
+    PRIMARY KEY (modelo_canonico, source_table, codigo_material)
+);
+
+CREATE INDEX IF NOT EXISTS idx_product_compat_modelo_preco
+    ON product_compatibility_v5 (modelo_canonico, preco_real, codigo_material);
+CREATE INDEX IF NOT EXISTS idx_product_compat_produto
+    ON product_compatibility_v5 (source_table, codigo_material);
+
+CREATE OR REPLACE FUNCTION rebuild_product_compatibility_v5()
+RETURNS INTEGER AS $$
+DECLARE
+    total INTEGER;
+BEGIN
+    TRUNCATE product_compatibility_v5;
+
+    INSERT INTO product_compatibility_v5 (modelo_canonico, source_table, codigo_material, descricao, preco_real)
+    SELECT
+        modelo, src.source_table, src.codigo_material, src.descricao, src.preco_real
+    FROM (
+        SELECT 'pecas'::TEXT AS source_table, codigo_material, descricao::TEXT AS descricao, preco_real, modelos AS texto FROM pecas
+        UNION ALL
+        SELECT 'acessorios', codigo_material, descricao::TEXT, preco_real, modelos FROM acessorios
+        UNION ALL
+        SELECT 'sabres_correntes_pinhoes_limas', codigo_material, descricao::TEXT, preco_real, modelos_maquinas FROM sabres_correntes_pinhoes_limas
+        UNION ALL
+        SELECT 'ferramentas', codigo_material, descricao::TEXT, preco_real, modelos FROM ferramentas
+        UNION ALL
+        SELECT 'cj_corte_fs', codigo_material, descricao::TEXT, preco_real, modelo FROM cj_corte_fs
+    ) src
+    CROSS JOIN LATERAL unnest(extract_models_v5(src.texto)) AS modelo
+    WHERE src.codigo_material IS NOT NULL;
+
+    GET DIAGNOSTICS total = ROW_COUNT;
+    ANALYZE product_compatibility_v5;
+    RETURN total;
+END;
+$$ LANGUAGE plpgsql;
+
+-- =====================================================
+-- SEÇÃO 4: DIRETÓRIO UNIVERSAL DE IDENTIFICADORES
+-- =====================================================
+
+-- Código de barras numérico -> texto sem zeros à esquerda
+CREATE OR REPLACE FUNCTION normalize_barcode_v5(p_value NUMERIC)
+RETURNS TEXT AS $$
+    SELECT NULLIF(ltrim(trunc(p_value)::TEXT, '0'), '');
+$$ LANGUAGE sql IMMUTABLE PARALLEL SAFE;
+
+-- Chaves candidatas para um identificador digitado pelo usuário.
+-- Espelha identifier_keys() em src/services/identifier_directory.py.
+CREATE OR REPLACE FUNCTION identifier_keys_v5(p_identifier TEXT)
+RETURNS TEXT[] AS $$
+DECLARE
+    v TEXT := upper(trim(COALESCE(p_identifier, '')));
+    digits TEXT;
+    keys TEXT[] := ARRAY[]::TEXT[];
+BEGIN
+    IF v = '' THEN
+        RETURN keys;
+    END IF;
+    keys := keys || v;
+
+    IF v ~ '^CA[\s:.]*[0-9][0-9.\s]*$' THEN
+        -- Certificado de Aprovação de EPI: "CA 12.345"
+        digits := ltrim(regexp_replace(v, '[^0-9]', '', 'g'), '0');
+        keys := keys || ('CA' || digits);
+    ELSIF v ~ '^[0-9][0-9\s]*$' THEN
+        digits := regexp_replace(v, '\s', '', 'g');
+        -- Código de material sem hífens: 00000071043 -> 0000-007-1043
+        IF length(digits) = 11 THEN
+            keys := keys || (substr(digits, 1, 4) || '-' || substr(digits, 5, 3) || '-' || substr(digits, 8, 4));
+        END IF;
+        -- EAN (sem zeros à esquerda) ou número de CA sem prefixo
+        keys := keys || ltrim(digits, '0') || ('CA' || ltrim(digits, '0'));
+    END IF;
+    RETURN keys;
+END;
+$$ LANGUAGE plpgsql IMMUTABLE PARALLEL SAFE;
+
+-- identificador -> (tabela de origem, código canônico)
+-- tipo: codigo | codigo_antigo | ean | ca
+CREATE TABLE IF NOT EXISTS product_identifiers_v5 (
+    identificador VARCHAR(64) NOT NULL,
+    tipo VARCHAR(20) NOT NULL,
+    source_table VARCHAR(50) NOT NULL,
+    codigo_material VARCHAR(40) NOT NULL,
+    PRIMARY KEY (identificador, tipo, source_table, codigo_material)
+);
+
+CREATE INDEX IF NOT EXISTS idx_product_identifiers_produto
+    ON product_identifiers_v5 (source_table, codigo_material);
+
+CREATE OR REPLACE FUNCTION rebuild_product_identifiers_v5()
+RETURNS INTEGER AS $$
+DECLARE
+    total INTEGER;
+BEGIN
+    TRUNCATE product_identifiers_v5;
+
+    INSERT INTO product_identifiers_v5 (identificador, tipo, source_table, codigo_material)
+    WITH RECURSIVE produtos AS (
+        SELECT 'ms'::TEXT AS source_table, codigo_material, cod_barras::NUMERIC AS barras, NULL::TEXT AS ca FROM ms
+        UNION ALL
+        SELECT 'rocadeiras_e_impl', codigo_material, cod_barras::NUMERIC, NULL FROM rocadeiras_e_impl
+        UNION ALL
+        SELECT 'produtos_a_bateria', codigo_material, cod_barras::NUMERIC, NULL FROM produtos_a_bateria
+        UNION ALL
+        SELECT 'pecas', codigo_material, codigo_barras::NUMERIC, NULL FROM pecas
+        UNION ALL
+        SELECT 'acessorios', codigo_material, codigo_barras::NUMERIC, NULL FROM acessorios
+        UNION ALL
+        SELECT 'sabres_correntes_pinhoes_limas', codigo_material, codigo_barras::NUMERIC, NULL FROM sabres_correntes_pinhoes_limas
+        UNION ALL
+        SELECT 'ferramentas', codigo_material, codigo_barras::NUMERIC, NULL FROM ferramentas
+        UNION ALL
+        SELECT 'epis', codigo_material, codigo_barras::NUMERIC, cod_ca::TEXT FROM epis
+    ),
+    -- Cadeias de substituição: A -> B -> C resolve A e B para C
+    cadeia (codigo_antigo, codigo_atual, profundidade) AS (
+        SELECT upper(trim(codigo_antigo)), upper(trim(codigo_novo)), 1
+        FROM cod_alterados
+        WHERE NULLIF(trim(codigo_antigo), '') IS NOT NULL
+            AND NULLIF(trim(codigo_novo), '') IS NOT NULL
+        UNION ALL
+        SELECT c.codigo_antigo, upper(trim(a.codigo_novo)), c.profundidade + 1
+        FROM cadeia c
+        JOIN cod_alterados a ON upper(trim(a.codigo_antigo)) = c.codigo_atual
+        WHERE c.profundidade < 10
+            AND NULLIF(trim(a.codigo_novo), '') IS NOT NULL
+    ),
+    identificadores AS (
+        SELECT upper(trim(p.codigo_material)) AS identificador, 'codigo' AS tipo, p.source_table, p.codigo_material
+        FROM produtos p
+        UNION ALL
+        SELECT normalize_barcode_v5(p.barras), 'ean', p.source_table, p.codigo_material
+        FROM produtos p
+        WHERE p.barras > 0
+        UNION ALL
+        SELECT 'CA' || ltrim(m[1], '0'), 'ca', p.source_table, p.codigo_material
+        FROM produtos p
+        CROSS JOIN LATERAL regexp_matches(replace(p.ca, '.', ''), '([0-9]{3,})', 'g') AS m
+        WHERE p.ca IS NOT NULL
+        UNION ALL
+        SELECT * FROM (
+            -- Elo mais distante da cadeia que ainda existe no catálogo
+            SELECT DISTINCT ON (c.codigo_antigo)
+                c.codigo_antigo, 'codigo_antigo', p.source_table, p.codigo_material
+            FROM cadeia c
+            JOIN produtos p ON upper(trim(p.codigo_material)) = c.codigo_atual
+            ORDER BY c.codigo_antigo, c.profundidade DESC
+        ) substituidos
+    )
+    SELECT DISTINCT identificador, tipo, source_table, codigo_material
+    FROM identificadores
+    WHERE identificador IS NOT NULL
+        AND codigo_material IS NOT NULL;
+
+    GET DIAGNOSTICS total = ROW_COUNT;
+    ANALYZE product_identifiers_v5;
+    RETURN total;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Resolve qualquer identificador com uma sondagem no índice primário.
+-- Prioridade: código vigente > código substituído > EAN > CA.
+CREATE OR REPLACE FUNCTION resolve_identifier_v5(p_identifier TEXT)
+RETURNS TABLE (
+    source_table TEXT,
+    codigo_material TEXT,
+    tipo TEXT
+) AS $$
+    SELECT pi.source_table::TEXT, pi.codigo_material::TEXT, pi.tipo::TEXT
+    FROM product_identifiers_v5 pi
+    WHERE pi.identificador = ANY(identifier_keys_v5(p_identifier))
+    ORDER BY CASE pi.tipo
+        WHEN 'codigo' THEN 1
+        WHEN 'codigo_antigo' THEN 2
+        WHEN 'ean' THEN 3
+        ELSE 4
+    END
+    LIMIT 1;
+$$ LANGUAGE sql STABLE;
+
+-- =====================================================
+-- SEÇÃO 5: VISÃO MATERIALIZADA DE BUSCA UNIFICADA
+-- =====================================================
+
+-- Uma linha por produto das oito abas pesquisáveis, com o tsvector
+-- ponderado já calculado sobre o texto sem acentos (A: descrição e
+-- código, B: compatibilidade), o texto para busca por substring
+-- (trigram), preço normalizado (NULL quando ausente ou <= 0) e os termos
+-- de categoria usados pelo filtro product_category.
+-- Recriada a cada execução deste script para acompanhar a definição.
+DROP MATERIALIZED VIEW IF EXISTS catalog_search_mv;
+CREATE MATERIALIZED VIEW catalog_search_mv AS
+WITH produtos AS (
+    SELECT 'motosserras'::TEXT AS source_table, m.codigo_material::TEXT AS codigo_material,
+        m.descricao::TEXT AS descricao, m.preco_real,
+        COALESCE(m.cilindrada_cm3 || ' cm³', '')::TEXT AS modelos_compatibilidade,
+        'Motosserra'::TEXT AS categoria_produto, ARRAY['motosserra'] AS categoria_termos
+    FROM ms m
+    UNION ALL
+    SELECT 'rocadeiras', r.codigo_material, r.descricao::TEXT, r.preco_real,
+        COALESCE(r.cilindrada_cm3 || ' cm³', ''), 'Roçadeira', ARRAY['roçadeira']
+    FROM rocadeiras_e_impl r
+    UNION ALL
+    SELECT 'produtos_bateria', p.codigo_material, p.descricao::TEXT, p.preco_real,
+        COALESCE(p.bateria_recomendada, ''), 'Produto a Bateria', ARRAY['bateria']
+    FROM produtos_a_bateria p
+    UNION ALL
+    SELECT 'pecas', pe.codigo_material, pe.descricao::TEXT, pe.preco_real,
+        COALESCE(pe.modelos, ''), 'Peça', ARRAY['peça']
+    FROM pecas pe
+    UNION ALL
+    SELECT 'acessorios', a.codigo_material, a.descricao::TEXT, a.preco_real,
+        COALESCE(a.modelos, ''), 'Acessório', ARRAY['acessorio']
+    FROM acessorios a
+    UNION ALL
+    SELECT 'sabres_correntes', s.codigo_material, s.descricao::TEXT, s.preco_real,
+        COALESCE(s.modelos_maquinas, ''), 'Sabre/Corrente/Pinhão/Lima',
+        ARRAY['sabre', 'corrente', 'pinhao', 'lima']
+    FROM sabres_correntes_pinhoes_limas s
+    UNION ALL
+    SELECT 'ferramentas', f.codigo_material, f.descricao::TEXT, f.preco_real,
+        COALESCE(f.modelos, ''), 'Ferramenta', ARRAY['ferramenta']
+    FROM ferramentas f
+    UNION ALL
+    SELECT 'epis', e.codigo_material, e.descricao::TEXT, e.preco_real,
+        COALESCE(e.material || ' - ' || e.protecao, ''), 'EPI', ARRAY['epi']
+    FROM epis e
+)
+SELECT
+    source_table,
+    codigo_material,
+    descricao,
+    CASE WHEN preco_real > 0 THEN preco_real END AS preco_real,
+    modelos_compatibilidade,
+    categoria_produto,
+    categoria_termos,
+    setweight(to_tsvector('portuguese', f_unaccent(COALESCE(descricao, '') || ' ' || codigo_material)), 'A') ||
+    setweight(to_tsvector('portuguese', f_unaccent(modelos_compatibilidade)), 'B') AS search_vector,
+    f_unaccent(lower(COALESCE(descricao, '') || ' ' || modelos_compatibilidade || ' ' || codigo_material)) AS texto_busca
+FROM produtos
+WHERE codigo_material IS NOT NULL
+WITH DATA;
+
+-- Índice único exigido por REFRESH MATERIALIZED VIEW CONCURRENTLY
+CREATE UNIQUE INDEX IF NOT EXISTS idx_catalog_search_mv_produto
+    ON catalog_search_mv (source_table, codigo_material);
+CREATE INDEX IF NOT EXISTS idx_catalog_search_mv_vector
+    ON catalog_search_mv USING gin(search_vector);
+CREATE INDEX IF NOT EXISTS idx_catalog_search_mv_texto_trgm
+    ON catalog_search_mv USING gin(texto_busca gin_trgm_ops);
+CREATE INDEX IF NOT EXISTS idx_catalog_search_mv_preco
+    ON catalog_search_mv (preco_real, codigo_material) WHERE preco_real IS NOT NULL;
+
+-- Atualização sem bloquear leituras (a visão continua consultável)
+CREATE OR REPLACE FUNCTION refresh_catalog_search_mv_v5()
+RETURNS INTEGER AS $$
+DECLARE
+    total INTEGER;
+BEGIN
+    REFRESH MATERIALIZED VIEW CONCURRENTLY catalog_search_mv;
+    ANALYZE catalog_search_mv;
+    SELECT COUNT(*) INTO total FROM catalog_search_mv;
+    RETURN total;
+END;
+$$ LANGUAGE plpgsql;
+
+-- =====================================================
+-- SEÇÃO 6: FUNÇÕES DE BUSCA SOBRE AS ESTRUTURAS DERIVADAS
+-- =====================================================
+
+-- Substitui a versão de 02_create_functions_v5.sql (oito UNION ALL que
+-- recalculavam to_tsvector duas vezes por linha): consulta única sobre
+-- catalog_search_mv. Casa por texto completo (GIN do tsvector) ou por
+-- substring sem acentos (GIN trigram), combinados em BitmapOr.
+CREATE OR REPLACE FUNCTION intelligent_product_search_v5(
+    search_query TEXT,
+    max_results INTEGER DEFAULT 20,
+    price_min DECIMAL DEFAULT NULL,
+    price_max DECIMAL DEFAULT NULL,
+    product_category TEXT DEFAULT NULL
+)
+RETURNS TABLE (
+    source_table TEXT,
+    codigo_material VARCHAR(32),
+    descricao TEXT,
+    preco_real DECIMAL(12,2),
+    modelos_compatibilidade TEXT,
+    categoria_produto TEXT,
+    relevance_score REAL
+) AS $$
+DECLARE
+    q tsquery := plainto_tsquery('portuguese', f_unaccent(search_query));
+    -- \, % e _ digitados valem como texto literal (LIKE ... ESCAPE '\')
+    pattern TEXT := '%' || replace(replace(replace(f_unaccent(lower(search_query)),
+                        '\', '\\'), '%', '\%'), '_', '\_') || '%';
+BEGIN
+    RETURN QUERY
+    SELECT
+        c.source_table,
+        c.codigo_material::VARCHAR(32),
+        c.descricao,
+        c.preco_real::DECIMAL(12,2),
+        c.modelos_compatibilidade,
+        c.categoria_produto,
+        CASE WHEN search_query IS NULL THEN NULL
+             ELSE ts_rank(c.search_vector, q)
+                  + CASE WHEN c.texto_busca LIKE pattern ESCAPE '\' THEN 0.05 ELSE 0 END
+        END::REAL
+    FROM catalog_search_mv c
+    WHERE (search_query IS NULL OR c.search_vector @@ q OR c.texto_busca LIKE pattern ESCAPE '\')
+        AND c.preco_real IS NOT NULL
+        AND (price_min IS NULL OR c.preco_real >= price_min)
+        AND (price_max IS NULL OR c.preco_real <= price_max)
+        AND (product_category IS NULL OR EXISTS (
+            SELECT 1 FROM unnest(c.categoria_termos) t
+            WHERE f_unaccent(product_category) ILIKE '%' || f_unaccent(t) || '%'))
+    ORDER BY 7 DESC NULLS LAST, c.preco_real ASC
+    LIMIT max_results;
+END;
+$$ LANGUAGE plpgsql STABLE;
+
+
+-- Substitui a versão de 02_create_functions_v5.sql (ILIKE em texto livre)
+CREATE OR REPLACE FUNCTION get_compatible_products_v5(model_name TEXT)
+RETURNS TABLE (
+    source_table TEXT,
+    codigo_material VARCHAR(32),
+    descricao TEXT,
+    preco_real DECIMAL(12,2),
+    tipo_compatibilidade TEXT,
+    categoria_produto TEXT
+) AS $$
+BEGIN
+    RETURN QUERY
+    SELECT
+        CASE pc.source_table
+            WHEN 'sabres_correntes_pinhoes_limas' THEN 'sabres_correntes'
+            ELSE pc.source_table
+        END::TEXT as source_table,
+        pc.codigo_material::VARCHAR(32),
+        pc.descricao,
+        pc.preco_real,
+        CASE pc.source_table
+            WHEN 'pecas' THEN 'Peça compatível'
+            WHEN 'acessorios' THEN 'Acessório compatível'
+            WHEN 'sabres_correntes_pinhoes_limas' THEN 'Componente de corte compatível'
+            WHEN 'ferramentas' THEN 'Ferramenta compatível'
+            ELSE 'Conjunto de corte compatível'
+        END::TEXT as tipo_compatibilidade,
+        CASE pc.source_table
+            WHEN 'pecas' THEN 'Peça'
+            WHEN 'acessorios' THEN 'Acessório'
+            WHEN 'sabres_correntes_pinhoes_limas' THEN 'Sabre/Corrente/Pinhão/Lima'
+            WHEN 'ferramentas' THEN 'Ferramenta'
+            ELSE 'Conjunto de Corte FS'
+        END::TEXT as categoria_produto
+    FROM product_compatibility_v5 pc
+    WHERE pc.modelo_canonico = canonical_model_v5(model_name)
+        AND pc.preco_real > 0
+    ORDER BY pc.preco_real ASC, pc.codigo_material;
+END;
+$$ LANGUAGE plpgsql STABLE;
+
+-- Substitui a versão de 02_create_functions_v5.sql (oito UNION ALL):
+-- resolve o identificador no diretório e consulta somente a aba de origem.
+CREATE OR REPLACE FUNCTION get_product_by_code_v5(material_code TEXT)
+RETURNS TABLE (
+    source_table TEXT,
+    codigo_material VARCHAR(32),
+    descricao TEXT,
+    preco_real DECIMAL(12,2),
+    detalhes_tecnicos TEXT,
+    modelos_compatibilidade TEXT,
+    categoria_produto TEXT
+) AS $$
+DECLARE
+    v_table TEXT;
+    v_code TEXT;
+BEGIN
+    SELECT r.source_table, r.codigo_material INTO v_table, v_code
+    FROM resolve_identifier_v5(material_code) r;
+
+    IF v_table = 'ms' THEN
+        RETURN QUERY
+        SELECT
+            'motosserras'::TEXT,
+            m.codigo_material,
+            m.descricao::TEXT,
+            m.preco_real,
+            CONCAT(
+                'Cilindrada: ', COALESCE(m.cilindrada_cm3, ''), ' cm³, ',
+                'Potência: ', COALESCE(m.pot::TEXT, ''), ' kW, ',
+                'Peso: ', COALESCE(m.peso_kg::TEXT, ''), ' kg, ',
+                'Sabre: ', COALESCE(m.sabre, ''), ', ',
+                'Corrente: ', COALESCE(m.corrente, '')
+            )::TEXT,
+            COALESCE(m.cilindrada_cm3 || ' cm³', '')::TEXT,
+            'Motosserra'::TEXT
+        FROM ms m
+        WHERE m.codigo_material = v_code;
+    ELSIF v_table = 'rocadeiras_e_impl' THEN
+        RETURN QUERY
+        SELECT
+            'rocadeiras'::TEXT,
+            r.codigo_material,
+            r.descricao::TEXT,
+            r.preco_real,
+            CONCAT(
+                'Cilindrada: ', COALESCE(r.cilindrada_cm3, ''), ' cm³, ',
+                'Potência: ', COALESCE(r.pot::TEXT, ''), ' kW, ',
+                'Peso: ', COALESCE(r.peso::TEXT, ''), ' kg, ',
+                'Conjunto de corte: ', COALESCE(r.conjunto_de_corte, '')
+            )::TEXT,
+            COALESCE(r.cilindrada_cm3 || ' cm³', '')::TEXT,
+            'Roçadeira'::TEXT
+        FROM rocadeiras_e_impl r
+        WHERE r.codigo_material = v_code;
+    ELSIF v_table = 'produtos_a_bateria' THEN
+        RETURN QUERY
+        SELECT
+            'produtos_bateria'::TEXT,
+            p.codigo_material,
+            p.descricao::TEXT,
+            p.preco_real,
+            CONCAT(
+                'Bateria recomendada: ', COALESCE(p.bateria_recomendada, ''), ', ',
+                'Tensão: ', COALESCE(p.tensao_nominal_bateria_v, ''), ', ',
+                'Peso: ', COALESCE(p.peso_kg, ''), ' kg'
+            )::TEXT,
+            COALESCE(p.bateria_recomendada, '')::TEXT,
+            'Produto a Bateria'::TEXT
+        FROM produtos_a_bateria p
+        WHERE p.codigo_material = v_code;
+    ELSIF v_table = 'pecas' THEN
+        RETURN QUERY
+        SELECT
+            'pecas'::TEXT,
+            pe.codigo_material,
+            pe.descricao::TEXT,
+            pe.preco_real,
+            'Peça de reposição original STIHL'::TEXT,
+            COALESCE(pe.modelos, '')::TEXT,
+            'Peça'::TEXT
+        FROM pecas pe
+        WHERE pe.codigo_material = v_code;
+    ELSIF v_table = 'acessorios' THEN
+        RETURN QUERY
+        SELECT
+            'acessorios'::TEXT,
+            a.codigo_material,
+            a.descricao::TEXT,
+            a.preco_real,
+            'Acessório original STIHL'::TEXT,
+            COALESCE(a.modelos, '')::TEXT,
+            'Acessório'::TEXT
+        FROM acessorios a
+        WHERE a.codigo_material = v_code;
+    ELSIF v_table = 'sabres_correntes_pinhoes_limas' THEN
+        RETURN QUERY
+        SELECT
+            'sabres_correntes'::TEXT,
+            s.codigo_material,
+            s.descricao::TEXT,
+            s.preco_real,
+            'Componente de corte original STIHL'::TEXT,
+            COALESCE(s.modelos_maquinas, '')::TEXT,
+            'Sabre/Corrente/Pinhão/Lima'::TEXT
+        FROM sabres_correntes_pinhoes_limas s
+        WHERE s.codigo_material = v_code;
+    ELSIF v_table = 'ferramentas' THEN
+        RETURN QUERY
+        SELECT
+            'ferramentas'::TEXT,
+            f.codigo_material,
+            f.descricao::TEXT,
+            f.preco_real,
+            CASE
+                WHEN f.ferramentas_basicas_para_oficina IS NOT NULL
+                THEN 'Ferramenta básica para oficina: ' || f.ferramentas_basicas_para_oficina
+                ELSE 'Ferramenta especializada STIHL'
+            END::TEXT,
+            COALESCE(f.modelos, '')::TEXT,
+            'Ferramenta'::TEXT
+        FROM ferramentas f
+        WHERE f.codigo_material = v_code;
+    ELSIF v_table = 'epis' THEN
+        RETURN QUERY
+        SELECT
+            'epis'::TEXT,
+            e.codigo_material,
+            e.descricao::TEXT,
+            e.preco_real,
+            CONCAT(
+                'Material: ', COALESCE(e.material, ''), ', ',
+                'Proteção: ', COALESCE(e.protecao, ''), ', ',
+                'CA: ', COALESCE(e.cod_ca, '')
+            )::TEXT,
+            COALESCE(e.material || ' - ' || e.protecao, '')::TEXT,
+            'EPI'::TEXT
+        FROM epis e
+        WHERE e.codigo_material = v_code;
+    END IF;
+END;
+$$ LANGUAGE plpgsql STABLE;
+
+-- =====================================================
+-- SEÇÃO 7: ESTATÍSTICAS DO CATÁLOGO
+-- =====================================================
+-- Agregados por categoria (contagens, faixa e média de preço, produto mais
+-- caro e histograma por faixa de preço) calculados numa única leitura de
+-- catalog_search_mv a cada importação. As funções de estatística e de
+-- faixas de preço passam a ler desta tabela.
+
+CREATE OR REPLACE FUNCTION catalog_price_bands_v5()
+RETURNS NUMERIC[] AS $$
+    SELECT ARRAY[50, 100, 250, 500, 1000, 2500, 5000]::NUMERIC[];
+$$ LANGUAGE sql IMMUTABLE;
+
+CREATE OR REPLACE FUNCTION catalog_category_label_v5(p_source_table TEXT)
+RETURNS TEXT AS $$
+    SELECT CASE p_source_table
+        WHEN 'motosserras' THEN 'Motosserras'
+        WHEN 'rocadeiras' THEN 'Roçadeiras'
+        WHEN 'produtos_bateria' THEN 'Produtos a Bateria'
+        WHEN 'pecas' THEN 'Peças'
+        WHEN 'acessorios' THEN 'Acessórios'
+        WHEN 'sabres_correntes' THEN 'Sabres e Correntes'
+        WHEN 'ferramentas' THEN 'Ferramentas'
+        WHEN 'epis' THEN 'EPIs'
+        ELSE initcap(replace(p_source_table, '_', ' '))
+    END;
+$$ LANGUAGE sql IMMUTABLE;
+
+CREATE TABLE IF NOT EXISTS catalog_statistics_v5 (
+    source_table TEXT PRIMARY KEY,
+    categoria TEXT NOT NULL,
+    total_produtos BIGINT NOT NULL,
+    produtos_com_preco BIGINT NOT NULL,
+    preco_minimo DECIMAL(12,2),
+    preco_maximo DECIMAL(12,2),
+    preco_medio DECIMAL(12,2),
+    produto_mais_caro TEXT,
+    -- Produtos com preço por faixa: [0, 50), [50, 100), ..., [5000, ∞)
+    histograma BIGINT[] NOT NULL,
+    computed_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
+);
+
+CREATE OR REPLACE FUNCTION rebuild_catalog_statistics_v5()
+RETURNS INTEGER AS $$
+DECLARE
+    total INTEGER;
+BEGIN
+    DELETE FROM catalog_statistics_v5;
+
+    INSERT INTO catalog_statistics_v5 (
+        source_table, categoria, total_produtos, produtos_com_preco, preco_minimo,
+        preco_maximo, preco_medio, produto_mais_caro, histograma
+    )
+    WITH faixas AS (
+        -- Única leitura da visão: agregados parciais por (categoria, faixa)
+        SELECT source_table,
+               width_bucket(preco_real, catalog_price_bands_v5()) AS faixa,
+               COUNT(*) AS total,
+               COUNT(preco_real) AS com_preco,
+               MIN(preco_real) AS minimo,
+               MAX(preco_real) AS maximo,
+               SUM(preco_real) AS soma,
+               (array_agg(descricao ORDER BY preco_real DESC NULLS LAST))[1] AS mais_caro
+        FROM catalog_search_mv
+        GROUP BY 1, 2
+    )
+    SELECT f.source_table,
+           catalog_category_label_v5(f.source_table),
+           SUM(f.total),
+           SUM(f.com_preco),
+           MIN(f.minimo),
+           MAX(f.maximo),
+           ROUND(SUM(f.soma) / NULLIF(SUM(f.com_preco), 0), 2),
+           (array_agg(f.mais_caro ORDER BY f.maximo DESC NULLS LAST))[1],
+           ARRAY(
+               SELECT COALESCE(SUM(h.com_preco), 0)::BIGINT
+               FROM generate_series(0, array_length(catalog_price_bands_v5(), 1)) b
+               LEFT JOIN faixas h ON h.source_table = f.source_table AND h.faixa = b
+               GROUP BY b ORDER BY b
+           )
+    FROM faixas f
+    GROUP BY f.source_table;
+
+    GET DIAGNOSTICS total = ROW_COUNT;
+    RETURN total;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Substituem as versões de 02_create_functions_v5.sql (uma varredura
+-- completa de cada aba, com subconsultas correlacionadas, por chamada)
+CREATE OR REPLACE FUNCTION get_price_ranges_by_category_v5()
+RETURNS TABLE (
+    categoria TEXT,
+    preco_minimo DECIMAL(12,2),
+    preco_maximo DECIMAL(12,2),
+    preco_medio DECIMAL(12,2),
+    total_produtos BIGINT
+) AS $$
+    SELECT s.categoria, s.preco_minimo, s.preco_maximo, s.preco_medio, s.produtos_com_preco
+    FROM catalog_statistics_v5 s
+    WHERE s.produtos_com_preco > 0
+    ORDER BY s.categoria;
+$$ LANGUAGE sql STABLE;
+
+CREATE OR REPLACE FUNCTION get_catalog_statistics_v5()
+RETURNS TABLE (
+    categoria TEXT,
+    total_produtos BIGINT,
+    produtos_com_preco BIGINT,
+    preco_medio DECIMAL(12,2),
+    produto_mais_caro TEXT,
+    preco_mais_caro DECIMAL(12,2)
+) AS $$
+    SELECT s.categoria, s.total_produtos, s.produtos_com_preco, s.preco_medio,
+           s.produto_mais_caro, s.preco_maximo
+    FROM catalog_statistics_v5 s
+    ORDER BY s.total_produtos DESC;
+$$ LANGUAGE sql STABLE;
+
+-- =====================================================
+-- SEÇÃO 8: VERSÕES DO CATÁLOGO
+-- =====================================================
+-- Cada importação que altera o catálogo recebe um número de versão
+-- (catalog_version_seq); cada produto guarda a versão em que mudou pela
+-- última vez. Exportações incrementais pedem "o que mudou depois da
+-- versão N" (removidos inclusive) sem comparar o catálogo inteiro.
+
+CREATE SEQUENCE IF NOT EXISTS catalog_version_seq;
+
+CREATE TABLE IF NOT EXISTS catalog_product_versions_v5 (
+    source_table TEXT NOT NULL,
+    codigo_material TEXT NOT NULL,
+    row_hash TEXT NOT NULL,
+    catalog_version BIGINT NOT NULL,
+    removed BOOLEAN NOT NULL DEFAULT FALSE,
+    PRIMARY KEY (source_table, codigo_material)
+);
+
+CREATE INDEX IF NOT EXISTS idx_catalog_product_versions_v5_version
+    ON catalog_product_versions_v5 (catalog_version);
+
+-- Versão do catálogo como um todo: avança quando muda qualquer dado
+-- servido pela API (produtos, campanhas, tabelas fiscais). Base dos ETags.
+CREATE TABLE IF NOT EXISTS catalog_version_v5 (
+    singleton BOOLEAN PRIMARY KEY DEFAULT TRUE CHECK (singleton),
+    catalog_version BIGINT NOT NULL,
+    content_hash TEXT NOT NULL,
+    stamped_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
+);
+
+-- Compara o catálogo atual (catalog_search_mv e tabelas auxiliares) com o
+-- último carimbo; havendo diferença, atribui a próxima versão ao catálogo
+-- e aos produtos novos, alterados e removidos. Retorna o número de
+-- produtos alterados (0 também quando só campanhas/tabelas fiscais mudaram).
+CREATE OR REPLACE FUNCTION stamp_catalog_versions_v5()
+RETURNS INTEGER AS $$
+DECLARE
+    v_version BIGINT;
+    v_hash TEXT;
+    v_changed INTEGER;
+    v_removed INTEGER;
+BEGIN
+    CREATE TEMP TABLE catalog_current_v5 ON COMMIT DROP AS
+    SELECT source_table, codigo_material,
+           md5(concat_ws('|', descricao, preco_real, modelos_compatibilidade, categoria_produto)) AS row_hash
+    FROM catalog_search_mv;
+
+    SELECT md5(concat_ws('|',
+        (SELECT string_agg(row_hash, '' ORDER BY source_table, codigo_material) FROM catalog_current_v5),
+        (SELECT md5(string_agg(t::TEXT, '|' ORDER BY t::TEXT)) FROM campanhas_stihl t),
+        (SELECT md5(string_agg(t::TEXT, '|' ORDER BY t::TEXT)) FROM subst_tributaria t),
+        (SELECT md5(string_agg(t::TEXT, '|' ORDER BY t::TEXT)) FROM tabela_dif_icms_f_cd_sp t),
+        (SELECT md5(string_agg(t::TEXT, '|' ORDER BY t::TEXT)) FROM tabela_dif_icms_f_cd_rs t),
+        (SELECT md5(string_agg(t::TEXT, '|' ORDER BY t::TEXT)) FROM tabela_dif_icms_f_cd_pa t)
+    )) INTO v_hash;
+
+    IF EXISTS (SELECT 1 FROM catalog_version_v5 WHERE content_hash = v_hash) THEN
+        DROP TABLE catalog_current_v5;
+        RETURN 0;
+    END IF;
+
+    v_version := nextval('catalog_version_seq');
+
+    INSERT INTO catalog_product_versions_v5 (source_table, codigo_material, row_hash, catalog_version, removed)
+    SELECT source_table, codigo_material, row_hash, v_version, FALSE
+    FROM catalog_current_v5
+    ON CONFLICT (source_table, codigo_material) DO UPDATE
+        SET row_hash = EXCLUDED.row_hash, catalog_version = EXCLUDED.catalog_version, removed = FALSE
+        WHERE catalog_product_versions_v5.row_hash IS DISTINCT FROM EXCLUDED.row_hash
+           OR catalog_product_versions_v5.removed;
+    GET DIAGNOSTICS v_changed = ROW_COUNT;
+
+    UPDATE catalog_product_versions_v5 v
+    SET removed = TRUE, catalog_version = v_version
+    WHERE NOT v.removed
+      AND NOT EXISTS (SELECT 1 FROM catalog_current_v5 c
+                      WHERE c.source_table = v.source_table AND c.codigo_material = v.codigo_material);
+    GET DIAGNOSTICS v_removed = ROW_COUNT;
+
+    INSERT INTO catalog_version_v5 (singleton, catalog_version, content_hash, stamped_at)
+    VALUES (TRUE, v_version, v_hash, NOW())
+    ON CONFLICT (singleton) DO UPDATE
+        SET catalog_version = EXCLUDED.catalog_version,
+            content_hash = EXCLUDED.content_hash,
+            stamped_at = EXCLUDED.stamped_at;
+
+    DROP TABLE catalog_current_v5;
+    RETURN v_changed + v_removed;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION current_catalog_version_v5()
+RETURNS BIGINT AS $$
+    SELECT COALESCE((SELECT catalog_version FROM catalog_version_v5), 0);
+$$ LANGUAGE sql STABLE;
+
+-- =====================================================
+-- SEÇÃO 9: RECONSTRUÇÃO APÓS IMPORTAÇÃO
+-- =====================================================
+
+CREATE OR REPLACE FUNCTION rebuild_catalog_derived_v5()
+RETURNS TABLE (
+    estrutura TEXT,
+    linhas INTEGER
+) AS $$
+BEGIN
+    RETURN QUERY SELECT 'product_compatibility_v5'::TEXT, rebuild_product_compatibility_v5();
+    RETURN QUERY SELECT 'product_identifiers_v5'::TEXT, rebuild_product_identifiers_v5();
+    RETURN QUERY SELECT 'catalog_search_mv'::TEXT, refresh_catalog_search_mv_v5();
+    RETURN QUERY SELECT 'catalog_statistics_v5'::TEXT, rebuild_catalog_statistics_v5();
+    RETURN QUERY SELECT 'catalog_product_versions_v5'::TEXT, stamp_catalog_versions_v5();
+END;
+$$ LANGUAGE plpgsql;
+
+COMMENT ON FUNCTION f_unaccent(TEXT) IS 'unaccent() imutável, utilizável em índices funcionais';
+COMMENT ON FUNCTION extract_models_v5(TEXT) IS 'Extrai modelos canônicos (MS250, FS220) de texto livre de compatibilidade';
+COMMENT ON FUNCTION canonical_model_v5(TEXT) IS 'Forma canônica de um nome de modelo (MS 250 -> MS250)';
+COMMENT ON TABLE product_compatibility_v5 IS 'Compatibilidade produto x modelo canônico, reconstruída a cada importação';
+COMMENT ON TABLE product_identifiers_v5 IS 'Diretório de identificadores (código, código substituído, EAN, CA) -> produto';
+COMMENT ON MATERIALIZED VIEW catalog_search_mv IS 'Catálogo pesquisável unificado com tsvector ponderado pré-calculado';
+COMMENT ON FUNCTION resolve_identifier_v5(TEXT) IS 'Resolve qualquer identificador de produto para (tabela de origem, código canônico)';
+COMMENT ON TABLE catalog_statistics_v5 IS 'Estatísticas por categoria (contagens, preços, histograma), recalculadas a cada importação';
+COMMENT ON FUNCTION rebuild_catalog_statistics_v5() IS 'Recalcula catalog_statistics_v5 numa única leitura de catalog_search_mv';
+COMMENT ON TABLE catalog_product_versions_v5 IS 'Versão do catálogo em que cada produto mudou pela última vez (exportação incremental)';
+COMMENT ON TABLE catalog_version_v5 IS 'Versão atual do catálogo (produtos, campanhas e tabelas fiscais), base dos ETags da API';
+COMMENT ON FUNCTION stamp_catalog_versions_v5() IS 'Atribui nova versão ao catálogo e aos produtos novos, alterados e removidos';
+COMMENT ON FUNCTION current_catalog_version_v5() IS 'Versão atual do catálogo (0 antes da primeira importação versionada)';
+COMMENT ON FUNCTION rebuild_catalog_derived_v5() IS 'Reconstrói todas as estruturas derivadas do catálogo';
+
+\echo 'Reconstruindo estruturas derivadas do catálogo...'
+SELECT * FROM rebuild_catalog_derived_v5();
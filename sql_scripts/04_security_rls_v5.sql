@@ -9,6 +9,7 @@
 -- 1. Tabelas criadas (01_create_tables_v5.sql)
 -- 2. Dados importados (05_import_csv_data_v5.sql)
 -- 3. Funções criadas (02_create_functions_v5.sql)
+-- 4. Estruturas derivadas criadas (03_derived_structures_v5.sql)
 -- =====================================================
 
 -- Configurações
@@ -481,6 +482,49 @@ BEGIN
 END;
 $$ LANGUAGE plpgsql SECURITY DEFINER;
 
+-- Acertos acumulados em memória pelos workers e gravados em lote
+-- (uma instrução por descarga em vez de um UPDATE por leitura)
+CREATE OR REPLACE FUNCTION record_cache_hits_v5(
+    p_cache_keys VARCHAR(256)[],
+    p_hits INTEGER[]
+)
+RETURNS INTEGER AS $$
+DECLARE
+    updated_count INTEGER;
+BEGIN
+    UPDATE query_cache_v5 q
+    SET hit_count = q.hit_count + h.hits,
+        last_accessed = NOW()
+    FROM unnest(p_cache_keys, p_hits) AS h(cache_key, hits)
+    WHERE q.cache_key = h.cache_key;
+    GET DIAGNOSTICS updated_count = ROW_COUNT;
+
+    RETURN updated_count;
+END;
+$$ LANGUAGE plpgsql SECURITY DEFINER;
+
+-- Updates do Telegram já aceitos pelo webhook: reenvios do mesmo
+-- update_id (webhook lento) são confirmados sem novo processamento
+CREATE TABLE IF NOT EXISTS telegram_updates_v5 (
+    update_id BIGINT PRIMARY KEY,
+    received_at TIMESTAMP WITH TIME ZONE DEFAULT NOW()
+);
+
+CREATE INDEX IF NOT EXISTS idx_telegram_updates_v5_received ON telegram_updates_v5(received_at);
+
+CREATE OR REPLACE FUNCTION cleanup_telegram_updates_v5(p_ttl_seconds INTEGER DEFAULT 86400)
+RETURNS INTEGER AS $$
+DECLARE
+    deleted_count INTEGER;
+BEGIN
+    DELETE FROM telegram_updates_v5
+    WHERE received_at < NOW() - (p_ttl_seconds || ' seconds')::INTERVAL;
+    GET DIAGNOSTICS deleted_count = ROW_COUNT;
+
+    RETURN deleted_count;
+END;
+$$ LANGUAGE plpgsql SECURITY DEFINER;
+
 -- =====================================================
 -- SEÇÃO 11: CONFIGURAÇÕES DE MONITORAMENTO
 -- =====================================================
@@ -512,6 +556,24 @@ BEGIN
 END;
 $$ LANGUAGE plpgsql SECURITY DEFINER;
 
+-- Eventos de busca gravados em lote (COPY) pelo analytics da API.
+-- Sob carga os eventos são amostrados: cada linha pesa 1 / sample_rate
+CREATE TABLE IF NOT EXISTS search_analytics_v5 (
+    id BIGSERIAL PRIMARY KEY,
+    occurred_at TIMESTAMP WITH TIME ZONE NOT NULL,
+    source VARCHAR(32) NOT NULL,
+    query TEXT,
+    results_count INTEGER,
+    response_time_ms REAL,
+    user_ip VARCHAR(64),
+    user_agent TEXT,
+    sample_rate REAL NOT NULL DEFAULT 1.0,
+    details JSONB
+);
+
+CREATE INDEX IF NOT EXISTS idx_search_analytics_v5_occurred ON search_analytics_v5(occurred_at);
+CREATE INDEX IF NOT EXISTS idx_search_analytics_v5_query ON search_analytics_v5(query);
+
 -- =====================================================
 -- SEÇÃO 12: CONFIGURAÇÕES FINAIS E LIMPEZA
 -- =====================================================
@@ -531,6 +593,9 @@ BEGIN
     DELETE FROM performance_metrics_v5 
     WHERE timestamp < NOW() - (days_to_keep || ' days')::INTERVAL;
     
+    DELETE FROM search_analytics_v5
+    WHERE occurred_at < NOW() - (days_to_keep || ' days')::INTERVAL;
+    
     -- Limpar sessões expiradas
     DELETE FROM user_sessions_v5 
     WHERE expires_at < NOW() OR last_activity < NOW() - '7 days'::INTERVAL;
@@ -545,19 +610,27 @@ GRANT EXECUTE ON FUNCTION validate_user_session_v5(VARCHAR) TO stihl_app_user, s
 GRANT EXECUTE ON FUNCTION create_user_session_v5(VARCHAR, VARCHAR, VARCHAR, VARCHAR, INTEGER) TO stihl_app_user, stihl_api, stihl_admin;
 GRANT EXECUTE ON FUNCTION get_cached_result_v5(VARCHAR) TO stihl_app_user, stihl_api, stihl_admin;
 GRANT EXECUTE ON FUNCTION set_cached_result_v5(VARCHAR, JSONB, INTEGER) TO stihl_app_user, stihl_api, stihl_admin;
+GRANT EXECUTE ON FUNCTION record_cache_hits_v5(VARCHAR[], INTEGER[]) TO stihl_app_user, stihl_api, stihl_admin;
+GRANT EXECUTE ON FUNCTION cleanup_expired_cache_v5() TO stihl_app_user, stihl_api, stihl_admin;
+GRANT EXECUTE ON FUNCTION cleanup_telegram_updates_v5(INTEGER) TO stihl_app_user, stihl_api, stihl_admin;
 GRANT EXECUTE ON FUNCTION record_performance_metric_v5(VARCHAR, DECIMAL, VARCHAR, JSONB) TO stihl_app_user, stihl_api, stihl_admin;
 
 -- Configurar permissões para tabelas de sistema
 GRANT SELECT, INSERT ON audit_log_v5 TO stihl_app_user, stihl_api, stihl_admin;
 GRANT SELECT, INSERT, UPDATE ON user_sessions_v5 TO stihl_app_user, stihl_api, stihl_admin;
 GRANT SELECT, INSERT, UPDATE, DELETE ON query_cache_v5 TO stihl_app_user, stihl_api, stihl_admin;
+GRANT SELECT, INSERT, DELETE ON telegram_updates_v5 TO stihl_app_user, stihl_api, stihl_admin;
 GRANT SELECT, INSERT ON performance_metrics_v5 TO stihl_app_user, stihl_api, stihl_admin;
+GRANT SELECT, INSERT ON search_analytics_v5 TO stihl_app_user, stihl_api, stihl_admin;
+GRANT USAGE ON SEQUENCE search_analytics_v5_id_seq TO stihl_app_user, stihl_api, stihl_admin;
 
 -- Comentários para documentação
 COMMENT ON TABLE audit_log_v5 IS 'Log de auditoria para todas as operações no sistema STIHL AI v5';
 COMMENT ON TABLE user_sessions_v5 IS 'Controle de sessões de usuário com validação e expiração';
 COMMENT ON TABLE query_cache_v5 IS 'Cache de consultas frequentes para otimização de performance';
+COMMENT ON TABLE telegram_updates_v5 IS 'update_id do Telegram já aceitos, para ignorar reenvios do webhook';
 COMMENT ON TABLE performance_metrics_v5 IS 'Métricas de performance e monitoramento do sistema';
+COMMENT ON TABLE search_analytics_v5 IS 'Eventos de busca da API, gravados em lote; sob carga, amostrados (peso 1 / sample_rate)';
 
 -- Log de conclusão
 SELECT 'Configuração de segurança e RLS para STIHL AI v5 concluída com sucesso!' as status;
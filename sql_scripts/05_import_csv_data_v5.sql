@@ -12,7 +12,8 @@
 -- 1. 01_create_tables_v5.sql
 -- 2. 05_import_csv_data_v5.sql (este arquivo)
 -- 3. 02_create_functions_v5.sql
--- 4. 04_security_rls_v5.sql
+-- 4. 03_derived_structures_v5.sql
+-- 5. 04_security_rls_v5.sql
 -- =====================================================
 
 -- Configurações para importação
@@ -548,6 +549,14 @@ SELECT
 FROM campanhas_stihl 
 WHERE preco_de_campanha IS NOT NULL AND preco_de_campanha > 0;
 
+-- Reconstruir estruturas derivadas (reimportação com 03 já aplicado)
+DO $$
+BEGIN
+    IF to_regproc('rebuild_catalog_derived_v5') IS NOT NULL THEN
+        PERFORM rebuild_catalog_derived_v5();
+    END IF;
+END $$;
+
 \echo '================================================='
 \echo 'IMPORTAÇÃO CONCLUÍDA COM SUCESSO!'
 \echo 'Base de dados STIHL AI v5 pronta para uso.'
@@ -12,6 +12,13 @@ load_dotenv()
 # Importa blueprint e inicializador do motor de busca v5
 from src.routes.search_api_v5 import search_bp, init_search_engine
 from src.routes.telegram_webhook import telegram_bp
+from src.routes.quote_api import quote_bp
+from src.routes.catalog_api import catalog_bp
+from src.routes.metrics_api import metrics_bp
+from src.routes.debug_api import debug_bp
+from src.services.autocomplete import warm_autocomplete
+from src.services.tax_engine import warm_tax_engine
+from src.utils import metrics, tracing
 
 def create_app():
     app = Flask(__name__, static_folder=os.path.join(os.path.dirname(__file__), 'static'))
@@ -22,6 +29,11 @@ def create_app():
     # CORS global (ajuste origens via ENV, ex: "https://dominio.com, http://localhost:5173")
     CORS(app, resources={r"/api/*": {"origins": os.getenv("CORS_ORIGINS", "*").split(",")}})
 
+    # Contagem e duração de todas as requisições (expostas em /metrics)
+    metrics.install(app)
+    # Um trace por requisição, com X-Request-ID na resposta
+    tracing.install(app)
+
     # Inicializa motor de busca (usa DATABASE_URL)
     database_url = os.getenv('DATABASE_URL')
     if database_url:
@@ -29,6 +41,10 @@ def create_app():
     else:
         app.logger.warning("DATABASE_URL não definido; endpoints de busca podem falhar.")
 
+    # Motor fiscal (preço final por UF) e autocompletar construídos em segundo plano
+    warm_tax_engine()
+    warm_autocomplete()
+
     # Healthcheck simples
     @app.get("/api/health")
     def health():
@@ -45,6 +61,10 @@ def create_app():
     # Registrar rotas de busca sob /api/search
     app.register_blueprint(search_bp)
     app.register_blueprint(telegram_bp, url_prefix="/bot/telegram")
+    app.register_blueprint(quote_bp)
+    app.register_blueprint(catalog_bp)
+    app.register_blueprint(metrics_bp)
+    app.register_blueprint(debug_bp)
 
     # Servir arquivos estáticos de src/static
     @app.route('/', defaults={'path': ''})
@@ -23,14 +23,39 @@ import os
 import re
 import json
 import hashlib
+import logging
+import threading
+from collections import OrderedDict
 from typing import Dict, List, Optional, Tuple, Any
-from dataclasses import dataclass
+from dataclasses import asdict, dataclass
 from datetime import datetime, timedelta
 import psycopg2
 from psycopg2.extras import RealDictCursor
 import openai
 from openai import OpenAI
 
+from ..utils.cache import ShardedLRUCache
+from ..utils.shared_cache import TwoTierCache
+from ..utils.db_pool import connection
+from ..utils.metrics import stage
+from ..utils.tracing import annotate, record_error, traced
+from ..utils.pagination import decode_cursor, encode_cursor
+from ..services.compatibility import COMPAT_LABELS, get_compatibility_index
+from ..services.identifier_directory import get_identifier_directory
+from ..services.intent_cache import get_intent_cache
+from ..services.text_normalizer import (
+    canonical_model, canonical_query, canonical_query_key, fold_text, material_code,
+    model_search_text, normalize_input,
+)
+
+logger = logging.getLogger(__name__)
+
+
+def _escape_like(text: str) -> str:
+    """Escapa \\, % e _ para um padrão LIKE com ESCAPE '\\'"""
+    return text.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+
 # Configuração do cliente OpenAI
 client = OpenAI(
     api_key=os.getenv('OPENAI_API_KEY'),
@@ -80,8 +105,30 @@ class IntelligentSearchV5:
             database_url: URL de conexão com o banco de dados PostgreSQL
         """
         self.database_url = database_url
-        self.cache = {}
-        self.cache_ttl = timedelta(minutes=30)
+        self.cache = self._build_cache()
+        self.cache_ttl = timedelta(seconds=self.cache.ttl)
+
+        # Hashes do texto como digitado (SEARCH_KEY_STATS=on), só para medir
+        # o ganho da chave canônica; FIFO limitado, sem guardar resultados
+        self._raw_keys: Optional[OrderedDict] = None
+        if os.getenv('SEARCH_KEY_STATS', 'off').lower() == 'on':
+            self._raw_keys = OrderedDict()
+        try:
+            self._raw_keys_max = int(os.getenv('SEARCH_KEY_STATS_MAX', 10000))
+        except ValueError:
+            self._raw_keys_max = 10000
+        self._key_stats_lock = threading.Lock()
+        self._key_stats = {'lookups': 0, 'hits': 0, 'raw_key_hits': 0}
+
+        # Abaixo deste valor de confiança a análise por regras cede ao GPT-4
+        try:
+            self.intent_llm_threshold = float(os.getenv('INTENT_LLM_THRESHOLD', 0.7))
+        except ValueError:
+            self.intent_llm_threshold = 0.7
+        self._intent_stats = {'rule_based': 0, 'intent_cache': 0, 'llm': 0, 'llm_errors': 0}
+
+        # Intenções do GPT-4 persistidas por chave semântica (SQLite)
+        self.intent_cache = get_intent_cache()
         
         # Mapeamento de categorias para facilitar a busca
         self.category_mapping = {
@@ -106,32 +153,71 @@ class IntelligentSearchV5:
             'profissional': ['comercial', 'industrial', 'trabalho']
         }
 
-    def _get_db_connection(self):
-        """Cria conexão com o banco de dados"""
-        return psycopg2.connect(
-            self.database_url,
-            cursor_factory=RealDictCursor
+    def _build_cache(self):
+        """
+        Cache de resultados: L1 limitado (entradas e bytes, LRU por shard,
+        TTL ativo) e, com SEARCH_CACHE_L2=postgres, L2 compartilhado entre
+        workers em query_cache_v5
+        """
+        l1 = ShardedLRUCache.from_env("SEARCH_CACHE")
+        if os.getenv('SEARCH_CACHE_L2', 'off').lower() != 'postgres':
+            return l1
+        try:
+            flush_interval = float(os.getenv('SEARCH_CACHE_FLUSH_S', 10))
+            sweep_interval = float(os.getenv('SEARCH_CACHE_SWEEP_S', 300))
+        except ValueError:
+            flush_interval, sweep_interval = 10.0, 300.0
+        return TwoTierCache(
+            l1,
+            dsn=self.database_url,
+            namespace='search_v5:',
+            encode=lambda results: [asdict(r) for r in results],
+            decode=lambda data: [SearchResult(**item) for item in data],
+            flush_interval=flush_interval,
+            sweep_interval=sweep_interval,
         )
 
+    def _get_db_connection(self):
+        """Empresta conexão do pool compartilhado do processo"""
+        return connection(self.database_url, cursor_factory=RealDictCursor)
+
     def _generate_cache_key(self, query: str, filters: Dict) -> str:
-        """Gera chave única para cache baseada na consulta e filtros"""
-        cache_data = f"{query}_{json.dumps(filters, sort_keys=True)}"
+        """
+        Gera chave de cache a partir da forma canônica da consulta
+
+        Grafias diferentes da mesma pergunta ("Filtro de ar FS221",
+        "filtro do ar FS-221") compartilham a entrada e a análise de
+        intenção (ver text_normalizer.canonical_query).
+        """
+        cache_data = f"{canonical_query_key(query)}_{json.dumps(filters, sort_keys=True)}"
         return hashlib.md5(cache_data.encode()).hexdigest()
 
-    def _is_cache_valid(self, cache_entry: Dict) -> bool:
-        """Verifica se entrada do cache ainda é válida"""
-        if not cache_entry:
-            return False
-        
-        created_at = cache_entry.get('created_at')
-        if not created_at:
-            return False
-            
-        return datetime.now() - created_at < self.cache_ttl
+    def _count_intent(self, name: str):
+        with self._key_stats_lock:
+            self._intent_stats[name] += 1
+
+    def _record_key_lookup(self, query: str, filters: Dict, hit: bool):
+        """Compara o acerto da chave canônica com o que o texto bruto teria"""
+        raw_hit = False
+        with self._key_stats_lock:
+            if self._raw_keys is not None:
+                raw_key = hash((query, json.dumps(filters, sort_keys=True)))
+                raw_hit = raw_key in self._raw_keys
+                if not raw_hit:
+                    self._raw_keys[raw_key] = None
+                    if len(self._raw_keys) > self._raw_keys_max:
+                        self._raw_keys.popitem(last=False)
+            self._key_stats['lookups'] += 1
+            self._key_stats['hits'] += int(hit)
+            self._key_stats['raw_key_hits'] += int(raw_hit)
 
+    @traced("search.analyze_intent")
     def _analyze_search_intent(self, query: str) -> SearchIntent:
         """
         Analisa a intenção de busca usando GPT-4
+
+        Consulta antes o cache persistente de intenções; só respostas
+        válidas do modelo são gravadas nele (o fallback por regras não).
         
         Args:
             query: Consulta em linguagem natural
@@ -139,37 +225,71 @@ class IntelligentSearchV5:
         Returns:
             SearchIntent: Objeto com a intenção analisada
         """
+        cache = self.intent_cache
+        if cache is not None:
+            cached = cache.get(query)
+            if cached is not None:
+                self._count_intent('intent_cache')
+                annotate(source='intent_cache')
+                return SearchIntent(**{k: v for k, v in cached.items() if k in SearchIntent.__dataclass_fields__})
+
         try:
-            system_prompt = """
-            Você é um especialista em análise de consultas para produtos STIHL.
-            Analise a consulta do usuário e extraia as seguintes informações:
-            
-            1. Tipo de busca (PRODUCT_SEARCH, PRICE_RANGE, COMPATIBILITY, RECOMMENDATION)
-            2. Categoria do produto (motosserra, roçadeira, peça, acessório, etc.)
-            3. Nome do modelo (se mencionado, ex: MS 162, FS 220)
-            4. Faixa de preço (se mencionada)
-            5. Tipo de uso (doméstico, profissional, poda, etc.)
-            6. Palavras-chave importantes
-            
-            Responda APENAS em formato JSON válido.
-            """
-            
-            user_prompt = f"""
-            Consulta: "{query}"
-            
-            Analise e responda em JSON com esta estrutura:
-            {{
-                "search_type": "PRODUCT_SEARCH",
-                "product_category": "motosserra",
-                "model_name": "MS 162",
-                "price_min": 1000.0,
-                "price_max": 2000.0,
-                "usage_type": "domestico",
-                "keywords": ["motosserra", "elétrica", "leve"],
-                "confidence": 0.85
-            }}
-            """
+            self._count_intent('llm')
+            annotate(source='llm')
+            intent = self._request_llm_intent(query)
+        except Exception as e:
+            print(f"Erro na análise de intenção: {e}")
+            self._count_intent('llm_errors')
+            annotate(source='rules_fallback')
+            record_error(e)
+            # Fallback para análise simples baseada em regex
+            return self._simple_intent_analysis(query)
+
+        if cache is not None:
+            cache.put(query, asdict(intent))
+        return intent
+
+    def _request_llm_intent(self, query: str) -> SearchIntent:
+        """
+        Requisição ao GPT-4 para análise de intenção (erros são propagados)
+        
+        Args:
+            query: Consulta em linguagem natural
             
+        Returns:
+            SearchIntent: Objeto com a intenção analisada
+        """
+        system_prompt = """
+        Você é um especialista em análise de consultas para produtos STIHL.
+        Analise a consulta do usuário e extraia as seguintes informações:
+        
+        1. Tipo de busca (PRODUCT_SEARCH, PRICE_RANGE, COMPATIBILITY, RECOMMENDATION)
+        2. Categoria do produto (motosserra, roçadeira, peça, acessório, etc.)
+        3. Nome do modelo (se mencionado, ex: MS 162, FS 220)
+        4. Faixa de preço (se mencionada)
+        5. Tipo de uso (doméstico, profissional, poda, etc.)
+        6. Palavras-chave importantes
+        
+        Responda APENAS em formato JSON válido.
+        """
+        
+        user_prompt = f"""
+        Consulta: "{query}"
+        
+        Analise e responda em JSON com esta estrutura:
+        {{
+            "search_type": "PRODUCT_SEARCH",
+            "product_category": "motosserra",
+            "model_name": "MS 162",
+            "price_min": 1000.0,
+            "price_max": 2000.0,
+            "usage_type": "domestico",
+            "keywords": ["motosserra", "elétrica", "leve"],
+            "confidence": 0.85
+        }}
+        """
+        
+        with stage('llm_call'):
             response = client.chat.completions.create(
                 model="gpt-4",
                 messages=[
@@ -179,29 +299,52 @@ class IntelligentSearchV5:
                 temperature=0.1,
                 max_tokens=500
             )
-            
-            # Parse da resposta JSON
-            intent_data = json.loads(response.choices[0].message.content)
-            
-            return SearchIntent(
-                search_type=intent_data.get('search_type', 'PRODUCT_SEARCH'),
-                product_category=intent_data.get('product_category'),
-                model_name=intent_data.get('model_name'),
-                price_min=intent_data.get('price_min'),
-                price_max=intent_data.get('price_max'),
-                usage_type=intent_data.get('usage_type'),
-                keywords=intent_data.get('keywords', []),
-                confidence=intent_data.get('confidence', 0.5)
-            )
-            
-        except Exception as e:
-            print(f"Erro na análise de intenção: {e}")
-            # Fallback para análise simples baseada em regex
-            return self._simple_intent_analysis(query)
+        
+        # Parse da resposta JSON
+        intent_data = json.loads(response.choices[0].message.content)
+        
+        return SearchIntent(
+            search_type=intent_data.get('search_type', 'PRODUCT_SEARCH'),
+            product_category=intent_data.get('product_category'),
+            model_name=intent_data.get('model_name'),
+            price_min=intent_data.get('price_min'),
+            price_max=intent_data.get('price_max'),
+            usage_type=intent_data.get('usage_type'),
+            keywords=intent_data.get('keywords', []),
+            confidence=intent_data.get('confidence', 0.5)
+        )
+
+    # Pesos da confiança da análise por regras: cada sinal reconhecido soma,
+    # cada palavra não reconhecida (além da primeira) subtrai. Calibrados
+    # para que código ou modelo isolados ("4147-141-0300", "MS 162") e
+    # categoria com faixa de preço fiquem acima do limiar padrão (0.7), e
+    # consultas descritivas ("motosserra leve para poda") abaixo dele.
+    INTENT_WEIGHTS = {
+        'base': 0.2,
+        'code': 0.75,
+        'model': 0.55,
+        'part_type': 0.2,
+        'spec': 0.05,
+        'category': 0.3,
+        'price': 0.25,
+        'usage': 0.1,
+        'unknown_word': -0.1,
+    }
+
+    USAGE_WORDS = {
+        'domestico': ['domestico', 'casa', 'jardim', 'residencial'],
+        'profissional': ['profissional', 'comercial', 'trabalho'],
+        'poda': ['poda', 'podar', 'arvore', 'arvores'],
+    }
 
     def _simple_intent_analysis(self, query: str) -> SearchIntent:
         """
-        Análise simples de intenção usando regex (fallback)
+        Análise de intenção determinística (regras e regex)
+
+        Usa as entidades de text_normalizer (CODE_RE, MODEL_RE, tipo de
+        peça, especificação, faixa de preço) e devolve uma confiança
+        calibrada por INTENT_WEIGHTS. É o caminho rápido de search(): o
+        GPT-4 só é consultado abaixo de INTENT_LLM_THRESHOLD.
         
         Args:
             query: Consulta em linguagem natural
@@ -209,67 +352,91 @@ class IntelligentSearchV5:
         Returns:
             SearchIntent: Objeto com a intenção analisada
         """
-        query_lower = query.lower()
-        
-        # Detectar categoria do produto
+        c = canonical_query(query)
+        normalized = normalize_input(query)
+        words = set(c['terms'])
+        recognized = set()
+        # "4147 141 0300" e "41471410300" também são código
+        code = c['code'] or material_code(query)
+        if code and not c['code']:
+            recognized |= words
+        w = self.INTENT_WEIGHTS
+        confidence = w['base']
+
+        # Categoria: chave ou alias como palavra inteira (aceita plural)
         product_category = None
         for category, aliases in self.category_mapping.items():
-            if any(alias in query_lower for alias in aliases):
-                product_category = category
+            for alias in [category] + aliases:
+                alias = fold_text(alias)
+                if ' ' in alias:
+                    hit = alias in normalized
+                    matched = set(alias.split()) & words
+                else:
+                    matched = {word for word in words if word in (alias, alias + 's', alias.rstrip('s'))}
+                    hit = bool(matched)
+                if hit:
+                    product_category = category
+                    recognized |= matched
+                    break
+            if product_category:
                 break
-        
-        # Detectar modelo específico
-        model_patterns = [
-            r'ms\s*(\d+)',  # MS 162, MS250, etc.
-            r'fs\s*(\d+)',  # FS 220, FS55, etc.
-            r'fsa\s*(\d+)', # FSA 45, etc.
-            r'fse\s*(\d+)'  # FSE 60, etc.
-        ]
-        
-        model_name = None
-        for pattern in model_patterns:
-            match = re.search(pattern, query_lower)
-            if match:
-                model_name = f"{pattern[:2].upper()} {match.group(1)}"
-                break
-        
-        # Detectar faixa de preço
-        price_min, price_max = None, None
-        price_patterns = [
-            r'até\s*r?\$?\s*(\d+(?:\.\d+)?)',
-            r'abaixo\s*de\s*r?\$?\s*(\d+(?:\.\d+)?)',
-            r'menos\s*de\s*r?\$?\s*(\d+(?:\.\d+)?)'
-        ]
-        
-        for pattern in price_patterns:
-            match = re.search(pattern, query_lower)
-            if match:
-                price_max = float(match.group(1))
-                break
-        
-        # Detectar tipo de uso
+
         usage_type = None
-        if any(word in query_lower for word in ['domestico', 'casa', 'jardim', 'residencial']):
-            usage_type = 'domestico'
-        elif any(word in query_lower for word in ['profissional', 'comercial', 'trabalho']):
-            usage_type = 'profissional'
-        elif any(word in query_lower for word in ['poda', 'podar', 'arvore']):
-            usage_type = 'poda'
-        
-        # Extrair palavras-chave
-        keywords = [word for word in query_lower.split() if len(word) > 2]
+        for usage, usage_words in self.USAGE_WORDS.items():
+            matched = words & set(usage_words)
+            if matched:
+                usage_type = usage
+                recognized |= matched
+                break
+        recognized |= words & set(self.synonyms)
+
+        model_name = c['models'][0] if c['models'] else None
+        has_price = c['price_min'] is not None or c['price_max'] is not None
+
+        if code:
+            confidence += w['code']
+        if model_name:
+            confidence += w['model']
+        if c['part_type']:
+            confidence += w['part_type']
+        if c['spec']:
+            confidence += w['spec']
+        if product_category:
+            confidence += w['category']
+        if has_price:
+            confidence += w['price']
+        if usage_type:
+            confidence += w['usage']
+        unknown = len(words - recognized)
+        if unknown > 1:
+            confidence += w['unknown_word'] * (unknown - 1)
+
+        if code or (model_name and not usage_type):
+            search_type = 'PRODUCT_SEARCH' if code or c['part_type'] else 'COMPATIBILITY'
+        elif has_price:
+            search_type = 'PRICE_RANGE'
+        elif usage_type:
+            search_type = 'RECOMMENDATION'
+        else:
+            search_type = 'PRODUCT_SEARCH'
+
+        # Palavras-chave para o tsquery: entidades + termos restantes. Modelos
+        # na forma das descrições ("ms 162"): o tsvector não tem "ms162"
+        keywords = [k for k in [code, *map(model_search_text, c['models']), c['part_type'], c['spec']] if k]
+        keywords += [word for word in c['terms'] if len(word) > 2 and word not in recognized]
         
         return SearchIntent(
-            search_type='PRODUCT_SEARCH',
+            search_type=search_type,
             product_category=product_category,
             model_name=model_name,
-            price_min=price_min,
-            price_max=price_max,
+            price_min=c['price_min'],
+            price_max=c['price_max'],
             usage_type=usage_type,
             keywords=keywords,
-            confidence=0.7
+            confidence=round(min(0.99, max(0.05, confidence)), 2)
         )
 
+    @traced("search.search")
     def search(self, query: str, max_results: int = 20) -> List[SearchResult]:
         """
         Executa busca inteligente principal
@@ -281,51 +448,158 @@ class IntelligentSearchV5:
         Returns:
             List[SearchResult]: Lista de resultados ordenados por relevância
         """
+        return self._search(query, max_results)
+
+    @traced("search.search_page")
+    def search_page(self, query: str, page_size: int = 20,
+                    cursor: Optional[str] = None) -> Tuple[List[SearchResult], Optional[str]]:
+        """
+        Uma página da busca, em ordem (relevância, preço, código)
+
+        A página seguinte começa depois do último item entregue (keyset),
+        com o mesmo custo da primeira, qualquer que seja a profundidade.
+
+        Args:
+            query: Consulta em linguagem natural
+            page_size: Itens por página
+            cursor: Cursor devolvido pela página anterior
+
+        Returns:
+            Tuple[List[SearchResult], Optional[str]]: Resultados e cursor da
+            próxima página (None na última)
+
+        Raises:
+            CursorError: Cursor inválido ou de outra consulta
+        """
+        scope = f"search:{canonical_query_key(query)}"
+        after = decode_cursor(cursor, scope)
+        results = self._search(query, page_size + 1, after)
+        if len(results) <= page_size:
+            return results, None
+        results = results[:page_size]
+        last = results[-1]
+        return results, encode_cursor(scope, [
+            last.relevance_score, last.preco_real, last.codigo_material, last.source_table,
+        ])
+
+    def _search(self, query: str, max_results: int, after: Optional[List] = None) -> List[SearchResult]:
         # Verificar cache
-        cache_key = self._generate_cache_key(query, {'max_results': max_results})
-        if cache_key in self.cache and self._is_cache_valid(self.cache[cache_key]):
-            return self.cache[cache_key]['results']
+        filters: Dict[str, Any] = {'max_results': max_results}
+        if after is not None:
+            filters['after'] = after
+        cache_key = self._generate_cache_key(query, filters)
+        cached = self.cache.get(cache_key)
+        self._record_key_lookup(query, filters, cached is not None)
+        annotate(cache='hit' if cached is not None else 'miss')
+        if cached is not None:
+            return cached
         
-        # Analisar intenção da busca
-        intent = self._analyze_search_intent(query)
+        # Analisar intenção: regras primeiro, GPT-4 só abaixo do limiar
+        with stage('intent_parse'):
+            intent = self._simple_intent_analysis(query)
+            if intent.confidence >= self.intent_llm_threshold:
+                self._count_intent('rule_based')
+            else:
+                intent = self._analyze_search_intent(query)
         
-        # Executar busca no banco de dados
-        results = self._execute_database_search(intent, max_results)
+        # Executar busca no banco de dados (erros sobem sem passar pelo cache)
+        results = self._execute_database_search(intent, max_results, after)
         
         # Armazenar no cache
-        self.cache[cache_key] = {
-            'results': results,
-            'created_at': datetime.now()
-        }
+        self.cache.set(cache_key, results)
         
         return results
 
-    def _execute_database_search(self, intent: SearchIntent, max_results: int) -> List[SearchResult]:
+    @traced("search.database")
+    def _execute_database_search(self, intent: SearchIntent, max_results: int,
+                                 after: Optional[List] = None) -> List[SearchResult]:
         """
         Executa a busca no banco de dados baseada na intenção analisada
         
         Args:
             intent: Intenção de busca analisada
             max_results: Número máximo de resultados
+            after: (relevância, preço, código, tabela) do último item já
+                entregue; a busca continua a partir dele
             
         Returns:
             List[SearchResult]: Lista de resultados
+
+        Raises:
+            psycopg2.Error: Falha no banco; propagada para que uma lista
+                vazia de erro nunca vá para o cache (L1 nem L2 compartilhado)
         """
+        # O modelo tem filtro próprio; as palavras-chave que o repetem
+        # ("ms 162", "MS162") saem do texto
+        model = canonical_model(intent.model_name) if intent.model_name else None
+        keywords = [k for k in intent.keywords or [] if not model or canonical_model(k) != model]
+        query_text = ' '.join(keywords) if keywords else None
+        # Curingas digitados (%, _) valem como texto literal no LIKE
+        like_text = _escape_like(query_text) if query_text else None
+        model_text = model_search_text(model) if model else None
+
+        # Consulta direta à visão materializada: texto completo (GIN do
+        # tsvector) ou substring sem acentos (GIN trigram em texto_busca)
+        rank: List[str] = []
+        params: List[Any] = []
+        if query_text:
+            rank.append("ts_rank(search_vector, plainto_tsquery('portuguese', f_unaccent(%s)))"
+                        " + CASE WHEN texto_busca LIKE '%%' || f_unaccent(lower(%s)) || '%%' ESCAPE '\\'"
+                        " THEN 0.05 ELSE 0 END")
+            params.extend([query_text, like_text])
+        if model:
+            # O próprio modelo (descrição) antes dos compatíveis
+            rank.append("ts_rank(search_vector, plainto_tsquery('portuguese', %s))")
+            params.append(model_text)
+        sql = """
+            SELECT source_table, codigo_material, descricao, preco_real,
+                   modelos_compatibilidade, categoria_produto,
+                   {rank} AS relevance_score
+            FROM catalog_search_mv
+            WHERE preco_real IS NOT NULL
+        """.format(rank=' + '.join(rank) or "0.0")
+
+        if query_text:
+            sql += """ AND (search_vector @@ plainto_tsquery('portuguese', f_unaccent(%s))
+                            OR texto_busca LIKE '%%' || f_unaccent(lower(%s)) || '%%' ESCAPE '\\')"""
+            params.extend([query_text, like_text])
+        if model:
+            # Descrição com o modelo ("MS 162 Motosserra") ou produto
+            # compatível em product_compatibility_v5
+            sql += """ AND (search_vector @@ plainto_tsquery('portuguese', %s)
+                            OR codigo_material IN (SELECT pc.codigo_material FROM product_compatibility_v5 pc
+                                                   WHERE pc.modelo_canonico = %s))"""
+            params.extend([model_text, model])
+        if intent.price_min is not None:
+            sql += " AND preco_real >= %s"
+            params.append(intent.price_min)
+        if intent.price_max is not None:
+            sql += " AND preco_real <= %s"
+            params.append(intent.price_max)
+        if intent.product_category:
+            sql += """ AND EXISTS (SELECT 1 FROM unnest(categoria_termos) t
+                                   WHERE f_unaccent(%s) ILIKE '%%' || f_unaccent(t) || '%%')"""
+            params.append(intent.product_category)
+
+        if after is not None:
+            # Keyset: relevância decrescente, depois (preço, código, tabela) crescentes
+            sql = f"""
+                SELECT * FROM ({sql}) matches
+                WHERE relevance_score < %s
+                   OR (relevance_score = %s
+                       AND (preco_real, codigo_material, source_table) > (%s, %s, %s))
+            """
+            params.extend([after[0], after[0], after[1], after[2], after[3]])
+
+        sql += " ORDER BY relevance_score DESC, preco_real ASC, codigo_material, source_table LIMIT %s"
+        params.append(max_results)
+
         try:
-            with self._get_db_connection() as conn:
+            with stage('db_query'), self._get_db_connection() as conn:
                 with conn.cursor() as cursor:
-                    # Usar a função SQL de busca inteligente
-                    cursor.execute("""
-                        SELECT * FROM intelligent_product_search_v5(%s, %s, %s, %s, %s)
-                    """, (
-                        ' '.join(intent.keywords) if intent.keywords else None,
-                        max_results,
-                        intent.price_min,
-                        intent.price_max,
-                        intent.product_category
-                    ))
-                    
+                    cursor.execute(sql, params)
                     rows = cursor.fetchall()
+                    annotate(rows=len(rows))
                     
                     results = []
                     for row in rows:
@@ -334,7 +608,7 @@ class IntelligentSearchV5:
                             codigo_material=row['codigo_material'],
                             descricao=row['descricao'],
                             preco_real=float(row['preco_real']) if row['preco_real'] else 0.0,
-                            modelos=row['modelos'] or '',
+                            modelos=row['modelos_compatibilidade'] or '',
                             categoria_produto=row['categoria_produto'],
                             relevance_score=float(row['relevance_score']) if row['relevance_score'] else 0.0
                         )
@@ -344,19 +618,30 @@ class IntelligentSearchV5:
                     
         except Exception as e:
             print(f"Erro na busca no banco de dados: {e}")
-            return []
+            raise
 
     def search_by_code(self, material_code: str) -> Optional[SearchResult]:
         """
         Busca produto específico por código de material
+
+        Aceita também código substituído, EAN e CA: o identificador é
+        resolvido no diretório (em memória, se habilitado, ou pela própria
+        get_product_by_code_v5) e o resultado traz o código vigente.
         
         Args:
-            material_code: Código do material
+            material_code: Código do material (ou EAN, CA, código antigo)
             
         Returns:
             Optional[SearchResult]: Resultado encontrado ou None
         """
         try:
+            directory = get_identifier_directory()
+            if directory is not None:
+                resolved = directory.resolve(material_code)
+                if resolved is None:
+                    return None
+                material_code = resolved['codigo_material']
+
             with self._get_db_connection() as conn:
                 with conn.cursor() as cursor:
                     cursor.execute("""
@@ -371,7 +656,7 @@ class IntelligentSearchV5:
                             codigo_material=row['codigo_material'],
                             descricao=row['descricao'],
                             preco_real=float(row['preco_real']) if row['preco_real'] else 0.0,
-                            modelos=row['modelos'] or '',
+                            modelos=row['modelos_compatibilidade'] or '',
                             categoria_produto=row['categoria_produto'],
                             relevance_score=1.0,
                             detalhes_tecnicos=row['detalhes_tecnicos']
@@ -383,6 +668,70 @@ class IntelligentSearchV5:
             print(f"Erro na busca por código: {e}")
             return None
 
+    def search_by_codes(self, material_codes: List[str]) -> Dict[str, Optional[SearchResult]]:
+        """
+        Busca vários códigos de material com uma única consulta (= ANY)
+
+        Os identificadores são resolvidos no diretório em memória, se
+        habilitado; sem ele, os códigos ausentes da visão (ex.: código
+        substituído) são consultados um a um por search_by_code.
+
+        Args:
+            material_codes: Códigos de material (ou EAN, CA, código antigo)
+
+        Returns:
+            Dict[str, Optional[SearchResult]]: Resultado (ou None) por código informado
+
+        Raises:
+            psycopg2.Error: Falha no banco (propagada: None significaria
+                "código inexistente")
+        """
+        directory = get_identifier_directory()
+        resolved: Dict[str, Optional[str]] = {}
+        for code in material_codes:
+            if directory is not None:
+                entry = directory.resolve(code)
+                resolved[code] = entry['codigo_material'] if entry else None
+            else:
+                resolved[code] = code
+
+        wanted = sorted({c for c in resolved.values() if c})
+        found: Dict[str, SearchResult] = {}
+        if wanted:
+            try:
+                with self._get_db_connection() as conn:
+                    with conn.cursor() as cursor:
+                        cursor.execute("""
+                            SELECT source_table, codigo_material, descricao, preco_real,
+                                   modelos_compatibilidade, categoria_produto
+                            FROM catalog_search_mv
+                            WHERE codigo_material = ANY(%s)
+                            ORDER BY codigo_material, source_table
+                        """, (wanted,))
+                        for row in cursor.fetchall():
+                            # Mesmo código em mais de uma aba: vale a primeira
+                            found.setdefault(row['codigo_material'], SearchResult(
+                                source_table=row['source_table'],
+                                codigo_material=row['codigo_material'],
+                                descricao=row['descricao'],
+                                preco_real=float(row['preco_real']) if row['preco_real'] else 0.0,
+                                modelos=row['modelos_compatibilidade'] or '',
+                                categoria_produto=row['categoria_produto'],
+                                relevance_score=1.0
+                            ))
+            except Exception as e:
+                logger.error("Erro na busca por códigos: %s", e)
+                record_error(e)
+                raise
+
+        results: Dict[str, Optional[SearchResult]] = {}
+        for code, canonical in resolved.items():
+            result = found.get(canonical) if canonical else None
+            if result is None and canonical and directory is None:
+                result = self.search_by_code(code)
+            results[code] = result
+        return results
+
     def get_compatible_products(self, model_name: str) -> List[SearchResult]:
         """
         Busca produtos compatíveis com um modelo específico
@@ -392,34 +741,128 @@ class IntelligentSearchV5:
             
         Returns:
             List[SearchResult]: Lista de produtos compatíveis
+
+        Raises:
+            psycopg2.Error: Falha no banco, propagada para a rota responder
+                5xx em vez de uma lista vazia que iria para o cache HTTP
         """
-        try:
+        index = get_compatibility_index()
+        if index is not None:
+            results = []
+            for table, codigo, descricao, preco in index.lookup(model_name, priced_only=True):
+                source_table, tipo, categoria = COMPAT_LABELS[table]
+                results.append(SearchResult(
+                    source_table=source_table,
+                    codigo_material=codigo,
+                    descricao=descricao,
+                    preco_real=preco,
+                    modelos=tipo,
+                    categoria_produto=categoria,
+                    relevance_score=0.8
+                ))
+            return results
+
+        with self._get_db_connection() as conn:
+            with conn.cursor() as cursor:
+                cursor.execute("""
+                    SELECT * FROM get_compatible_products_v5(%s)
+                """, (model_name,))
+                
+                rows = cursor.fetchall()
+                
+                results = []
+                for row in rows:
+                    result = SearchResult(
+                        source_table=row['source_table'],
+                        codigo_material=row['codigo_material'],
+                        descricao=row['descricao'],
+                        preco_real=float(row['preco_real']) if row['preco_real'] else 0.0,
+                        modelos=row['tipo_compatibilidade'],
+                        categoria_produto=row['categoria_produto'],
+                        relevance_score=0.8
+                    )
+                    results.append(result)
+                
+                return results
+
+    def get_compatible_page(self, model_name: str, page_size: int = 50,
+                            cursor: Optional[str] = None) -> Tuple[List[SearchResult], Optional[str]]:
+        """
+        Uma página dos produtos compatíveis, em ordem (preço, código)
+
+        Com o índice em memória a página é um recorte (bisect) da lista já
+        ordenada; sem ele, o keyset vai direto para product_compatibility_v5
+        (varredura de intervalo em idx_product_compat_modelo_preco), sem
+        montar o conjunto inteiro em get_compatible_products_v5().
+
+        Args:
+            model_name: Nome do modelo (ex: MS 250)
+            page_size: Itens por página
+            cursor: Cursor devolvido pela página anterior
+
+        Returns:
+            Tuple[List[SearchResult], Optional[str]]: Produtos e cursor da
+            próxima página (None na última)
+
+        Raises:
+            CursorError: Cursor inválido ou de outro modelo
+            psycopg2.Error: Falha no banco (propagada, ver get_compatible_products)
+        """
+        index = get_compatibility_index()
+        # A ordenação de texto do banco (collation) pode diferir da do Python: cursores não se misturam
+        scope = f"compat:{'mem' if index is not None else 'sql'}:{canonical_model(model_name)}"
+        after = decode_cursor(cursor, scope)
+        results: List[SearchResult] = []
+        last_key = None
+
+        if index is not None:
+            items = index.lookup_page(model_name, after, page_size + 1, priced_only=True)
+            for table, codigo, descricao, preco in items[:page_size]:
+                source_table, tipo, categoria = COMPAT_LABELS[table]
+                results.append(SearchResult(
+                    source_table=source_table,
+                    codigo_material=codigo,
+                    descricao=descricao,
+                    preco_real=preco,
+                    modelos=tipo,
+                    categoria_produto=categoria,
+                    relevance_score=0.8
+                ))
+                last_key = [preco, codigo, table]
+            has_more = len(items) > page_size
+        else:
+            # Mesmo filtro e rótulos de get_compatible_products_v5()
+            sql = """
+                SELECT pc.source_table, pc.codigo_material, pc.descricao, pc.preco_real
+                FROM product_compatibility_v5 pc
+                WHERE pc.modelo_canonico = canonical_model_v5(%s)
+                    AND pc.preco_real > 0
+            """
+            params: List[Any] = [model_name]
+            if after is not None:
+                sql += " AND (pc.preco_real, pc.codigo_material, pc.source_table) > (%s::numeric, %s, %s)"
+                params.extend(after)
+            sql += " ORDER BY pc.preco_real, pc.codigo_material, pc.source_table LIMIT %s"
+            params.append(page_size + 1)
             with self._get_db_connection() as conn:
-                with conn.cursor() as cursor:
-                    cursor.execute("""
-                        SELECT * FROM get_compatible_products_v5(%s)
-                    """, (model_name,))
-                    
-                    rows = cursor.fetchall()
-                    
-                    results = []
-                    for row in rows:
-                        result = SearchResult(
-                            source_table=row['source_table'],
-                            codigo_material=row['codigo_material'],
-                            descricao=row['descricao'],
-                            preco_real=float(row['preco_real']) if row['preco_real'] else 0.0,
-                            modelos=row['tipo_compatibilidade'],
-                            categoria_produto=row['categoria_produto'],
-                            relevance_score=0.8
-                        )
-                        results.append(result)
-                    
-                    return results
-                    
-        except Exception as e:
-            print(f"Erro na busca de compatibilidade: {e}")
-            return []
+                with conn.cursor() as cursor_:
+                    cursor_.execute(sql, params)
+                    rows = cursor_.fetchall()
+            for row in rows[:page_size]:
+                source_table, tipo, categoria = COMPAT_LABELS.get(row['source_table'], COMPAT_LABELS['cj_corte_fs'])
+                results.append(SearchResult(
+                    source_table=source_table,
+                    codigo_material=row['codigo_material'],
+                    descricao=row['descricao'],
+                    preco_real=float(row['preco_real']),
+                    modelos=tipo,
+                    categoria_produto=categoria,
+                    relevance_score=0.8
+                ))
+                last_key = [str(row['preco_real']), row['codigo_material'], row['source_table']]
+            has_more = len(rows) > page_size
+
+        return results, (encode_cursor(scope, last_key) if has_more else None)
 
     def get_recommendations(self, usage_type: str = 'domestico', 
                           budget_max: Optional[float] = None,
@@ -434,34 +877,33 @@ class IntelligentSearchV5:
             
         Returns:
             List[SearchResult]: Lista de recomendações
+
+        Raises:
+            psycopg2.Error: Falha no banco, propagada para a rota responder
+                5xx em vez de uma lista vazia que iria para o cache HTTP
         """
-        try:
-            with self._get_db_connection() as conn:
-                with conn.cursor() as cursor:
-                    cursor.execute("""
-                        SELECT * FROM get_product_recommendations_v5(%s, %s, %s)
-                    """, (usage_type, budget_max, product_type))
-                    
-                    rows = cursor.fetchall()
-                    
-                    results = []
-                    for row in rows:
-                        result = SearchResult(
-                            source_table=row['source_table'],
-                            codigo_material=row['codigo_material'],
-                            descricao=row['descricao'],
-                            preco_real=float(row['preco_real']) if row['preco_real'] else 0.0,
-                            modelos=row['motivo_recomendacao'],
-                            categoria_produto=row['categoria_produto'],
-                            relevance_score=float(row['score_recomendacao']) / 100.0
-                        )
-                        results.append(result)
-                    
-                    return results
-                    
-        except Exception as e:
-            print(f"Erro nas recomendações: {e}")
-            return []
+        with self._get_db_connection() as conn:
+            with conn.cursor() as cursor:
+                cursor.execute("""
+                    SELECT * FROM get_product_recommendations_v5(%s, %s, %s)
+                """, (usage_type, budget_max, product_type))
+                
+                rows = cursor.fetchall()
+                
+                results = []
+                for row in rows:
+                    result = SearchResult(
+                        source_table=row['source_table'],
+                        codigo_material=row['codigo_material'],
+                        descricao=row['descricao'],
+                        preco_real=float(row['preco_real']) if row['preco_real'] else 0.0,
+                        modelos=row['motivo_recomendacao'],
+                        categoria_produto=row['categoria_produto'],
+                        relevance_score=float(row['score_recomendacao']) / 100.0
+                    )
+                    results.append(result)
+                
+                return results
 
     def get_campaign_products(self) -> List[Dict]:
         """
@@ -469,32 +911,31 @@ class IntelligentSearchV5:
         
         Returns:
             List[Dict]: Lista de produtos em campanha
+
+        Raises:
+            psycopg2.Error: Falha no banco, propagada para a rota responder
+                5xx em vez de uma lista vazia que iria para o cache HTTP
         """
-        try:
-            with self._get_db_connection() as conn:
-                with conn.cursor() as cursor:
-                    cursor.execute("SELECT * FROM get_campaign_products_v5()")
-                    
-                    rows = cursor.fetchall()
-                    
-                    campaigns = []
-                    for row in rows:
-                        campaign = {
-                            'codigo': row['codigo'],
-                            'produto': row['produto'],
-                            'preco_lista': float(row['preco_lista']) if row['preco_lista'] else 0.0,
-                            'preco_campanha': float(row['preco_campanha']) if row['preco_campanha'] else 0.0,
-                            'desconto_percentual': float(row['desconto_percentual']) if row['desconto_percentual'] else 0.0,
-                            'economia': float(row['economia']) if row['economia'] else 0.0,
-                            'parcelas_sem_juros': int(row['parcelas_sem_juros']) if row['parcelas_sem_juros'] else 0
-                        }
-                        campaigns.append(campaign)
-                    
-                    return campaigns
-                    
-        except Exception as e:
-            print(f"Erro na busca de campanhas: {e}")
-            return []
+        with self._get_db_connection() as conn:
+            with conn.cursor() as cursor:
+                cursor.execute("SELECT * FROM get_campaign_products_v5()")
+                
+                rows = cursor.fetchall()
+                
+                campaigns = []
+                for row in rows:
+                    campaign = {
+                        'codigo': row['codigo'],
+                        'produto': row['produto'],
+                        'preco_lista': float(row['preco_lista']) if row['preco_lista'] else 0.0,
+                        'preco_campanha': float(row['preco_campanha']) if row['preco_campanha'] else 0.0,
+                        'desconto_percentual': float(row['desconto_percentual']) if row['desconto_percentual'] else 0.0,
+                        'economia': float(row['economia']) if row['economia'] else 0.0,
+                        'parcelas_sem_juros': int(row['parcelas_sem_juros']) if row['parcelas_sem_juros'] else 0
+                    }
+                    campaigns.append(campaign)
+                
+                return campaigns
 
     def get_price_ranges(self) -> List[Dict]:
         """
@@ -502,31 +943,31 @@ class IntelligentSearchV5:
         
         Returns:
             List[Dict]: Estatísticas de preço por categoria
+
+        Raises:
+            psycopg2.Error: Falha no banco, propagada para a rota responder
+                5xx em vez de uma lista vazia que iria para o cache HTTP
         """
-        try:
-            with self._get_db_connection() as conn:
-                with conn.cursor() as cursor:
-                    cursor.execute("SELECT * FROM get_price_ranges_by_category_v5()")
-                    
-                    rows = cursor.fetchall()
-                    
-                    ranges = []
-                    for row in rows:
-                        range_data = {
-                            'categoria': row['categoria'],
-                            'preco_minimo': float(row['preco_minimo']) if row['preco_minimo'] else 0.0,
-                            'preco_maximo': float(row['preco_maximo']) if row['preco_maximo'] else 0.0,
-                            'preco_medio': float(row['preco_medio']) if row['preco_medio'] else 0.0,
-                            'total_produtos': int(row['total_produtos']) if row['total_produtos'] else 0
-                        }
-                        ranges.append(range_data)
-                    
-                    return ranges
-                    
-        except Exception as e:
-            print(f"Erro na análise de preços: {e}")
-            return []
+        with self._get_db_connection() as conn:
+            with conn.cursor() as cursor:
+                cursor.execute("SELECT * FROM get_price_ranges_by_category_v5()")
+                
+                rows = cursor.fetchall()
+                
+                ranges = []
+                for row in rows:
+                    range_data = {
+                        'categoria': row['categoria'],
+                        'preco_minimo': float(row['preco_minimo']) if row['preco_minimo'] else 0.0,
+                        'preco_maximo': float(row['preco_maximo']) if row['preco_maximo'] else 0.0,
+                        'preco_medio': float(row['preco_medio']) if row['preco_medio'] else 0.0,
+                        'total_produtos': int(row['total_produtos']) if row['total_produtos'] else 0
+                    }
+                    ranges.append(range_data)
+                
+                return ranges
 
+    @traced("search.natural_response")
     def generate_natural_response(self, query: str, results: List[SearchResult]) -> str:
         """
         Gera resposta em linguagem natural baseada nos resultados
@@ -573,20 +1014,22 @@ class IntelligentSearchV5:
             5. Observações úteis
             """
             
-            response = client.chat.completions.create(
-                model="gpt-4",
-                messages=[
-                    {"role": "system", "content": system_prompt},
-                    {"role": "user", "content": user_prompt}
-                ],
-                temperature=0.3,
-                max_tokens=800
-            )
+            with stage('llm_call'):
+                response = client.chat.completions.create(
+                    model="gpt-4",
+                    messages=[
+                        {"role": "system", "content": system_prompt},
+                        {"role": "user", "content": user_prompt}
+                    ],
+                    temperature=0.3,
+                    max_tokens=800
+                )
             
             return response.choices[0].message.content
             
         except Exception as e:
             print(f"Erro na geração de resposta natural: {e}")
+            record_error(e)
             # Fallback para resposta simples
             if len(results) == 1:
                 result = results[0]
@@ -605,12 +1048,59 @@ class IntelligentSearchV5:
         Returns:
             Dict: Estatísticas do cache
         """
-        valid_entries = sum(1 for entry in self.cache.values() if self._is_cache_valid(entry))
-        
-        return {
-            'total_entries': len(self.cache),
-            'valid_entries': valid_entries,
-            'expired_entries': len(self.cache) - valid_entries,
+        stats = self.cache.stats()
+        stats.setdefault('l2_enabled', False)
+        stats.update({
+            'total_entries': stats['entries'],
+            'valid_entries': stats['entries'] - stats['expired_entries'],
             'cache_ttl_minutes': self.cache_ttl.total_seconds() / 60
-        }
+        })
 
+        # Taxa de acerto da chave canônica vs. a que o texto bruto teria
+        with self._key_stats_lock:
+            key_stats = dict(self._key_stats)
+        lookups = key_stats['lookups']
+        key_stats['hit_rate'] = round(key_stats['hits'] / lookups, 4) if lookups else 0.0
+        if self._raw_keys is None:
+            key_stats.pop('raw_key_hits')
+        else:
+            key_stats['raw_key_hit_rate'] = round(key_stats['raw_key_hits'] / lookups, 4) if lookups else 0.0
+        stats['key_normalization'] = key_stats
+        return stats
+
+    def get_intent_stats(self) -> Dict:
+        """
+        Obtém estatísticas da análise de intenção
+        
+        Returns:
+            Dict: Consultas resolvidas por regras, pelo cache de intenções,
+                  pelo GPT-4 e a fração atendida sem LLM
+        """
+        with self._key_stats_lock:
+            stats = dict(self._intent_stats)
+        without_llm = stats['rule_based'] + stats['intent_cache']
+        analyzed = without_llm + stats['llm']
+        stats['threshold'] = self.intent_llm_threshold
+        stats['served_without_llm'] = round(without_llm / analyzed, 4) if analyzed else 0.0
+        stats['persistent_cache'] = self.intent_cache.stats() if self.intent_cache is not None else None
+        return stats
+
+    def warm_intent_cache(self, queries, limit: Optional[int] = None) -> int:
+        """
+        Pré-aquece o cache de intenções com consultas históricas
+
+        Só as consultas que o caminho por regras não resolve (confiança
+        abaixo do limiar) são enviadas ao GPT-4.
+        
+        Args:
+            queries: Consultas, da mais para a menos frequente
+            limit: Máximo de chamadas ao GPT-4
+            
+        Returns:
+            int: Número de intenções gravadas
+        """
+        if self.intent_cache is None:
+            return 0
+        pending = [q for q in queries
+                   if q and self._simple_intent_analysis(q).confidence < self.intent_llm_threshold]
+        return self.intent_cache.prewarm(pending, lambda q: asdict(self._request_llm_intent(q)), limit)
@@ -0,0 +1,114 @@
+"""
+API do Catálogo STIHL AI v5
+===========================
+
+Exportação do catálogo completo para parceiros, em streaming, e
+estatísticas por categoria.
+
+Endpoints disponíveis:
+- GET /api/catalog/export - Catálogo em NDJSON ou CSV (gzip opcional)
+- GET /api/catalog/stats - Contagens, preços e histograma por categoria
+
+Parâmetros de /export:
+- format: ndjson (padrão) ou csv
+- category: source_table (ex.: pecas) ou categoria (ex.: Peça)
+- since: versão do catálogo; só o que mudou depois dela (removidos inclusive)
+- delimiter: ";" para CSV com ponto e vírgula
+
+O header X-Catalog-Version traz a versão exportada: é o "since" da
+próxima exportação incremental.
+"""
+
+import os
+
+from flask import Blueprint, Response, request, jsonify, current_app, stream_with_context
+from flask_cors import cross_origin
+
+from ..services.catalog_export import gzip_stream, iter_csv, iter_ndjson, open_catalog_export
+from ..services.catalog_stats import get_catalog_stats
+from ..services.catalog_version import current_catalog_version
+from ..utils.http_cache import catalog_versioned, snapshot_response
+
+catalog_bp = Blueprint('catalog_api', __name__, url_prefix='/api/catalog')
+
+
+def _wants_gzip() -> bool:
+    return 'gzip' in request.accept_encodings or request.args.get('gzip') in ('1', 'true')
+
+
+@catalog_bp.route('/export', methods=['GET'])
+@cross_origin()
+def export_catalog():
+    """
+    Exporta o catálogo em streaming (memória constante)
+
+    Returns:
+        NDJSON (application/x-ndjson) ou CSV (text/csv), com
+        Content-Encoding: gzip quando o cliente aceita
+    """
+    fmt = request.args.get('format', 'ndjson').lower()
+    if fmt not in ('ndjson', 'csv'):
+        return jsonify({'error': 'Formato deve ser ndjson ou csv', 'success': False}), 400
+
+    since = request.args.get('since')
+    if since not in (None, ''):
+        try:
+            since = int(since)
+        except ValueError:
+            return jsonify({'error': 'Parâmetro "since" deve ser uma versão numérica', 'success': False}), 400
+        if since < 0:
+            return jsonify({'error': 'Parâmetro "since" deve ser uma versão numérica', 'success': False}), 400
+    else:
+        since = None
+    category = (request.args.get('category') or '').strip() or None
+
+    dsn = os.getenv('DATABASE_URL')
+    try:
+        version, rows = open_catalog_export(dsn, category=category, since=since)
+    except Exception as e:
+        current_app.logger.error(f"Erro na exportação do catálogo: {e}")
+        return jsonify({
+            'error': 'Catálogo indisponível',
+            'success': False,
+            'details': str(e) if current_app.debug else None
+        }), 503
+
+    if fmt == 'csv':
+        delimiter = ';' if request.args.get('delimiter') == ';' else ','
+        body, mimetype, extension = iter_csv(rows, delimiter), 'text/csv', 'csv'
+    else:
+        body, mimetype, extension = iter_ndjson(rows, version), 'application/x-ndjson', 'ndjson'
+
+    headers = {
+        'X-Catalog-Version': str(version),
+        'X-Accel-Buffering': 'no',
+        'Cache-Control': 'no-store',
+        'Content-Disposition': f'attachment; filename=catalogo-v{version}.{extension}',
+        'Vary': 'Accept-Encoding',
+    }
+    if _wants_gzip():
+        body = gzip_stream(body)
+        headers['Content-Encoding'] = 'gzip'
+
+    return Response(stream_with_context(body), mimetype=mimetype, headers=headers)
+
+
+@catalog_bp.route('/stats', methods=['GET'])
+@cross_origin()
+@catalog_versioned(current_catalog_version)
+def catalog_statistics():
+    """
+    Estatísticas por categoria, servidas da memória
+
+    Returns:
+        JSON com total de produtos, produtos com preço, faixa e média de
+        preço, produto mais caro e histograma de cada categoria
+    """
+    stats = get_catalog_stats()
+    if stats is None:
+        return jsonify({'error': 'Estatísticas do catálogo desativadas', 'success': False}), 503
+    return snapshot_response(jsonify({
+        'success': True,
+        'catalog_version': stats.version,
+        'categories': stats.categories(),
+    }), stats.version)
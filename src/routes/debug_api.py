@@ -0,0 +1,91 @@
+"""
+API de Diagnóstico STIHL AI v5
+==============================
+
+Consulta dos traces retidos em memória pelo processo (ver utils.tracing).
+
+Endpoints disponíveis:
+- GET /api/debug/traces - Traces mais recentes (resumo)
+- GET /api/debug/trace/{id} - Cascata de um trace, por trace_id ou X-Request-ID
+
+Parâmetros de /trace/{id}:
+- format: json (padrão) ou text (cascata em texto, para terminal)
+
+Cada worker do gunicorn guarda os próprios traces; para a visão
+consolidada, exporte para um coletor OTLP (TRACE_EXPORT=otlp).
+Exige o mesmo METRICS_TOKEN de /metrics; sem token configurado as rotas
+ficam fechadas (403), ao contrário de /metrics.
+"""
+
+import os
+
+from flask import Blueprint, Response, jsonify, request
+
+from .metrics_api import authorized
+from ..utils.tracing import get_tracer, render_waterfall, tracing_stats, waterfall
+
+debug_bp = Blueprint('debug_api', __name__, url_prefix='/api/debug')
+
+
+@debug_bp.before_request
+def _require_token():
+    if not os.getenv('METRICS_TOKEN'):
+        return jsonify({'error': 'Defina METRICS_TOKEN para consultar traces', 'success': False}), 403
+    if not authorized():
+        return jsonify({'error': 'Não autorizado', 'success': False}), 401
+    if get_tracer() is None:
+        return jsonify({'error': 'Rastreamento desabilitado (TRACING=off)', 'success': False}), 503
+
+
+@debug_bp.route('/traces', methods=['GET'])
+def recent_traces():
+    """
+    Traces retidos mais recentes
+
+    Query params:
+        limit: Máximo de traces (padrão: 50, máximo: 500)
+
+    Returns:
+        JSON com o resumo de cada trace e as métricas do tracer
+    """
+    try:
+        limit = max(1, min(int(request.args.get('limit', 50)), 500))
+    except ValueError:
+        limit = 50
+    return jsonify({
+        'success': True,
+        'traces': get_tracer().store.recent(limit),
+        'tracing': tracing_stats(),
+    })
+
+
+@debug_bp.route('/trace/<trace_id>', methods=['GET'])
+def trace_waterfall(trace_id):
+    """
+    Cascata de um trace
+
+    Args:
+        trace_id: trace_id (32 hex) ou o X-Request-ID da requisição
+
+    Returns:
+        JSON com os spans em ordem de cascata (offset_ms, duration_ms,
+        depth), ou texto com ?format=text
+    """
+    spans = get_tracer().store.get(trace_id)
+    if spans is None:
+        return jsonify({
+            'error': 'Trace não encontrado (não amostrado, expirado ou de outro worker)',
+            'success': False
+        }), 404
+
+    rows = waterfall(spans)
+    if request.args.get('format') == 'text':
+        return Response(render_waterfall(rows), content_type='text/plain; charset=utf-8')
+
+    return jsonify({
+        'success': True,
+        'trace_id': rows[0]['trace_id'],
+        'request_id': rows[0]['request_id'],
+        'duration_ms': max(r['offset_ms'] + (r['duration_ms'] or 0) for r in rows),
+        'spans': rows,
+    })
@@ -0,0 +1,134 @@
+"""
+Métricas Prometheus STIHL AI v5
+===============================
+
+Endpoints disponíveis:
+- GET /metrics - Métricas no formato de texto do Prometheus
+
+Além dos contadores e histogramas acumulados pela app (requisições por
+endpoint e etapas: intent_parse, llm_call, db_query, formatting,
+telegram_send), cada coleta lê os valores instantâneos: acertos dos
+caches, uso do pool de conexões, profundidade das filas e a verificação
+real do banco.
+
+Com METRICS_TOKEN definido, a rota exige "Authorization: Bearer <token>".
+"""
+
+import os
+import hmac
+
+from flask import Blueprint, Response, jsonify, request
+
+from . import search_api_v5
+from ..services.analytics_sink import analytics_sink_stats
+from ..services.autocomplete import autocomplete_stats
+from ..services.telegram_dispatcher import dispatcher_stats
+from ..utils.db_pool import database_health, pool_stats
+from ..utils.http_cache import http_cache_stats
+from ..utils.metrics import registry
+
+metrics_bp = Blueprint('metrics_api', __name__)
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+def _cache_stats():
+    """(nome do cache, estatísticas com hits/misses) dos caches do processo"""
+    engine = search_api_v5.search_engine
+    if engine is not None:
+        yield 'search_results', engine.cache.stats()
+        if engine.intent_cache is not None:
+            yield 'intent', engine.intent_cache.stats()
+    responses = http_cache_stats().get('responses')
+    if responses:
+        yield 'http_responses', responses
+    autocomplete = autocomplete_stats()
+    if autocomplete:
+        yield 'autocomplete', autocomplete['cache']
+
+
+def collect_caches():
+    caches = list(_cache_stats())
+    hits = [({'cache': name}, s.get('hits', 0)) for name, s in caches]
+    misses = [({'cache': name}, s.get('misses', 0)) for name, s in caches]
+    ratios = []
+    for name, s in caches:
+        lookups = s.get('hits', 0) + s.get('misses', 0)
+        ratios.append(({'cache': name}, round(s.get('hits', 0) / lookups, 4) if lookups else None))
+    return [
+        ('cache_hits_total', 'Acertos do cache', 'counter', hits),
+        ('cache_misses_total', 'Faltas do cache', 'counter', misses),
+        ('cache_hit_ratio', 'Fração de consultas atendidas pelo cache', 'gauge', ratios),
+    ]
+
+
+def collect_pools():
+    pools = pool_stats()
+    return [
+        ('db_pool_connections', 'Conexões do pool por estado', 'gauge',
+         [({'pool': p['name'], 'state': state}, p[state]) for p in pools for state in ('in_use', 'idle')]),
+        ('db_pool_max_connections', 'Tamanho máximo do pool', 'gauge',
+         [({'pool': p['name']}, p['max_size']) for p in pools]),
+        ('db_pool_waits_total', 'Empréstimos que esperaram por conexão', 'counter',
+         [({'pool': p['name']}, p.get('waits', 0)) for p in pools]),
+    ]
+
+
+def collect_queues():
+    depth, capacity = [], []
+    telegram = dispatcher_stats()
+    if telegram:
+        depth.append(({'queue': 'telegram'}, telegram['queue_depth'] + telegram['in_flight']))
+        capacity.append(({'queue': 'telegram'}, telegram['queue_capacity']))
+    analytics = analytics_sink_stats()
+    if analytics:
+        depth.append(({'queue': 'analytics'}, analytics['buffer_depth']))
+        capacity.append(({'queue': 'analytics'}, analytics['buffer_capacity']))
+    samples = [
+        ('queue_depth', 'Itens aguardando ou em processamento', 'gauge', depth),
+        ('queue_capacity', 'Capacidade da fila', 'gauge', capacity),
+    ]
+    if analytics:
+        samples.append(('analytics_events_dropped_total', 'Eventos de analytics descartados', 'counter',
+                        [({'reason': 'sampled'}, analytics['sampled_out']),
+                         ({'reason': 'buffer_full'}, analytics['dropped']),
+                         ({'reason': 'spill_full'}, analytics['spill_dropped'])]))
+    return samples
+
+
+def collect_database():
+    health = database_health()
+    if health['connected'] is None:
+        return []
+    return [
+        ('database_up', 'Resultado do SELECT 1 de verificação', 'gauge',
+         [({}, 1 if health['connected'] else 0)]),
+        ('database_ping_seconds', 'Latência da verificação do banco', 'gauge',
+         [({}, health['latency_ms'] / 1000.0)]),
+    ]
+
+
+for _collector in (collect_caches, collect_pools, collect_queues, collect_database):
+    registry.add_collector(_collector)
+
+
+def authorized() -> bool:
+    """Token de observabilidade (METRICS_TOKEN), se configurado"""
+    token = os.getenv('METRICS_TOKEN')
+    if not token:
+        return True
+    return hmac.compare_digest(request.headers.get('Authorization', ''), f'Bearer {token}')
+
+
+@metrics_bp.route('/metrics', methods=['GET'])
+def metrics():
+    """
+    Exporta as métricas do processo
+
+    Returns:
+        Texto no formato de exposição do Prometheus (0.0.4)
+    """
+    if not authorized():
+        return jsonify({'error': 'Não autorizado', 'success': False}), 401
+    return Response(registry.render(), content_type=CONTENT_TYPE,
+                    headers={'Cache-Control': 'no-store'})
@@ -0,0 +1,126 @@
+"""
+API de Orçamentos STIHL AI v5
+=============================
+
+Orçamento em lote para revendas: lista de (código, quantidade) precificada
+com lote mínimo, IPI, ST e diferencial de ICMS da UF de destino.
+
+Endpoints disponíveis:
+- POST /api/quote - Orçamento (JSON ou CSV na entrada e na saída)
+
+Como o cálculo usa o lote mínimo (campo sensível, ver RELEASE_NOTES), o
+endpoint exige a chave QUOTE_API_KEY no header X-API-Key e fica desligado
+enquanto ela não estiver configurada.
+"""
+
+import hmac
+import os
+from typing import List, Tuple
+
+from flask import Blueprint, Response, request, jsonify, current_app, stream_with_context
+from flask_cors import cross_origin
+
+from ..services.quote_engine import QuoteError, get_quote_engine, iter_quote_csv, read_csv_lines
+
+quote_bp = Blueprint('quote_api', __name__, url_prefix='/api/quote')
+
+CODE_KEYS = ('codigo_material', 'codigo', 'code')
+QTY_KEYS = ('quantidade', 'qtde', 'qty')
+
+
+def _check_api_key():
+    """None se autorizado; senão a resposta de erro"""
+    expected = os.getenv('QUOTE_API_KEY')
+    if not expected:
+        return jsonify({
+            'error': 'Orçamentos desabilitados (QUOTE_API_KEY não configurada)',
+            'success': False
+        }), 503
+    got = request.headers.get('X-API-Key', '')
+    if not hmac.compare_digest(got.encode(), expected.encode()):
+        return jsonify({'error': 'Não autorizado', 'success': False}), 401
+    return None
+
+
+def _json_lines(items) -> List[Tuple[str, object]]:
+    if not isinstance(items, list):
+        raise QuoteError('Campo "itens" deve ser uma lista')
+    lines = []
+    for item in items:
+        if isinstance(item, dict):
+            code = next((item[k] for k in CODE_KEYS if k in item), '')
+            qty = next((item[k] for k in QTY_KEYS if k in item), None)
+        elif isinstance(item, (list, tuple)) and len(item) == 2:
+            code, qty = item
+        else:
+            code, qty = '', None
+        lines.append((str(code or ''), qty))
+    return lines
+
+
+def _wants_csv() -> bool:
+    fmt = request.args.get('format', '').lower()
+    if fmt:
+        return fmt == 'csv'
+    best = request.accept_mimetypes.best_match(['application/json', 'text/csv'])
+    return best == 'text/csv'
+
+
+@quote_bp.route('', methods=['POST'])
+@cross_origin()
+def create_quote():
+    """
+    Gera um orçamento
+
+    Body JSON:
+    {
+        "uf": "BA",
+        "cd": "sp",
+        "itens": [{"codigo": "1148-200-0249", "quantidade": 2}, ...]
+    }
+
+    Ou CSV (Content-Type text/csv, ou arquivo "file" em multipart) com as
+    colunas código e quantidade; UF e CD vão na query string (?uf=BA).
+
+    Returns:
+        JSON com itens e resumo, ou CSV com ?format=csv / Accept: text/csv
+    """
+    denied = _check_api_key()
+    if denied:
+        return denied
+
+    try:
+        if 'file' in request.files:
+            lines = read_csv_lines(request.files['file'].read())
+            params = request.form
+        elif request.mimetype in ('text/csv', 'text/plain', 'application/csv'):
+            lines = read_csv_lines(request.get_data())
+            params = request.args
+        else:
+            data = request.get_json(silent=True) or {}
+            lines = _json_lines(data.get('itens', data.get('items')))
+            params = data
+        uf = params.get('uf') or request.args.get('uf')
+        cd = params.get('cd') or request.args.get('cd')
+
+        if not lines:
+            raise QuoteError('Nenhum item informado')
+        quote = get_quote_engine().quote(lines, uf, cd)
+    except QuoteError as e:
+        return jsonify({'error': str(e), 'success': False}), 400
+    except Exception as e:
+        current_app.logger.error(f"Erro no orçamento: {e}")
+        return jsonify({
+            'error': 'Erro interno do servidor',
+            'success': False,
+            'details': str(e) if current_app.debug else None
+        }), 500
+
+    if _wants_csv():
+        delimiter = ';' if request.args.get('delimiter') == ';' else ','
+        return Response(
+            stream_with_context(iter_quote_csv(quote, delimiter)),
+            mimetype='text/csv',
+            headers={'Content-Disposition': 'attachment; filename=orcamento.csv'}
+        )
+    return jsonify({'success': True, **quote})
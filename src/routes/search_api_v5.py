@@ -5,8 +5,13 @@ API de Busca Inteligente STIHL AI v5
 Este módulo implementa as rotas da API REST para o sistema de busca
 inteligente STIHL AI v5, adaptado para a nova estrutura de banco de dados.
 
+As rotas GET de leitura do catálogo (produto, compatíveis, recomendações,
+campanhas e faixas de preço) respondem com ETag e Cache-Control derivados
+da versão do catálogo e com 304 para If-None-Match (ver utils.http_cache).
+
 Endpoints disponíveis:
 - POST /api/search/search - Busca inteligente principal
+- POST /api/search/batch - Busca em lote (NDJSON, resultados por consulta)
 - GET /api/search/product/{code} - Busca por código de material
 - GET /api/search/compatible/{model} - Busca produtos compatíveis
 - GET /api/search/recommendations - Recomendações inteligentes
@@ -23,14 +28,29 @@ Versão: 5.0
 import os
 import json
 import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime
 from typing import Dict, List, Optional, Any
-from flask import Blueprint, request, jsonify, current_app
+from flask import Blueprint, Response, request, jsonify, current_app, has_request_context, stream_with_context
 from flask_cors import cross_origin
 import psycopg2
 from psycopg2.extras import RealDictCursor
 
 from ..models.intelligent_search_v5 import IntelligentSearchV5, SearchResult, SearchIntent
+from ..utils.db_pool import database_health, pool_stats
+from ..utils.http_cache import catalog_versioned, http_cache_stats, snapshot_response
+from ..utils.metrics import count_results, stage
+from ..utils.tracing import current_context, span, tracing_stats
+from ..utils.pagination import CursorError, page_size
+from ..services.analytics_sink import analytics_sink_stats, emit_search_event, search_event
+from ..services.autocomplete import autocomplete_stats, record_query, suggest
+from ..services.catalog_stats import catalog_stats_stats, get_catalog_stats
+from ..services.catalog_version import catalog_version_stats, current_catalog_version
+from ..services.tax_engine import normalize_uf, tax_engine_stats, tax_price
+from ..services.telegram_client import telegram_client_stats
+from ..services.text_normalizer import canonical_query_key, material_code
+from ..services.telegram_dispatcher import dispatcher_stats
+from ..services.update_dedup import dedup_stats
 
 # Criar blueprint para as rotas de busca
 search_bp = Blueprint('search_api_v5', __name__, url_prefix='/api/search')
@@ -43,29 +63,69 @@ def init_search_engine(database_url: str):
     global search_engine
     search_engine = IntelligentSearchV5(database_url)
 
-def log_search_analytics(query: str, results_count: int, response_time: float, user_ip: str = None):
+def _env_int(name: str, default: int) -> int:
+    try:
+        return int(os.getenv(name, default))
+    except (TypeError, ValueError):
+        return default
+
+def serialize_result(result: SearchResult, include_details: bool = False,
+                     uf: Optional[str] = None) -> Dict[str, Any]:
+    """
+    Converte um SearchResult no formato JSON das respostas de busca
+
+    Com ``uf``, inclui "preco_uf" (preço final com IPI, diferencial de ICMS
+    e ST na UF), calculado pelo motor fiscal em memória
+    """
+    result_data = {
+        'source_table': result.source_table,
+        'codigo_material': result.codigo_material,
+        'descricao': result.descricao,
+        'preco_real': result.preco_real,
+        'categoria_produto': result.categoria_produto,
+        'relevance_score': result.relevance_score
+    }
+    if include_details:
+        result_data['modelos'] = result.modelos
+        result_data['detalhes_tecnicos'] = result.detalhes_tecnicos
+    if uf:
+        result_data['preco_uf'] = tax_price(result.codigo_material, result.preco_real, uf)
+    return result_data
+
+def _uf_param(value) -> tuple:
+    """(uf, erro): UF opcional normalizada, ou a resposta 400 se inválida"""
+    if value in (None, ''):
+        return None, None
+    uf = normalize_uf(value)
+    if uf is None:
+        return None, (jsonify({'error': f'UF desconhecida: {value}', 'success': False}), 400)
+    return uf, None
+
+def log_search_analytics(query: str, results_count: int, response_time: float, user_ip: str = None,
+                         first_page: bool = True):
     """
     Registra analytics de busca para análise posterior
     
+    O evento só entra no buffer do sink (services.analytics_sink); a
+    gravação em lote acontece em segundo plano, fora da requisição.
+    
     Args:
         query: Consulta realizada
         results_count: Número de resultados retornados
         response_time: Tempo de resposta em milissegundos
         user_ip: IP do usuário (opcional)
+        first_page: False nas páginas seguintes (com cursor), que não
+            contam de novo para a popularidade
     """
     try:
-        analytics_data = {
-            'timestamp': datetime.now().isoformat(),
-            'query': query,
-            'results_count': results_count,
-            'response_time_ms': response_time,
-            'user_ip': user_ip,
-            'user_agent': request.headers.get('User-Agent', '')
-        }
-        
-        # Aqui você pode implementar o log em banco de dados ou arquivo
-        # Por enquanto, apenas print para debug
-        current_app.logger.info(f"Search Analytics: {json.dumps(analytics_data)}")
+        source = 'batch' if query.startswith('batch:') else 'search'
+        emit_search_event(search_event(
+            source, query, results_count, response_time, user_ip,
+            request.headers.get('User-Agent', '') if has_request_context() else None
+        ))
+        # Popularidade para o ranking do autocompletar
+        if source == 'search' and first_page:
+            record_query(query, results_count, user_ip)
         
     except Exception as e:
         current_app.logger.error(f"Erro ao registrar analytics: {e}")
@@ -80,8 +140,14 @@ def intelligent_search():
     {
         "query": "motosserra elétrica até R$ 1500",
         "max_results": 20,
-        "include_details": true
+        "include_details": true,
+        "uf": "BA",
+        "cursor": "..."
     }
+
+    Com "uf", cada resultado traz "preco_uf" (preço final na UF).
+    "max_results" é o tamanho da página; "next_cursor" da resposta, enviado
+    como "cursor", traz a página seguinte (null na última).
     
     Returns:
         JSON com resultados da busca
@@ -110,35 +176,31 @@ def intelligent_search():
                 'success': False
             }), 400
         
-        max_results = data.get('max_results', 20)
+        max_results = page_size(data.get('max_results'), 20)
         include_details = data.get('include_details', False)
+        uf, error = _uf_param(data.get('uf'))
+        if error:
+            return error
         
-        # Executar busca
-        results = search_engine.search(query, max_results)
+        # Executar busca (uma página, keyset)
+        try:
+            results, next_cursor = search_engine.search_page(query, max_results, data.get('cursor'))
+        except CursorError as e:
+            return jsonify({'error': str(e), 'success': False}), 400
         
         # Preparar resposta
         response_data = {
             'success': True,
             'query': query,
             'total_results': len(results),
-            'results': []
+            'results': [],
+            'next_cursor': next_cursor
         }
         
-        for result in results:
-            result_data = {
-                'source_table': result.source_table,
-                'codigo_material': result.codigo_material,
-                'descricao': result.descricao,
-                'preco_real': result.preco_real,
-                'categoria_produto': result.categoria_produto,
-                'relevance_score': result.relevance_score
-            }
-            
-            if include_details:
-                result_data['modelos'] = result.modelos
-                result_data['detalhes_tecnicos'] = result.detalhes_tecnicos
-            
-            response_data['results'].append(result_data)
+        with stage('formatting'):
+            for result in results:
+                response_data['results'].append(serialize_result(result, include_details, uf))
+        count_results(results)
         
         # Gerar resposta em linguagem natural se solicitado
         if data.get('natural_response', False):
@@ -149,7 +211,8 @@ def intelligent_search():
         response_data['response_time_ms'] = round(response_time, 2)
         
         # Registrar analytics
-        log_search_analytics(query, len(results), response_time, request.remote_addr)
+        log_search_analytics(query, len(results), response_time, request.remote_addr,
+                             first_page=not data.get('cursor'))
         
         return jsonify(response_data)
         
@@ -161,18 +224,183 @@ def intelligent_search():
             'details': str(e) if current_app.debug else None
         }), 500
 
+@search_bp.route('/batch', methods=['POST'])
+@cross_origin()
+def batch_search():
+    """
+    Busca em lote: várias consultas numa única requisição
+
+    Consultas repetidas (mesma chave canônica) rodam uma vez; códigos de
+    material puros são resolvidos juntos numa única consulta e o restante
+    roda em paralelo num pool limitado (SEARCH_BATCH_WORKERS).
+
+    Body JSON:
+    {
+        "queries": ["4134-200-0367", "filtro de ar FS221", ...],
+        "max_results": 5,
+        "include_details": false,
+        "uf": "BA"
+    }
+
+    Returns:
+        NDJSON com uma linha por consulta distinta, na ordem em que ficam
+        prontas ("positions" indica as posições em "queries"), e uma linha
+        final de resumo ("done": true)
+    """
+    if not search_engine:
+        return jsonify({
+            'error': 'Sistema de busca não inicializado',
+            'success': False
+        }), 500
+
+    data = request.get_json(silent=True) or {}
+    queries = data.get('queries')
+    if not isinstance(queries, list) or not queries:
+        return jsonify({
+            'error': 'Campo "queries" deve ser uma lista não vazia',
+            'success': False
+        }), 400
+
+    max_queries = _env_int('SEARCH_BATCH_MAX_QUERIES', 200)
+    if len(queries) > max_queries:
+        return jsonify({
+            'error': f'Máximo de {max_queries} consultas por lote',
+            'success': False
+        }), 400
+
+    try:
+        max_results = max(1, min(int(data.get('max_results', 5)), 50))
+    except (TypeError, ValueError):
+        max_results = 5
+    include_details = bool(data.get('include_details', False))
+    uf, error = _uf_param(data.get('uf'))
+    if error:
+        return error
+
+    # Agrupa posições por consulta distinta
+    groups: Dict[str, Dict[str, Any]] = {}
+    invalid: List[int] = []
+    for position, raw in enumerate(queries):
+        query = ' '.join(raw.split()) if isinstance(raw, str) else ''
+        if not query:
+            invalid.append(position)
+            continue
+        code = material_code(query)
+        key = f'code:{code}' if code else f'query:{canonical_query_key(query)}'
+        group = groups.setdefault(key, {'query': query, 'code': code, 'positions': []})
+        group['positions'].append(position)
+
+    code_groups = [g for g in groups.values() if g['code']]
+    text_groups = [g for g in groups.values() if not g['code']]
+    remote_addr = request.remote_addr
+
+    def line(payload: Dict[str, Any]) -> str:
+        return json.dumps(payload, ensure_ascii=False, default=str) + '\n'
+
+    def group_line(group: Dict[str, Any], results: List[SearchResult], elapsed_ms: float) -> str:
+        return line({
+            'success': True,
+            'positions': group['positions'],
+            'query': group['query'],
+            'type': 'code' if group['code'] else 'search',
+            'total_results': len(results),
+            'results': [serialize_result(r, include_details, uf) for r in results],
+            'response_time_ms': round(elapsed_ms, 2)
+        })
+
+    # As consultas rodam nas threads do pool: o trace da requisição vai junto
+    trace_context = current_context()
+
+    def timed_search(query: str):
+        started = time.time()
+        with span('search.batch_query', trace_context, query_chars=len(query)):
+            results = search_engine.search(query, max_results)
+        return results, (time.time() - started) * 1000
+
+    def generate():
+        start_time = time.time()
+        total_results = 0
+
+        if invalid:
+            yield line({'success': False, 'positions': invalid, 'error': 'Consulta vazia ou inválida'})
+
+        # Códigos puros: uma consulta (= ANY) para todos
+        if code_groups:
+            started = time.time()
+            try:
+                found = search_engine.search_by_codes([g['code'] for g in code_groups])
+            except Exception as e:
+                current_app.logger.error(f"Erro na busca em lote por códigos: {e}")
+                found = None
+            elapsed = (time.time() - started) * 1000
+            for group in code_groups:
+                if found is None:
+                    # Falha no banco não é "código inexistente"
+                    yield line({'success': False, 'positions': group['positions'], 'query': group['query'],
+                                'type': 'code', 'error': 'Banco de dados indisponível'})
+                    continue
+                result = found.get(group['code'])
+                total_results += 1 if result else 0
+                yield group_line(group, [result] if result else [], elapsed)
+
+        # Texto livre: pool limitado, resultados emitidos conforme terminam
+        if text_groups:
+            workers = max(1, min(_env_int('SEARCH_BATCH_WORKERS', 4), len(text_groups)))
+            executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='search-batch')
+            try:
+                futures = {executor.submit(timed_search, g['query']): g for g in text_groups}
+                for future in as_completed(futures):
+                    group = futures[future]
+                    try:
+                        results, elapsed = future.result()
+                    except Exception as e:
+                        current_app.logger.error(f"Erro na busca em lote ({group['query']}): {e}")
+                        yield line({'success': False, 'positions': group['positions'],
+                                    'query': group['query'], 'error': 'Erro interno do servidor'})
+                        continue
+                    total_results += len(results)
+                    yield group_line(group, results, elapsed)
+            finally:
+                # Cliente desconectou: descarta o que ainda não começou
+                executor.shutdown(wait=False, cancel_futures=True)
+
+        response_time = (time.time() - start_time) * 1000
+        yield line({
+            'done': True,
+            'total_queries': len(queries),
+            'unique_queries': len(groups),
+            'code_queries': len(code_groups),
+            'invalid_queries': len(invalid),
+            'total_results': total_results,
+            'response_time_ms': round(response_time, 2)
+        })
+        log_search_analytics(f'batch:{len(queries)}', total_results, response_time, remote_addr)
+
+    return Response(
+        stream_with_context(generate()),
+        mimetype='application/x-ndjson',
+        headers={'X-Accel-Buffering': 'no', 'Cache-Control': 'no-store'}
+    )
+
 @search_bp.route('/product/<string:code>', methods=['GET'])
 @cross_origin()
+@catalog_versioned(current_catalog_version)
 def get_product_by_code(code: str):
     """
     Busca produto específico por código de material
     
     Args:
-        code: Código do material
+        code: Código do material, código substituído, EAN ou CA
+
+    Query string opcional: ?uf=BA inclui "preco_uf" (preço final na UF)
         
     Returns:
         JSON com dados do produto
     """
+    uf, error = _uf_param(request.args.get('uf'))
+    if error:
+        return error
+
     try:
         if not search_engine:
             return jsonify({
@@ -214,6 +442,13 @@ def get_product_by_code(code: str):
                 for comp in compatible_products[:10]  # Limitar a 10 produtos compatíveis
             ]
         }
+
+        if uf:
+            response_data['product']['preco_uf'] = tax_price(result.codigo_material, result.preco_real, uf)
+
+        # Identificador resolvido para outro código (substituído, EAN ou CA)
+        if result.codigo_material != code:
+            response_data['redirected_from'] = code
         
         return jsonify(response_data)
         
@@ -226,12 +461,16 @@ def get_product_by_code(code: str):
 
 @search_bp.route('/compatible/<string:model>', methods=['GET'])
 @cross_origin()
+@catalog_versioned(current_catalog_version)
 def get_compatible_products(model: str):
     """
     Busca produtos compatíveis com um modelo específico
     
     Args:
         model: Nome do modelo (ex: MS 162, FS 220)
+
+    Query string: ?page_size=50&cursor=... (cursor = "next_cursor" da
+    página anterior; null na última)
         
     Returns:
         JSON com produtos compatíveis
@@ -243,13 +482,18 @@ def get_compatible_products(model: str):
                 'success': False
             }), 500
         
-        # Executar busca de compatibilidade
-        results = search_engine.get_compatible_products(model)
+        # Executar busca de compatibilidade (uma página, keyset)
+        try:
+            results, next_cursor = search_engine.get_compatible_page(
+                model, page_size(request.args.get('page_size'), 50), request.args.get('cursor'))
+        except CursorError as e:
+            return jsonify({'error': str(e), 'success': False}), 400
         
         response_data = {
             'success': True,
             'model': model,
             'total_compatible': len(results),
+            'next_cursor': next_cursor,
             'compatible_products': [
                 {
                     'source_table': result.source_table,
@@ -274,6 +518,7 @@ def get_compatible_products(model: str):
 
 @search_bp.route('/recommendations', methods=['GET'])
 @cross_origin()
+@catalog_versioned(current_catalog_version)
 def get_recommendations():
     """
     Obtém recomendações inteligentes baseadas em parâmetros
@@ -334,6 +579,7 @@ def get_recommendations():
 
 @search_bp.route('/campaigns', methods=['GET'])
 @cross_origin()
+@catalog_versioned(current_catalog_version)
 def get_campaign_products():
     """
     Obtém produtos em campanha com descontos
@@ -368,14 +614,23 @@ def get_campaign_products():
 
 @search_bp.route('/price-ranges', methods=['GET'])
 @cross_origin()
+@catalog_versioned(current_catalog_version)
 def get_price_ranges():
     """
     Obtém faixas de preço por categoria
     
+    Servidas do snapshot em memória (catalog_statistics_v5, recalculada a
+    cada importação); a função SQL só é consultada se ele estiver desligado.
+    
     Returns:
-        JSON com estatísticas de preço
+        JSON com estatísticas de preço e histograma por faixa
     """
     try:
+        stats = get_catalog_stats()
+        if stats is not None:
+            return snapshot_response(jsonify({'success': True, 'price_ranges': stats.price_ranges()}),
+                                     stats.version)
+
         if not search_engine:
             return jsonify({
                 'error': 'Sistema de busca não inicializado',
@@ -405,16 +660,19 @@ def get_search_suggestions():
     """
     Obtém sugestões de busca baseadas em termo parcial
     
+    Modelos, códigos, descrições do catálogo e consultas populares, do
+    índice de prefixos em memória (services.autocomplete).
+    
     Query Parameters:
         q: Termo parcial para sugestão
-        limit: Número máximo de sugestões (padrão: 10)
+        limit: Número máximo de sugestões (padrão: 10, máximo: 20)
         
     Returns:
-        JSON com sugestões
+        JSON com sugestões (texto) e itens (texto, tipo e código)
     """
     try:
         query_term = request.args.get('q', '').strip()
-        limit = request.args.get('limit', 10, type=int)
+        limit = max(1, min(request.args.get('limit', 10, type=int) or 10, 20))
         
         if not query_term or len(query_term) < 2:
             return jsonify({
@@ -422,40 +680,13 @@ def get_search_suggestions():
                 'suggestions': []
             })
         
-        # Sugestões pré-definidas baseadas em categorias e modelos comuns
-        predefined_suggestions = [
-            'motosserra elétrica',
-            'motosserra a gasolina',
-            'roçadeira profissional',
-            'roçadeira doméstica',
-            'produtos a bateria',
-            'MS 162',
-            'MS 250',
-            'FS 220',
-            'FS 55',
-            'peças de reposição',
-            'acessórios para motosserra',
-            'sabres e correntes',
-            'EPIs STIHL',
-            'ferramentas básicas',
-            'carburador',
-            'filtro de ar',
-            'vela de ignição',
-            'corrente picco micro',
-            'sabre 40cm',
-            'óleo para corrente'
-        ]
-        
-        # Filtrar sugestões que contêm o termo
-        suggestions = [
-            suggestion for suggestion in predefined_suggestions
-            if query_term.lower() in suggestion.lower()
-        ][:limit]
+        items = suggest(query_term, limit)
         
         response_data = {
             'success': True,
             'query': query_term,
-            'suggestions': suggestions
+            'suggestions': [item['texto'] for item in items],
+            'items': items
         }
         
         return jsonify(response_data)
@@ -490,9 +721,21 @@ def get_search_analytics():
         response_data = {
             'success': True,
             'cache_statistics': cache_stats,
+            'intent_statistics': search_engine.get_intent_stats(),
+            'pool_statistics': pool_stats(),
+            'telegram_queue': dispatcher_stats(),
+            'telegram_outbound': telegram_client_stats(),
+            'telegram_dedup': dedup_stats(),
+            'tax_engine': tax_engine_stats(),
+            'catalog_version': catalog_version_stats(),
+            'catalog_stats': catalog_stats_stats(),
+            'autocomplete': autocomplete_stats(),
+            'analytics_sink': analytics_sink_stats(),
+            'http_cache': http_cache_stats(),
+            'tracing': tracing_stats(),
             'system_status': {
                 'search_engine_initialized': True,
-                'database_connected': True,  # Você pode implementar uma verificação real
+                'database_connected': database_health()['connected'],
                 'openai_configured': bool(os.getenv('OPENAI_API_KEY'))
             }
         }
@@ -516,14 +759,17 @@ def health_check():
         JSON com status da API
     """
     try:
+        # SELECT 1 real (resultado reaproveitado por alguns segundos)
+        database = database_health()
         status = {
             'success': True,
-            'status': 'healthy',
+            'status': 'degraded' if database['connected'] is False else 'healthy',
             'timestamp': datetime.now().isoformat(),
             'version': '5.0',
             'components': {
                 'search_engine': search_engine is not None,
-                'database': True,  # Implementar verificação real se necessário
+                'database': database['connected'],
+                'database_latency_ms': database['latency_ms'],
                 'openai': bool(os.getenv('OPENAI_API_KEY'))
             }
         }
@@ -1,12 +1,34 @@
 from flask import Blueprint, request, jsonify, current_app
-import os, requests
+import os, logging
 from src.services.parts_assistant import search_and_format
+from src.services.telegram_client import get_telegram_client, telegram_client_stats
+from src.services.telegram_dispatcher import dispatcher_stats, get_dispatcher
+from src.services.update_dedup import dedup_stats, get_deduplicator
+from src.utils.metrics import bind_endpoint, stage
+from src.utils.tracing import annotate, current_context, record_error, span, traced
 
 telegram_bp = Blueprint("telegram_bp", __name__, url_prefix="/bot/telegram")
 
+# As respostas são enviadas pelas threads da fila, fora do contexto da app
+logger = logging.getLogger(__name__)
+
+HELP_TEXT = (
+    "Olá! 👋 Posso ajudar você a encontrar peças.\n\n"
+    "Exemplos:\n"
+    "• filtro de ar FS221\n"
+    "• 4147-141-0300\n\n"
+    "Envie o modelo, descrição ou código da peça."
+)
+
 @telegram_bp.get("/webhook/health")
 def webhook_health():
-    return jsonify({"ok": True, "message": "telegram webhook up"}), 200
+    return jsonify({
+        "ok": True,
+        "message": "telegram webhook up",
+        "queue": dispatcher_stats(),
+        "outbound": telegram_client_stats(),
+        "dedup": dedup_stats(),
+    }), 200
 
 def _check_secret():
     expected = os.getenv("TELEGRAM_SECRET_TOKEN") or os.getenv("TELEGRAM_WEBHOOK_SECRET")
@@ -15,23 +37,42 @@ def _check_secret():
     got = request.headers.get("X-Telegram-Bot-Api-Secret-Token")
     return got == expected
 
+@traced("telegram.send_message")
 def _send_message(token: str, chat_id: int | str, text: str):
-    url = f"https://api.telegram.org/bot{token}/sendMessage"
-    payload = {
-        "chat_id": chat_id,
-        "text": text,
-        # Sem parse_mode para evitar erro de formatação por caracteres especiais
-        # "parse_mode": "MarkdownV2",
-        "disable_web_page_preview": True,
-    }
+    # Sessão persistente, limites por chat/global e novas tentativas (429/5xx)
+    with stage("telegram_send"):
+        return get_telegram_client(token).send_message(
+            chat_id,
+            text,
+            # Sem parse_mode para evitar erro de formatação por caracteres especiais
+            # parse_mode="MarkdownV2",
+            disable_web_page_preview=True,
+        )
+
+def _process_update(job):
+    """Executa a busca e envia a resposta (roda nas threads da fila)."""
+    token, chat_id, text, trace_context = job
+    # Fora de requisição: as etapas são rotuladas com o endpoint "telegram"
+    # e o trace continua o do webhook que enfileirou o update
+    with bind_endpoint("telegram"), span("telegram.process_update", trace_context):
+        _answer(token, chat_id, text)
+
+def _answer(token, chat_id, text):
+    # Comandos básicos
+    if text.strip().lower() in ("/start", "/help"):
+        _send_message(token, chat_id, HELP_TEXT)
+        return
+
+    # Integra com o assistente de peças
     try:
-        resp = requests.post(url, json=payload, timeout=10)
-        if resp.status_code != 200:
-            current_app.logger.error("TG sendMessage status=%s body=%s", resp.status_code, resp.text)
-        return resp.status_code == 200
+        result = search_and_format(text)
+        answer = result.get("text") or "Não encontrei resultados para sua busca."
     except Exception as e:
-        current_app.logger.exception("TG sendMessage exception: %s", e)
-        return False
+        logger.exception("Erro no search_and_format: %s", e)
+        record_error(e)
+        answer = "Tive um erro ao processar sua solicitação. Tente novamente em instantes."
+
+    _send_message(token, chat_id, answer)
 
 @telegram_bp.post("/webhook")
 def telegram_webhook():
@@ -57,29 +98,25 @@ def telegram_webhook():
     chat_id = chat.get("id")
     text = message.get("text") or ""
 
-    # Comandos básicos
-    if text.strip().lower() in ("/start", "/help"):
-        help_text = (
-            "Olá! 👋 Posso ajudar você a encontrar peças.\n\n"
-            "Exemplos:\n"
-            "• filtro de ar FS221\n"
-            "• 4147-141-0300\n\n"
-            "Envie o modelo, descrição ou código da peça."
-        )
-        if chat_id is not None:
-            _send_message(token, chat_id, help_text)
-        return jsonify({"ok": True}), 200
+    if chat_id is None:
+        return jsonify({"ok": True, "skipped": True}), 200
 
-    # Integra com o assistente de peças
-    try:
-        result = search_and_format(text)
-        answer = result.get("text") or "Não encontrei resultados para sua busca."
-    except Exception as e:
-        current_app.logger.exception("Erro no search_and_format: %s", e)
-        answer = "Tive um erro ao processar sua solicitação. Tente novamente em instantes."
+    # Reenvio de um update já aceito (webhook lento): confirma sem repetir a busca
+    update_id = update.get("update_id")
+    dedup = get_deduplicator() if update_id is not None else None
+    if dedup is not None and not dedup.claim(update_id):
+        return jsonify({"ok": True, "duplicate": True}), 200
 
-    if chat_id is not None:
-        _send_message(token, chat_id, answer)
+    # Busca e resposta saem do request: a fila responde pelo processamento
+    if update_id is not None:
+        annotate(**{"telegram.update_id": update_id})
+    if not get_dispatcher(_process_update).submit((token, chat_id, text, current_context())):
+        # Fila cheia (ou em drenagem): 503 faz o Telegram reenviar mais tarde,
+        # e o reenvio precisa ser aceito
+        if dedup is not None:
+            dedup.release(update_id)
+        current_app.logger.warning("Fila do Telegram cheia; update recusado (chat=%s)", chat_id)
+        return jsonify({"ok": False, "error": "busy"}), 503, {"Retry-After": "5"}
 
-    # Sempre 200 para Telegram considerar entregue
-    return jsonify({"ok": True}), 200
+    # 200 imediato para Telegram considerar entregue
+    return jsonify({"ok": True, "queued": True}), 200
@@ -0,0 +1,431 @@
+"""
+Analytics de Busca STIHL AI v5
+==============================
+
+Registro de eventos de busca fora do caminho da requisição: ``emit``
+só acrescenta o evento a um buffer em memória; uma thread em segundo
+plano grava os eventos em lote (COPY em search_analytics_v5).
+
+Funcionalidades:
+- ``emit`` nunca bloqueia nem acessa o banco: custo de um append
+- Descarga por tamanho de lote ou por intervalo, o que vier primeiro
+- Amostragem sob carga: acima da marca d'água do buffer, os eventos são
+  aceitos com probabilidade decrescente e gravados com ``sample_rate``
+  (peso 1 / sample_rate nas agregações); buffer cheio descarta
+- Banco fora: os lotes vão para um arquivo de transbordo (JSON Lines,
+  tamanho limitado) e são regravados quando o banco volta, com espera
+  exponencial entre tentativas; o arquivo é compartilhado pelos workers
+  (flock na gravação e renomeação antes de regravar)
+- Descarga final no encerramento do processo
+
+Configuração via ambiente:
+- ANALYTICS_SINK: db, log ou off (padrão: db se DATABASE_URL, senão log)
+- ANALYTICS_BUFFER_MAX: capacidade do buffer (padrão: 10000)
+- ANALYTICS_BATCH_SIZE: eventos por lote (padrão: 500)
+- ANALYTICS_FLUSH_INTERVAL_S: intervalo máximo entre descargas (padrão: 2)
+- ANALYTICS_SAMPLE_HIGH_WATER: fração do buffer a partir da qual amostra (padrão: 0.5)
+- ANALYTICS_SAMPLE_MIN_RATE: menor taxa de amostragem (padrão: 0.05)
+- ANALYTICS_SPILL_PATH: arquivo de transbordo (padrão: instance/analytics_spill.jsonl)
+- ANALYTICS_SPILL_MAX_BYTES: tamanho máximo do transbordo (padrão: 16 MiB)
+- ANALYTICS_TIMEOUT_MS: timeout da gravação no banco (padrão: 5000)
+"""
+
+import io
+import os
+import csv
+import json
+import time
+import atexit
+import random
+import logging
+import threading
+from collections import deque
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from typing import Callable, Dict, List, Optional
+
+try:
+    import fcntl
+except ImportError:  # Windows: sem trava entre processos
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+DEFAULT_SPILL_PATH = os.path.join(ROOT_DIR, "instance", "analytics_spill.jsonl")
+
+EVENT_FIELDS = (
+    "occurred_at", "source", "query", "results_count", "response_time_ms",
+    "user_ip", "user_agent", "sample_rate", "details",
+)
+
+COPY_SQL = f"COPY search_analytics_v5 ({', '.join(EVENT_FIELDS)}) FROM STDIN WITH (FORMAT csv)"
+
+
+def search_event(source: str, query: Optional[str], results_count: Optional[int] = None,
+                 response_time_ms: Optional[float] = None, user_ip: Optional[str] = None,
+                 user_agent: Optional[str] = None, details: Optional[Dict] = None) -> Dict:
+    """Evento no formato de search_analytics_v5"""
+    return {
+        "occurred_at": datetime.now(timezone.utc).isoformat(),
+        "source": source,
+        "query": query,
+        "results_count": results_count,
+        "response_time_ms": round(response_time_ms, 2) if response_time_ms is not None else None,
+        "user_ip": user_ip,
+        "user_agent": (user_agent or "")[:512] or None,
+        "details": details,
+    }
+
+
+def events_to_csv(events: List[Dict]) -> io.StringIO:
+    """Lote em CSV para COPY (vazio = NULL; details em JSON)"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, lineterminator="\n")
+    for event in events:
+        row = []
+        for field in EVENT_FIELDS:
+            value = event.get(field)
+            if field == "details" and value is not None:
+                value = json.dumps(value, ensure_ascii=False, default=str)
+            row.append("" if value is None else value)
+        writer.writerow(row)
+    buffer.seek(0)
+    return buffer
+
+
+def copy_events_db(events: List[Dict], dsn: Optional[str] = None, timeout_ms: int = 5000):
+    """Grava o lote com um único COPY"""
+    from src.utils.db_pool import connection
+    with connection(dsn, statement_timeout_ms=timeout_ms) as conn:
+        with conn.cursor() as cur:
+            cur.copy_expert(COPY_SQL, events_to_csv(events))
+
+
+def log_events(events: List[Dict]):
+    """Sem banco: uma linha JSON por evento no log da aplicação"""
+    for event in events:
+        logger.info("Search Analytics: %s", json.dumps(event, ensure_ascii=False, default=str))
+
+
+class AnalyticsSink:
+    """
+    Buffer de eventos com descarga em lote por uma thread própria
+
+    ``writer`` recebe listas de eventos e deve levantar exceção em caso de
+    falha; só a thread de descarga (ou ``flush``) o chama.
+    """
+
+    def __init__(self, writer: Callable[[List[Dict]], None], max_buffer: int = 10000,
+                 batch_size: int = 500, flush_interval: float = 2.0, high_water: float = 0.5,
+                 min_sample_rate: float = 0.05, spill_path: Optional[str] = None,
+                 spill_max_bytes: int = 16 * 1024 * 1024, max_backoff: float = 60.0,
+                 name: str = "analytics"):
+        if max_buffer <= 0 or batch_size <= 0:
+            raise ValueError("max_buffer e batch_size devem ser positivos")
+        self.writer = writer
+        self.max_buffer = max_buffer
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.high_water = max(1, int(max_buffer * high_water))
+        self.min_sample_rate = min_sample_rate
+        self.spill_path = spill_path
+        self.spill_max_bytes = spill_max_bytes
+        self.max_backoff = max_backoff
+        self.name = name
+        self._buffer: deque = deque()
+        self._lock = threading.Lock()
+        self._write_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._closed = False
+        self._backoff = 0.0
+        self._retry_at = 0.0
+        self._stats = {
+            "emitted": 0, "sampled_out": 0, "dropped": 0, "written": 0, "batches": 0,
+            "write_errors": 0, "spilled": 0, "spill_dropped": 0, "replayed": 0,
+            "max_depth": 0, "last_batch_ms": 0.0,
+        }
+
+    def _count(self, name: str, n: int = 1):
+        with self._lock:
+            self._stats[name] += n
+
+    def _start_locked(self):
+        if self._thread is None and not self._closed:
+            self._thread = threading.Thread(target=self._run, name=f"{self.name}-flush", daemon=True)
+            self._thread.start()
+
+    def emit(self, event: Dict) -> bool:
+        """
+        Acrescenta um evento ao buffer sem bloquear
+
+        Returns:
+            bool: False se o evento foi descartado (amostragem ou buffer cheio)
+        """
+        with self._lock:
+            if self._closed:
+                self._stats["dropped"] += 1
+                return False
+            depth = len(self._buffer)
+            if depth >= self.max_buffer:
+                self._stats["dropped"] += 1
+                return False
+            rate = 1.0
+            if depth >= self.high_water:
+                rate = max(self.min_sample_rate,
+                           (self.max_buffer - depth) / (self.max_buffer - self.high_water + 1))
+                if random.random() >= rate:
+                    self._stats["sampled_out"] += 1
+                    return False
+            event["sample_rate"] = round(rate, 4)
+            self._buffer.append(event)
+            self._stats["emitted"] += 1
+            self._stats["max_depth"] = max(self._stats["max_depth"], depth + 1)
+            self._start_locked()
+            full = depth + 1 >= self.batch_size
+        if full:
+            self._wake.set()
+        return True
+
+    def _take(self, limit: int) -> List[Dict]:
+        with self._lock:
+            return [self._buffer.popleft() for _ in range(min(limit, len(self._buffer)))]
+
+    def _run(self):
+        while not self._closed:
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            self._drain()
+
+    def _drain(self, final: bool = False):
+        """Descarrega o buffer em lotes; com o banco em espera, transborda"""
+        with self._write_lock:
+            while True:
+                batch = self._take(self.batch_size)
+                if not batch:
+                    return
+                if not final and time.monotonic() < self._retry_at:
+                    self._spill(batch)
+                elif not self._write(batch):
+                    self._spill(batch)
+                    if final:
+                        # Encerrando: o resto vai direto para o transbordo
+                        self._spill(self._take(self.max_buffer))
+                        return
+
+    def _write(self, batch: List[Dict]) -> bool:
+        start = time.monotonic()
+        try:
+            self.writer(batch)
+        except Exception as e:
+            self._count("write_errors")
+            self._backoff = min(self.max_backoff, self._backoff * 2 or 1.0)
+            self._retry_at = time.monotonic() + self._backoff
+            logger.warning("Falha ao gravar %d eventos de analytics (nova tentativa em %.0f s): %s",
+                           len(batch), self._backoff, e)
+            return False
+        with self._lock:
+            self._stats["written"] += len(batch)
+            self._stats["batches"] += 1
+            self._stats["last_batch_ms"] = round((time.monotonic() - start) * 1000, 2)
+        self._backoff = 0.0
+        self._retry_at = 0.0
+        self._replay()
+        return True
+
+    def _spill_size(self) -> int:
+        try:
+            return os.path.getsize(self.spill_path) if self.spill_path else 0
+        except OSError:
+            return 0
+
+    @contextmanager
+    def _spill_lock(self):
+        """
+        Trava exclusiva entre processos (flock em ``<spill>.lock``): os
+        workers do gunicorn compartilham o mesmo arquivo de transbordo
+        """
+        os.makedirs(os.path.dirname(self.spill_path) or ".", exist_ok=True)
+        with open(self.spill_path + ".lock", "a") as lock:
+            if fcntl is not None:
+                fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def _spill(self, batch: List[Dict]):
+        if not batch:
+            return
+        if not self.spill_path:
+            self._count("spill_dropped", len(batch))
+            return
+        lines = []
+        try:
+            with self._spill_lock():
+                size = self._spill_size()
+                for event in batch:
+                    line = json.dumps(event, ensure_ascii=False, default=str) + "\n"
+                    size += len(line.encode("utf-8"))
+                    if size > self.spill_max_bytes:
+                        break
+                    lines.append(line)
+                with open(self.spill_path, "a", encoding="utf-8") as fh:
+                    fh.writelines(lines)
+        except OSError as e:
+            logger.warning("Transbordo de analytics indisponível: %s", e)
+            lines = []
+        self._count("spilled", len(lines))
+        self._count("spill_dropped", len(batch) - len(lines))
+
+    def _claim_spill(self) -> List[str]:
+        """
+        Renomeia o transbordo (e sobras de workers encerrados) para arquivos
+        deste processo, sob a trava: quem chega depois grava num arquivo
+        novo e nenhum evento é regravado por dois workers
+        """
+        claimed = []
+        directory = os.path.dirname(self.spill_path) or "."
+        prefix = os.path.basename(self.spill_path) + ".replay-"
+        with self._spill_lock():
+            sources = [self.spill_path] if self._spill_size() else []
+            for name in sorted(os.listdir(directory)):
+                if not name.startswith(prefix):
+                    continue
+                pid = name[len(prefix):].split(".")[0]
+                if pid.isdigit() and int(pid) != os.getpid() and _pid_alive(int(pid)):
+                    continue  # outro worker ainda está regravando
+                sources.append(os.path.join(directory, name))
+            for n, source in enumerate(sources):
+                target = os.path.join(directory, f"{prefix}{os.getpid()}.{time.time_ns()}.{n}")
+                os.replace(source, target)
+                claimed.append(target)
+        return claimed
+
+    def _replay(self):
+        """Regrava o transbordo depois de uma gravação bem-sucedida"""
+        if not self.spill_path:
+            return
+        try:
+            claimed = self._claim_spill()
+        except OSError as e:
+            logger.warning("Transbordo de analytics indisponível: %s", e)
+            return
+        for path in claimed:
+            try:
+                with open(path, encoding="utf-8") as fh:
+                    events = [json.loads(line) for line in fh if line.strip()]
+            except (OSError, ValueError) as e:
+                logger.warning("Transbordo de analytics ilegível (%s): %s", path, e)
+                continue
+            for i in range(0, len(events), self.batch_size):
+                batch = events[i:i + self.batch_size]
+                try:
+                    self.writer(batch)
+                except Exception as e:
+                    logger.warning("Falha ao regravar transbordo de analytics: %s", e)
+                    self._spill(events[i:])
+                    break
+                self._count("replayed", len(batch))
+            else:
+                logger.info("Transbordo de analytics regravado: %d eventos", len(events))
+            os.remove(path)
+
+    def flush(self):
+        """Descarrega o buffer agora, na thread atual"""
+        self._drain()
+
+    def close(self, timeout: float = 5.0):
+        """Para a thread e faz a descarga final (o que falhar vai para o transbordo)"""
+        with self._lock:
+            self._closed = True
+            thread = self._thread
+        self._wake.set()
+        if thread is not None:
+            thread.join(timeout)
+        self._drain(final=True)
+
+    def stats(self) -> Dict:
+        with self._lock:
+            stats = dict(self._stats)
+            stats["buffer_depth"] = len(self._buffer)
+        stats.update({
+            "buffer_capacity": self.max_buffer,
+            "batch_size": self.batch_size,
+            "spill_bytes": self._spill_size(),
+            "retry_in_s": round(max(0.0, self._retry_at - time.monotonic()), 1),
+        })
+        return stats
+
+
+def _pid_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except OSError:
+        return True
+    return True
+
+
+_sink: Optional[AnalyticsSink] = None
+_sink_lock = threading.Lock()
+
+
+def _env_int(name: str, default: int) -> int:
+    try:
+        return int(os.getenv(name, default))
+    except (TypeError, ValueError):
+        return default
+
+
+def _env_float(name: str, default: float) -> float:
+    try:
+        return float(os.getenv(name, default))
+    except (TypeError, ValueError):
+        return default
+
+
+def get_analytics_sink() -> Optional[AnalyticsSink]:
+    """
+    Obtém o sink do processo (criado na primeira chamada, após o fork dos
+    workers do gunicorn), ou None se ANALYTICS_SINK=off
+    """
+    global _sink
+    dsn = os.getenv("DATABASE_URL")
+    mode = (os.getenv("ANALYTICS_SINK") or ("db" if dsn else "log")).lower()
+    if mode not in ("db", "log"):
+        return None
+    if _sink is None:
+        with _sink_lock:
+            if _sink is None:
+                if mode == "db":
+                    timeout_ms = _env_int("ANALYTICS_TIMEOUT_MS", 5000)
+                    writer = lambda events: copy_events_db(events, dsn, timeout_ms)  # noqa: E731
+                else:
+                    writer = log_events
+                _sink = AnalyticsSink(
+                    writer,
+                    max_buffer=_env_int("ANALYTICS_BUFFER_MAX", 10000),
+                    batch_size=_env_int("ANALYTICS_BATCH_SIZE", 500),
+                    flush_interval=_env_float("ANALYTICS_FLUSH_INTERVAL_S", 2.0),
+                    high_water=_env_float("ANALYTICS_SAMPLE_HIGH_WATER", 0.5),
+                    min_sample_rate=_env_float("ANALYTICS_SAMPLE_MIN_RATE", 0.05),
+                    spill_path=(os.getenv("ANALYTICS_SPILL_PATH") or DEFAULT_SPILL_PATH) if mode == "db" else None,
+                    spill_max_bytes=_env_int("ANALYTICS_SPILL_MAX_BYTES", 16 * 1024 * 1024),
+                )
+                atexit.register(_sink.close)
+    return _sink
+
+
+def emit_search_event(event: Dict) -> bool:
+    """Atalho para as rotas: enfileira o evento, ou False se desativado/descartado"""
+    sink = get_analytics_sink()
+    return sink.emit(event) if sink is not None else False
+
+
+def analytics_sink_stats() -> Optional[Dict]:
+    """Métricas do sink, ou None se ainda não criado"""
+    return _sink.stats() if _sink is not None else None
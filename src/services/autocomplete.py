@@ -0,0 +1,434 @@
+"""
+Autocompletar STIHL AI v5
+=========================
+
+Sugestões de busca a cada tecla, tiradas do próprio catálogo: descrições
+de produtos, modelos canônicos e códigos de material, mais as consultas
+populares registradas pelo analytics de busca.
+
+Funcionalidades:
+- Índice de prefixos em array ordenado (bisect): cada palavra de uma
+  descrição é um ponto de entrada ("corr" encontra "Óleo de corrente")
+- Entradas numeradas por ranking (popularidade, tipo, produtos do modelo,
+  tamanho): o melhor
+  resultado de um prefixo é o de menor número
+- Top-k pré-calculado para prefixos curtos (os de faixa mais longa) e
+  cache LRU por prefixo para os demais
+- Popularidade contada em memória (``record_query``) e, opcionalmente,
+  semeada de um log de analytics em JSON Lines; o índice é reconstruído
+  em segundo plano para incorporá-la. Conta clientes (IP) distintos, não
+  requisições: um único cliente repetindo a busca não cria sugestão
+
+Configuração via ambiente:
+- SUGGEST_ENGINE: memory (padrão) ou off
+- SUGGEST_SOURCE: db ou csv (padrão: db se DATABASE_URL definido)
+- SUGGEST_REFRESH_S: intervalo de reconstrução do índice (padrão: 600)
+- SUGGEST_MIN_QUERY_COUNT: clientes distintos que buscaram uma consulta para
+  ela virar sugestão (padrão: 3)
+- SUGGEST_ANALYTICS_LOG: log de analytics (JSON por linha) lido na construção
+- SUGGEST_CACHE_MAX_ENTRIES / _MAX_BYTES / _TTL_S / _SHARDS: cache por
+  prefixo (ver utils.cache)
+"""
+
+import os
+import re
+import csv
+import json
+import time
+import heapq
+import logging
+import threading
+from bisect import bisect_left
+from collections import Counter
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from src.services.catalog_stats import PRODUCT_CSV_DIRS, SHEET_TABLES, sheet_path
+from src.services.text_normalizer import MATERIAL_CODE_RE, extract_models, fold_text
+from src.utils.cache import ShardedLRUCache
+
+logger = logging.getLogger(__name__)
+
+
+# Colunas de compatibilidade das planilhas (mesmas de services.compatibility)
+MODEL_COLUMNS = {
+    "pecas": "modelos",
+    "acessorios": "modelos",
+    "sabres_correntes_pinhoes_limas": "modelos_maquinas",
+    "ferramentas": "modelos",
+    "cj_corte_fs": "modelo",
+}
+
+# Abas de máquinas: o modelo vem da própria descrição ("MS 162 Motosserra")
+MACHINE_TABLES = {"motosserras", "rocadeiras", "produtos_bateria"}
+
+PRODUCTS_SQL = "SELECT source_table, codigo_material, descricao FROM catalog_search_mv"
+MODELS_SQL = "SELECT modelo_canonico, COUNT(*) FROM product_compatibility_v5 GROUP BY 1"
+
+# Ordem entre tipos com a mesma popularidade
+KIND_ORDER = {"consulta": 0, "modelo": 1, "codigo": 2, "produto": 3}
+
+# Prefixos de até este tamanho têm o top-k calculado na construção
+PRECOMPUTED_PREFIX_LEN = 3
+PRECOMPUTED_TOP_K = 20
+
+MIN_PREFIX_LEN = 2
+SEPARATOR_RE = re.compile(r"[^a-z0-9]+")
+MODEL_DISPLAY_RE = re.compile(r"^([A-Z]+)(\d.*)$")
+# Descarta ruído das colunas livres de compatibilidade ("MS 03")
+MODEL_NAME_RE = re.compile(r"^[A-Z]+[1-9]")
+
+
+def normalize_prefix(text: str) -> str:
+    """Minúsculas, sem acentos e pontuação: "MS-25" -> "ms 25" """
+    return SEPARATOR_RE.sub(" ", fold_text(text)).strip()
+
+
+def _word_starts(key: str) -> Iterable[str]:
+    """Sufixos que começam em cada palavra: "oleo de corrente" -> ..., "corrente" """
+    yield key
+    for i, ch in enumerate(key):
+        if ch == " ":
+            yield key[i + 1:]
+
+
+def _model_display(model: str) -> str:
+    m = MODEL_DISPLAY_RE.match(model)
+    return f"{m.group(1)} {m.group(2)}" if m else model
+
+
+class Entry:
+    __slots__ = ("text", "kind", "code", "popularity", "weight")
+
+    def __init__(self, text: str, kind: str, code: Optional[str] = None, weight: int = 0):
+        self.text = text
+        self.kind = kind
+        self.code = code
+        self.popularity = 0
+        self.weight = weight
+
+    def to_dict(self) -> Dict:
+        item = {"texto": self.text, "tipo": self.kind}
+        if self.code:
+            item["codigo_material"] = self.code
+        return item
+
+
+class AutocompleteIndex:
+    """
+    Índice imutável de prefixos
+
+    ``_keys`` é a lista ordenada de chaves normalizadas e ``_ranks`` traz,
+    na mesma posição, o ranking da entrada (índice em ``_entries``).
+    """
+
+    def __init__(self, products: Iterable[Tuple[str, str, str]], models: Optional[Dict[str, int]] = None,
+                 popularity: Optional[Dict[str, int]] = None, min_query_count: int = 3):
+        start = time.perf_counter()
+        entries: Dict[str, Entry] = {}
+        # Chaves completas (não sufixos) de cada entrada, para casar popularidade
+        full_keys: Dict[str, List[str]] = {}
+
+        def add(key: str, entry: Entry, *aliases: str) -> Entry:
+            existing = entries.get(key)
+            if existing is not None:
+                return existing
+            entries[key] = entry
+            full_keys[key] = [key, *aliases]
+            return entry
+
+        # Modelo -> produtos que o citam (desempate entre modelos)
+        model_weights = Counter(models or {})
+        for table, code, description in products:
+            if code:
+                digits = re.sub(r"\D", "", code)
+                add(normalize_prefix(code), Entry(code, "codigo", code), digits)
+            key = normalize_prefix(description or "")
+            if key:
+                add(key, Entry(description.strip(), "produto", code))
+                if table in MACHINE_TABLES:
+                    model_weights.update(extract_models((description or "").upper()))
+        for model, weight in model_weights.items():
+            if not MODEL_NAME_RE.match(model):
+                continue
+            display = _model_display(model)
+            add(normalize_prefix(display), Entry(display, "modelo", weight=weight), model.lower())
+
+        # Popularidade: soma na entrada com a mesma chave ou vira sugestão própria
+        alias_of = {alias: key for key, aliases in full_keys.items() for alias in aliases}
+        for query, count in (popularity or {}).items():
+            key = normalize_prefix(query)
+            if not key:
+                continue
+            target = alias_of.get(key)
+            if target is not None:
+                entries[target].popularity += count
+            elif count >= min_query_count:
+                add(key, Entry(key, "consulta")).popularity += count
+
+        ranked = sorted(entries.items(), key=lambda kv: (
+            -kv[1].popularity, KIND_ORDER[kv[1].kind], -kv[1].weight, len(kv[1].text), kv[0]))
+        self._entries = [entry for _, entry in ranked]
+
+        pairs = []
+        for rank, (key, entry) in enumerate(ranked):
+            names = set()
+            for full in full_keys[key]:
+                names.update(_word_starts(full) if entry.kind in ("produto", "consulta") else (full,))
+            pairs.extend((name, rank) for name in names)
+        pairs.sort()
+        self._keys = [name for name, _ in pairs]
+        self._ranks = [rank for _, rank in pairs]
+
+        # Top-k dos prefixos curtos: as faixas mais longas do array
+        top: Dict[str, List[int]] = {}
+        for name, rank in pairs:
+            for n in range(MIN_PREFIX_LEN, min(PRECOMPUTED_PREFIX_LEN, len(name)) + 1):
+                top.setdefault(name[:n], []).append(rank)
+        self._top = {prefix: heapq.nsmallest(PRECOMPUTED_TOP_K, set(ranks))
+                     for prefix, ranks in top.items()}
+
+        self._cache = ShardedLRUCache.from_env("SUGGEST_CACHE")
+        self.built_at = time.time()
+        self.build_ms = (time.perf_counter() - start) * 1000
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def _ranks_for(self, prefix: str, limit: int) -> List[int]:
+        if len(prefix) <= PRECOMPUTED_PREFIX_LEN and limit <= PRECOMPUTED_TOP_K:
+            return self._top.get(prefix, [])[:limit]
+        keys, ranks = self._keys, self._ranks
+        lo = bisect_left(keys, prefix)
+        hi = bisect_left(keys, prefix + "\x7f", lo)
+        return heapq.nsmallest(limit, set(ranks[lo:hi]))
+
+    def suggest(self, text: str, limit: int = 10) -> List[Dict]:
+        """
+        Melhores sugestões para o texto digitado até agora
+
+        Args:
+            text: Prefixo digitado (qualquer grafia; acentos e pontuação ignorados)
+            limit: Número máximo de sugestões
+
+        Returns:
+            List[Dict]: {"texto", "tipo", "codigo_material"?} em ordem de ranking
+        """
+        prefix = normalize_prefix(text)
+        if len(prefix) < MIN_PREFIX_LEN or limit <= 0:
+            return []
+        cached = self._cache.get((prefix, limit))
+        if cached is not None:
+            return cached
+        result = [self._entries[rank].to_dict() for rank in self._ranks_for(prefix, limit)]
+        self._cache.set((prefix, limit), result)
+        return result
+
+    def stats(self) -> Dict:
+        return {
+            "entries": len(self._entries),
+            "keys": len(self._keys),
+            "precomputed_prefixes": len(self._top),
+            "build_ms": round(self.build_ms, 1),
+            "built_at": self.built_at,
+            "cache": self._cache.stats(),
+        }
+
+
+class QueryPopularity:
+    """
+    Clientes distintos por consulta com resultados, segura entre threads
+
+    Cada cliente (IP) conta uma vez por consulta, até ``max_clients``
+    clientes; daí em diante a consulta já é popular e cada busca soma.
+    Sem cliente conhecido (linhas antigas do log), cada busca conta.
+    """
+
+    def __init__(self, max_queries: int = 50000, max_clients: int = 256):
+        self.max_queries = max_queries
+        self.max_clients = max_clients
+        self._counts: Counter = Counter()
+        self._clients: Dict[str, set] = {}
+        self._lock = threading.Lock()
+
+    def record(self, query: str, client: Optional[str] = None):
+        key = normalize_prefix(query)
+        if len(key) < MIN_PREFIX_LEN:
+            return
+        with self._lock:
+            if client is not None:
+                seen = self._clients.setdefault(key, set())
+                if len(seen) < self.max_clients:
+                    marker = hash(client)
+                    if marker in seen:
+                        return
+                    seen.add(marker)
+            self._counts[key] += 1
+            if len(self._counts) > 2 * self.max_queries:
+                # Mantém as mais buscadas; as raras saem primeiro
+                self._counts = Counter(dict(self._counts.most_common(self.max_queries)))
+                self._clients = {k: v for k, v in self._clients.items() if k in self._counts}
+
+    def load_log(self, path: str) -> int:
+        """
+        Soma as consultas de um log de analytics (um JSON por linha, com
+        prefixo opcional como "Search Analytics: {...}"); devolve as lidas
+        """
+        loaded = 0
+        with open(path, encoding="utf-8", errors="replace") as fh:
+            for line in fh:
+                start = line.find("{")
+                if start < 0:
+                    continue
+                try:
+                    event = json.loads(line[start:])
+                except ValueError:
+                    continue
+                query = event.get("query") if isinstance(event, dict) else None
+                if query and event.get("results_count", 1):
+                    self.record(str(query), event.get("user_ip"))
+                    loaded += 1
+        return loaded
+
+    def snapshot(self) -> Dict[str, int]:
+        with self._lock:
+            return dict(self._counts)
+
+    def __len__(self) -> int:
+        return len(self._counts)
+
+
+def load_catalog_csv(directories: Iterable[str] = PRODUCT_CSV_DIRS) -> Tuple[List[Tuple[str, str, str]], Dict[str, int]]:
+    """(produtos, modelo -> produtos compatíveis) das planilhas em csv_data/ e csv_outputs_v5/"""
+    products, models = [], Counter()
+    for sheet, table in SHEET_TABLES.items():
+        path = sheet_path(sheet, directories)
+        if path is None:
+            logger.warning("Planilha %s.csv ausente: produtos fora do autocompletar", sheet)
+            continue
+        with open(path, encoding="utf-8", newline="") as fh:
+            for r in csv.DictReader(fh):
+                code = r.get("codigo_material") or ""
+                products.append((table, code if MATERIAL_CODE_RE.match(code) else "", r.get("descricao")))
+                column = MODEL_COLUMNS.get(sheet)
+                if column:
+                    models.update(extract_models(r.get(column)))
+    return products, dict(models)
+
+
+def load_catalog_db(dsn: Optional[str] = None) -> Tuple[List[Tuple[str, str, str]], Dict[str, int]]:
+    from src.utils.db_pool import connection
+    with connection(dsn) as conn:
+        with conn.cursor() as cur:
+            cur.execute(PRODUCTS_SQL)
+            products = [(t, c if c and MATERIAL_CODE_RE.match(c) else "", d) for t, c, d in cur.fetchall()]
+            cur.execute(MODELS_SQL)
+            models = {model: int(count) for model, count in cur.fetchall()}
+    return products, models
+
+
+def _env_int(name: str, default: int) -> int:
+    try:
+        return int(os.getenv(name, default))
+    except (TypeError, ValueError):
+        return default
+
+
+_popularity = QueryPopularity()
+_index: Optional[AutocompleteIndex] = None
+_index_lock = threading.Lock()
+_refreshing = False
+_log_loaded = False
+
+
+def build_autocomplete(source: str = "csv", dsn: Optional[str] = None,
+                       popularity: Optional[Dict[str, int]] = None) -> AutocompleteIndex:
+    if source == "db":
+        products, models = load_catalog_db(dsn)
+    else:
+        products, models = load_catalog_csv()
+    index = AutocompleteIndex(products, models, popularity,
+                              _env_int("SUGGEST_MIN_QUERY_COUNT", 3))
+    logger.info("Autocompletar construído: %d entradas, %d chaves (%s, %.0f ms)",
+                len(index), len(index._keys), source, index.build_ms)
+    return index
+
+
+def _build_from_env() -> AutocompleteIndex:
+    global _log_loaded
+    path = os.getenv("SUGGEST_ANALYTICS_LOG")
+    if path and not _log_loaded:
+        _log_loaded = True
+        try:
+            logger.info("Consultas lidas do log de analytics: %d", _popularity.load_log(path))
+        except OSError as e:
+            logger.warning("Log de analytics indisponível (%s): %s", path, e)
+    dsn = os.getenv("DATABASE_URL")
+    source = os.getenv("SUGGEST_SOURCE") or ("db" if dsn else "csv")
+    if source == "db":
+        try:
+            return build_autocomplete("db", dsn, _popularity.snapshot())
+        except Exception as e:
+            logger.warning("Catálogo do banco indisponível para o autocompletar, usando CSV: %s", e)
+    return build_autocomplete("csv", popularity=_popularity.snapshot())
+
+
+def _refresh():
+    global _index, _refreshing
+    try:
+        _index = _build_from_env()
+    except Exception as e:
+        logger.warning("Falha ao reconstruir o autocompletar: %s", e)
+    finally:
+        _refreshing = False
+
+
+def get_autocomplete() -> Optional[AutocompleteIndex]:
+    """
+    Obtém o índice do processo, ou None se SUGGEST_ENGINE=off; vencido o
+    intervalo, reconstrói em segundo plano com a popularidade atual
+    """
+    global _index, _refreshing
+    if os.getenv("SUGGEST_ENGINE", "memory").lower() != "memory":
+        return None
+    index = _index
+    if index is None:
+        with _index_lock:
+            if _index is None:
+                try:
+                    _index = _build_from_env()
+                except Exception as e:
+                    logger.warning("Autocompletar indisponível: %s", e)
+                    return None
+            return _index
+    refresh = _env_int("SUGGEST_REFRESH_S", 600)
+    if refresh > 0 and not _refreshing and time.time() - index.built_at > refresh:
+        _refreshing = True
+        threading.Thread(target=_refresh, name="autocomplete-refresh", daemon=True).start()
+    return index
+
+
+def warm_autocomplete():
+    """Constrói o índice em segundo plano na inicialização da app"""
+    if os.getenv("SUGGEST_ENGINE", "memory").lower() == "memory" and _index is None:
+        threading.Thread(target=get_autocomplete, name="autocomplete-warm", daemon=True).start()
+
+
+def suggest(text: str, limit: int = 10) -> List[Dict]:
+    """Atalho para as rotas: sugestões para o prefixo, ou [] se desativado"""
+    index = get_autocomplete()
+    return index.suggest(text, limit) if index is not None else []
+
+
+def record_query(query: str, results_count: int, client: Optional[str] = None):
+    """Conta uma busca com resultados, uma vez por cliente, para o ranking das sugestões"""
+    if results_count > 0:
+        _popularity.record(query, client)
+
+
+def autocomplete_stats() -> Optional[Dict]:
+    """Estatísticas do índice, ou None se ainda não construído"""
+    if _index is None:
+        return None
+    stats = _index.stats()
+    stats["tracked_queries"] = len(_popularity)
+    return stats
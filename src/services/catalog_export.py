@@ -0,0 +1,179 @@
+"""
+Exportação do Catálogo STIHL AI v5
+==================================
+
+Percorre o catálogo inteiro (todas as abas, via catalog_search_mv) com um
+cursor nomeado no servidor: o Postgres entrega ``fetch_size`` linhas por
+vez e a memória do processo fica constante, qualquer que seja o tamanho
+do catálogo.
+
+Funcionalidades:
+- NDJSON (uma linha por produto + linha final de resumo) ou CSV
+- Filtro por categoria (source_table ou categoria_produto)
+- Exportação incremental: ``since`` = versão do catálogo
+  (catalog_product_versions_v5); inclui os removidos desde então
+- Versão e linhas lidas na mesma transação REPEATABLE READ: a versão
+  anunciada é exatamente a do snapshot exportado, mesmo com uma
+  importação concorrente
+- Compressão gzip em streaming
+
+Configuração via ambiente:
+- CATALOG_EXPORT_FETCH_SIZE: linhas por FETCH do cursor (padrão: 2000)
+- CATALOG_EXPORT_TIMEOUT_MS: timeout por instrução (padrão: 0, sem limite)
+"""
+
+import io
+import os
+import csv
+import json
+import zlib
+import logging
+from decimal import Decimal
+from typing import Dict, Iterable, Iterator, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+EXPORT_FIELDS = (
+    "source_table", "codigo_material", "descricao", "preco_real",
+    "modelos_compatibilidade", "categoria_produto", "catalog_version", "removido",
+)
+
+SNAPSHOT_SQL = "SET TRANSACTION ISOLATION LEVEL REPEATABLE READ, READ ONLY"
+VERSION_SQL = "SELECT current_catalog_version_v5() AS version"
+
+
+def _env_int(name: str, default: int) -> int:
+    try:
+        return int(os.getenv(name, default))
+    except (TypeError, ValueError):
+        return default
+
+
+def build_export_sql(category: Optional[str] = None, since: Optional[int] = None):
+    """
+    Consulta da exportação e parâmetros
+
+    Sem ``since``: produtos atuais. Com ``since``: somente os que mudaram
+    depois dessa versão, mais os removidos (removido = true).
+    """
+    params: Dict = {}
+    where = []
+    if category:
+        where.append("(m.source_table = %(category)s"
+                     " OR f_unaccent(lower(m.categoria_produto)) = f_unaccent(lower(%(category)s)))")
+        params["category"] = category
+    if since is not None:
+        where.append("v.catalog_version > %(since)s")
+        params["since"] = since
+    sql = """
+        SELECT m.source_table, m.codigo_material, m.descricao, m.preco_real,
+               m.modelos_compatibilidade, m.categoria_produto,
+               v.catalog_version, FALSE AS removido
+        FROM catalog_search_mv m
+        LEFT JOIN catalog_product_versions_v5 v
+               ON v.source_table = m.source_table AND v.codigo_material = m.codigo_material
+    """
+    if where:
+        sql += " WHERE " + " AND ".join(where)
+    if since is not None:
+        removed = ["v.removed", "v.catalog_version > %(since)s"]
+        if category:
+            removed.append("v.source_table = %(category)s")
+        sql += f"""
+        UNION ALL
+        SELECT v.source_table, v.codigo_material, NULL, NULL, NULL, NULL,
+               v.catalog_version, TRUE
+        FROM catalog_product_versions_v5 v
+        WHERE {' AND '.join(removed)}
+        """
+    return sql, params
+
+
+def _snapshot_rows(dsn: Optional[str], category: Optional[str], since: Optional[int],
+                   fetch_size: int) -> Iterator:
+    """Versão do catálogo e, em seguida, as linhas, todas do mesmo snapshot"""
+    from psycopg2.extras import RealDictCursor
+    from src.utils.db_pool import connection
+    sql, params = build_export_sql(category, since)
+    with connection(dsn, statement_timeout_ms=_env_int("CATALOG_EXPORT_TIMEOUT_MS", 0)) as conn:
+        with conn.cursor() as cur:
+            # Antes da primeira consulta: o snapshot nasce no SELECT da versão
+            cur.execute(SNAPSHOT_SQL)
+            cur.execute(VERSION_SQL)
+            yield int(cur.fetchone()[0] or 0)
+        with conn.cursor(name="catalog_export", cursor_factory=RealDictCursor) as cur:
+            cur.execute(sql, params)
+            while True:
+                rows = cur.fetchmany(fetch_size)
+                if not rows:
+                    break
+                yield from rows
+
+
+def open_catalog_export(dsn: Optional[str] = None, category: Optional[str] = None,
+                        since: Optional[int] = None,
+                        fetch_size: Optional[int] = None) -> Tuple[int, Iterator[Dict]]:
+    """
+    Versão do catálogo e produtos, lidos em blocos de um cursor nomeado
+
+    A versão é lida na mesma transação REPEATABLE READ do cursor, então
+    corresponde às linhas exportadas. A conexão fica emprestada enquanto
+    o iterador é consumido e volta ao pool quando ele termina ou é
+    fechado (cliente desconectou).
+
+    Returns:
+        Tuple[int, Iterator[Dict]]: Versão exportada e linhas
+
+    Raises:
+        psycopg2.Error: Banco indisponível (antes de qualquer linha)
+    """
+    rows = _snapshot_rows(dsn, category, since, fetch_size or _env_int("CATALOG_EXPORT_FETCH_SIZE", 2000))
+    return next(rows), rows
+
+
+def _plain(row: Dict) -> Dict:
+    return {key: float(value) if isinstance(value, Decimal) else value
+            for key, value in row.items()}
+
+
+def iter_ndjson(rows: Iterable[Dict], version: Optional[int] = None) -> Iterator[str]:
+    """Uma linha JSON por produto e uma linha final {"done": true, ...}"""
+    count = 0
+    for row in rows:
+        count += 1
+        yield json.dumps(_plain(row), ensure_ascii=False, default=str) + "\n"
+    yield json.dumps({"done": True, "rows": count, "catalog_version": version}) + "\n"
+
+
+def iter_csv(rows: Iterable[Dict], delimiter: str = ",", batch: int = 500) -> Iterator[str]:
+    """CSV com cabeçalho; linhas agrupadas em blocos de ``batch``"""
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=EXPORT_FIELDS, delimiter=delimiter,
+                            extrasaction="ignore", lineterminator="\n")
+    writer.writeheader()
+    pending = 0
+    for row in rows:
+        writer.writerow(_plain(row))
+        pending += 1
+        if pending >= batch:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+            pending = 0
+    yield buffer.getvalue()
+
+
+def gzip_stream(chunks: Iterable[str], level: int = 6, min_flush: int = 64 * 1024) -> Iterator[bytes]:
+    """Comprime o fluxo em gzip, emitindo blocos de ~``min_flush`` bytes de entrada"""
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+    pending = 0
+    for chunk in chunks:
+        data = chunk.encode("utf-8")
+        pending += len(data)
+        out = compressor.compress(data)
+        if pending >= min_flush:
+            out += compressor.flush(zlib.Z_SYNC_FLUSH)
+            pending = 0
+        if out:
+            yield out
+    yield compressor.flush(zlib.Z_FINISH)
@@ -0,0 +1,296 @@
+"""
+Estatísticas do Catálogo STIHL AI v5
+====================================
+
+Agregados por categoria (contagens, faixa e média de preço, produto mais
+caro e histograma por faixa de preço), calculados numa única passada a
+cada importação (catalog_statistics_v5, ver rebuild_catalog_statistics_v5)
+e servidos da memória: /api/search/price-ranges não consulta o banco.
+
+Funcionalidades:
+- Snapshot imutável, trocado inteiro quando a versão do catálogo muda
+  (recarga em segundo plano; as leituras continuam no snapshot anterior)
+- ``compute_statistics``: a mesma agregação da função SQL, em Python,
+  usada com as planilhas de csv_data/ e csv_outputs_v5/ quando não há banco
+- Faixas de preço iguais às de catalog_price_bands_v5()
+
+Configuração via ambiente:
+- CATALOG_STATS: memory (padrão) ou off
+- CATALOG_STATS_SOURCE: db ou csv (padrão: db se DATABASE_URL definido)
+- CATALOG_STATS_RETRY_S: com o banco fora, intervalo entre novas
+  tentativas; até lá vale o snapshot das planilhas, sem versão (padrão: 60)
+"""
+
+import os
+import csv
+import time
+import logging
+import threading
+from bisect import bisect_right
+from decimal import Decimal
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from src.services.catalog_version import current_catalog_version
+
+logger = logging.getLogger(__name__)
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+# Planilhas exportadas: as de máquinas e peças em csv_data/, as demais
+# (bateria, ferramentas, EPIs) em csv_outputs_v5/
+PRODUCT_CSV_DIRS = (os.path.join(ROOT_DIR, "csv_data"), os.path.join(ROOT_DIR, "csv_outputs_v5"))
+
+# Limites das faixas de preço: [0, 50), [50, 100), ..., [5000, ∞)
+PRICE_BANDS = (50, 100, 250, 500, 1000, 2500, 5000)
+
+# Planilha -> source_table de catalog_search_mv
+SHEET_TABLES = {
+    "ms": "motosserras",
+    "rocadeiras_e_impl": "rocadeiras",
+    "produtos_a_bateria": "produtos_bateria",
+    "pecas": "pecas",
+    "acessorios": "acessorios",
+    "sabres_correntes_pinhoes_limas": "sabres_correntes",
+    "ferramentas": "ferramentas",
+    "epis": "epis",
+}
+
+# Mesmos rótulos de catalog_category_label_v5()
+CATEGORY_LABELS = {
+    "motosserras": "Motosserras",
+    "rocadeiras": "Roçadeiras",
+    "produtos_bateria": "Produtos a Bateria",
+    "pecas": "Peças",
+    "acessorios": "Acessórios",
+    "sabres_correntes": "Sabres e Correntes",
+    "ferramentas": "Ferramentas",
+    "epis": "EPIs",
+}
+
+STATISTICS_SQL = """
+    SELECT source_table, categoria, total_produtos, produtos_com_preco, preco_minimo,
+           preco_maximo, preco_medio, produto_mais_caro, histograma
+    FROM catalog_statistics_v5
+"""
+
+
+def category_label(source_table: str) -> str:
+    return CATEGORY_LABELS.get(source_table) or source_table.replace("_", " ").title()
+
+
+def _price(value) -> Optional[float]:
+    """Preço > 0 como float; vazio, inválido ou não positivo -> None (como na visão)"""
+    if value in (None, ""):
+        return None
+    try:
+        price = float(value)
+    except (TypeError, ValueError):
+        return None
+    return price if price > 0 else None
+
+
+def _histogram(counts: List[int]) -> List[Dict]:
+    bounds = (0,) + PRICE_BANDS
+    return [{"de": bounds[i], "ate": PRICE_BANDS[i] if i < len(PRICE_BANDS) else None,
+             "produtos": int(count)}
+            for i, count in enumerate(counts)]
+
+
+def compute_statistics(rows: Iterable[Tuple[str, str, object]]) -> List[Dict]:
+    """
+    Agregados por categoria numa única passada
+
+    Args:
+        rows: (source_table, descrição, preço) de cada produto
+
+    Returns:
+        List[Dict]: Uma entrada por categoria, no formato de catalog_statistics_v5
+    """
+    acc: Dict[str, Dict] = {}
+    for table, description, value in rows:
+        entry = acc.get(table)
+        if entry is None:
+            entry = acc[table] = {"total": 0, "priced": 0, "sum": 0.0, "min": None, "max": None,
+                                  "top": None, "bands": [0] * (len(PRICE_BANDS) + 1)}
+        entry["total"] += 1
+        price = _price(value)
+        if price is None:
+            continue
+        entry["priced"] += 1
+        entry["sum"] += price
+        entry["bands"][bisect_right(PRICE_BANDS, price)] += 1
+        if entry["min"] is None or price < entry["min"]:
+            entry["min"] = price
+        if entry["max"] is None or price > entry["max"]:
+            entry["max"] = price
+            entry["top"] = description
+
+    return [{
+        "source_table": table,
+        "categoria": category_label(table),
+        "total_produtos": entry["total"],
+        "produtos_com_preco": entry["priced"],
+        "preco_minimo": entry["min"],
+        "preco_maximo": entry["max"],
+        "preco_medio": round(entry["sum"] / entry["priced"], 2) if entry["priced"] else None,
+        "produto_mais_caro": entry["top"],
+        "histograma": entry["bands"],
+    } for table, entry in acc.items()]
+
+
+class CatalogStats:
+    """Snapshot imutável das estatísticas, com as respostas já montadas"""
+
+    def __init__(self, categories: List[Dict], version: Optional[int] = None, source: str = "csv"):
+        self.version = version
+        self.source = source
+        self.built_at = time.time()
+        self._categories = []
+        for c in sorted(categories, key=lambda c: c["categoria"]):
+            c = {key: float(value) if isinstance(value, Decimal) else value for key, value in c.items()}
+            c["histograma"] = _histogram(c.get("histograma") or [])
+            self._categories.append(c)
+        self._by_size = sorted(self._categories, key=lambda c: -c["total_produtos"])
+        self._price_ranges = [{
+            "categoria": c["categoria"],
+            "preco_minimo": c["preco_minimo"] or 0.0,
+            "preco_maximo": c["preco_maximo"] or 0.0,
+            "preco_medio": c["preco_medio"] or 0.0,
+            "total_produtos": c["produtos_com_preco"],
+            "histograma": c["histograma"],
+        } for c in self._categories if c["produtos_com_preco"]]
+
+    def price_ranges(self) -> List[Dict]:
+        """Faixas de preço por categoria (só categorias com preço)"""
+        return self._price_ranges
+
+    def categories(self) -> List[Dict]:
+        """Estatísticas completas, da categoria com mais produtos para a com menos"""
+        return self._by_size
+
+    def __len__(self) -> int:
+        return len(self._categories)
+
+    def stats(self) -> Dict:
+        return {"categories": len(self._categories), "version": self.version,
+                "source": self.source, "built_at": self.built_at}
+
+
+def sheet_path(sheet: str, directories: Iterable[str] = PRODUCT_CSV_DIRS) -> Optional[str]:
+    """Primeiro ``<sheet>.csv`` existente nos diretórios, em ordem"""
+    for directory in directories:
+        path = os.path.join(directory, f"{sheet}.csv")
+        if os.path.exists(path):
+            return path
+    return None
+
+
+def load_statistics_csv(directories: Iterable[str] = PRODUCT_CSV_DIRS) -> List[Dict]:
+    def rows():
+        for sheet, table in SHEET_TABLES.items():
+            path = sheet_path(sheet, directories)
+            if path is None:
+                logger.warning("Planilha %s.csv ausente: categoria fora das estatísticas", sheet)
+                continue
+            with open(path, encoding="utf-8", newline="") as fh:
+                for r in csv.DictReader(fh):
+                    yield table, r.get("descricao"), r.get("preco_real")
+    return compute_statistics(rows())
+
+
+def load_statistics_db(dsn: Optional[str] = None) -> List[Dict]:
+    from psycopg2.extras import RealDictCursor
+    from src.utils.db_pool import connection
+    with connection(dsn, cursor_factory=RealDictCursor) as conn:
+        with conn.cursor() as cur:
+            cur.execute(STATISTICS_SQL)
+            return [dict(r) for r in cur.fetchall()]
+
+
+def build_catalog_stats(source: str = "csv", dsn: Optional[str] = None,
+                        version: Optional[int] = None) -> CatalogStats:
+    start = time.perf_counter()
+    if source == "db":
+        stats = CatalogStats(load_statistics_db(dsn), version, "db")
+    else:
+        stats = CatalogStats(load_statistics_csv(), version, "csv")
+    logger.info("Estatísticas do catálogo carregadas: %d categorias (%s, versão %s, %.0f ms)",
+                len(stats), source, version, (time.perf_counter() - start) * 1000)
+    return stats
+
+
+_stats: Optional[CatalogStats] = None
+_stats_lock = threading.Lock()
+_refreshing = False
+# Próxima tentativa no banco depois de cair para o CSV (time.monotonic)
+_retry_at = 0.0
+
+
+def _source() -> str:
+    return os.getenv("CATALOG_STATS_SOURCE") or ("db" if os.getenv("DATABASE_URL") else "csv")
+
+
+def _retry_interval() -> float:
+    try:
+        return float(os.getenv("CATALOG_STATS_RETRY_S", 60))
+    except ValueError:
+        return 60.0
+
+
+def _build(version: Optional[int]) -> CatalogStats:
+    global _retry_at
+    if _source() == "db":
+        try:
+            return build_catalog_stats("db", os.getenv("DATABASE_URL"), version)
+        except Exception as e:
+            logger.warning("Estatísticas do banco indisponíveis, usando CSV: %s", e)
+            _retry_at = time.monotonic() + _retry_interval()
+        # Sem a versão do banco: as planilhas não são aquele catálogo, e as
+        # respostas saem sem ETag até o banco voltar
+        return build_catalog_stats("csv")
+    return build_catalog_stats("csv", version=version)
+
+
+def _refresh(version: int):
+    global _stats, _refreshing
+    try:
+        _stats = _build(version)
+    except Exception as e:
+        logger.warning("Falha ao recarregar estatísticas do catálogo: %s", e)
+    finally:
+        _refreshing = False
+
+
+def get_catalog_stats() -> Optional[CatalogStats]:
+    """
+    Obtém o snapshot do processo, ou None se CATALOG_STATS=off; quando a
+    versão do catálogo muda, recarrega em segundo plano e troca o snapshot.
+    Enquanto isso o snapshot anterior continua servido, com a própria
+    versão: as rotas o marcam com http_cache.snapshot_response
+    """
+    global _stats, _refreshing
+    if os.getenv("CATALOG_STATS", "memory").lower() != "memory":
+        return None
+    stats = _stats
+    if stats is None:
+        with _stats_lock:
+            if _stats is None:
+                try:
+                    _stats = _build(current_catalog_version())
+                except Exception as e:
+                    logger.warning("Estatísticas do catálogo indisponíveis: %s", e)
+                    return None
+            return _stats
+    # Inclui o snapshot de CSV usado enquanto o banco estava fora
+    if _source() == "db":
+        version = current_catalog_version()
+        if (version is not None and version != stats.version and not _refreshing
+                and time.monotonic() >= _retry_at):
+            _refreshing = True
+            threading.Thread(target=_refresh, args=(version,), name="catalog-stats-refresh",
+                             daemon=True).start()
+    return stats
+
+
+def catalog_stats_stats() -> Optional[Dict]:
+    """Estatísticas do snapshot, ou None se ainda não carregado"""
+    return _stats.stats() if _stats is not None else None
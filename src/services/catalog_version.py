@@ -0,0 +1,111 @@
+"""
+Versão do Catálogo STIHL AI v5
+==============================
+
+Número da versão do catálogo (catalog_version_v5), que avança a cada
+importação que altera produtos, campanhas ou tabelas fiscais. As rotas
+de leitura derivam dele ETag e Cache-Control (ver utils.http_cache).
+
+Funcionalidades:
+- Versão consultada no banco no máximo uma vez a cada ``ttl`` segundos
+  por processo; entre consultas, a verificação custa um acesso à memória
+- Falha do banco mantém a última versão conhecida (ou None: sem ETag)
+- ``invalidate`` força nova leitura (ex.: logo após uma importação)
+
+Configuração via ambiente:
+- CATALOG_VERSION_TTL_S: intervalo entre leituras da versão (padrão: 30)
+"""
+
+import os
+import time
+import logging
+import threading
+from typing import Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+VERSION_SQL = "SELECT current_catalog_version_v5()"
+
+
+class CatalogVersion:
+    """Versão do catálogo com leitura espaçada e segura entre threads"""
+
+    def __init__(self, dsn: Optional[str] = None, ttl: float = 30.0, error_backoff: float = 5.0):
+        self.dsn = dsn
+        self.ttl = ttl
+        self.error_backoff = error_backoff
+        self._version: Optional[int] = None
+        self._checked = 0.0
+        self._lock = threading.Lock()
+        self._stats = {"reads": 0, "errors": 0, "changes": 0}
+
+    def _read(self) -> int:
+        from src.utils.db_pool import connection
+        with connection(self.dsn) as conn:
+            with conn.cursor() as cur:
+                cur.execute(VERSION_SQL)
+                return int(cur.fetchone()[0] or 0)
+
+    def current(self) -> Optional[int]:
+        """Versão atual, relida do banco quando o ttl vence"""
+        if time.monotonic() - self._checked < self.ttl:
+            return self._version
+        with self._lock:
+            if time.monotonic() - self._checked < self.ttl:
+                return self._version
+            try:
+                version = self._read()
+            except Exception as e:
+                self._stats["errors"] += 1
+                # Nova tentativa depois de error_backoff, não de ttl
+                self._checked = time.monotonic() - self.ttl + self.error_backoff
+                logger.warning("Versão do catálogo indisponível: %s", e)
+                return self._version
+            self._stats["reads"] += 1
+            if self._version is not None and version != self._version:
+                self._stats["changes"] += 1
+                logger.info("Catálogo mudou da versão %s para %s", self._version, version)
+            self._version = version
+            self._checked = time.monotonic()
+            return version
+
+    def invalidate(self):
+        with self._lock:
+            self._checked = 0.0
+
+    def stats(self) -> Dict:
+        stats = dict(self._stats)
+        stats.update({"version": self._version, "ttl": self.ttl})
+        return stats
+
+
+_catalog_version: Optional[CatalogVersion] = None
+_catalog_version_lock = threading.Lock()
+
+
+def get_catalog_version() -> Optional[CatalogVersion]:
+    """Obtém o leitor de versão do processo, ou None sem DATABASE_URL"""
+    global _catalog_version
+    if _catalog_version is None:
+        dsn = os.getenv("DATABASE_URL")
+        if not dsn:
+            return None
+        with _catalog_version_lock:
+            if _catalog_version is None:
+                try:
+                    ttl = float(os.getenv("CATALOG_VERSION_TTL_S", 30))
+                except ValueError:
+                    ttl = 30.0
+                _catalog_version = CatalogVersion(dsn, ttl=ttl)
+    return _catalog_version
+
+
+def current_catalog_version() -> Optional[int]:
+    """Versão atual do catálogo, ou None se desconhecida"""
+    version = get_catalog_version()
+    return version.current() if version is not None else None
+
+
+def catalog_version_stats() -> Optional[Dict]:
+    """Estatísticas do leitor, ou None se ainda não criado"""
+    return _catalog_version.stats() if _catalog_version is not None else None
@@ -0,0 +1,267 @@
+"""
+Índice de Compatibilidade por Modelo STIHL AI v5
+================================================
+
+Espelho em memória de ``product_compatibility_v5``: modelo canônico ->
+produtos compatíveis (peças, acessórios, sabres/correntes, ferramentas e
+conjuntos de corte FS), já na ordem de preço.
+
+Configuração via ambiente:
+- COMPAT_INDEX_ENGINE: "memory" habilita o índice em memória (padrão: "sql")
+- COMPAT_INDEX_REFRESH_S: intervalo mínimo entre verificações de mudança da
+  tabela (padrão: 300); a recarga roda em segundo plano
+- COMPAT_INDEX_RETRY_S: espera após falha da primeira carga, com as consultas
+  indo ao SQL enquanto isso (padrão: 60)
+"""
+
+import os
+import csv
+import time
+import bisect
+import logging
+import threading
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from src.services.text_normalizer import canonical_model, extract_models
+
+logger = logging.getLogger(__name__)
+
+CSV_DIR = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))),
+    "csv_data",
+)
+
+# Tabela base -> coluna com o texto livre de compatibilidade
+MODEL_COLUMNS = {
+    "pecas": "modelos",
+    "acessorios": "modelos",
+    "sabres_correntes_pinhoes_limas": "modelos_maquinas",
+    "ferramentas": "modelos",
+    "cj_corte_fs": "modelo",
+}
+
+# Tabela base -> (source_table exposto, tipo de compatibilidade, categoria)
+# Mesmos rótulos de get_compatible_products_v5()
+COMPAT_LABELS = {
+    "pecas": ("pecas", "Peça compatível", "Peça"),
+    "acessorios": ("acessorios", "Acessório compatível", "Acessório"),
+    "sabres_correntes_pinhoes_limas": ("sabres_correntes", "Componente de corte compatível", "Sabre/Corrente/Pinhão/Lima"),
+    "ferramentas": ("ferramentas", "Ferramenta compatível", "Ferramenta"),
+    "cj_corte_fs": ("cj_corte_fs", "Conjunto de corte compatível", "Conjunto de Corte FS"),
+}
+
+FETCH_SQL = """
+    SELECT modelo_canonico, source_table, codigo_material, descricao, preco_real
+    FROM product_compatibility_v5
+"""
+
+# Contadores de escrita da tabela: mudam a cada rebuild_product_compatibility_v5()
+FINGERPRINT_SQL = """
+    SELECT COALESCE(n_tup_ins + n_tup_upd + n_tup_del, 0), n_live_tup
+    FROM pg_stat_user_tables
+    WHERE relname = 'product_compatibility_v5'
+"""
+
+
+def _sort_key(item: Tuple) -> Tuple:
+    """(sem preço por último, preço, código, tabela)"""
+    return item[3] is None, item[3] or 0.0, item[1], item[0]
+
+
+class CompatibilityIndex:
+    """
+    Dicionário modelo canônico -> tuplas (source_table, codigo, descricao, preco)
+
+    Cada lista é ordenada por (preço, código, tabela) na construção; a
+    consulta é um acesso ao dicionário e a paginação, um bisect.
+    """
+
+    def __init__(self, entries: Iterable[Tuple[str, str, str, Optional[str], Optional[float]]],
+                 version: Optional[Tuple] = None):
+        by_model: Dict[str, List[Tuple]] = {}
+        for modelo, source_table, codigo, descricao, preco in entries:
+            by_model.setdefault(modelo, []).append(
+                (source_table, codigo, descricao or "", float(preco) if preco is not None else None)
+            )
+        for items in by_model.values():
+            items.sort(key=_sort_key)
+        self._by_model = by_model
+        self.version = version
+        self.loaded_at = time.time()
+
+    @classmethod
+    def from_csv_dir(cls, csv_dir: str = CSV_DIR):
+        """Constrói a partir dos CSVs normalizados disponíveis em csv_dir"""
+        entries = []
+        for table, column in MODEL_COLUMNS.items():
+            path = os.path.join(csv_dir, f"{table}.csv")
+            if not os.path.exists(path):
+                continue
+            with open(path, encoding="utf-8", newline="") as fh:
+                for r in csv.DictReader(fh):
+                    preco = r.get("preco_real")
+                    for modelo in extract_models(r.get(column)):
+                        entries.append((
+                            modelo, table, r["codigo_material"], r.get("descricao"),
+                            float(preco) if preco else None,
+                        ))
+        return cls(entries)
+
+    @classmethod
+    def from_db(cls, dsn: Optional[str] = None):
+        """Carrega a tabela product_compatibility_v5 (com a impressão digital lida antes)"""
+        from src.utils.db_pool import connection
+        with connection(dsn) as conn:
+            with conn.cursor() as cur:
+                cur.execute(FINGERPRINT_SQL)
+                row = cur.fetchone()
+                cur.execute(FETCH_SQL)
+                return cls(cur.fetchall(), version=tuple(row) if row else None)
+
+    def __len__(self):
+        return len(self._by_model)
+
+    def models(self) -> List[str]:
+        return sorted(self._by_model)
+
+    def lookup(self, model: str, source_tables: Optional[Iterable[str]] = None,
+               priced_only: bool = False) -> List[Tuple]:
+        """
+        Produtos compatíveis com um modelo
+
+        Args:
+            model: Nome do modelo em qualquer grafia (MS 250, ms250, MS-250)
+            source_tables: Restringe às tabelas base informadas
+            priced_only: Somente itens com preço > 0
+
+        Returns:
+            List[Tuple]: (source_table, codigo, descricao, preco) por preço
+        """
+        items = self._by_model.get(canonical_model(model), [])
+        if source_tables is not None:
+            wanted = set(source_tables)
+            items = [it for it in items if it[0] in wanted]
+        if priced_only:
+            items = [it for it in items if it[3]]
+        return items
+
+    def lookup_page(self, model: str, after: Optional[List] = None, limit: int = 50,
+                    priced_only: bool = False) -> List[Tuple]:
+        """
+        Até ``limit`` produtos compatíveis depois de ``after``
+
+        Args:
+            model: Nome do modelo em qualquer grafia
+            after: (preço, código, tabela) do último item já entregue
+            limit: Itens da página
+            priced_only: Somente itens com preço > 0
+
+        Returns:
+            List[Tuple]: (source_table, codigo, descricao, preco) por preço
+        """
+        items = self._by_model.get(canonical_model(model), [])
+        start = 0
+        if after is not None:
+            price, code, table = after
+            start = bisect.bisect_right(items, _sort_key((table, code, None, price)), key=_sort_key)
+        page = []
+        for i in range(start, len(items)):
+            item = items[i]
+            if priced_only and not item[3]:
+                continue
+            page.append(item)
+            if len(page) >= limit:
+                break
+        return page
+
+    def stats(self) -> Dict:
+        return {
+            "models": len(self._by_model),
+            "entries": sum(len(v) for v in self._by_model.values()),
+            "loaded_at": self.loaded_at,
+        }
+
+
+def _env_seconds(name: str, default: float) -> float:
+    try:
+        return float(os.getenv(name, default))
+    except ValueError:
+        return default
+
+
+def _fingerprint(dsn: Optional[str]) -> Optional[Tuple]:
+    from src.utils.db_pool import connection
+    with connection(dsn) as conn:
+        with conn.cursor() as cur:
+            cur.execute(FINGERPRINT_SQL)
+            row = cur.fetchone()
+    return tuple(row) if row else None
+
+
+_index: Optional[CompatibilityIndex] = None
+_index_lock = threading.Lock()
+_index_checked = 0.0
+_refreshing = False
+_retry_at = 0.0
+
+
+def _refresh_if_changed():
+    global _index, _index_checked, _refreshing
+    try:
+        dsn = os.getenv("DATABASE_URL")
+        current = _index
+        if current is None or _fingerprint(dsn) != current.version:
+            _index = CompatibilityIndex.from_db(dsn)
+            logger.info("Índice de compatibilidade recarregado: %d modelos", len(_index))
+    except Exception as e:
+        logger.warning("Falha ao recarregar índice de compatibilidade: %s", e)
+    finally:
+        _index_checked = time.monotonic()
+        _refreshing = False
+
+
+def _load_first() -> Optional[CompatibilityIndex]:
+    global _index, _index_checked, _retry_at
+    if time.monotonic() < _retry_at:
+        return None
+    with _index_lock:
+        if _index is not None or time.monotonic() < _retry_at:
+            return _index
+        try:
+            _index = CompatibilityIndex.from_db(os.getenv("DATABASE_URL"))
+        except Exception as e:
+            retry = _env_seconds("COMPAT_INDEX_RETRY_S", 60.0)
+            _retry_at = time.monotonic() + retry
+            logger.warning("Falha ao carregar índice de compatibilidade (nova tentativa em %.0f s): %s",
+                           retry, e)
+            return None
+        _index_checked = time.monotonic()
+        return _index
+
+
+def get_compatibility_index() -> Optional[CompatibilityIndex]:
+    """
+    Obtém o índice do processo, ou None se COMPAT_INDEX_ENGINE != memory
+    ou se a primeira carga falhou (consulta segue pelo SQL)
+
+    A primeira chamada carrega do banco; depois, no máximo a cada
+    COMPAT_INDEX_REFRESH_S segundos, uma thread compara a impressão digital
+    da tabela e só então recarrega. As consultas continuam no índice vigente
+    durante a recarga (troca atômica da referência).
+    """
+    global _refreshing
+    if os.getenv("COMPAT_INDEX_ENGINE", "sql").lower() != "memory":
+        return None
+    index = _index
+    if index is None:
+        return _load_first()
+
+    refresh = _env_seconds("COMPAT_INDEX_REFRESH_S", 300.0)
+    if refresh > 0 and not _refreshing and time.monotonic() - _index_checked > refresh:
+        with _index_lock:
+            if _refreshing:
+                return index
+            _refreshing = True
+        threading.Thread(target=_refresh_if_changed, name="compat-index-refresh",
+                         daemon=True).start()
+    return index
@@ -0,0 +1,333 @@
+"""
+Diretório Universal de Identificadores STIHL AI v5
+==================================================
+
+Resolve qualquer identificador de produto para (tabela de origem, código
+canônico) com um único acesso a hash, espelhando ``product_identifiers_v5``.
+
+Identificadores aceitos:
+- Código de material (0000-007-1043, também sem hífens)
+- Código de barras EAN/UPC (zeros à esquerda ignorados)
+- Número de CA de EPI ("CA 12.345")
+- Código substituído em cod_alterados (redireciona para o código vigente)
+
+Configuração via ambiente:
+- IDENTIFIER_DIRECTORY_ENGINE: "memory" habilita o diretório em memória
+  (padrão: "sql", via resolve_identifier_v5)
+- IDENTIFIER_DIRECTORY_REFRESH_S: intervalo mínimo entre verificações de
+  mudança da tabela (padrão: 300); a recarga roda em segundo plano
+- IDENTIFIER_DIRECTORY_RETRY_S: espera após falha da primeira carga, com a
+  resolução indo ao SQL enquanto isso (padrão: 60)
+"""
+
+import os
+import re
+import csv
+import time
+import logging
+import threading
+from decimal import Decimal, InvalidOperation
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from src.services.catalog_stats import PRODUCT_CSV_DIRS, sheet_path
+
+logger = logging.getLogger(__name__)
+
+# Tabela base -> (coluna de código de barras, coluna de CA)
+IDENTIFIER_COLUMNS = {
+    "ms": ("cod_barras", None),
+    "rocadeiras_e_impl": ("cod_barras", None),
+    "produtos_a_bateria": ("cod_barras", None),
+    "pecas": ("codigo_barras", None),
+    "acessorios": ("codigo_barras", None),
+    "sabres_correntes_pinhoes_limas": ("codigo_barras", None),
+    "ferramentas": ("codigo_barras", None),
+    "epis": ("codigo_barras", "cod_ca"),
+}
+
+# Menor valor vence quando um identificador aponta para mais de um produto
+TYPE_PRIORITY = {"codigo": 1, "codigo_antigo": 2, "ean": 3, "ca": 4}
+
+CA_RE = re.compile(r"^CA[\s:.]*[0-9][0-9.\s]*$")
+DIGITS_RE = re.compile(r"^[0-9][0-9\s]*$")
+CA_NUMBER_RE = re.compile(r"[0-9]{3,}")
+
+FETCH_SQL = """
+    SELECT identificador, tipo, source_table, codigo_material
+    FROM product_identifiers_v5
+"""
+
+# Contadores de escrita da tabela: mudam a cada rebuild_product_identifiers_v5()
+FINGERPRINT_SQL = """
+    SELECT COALESCE(n_tup_ins + n_tup_upd + n_tup_del, 0), n_live_tup
+    FROM pg_stat_user_tables
+    WHERE relname = 'product_identifiers_v5'
+"""
+
+RESOLVE_SQL = "SELECT source_table, codigo_material, tipo FROM resolve_identifier_v5(%s)"
+
+
+def normalize_barcode(value) -> Optional[str]:
+    """886661266555, "0886661266555" e 886661970544.0 -> "886661266555" """
+    if value is None or value == "":
+        return None
+    try:
+        number = Decimal(str(value).strip())
+    except InvalidOperation:
+        return None
+    if number <= 0:
+        return None
+    return str(int(number)).lstrip("0") or None
+
+
+def identifier_keys(raw: str) -> List[str]:
+    """
+    Chaves candidatas para um identificador digitado pelo usuário.
+    Espelha identifier_keys_v5() em sql_scripts/03_derived_structures_v5.sql.
+    """
+    v = (raw or "").strip().upper()
+    if not v:
+        return []
+    keys = [v]
+    if CA_RE.match(v):
+        keys.append("CA" + re.sub(r"[^0-9]", "", v).lstrip("0"))
+    elif DIGITS_RE.match(v):
+        digits = re.sub(r"\s", "", v)
+        if len(digits) == 11:
+            keys.append(f"{digits[:4]}-{digits[4:7]}-{digits[7:]}")
+        keys.append(digits.lstrip("0"))
+        keys.append("CA" + digits.lstrip("0"))
+    return keys
+
+
+def build_entries(products: Iterable[Tuple[str, str, object, Optional[str]]],
+                  replacements: Iterable[Tuple[str, str]] = ()) -> List[Tuple[str, str, str, str]]:
+    """
+    Gera as linhas do diretório, como rebuild_product_identifiers_v5()
+
+    Args:
+        products: (source_table, codigo_material, codigo_barras, cod_ca)
+        replacements: (codigo_antigo, codigo_novo) de cod_alterados
+
+    Returns:
+        List[Tuple]: (identificador, tipo, source_table, codigo_material)
+    """
+    entries = []
+    by_code: Dict[str, Tuple[str, str]] = {}
+    for source_table, codigo, barras, ca in products:
+        if not codigo:
+            continue
+        key = codigo.strip().upper()
+        by_code.setdefault(key, (source_table, codigo))
+        entries.append((key, "codigo", source_table, codigo))
+        ean = normalize_barcode(barras)
+        if ean:
+            entries.append((ean, "ean", source_table, codigo))
+        if ca:
+            for number in CA_NUMBER_RE.findall(ca.replace(".", "")):
+                entries.append(("CA" + number.lstrip("0"), "ca", source_table, codigo))
+
+    # Cadeias A -> B -> C: vale o elo mais distante que existe no catálogo
+    successors: Dict[str, List[str]] = {}
+    for antigo, novo in replacements:
+        antigo, novo = (antigo or "").strip().upper(), (novo or "").strip().upper()
+        if antigo and novo:
+            successors.setdefault(antigo, []).append(novo)
+    for antigo in successors:
+        best = None
+        frontier, depth, seen = list(successors[antigo]), 1, {antigo}
+        while frontier and depth <= 10:
+            nxt = []
+            for code in frontier:
+                if code in seen:
+                    continue
+                seen.add(code)
+                if code in by_code:
+                    best = by_code[code]
+                nxt.extend(successors.get(code, ()))
+            frontier, depth = nxt, depth + 1
+        if best:
+            entries.append((antigo, "codigo_antigo", best[0], best[1]))
+    return entries
+
+
+class IdentifierDirectory:
+    """Hash identificador -> (source_table, codigo_material, tipo)"""
+
+    def __init__(self, entries: Iterable[Tuple[str, str, str, str]],
+                 version: Optional[Tuple] = None):
+        directory: Dict[str, Tuple[str, str, str]] = {}
+        for identificador, tipo, source_table, codigo in entries:
+            current = directory.get(identificador)
+            if current is None or TYPE_PRIORITY[tipo] < TYPE_PRIORITY[current[2]]:
+                directory[identificador] = (source_table, codigo, tipo)
+        self._directory = directory
+        self.version = version
+        self.loaded_at = time.time()
+
+    @classmethod
+    def from_csv_dir(cls, directories: Iterable[str] = PRODUCT_CSV_DIRS):
+        """Constrói a partir dos CSVs normalizados (csv_data/ e csv_outputs_v5/)"""
+        products = []
+        for table, (barcode_col, ca_col) in IDENTIFIER_COLUMNS.items():
+            path = sheet_path(table, directories)
+            if path is None:
+                logger.warning("Planilha %s.csv ausente: identificadores fora do diretório", table)
+                continue
+            with open(path, encoding="utf-8", newline="") as fh:
+                for r in csv.DictReader(fh):
+                    products.append((table, r.get("codigo_material"), r.get(barcode_col),
+                                     r.get(ca_col) if ca_col else None))
+        replacements = []
+        path = sheet_path("cod_alterados", directories)
+        if path is not None:
+            with open(path, encoding="utf-8", newline="") as fh:
+                replacements = [(r.get("codigo_antigo"), r.get("codigo_novo")) for r in csv.DictReader(fh)]
+        return cls(build_entries(products, replacements))
+
+    @classmethod
+    def from_db(cls, dsn: Optional[str] = None):
+        """Carrega a tabela product_identifiers_v5 (com a impressão digital lida antes)"""
+        from src.utils.db_pool import connection
+        with connection(dsn) as conn:
+            with conn.cursor() as cur:
+                cur.execute(FINGERPRINT_SQL)
+                row = cur.fetchone()
+                cur.execute(FETCH_SQL)
+                return cls(cur.fetchall(), version=tuple(row) if row else None)
+
+    def __len__(self):
+        return len(self._directory)
+
+    def resolve(self, raw: str) -> Optional[Dict]:
+        """
+        Resolve um identificador
+
+        Args:
+            raw: Código, EAN, CA ou código substituído
+
+        Returns:
+            Optional[Dict]: {source_table, codigo_material, tipo} ou None
+        """
+        best = None
+        for key in identifier_keys(raw):
+            hit = self._directory.get(key)
+            if hit and (best is None or TYPE_PRIORITY[hit[2]] < TYPE_PRIORITY[best[2]]):
+                best = hit
+        if best is None:
+            return None
+        return {"source_table": best[0], "codigo_material": best[1], "tipo": best[2]}
+
+
+def _env_seconds(name: str, default: float) -> float:
+    try:
+        return float(os.getenv(name, default))
+    except ValueError:
+        return default
+
+
+def _fingerprint(dsn: Optional[str]) -> Optional[Tuple]:
+    from src.utils.db_pool import connection
+    with connection(dsn) as conn:
+        with conn.cursor() as cur:
+            cur.execute(FINGERPRINT_SQL)
+            row = cur.fetchone()
+    return tuple(row) if row else None
+
+
+_directory: Optional[IdentifierDirectory] = None
+_directory_lock = threading.Lock()
+_directory_checked = 0.0
+_refreshing = False
+_retry_at = 0.0
+
+
+def _refresh_if_changed():
+    global _directory, _directory_checked, _refreshing
+    try:
+        dsn = os.getenv("DATABASE_URL")
+        current = _directory
+        if current is None or _fingerprint(dsn) != current.version:
+            _directory = IdentifierDirectory.from_db(dsn)
+            logger.info("Diretório de identificadores recarregado: %d chaves", len(_directory))
+    except Exception as e:
+        logger.warning("Falha ao recarregar diretório de identificadores: %s", e)
+    finally:
+        _directory_checked = time.monotonic()
+        _refreshing = False
+
+
+def _load_first() -> Optional[IdentifierDirectory]:
+    global _directory, _directory_checked, _retry_at
+    if time.monotonic() < _retry_at:
+        return None
+    with _directory_lock:
+        if _directory is not None or time.monotonic() < _retry_at:
+            return _directory
+        try:
+            _directory = IdentifierDirectory.from_db(os.getenv("DATABASE_URL"))
+        except Exception as e:
+            retry = _env_seconds("IDENTIFIER_DIRECTORY_RETRY_S", 60.0)
+            _retry_at = time.monotonic() + retry
+            logger.warning("Falha ao carregar diretório de identificadores (nova tentativa em %.0f s): %s",
+                           retry, e)
+            return None
+        _directory_checked = time.monotonic()
+        return _directory
+
+
+def get_identifier_directory() -> Optional[IdentifierDirectory]:
+    """
+    Obtém o diretório do processo, ou None se IDENTIFIER_DIRECTORY_ENGINE != memory
+    ou se a primeira carga falhou (resolução segue pelo SQL)
+
+    Depois da primeira carga, no máximo a cada IDENTIFIER_DIRECTORY_REFRESH_S
+    segundos uma thread compara a impressão digital da tabela e só então
+    recarrega; as consultas continuam no diretório vigente durante a recarga.
+    """
+    global _refreshing
+    if os.getenv("IDENTIFIER_DIRECTORY_ENGINE", "sql").lower() != "memory":
+        return None
+    directory = _directory
+    if directory is None:
+        return _load_first()
+
+    refresh = _env_seconds("IDENTIFIER_DIRECTORY_REFRESH_S", 300.0)
+    if refresh > 0 and not _refreshing and time.monotonic() - _directory_checked > refresh:
+        with _directory_lock:
+            if _refreshing:
+                return directory
+            _refreshing = True
+        threading.Thread(target=_refresh_if_changed, name="identifier-directory-refresh",
+                         daemon=True).start()
+    return directory
+
+
+def resolve_identifier(raw: str, dsn: Optional[str] = None) -> Optional[Dict]:
+    """
+    Resolve um identificador pelo diretório em memória ou, se desabilitado,
+    por resolve_identifier_v5() no banco
+
+    Returns:
+        Optional[Dict]: {source_table, codigo_material, tipo} ou None
+    """
+    if not raw:
+        return None
+    try:
+        directory = get_identifier_directory()
+        if directory is not None:
+            return directory.resolve(raw)
+
+        from src.utils.db_pool import connection
+        with connection(dsn) as conn:
+            with conn.cursor() as cur:
+                cur.execute(RESOLVE_SQL, (raw,))
+                row = cur.fetchone()
+    except Exception as e:
+        logger.warning("Falha ao resolver identificador %r: %s", raw, e)
+        return None
+    if not row:
+        return None
+    if isinstance(row, dict):
+        return dict(row)
+    return {"source_table": row[0], "codigo_material": row[1], "tipo": row[2]}
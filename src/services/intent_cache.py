@@ -0,0 +1,310 @@
+"""
+Cache Persistente de Intenções STIHL AI v5
+==========================================
+
+Guarda o resultado da análise de intenção do GPT-4 (SearchIntent em JSON)
+num SQLite local, separado do cache de resultados: a intenção de uma
+pergunta não muda com o catálogo e custa muito mais que a busca no banco.
+
+Funcionalidades:
+- Chave semântica (text_normalizer.canonical_query_key): grafias
+  diferentes da mesma pergunta compartilham uma única entrada
+- Persistência entre reinícios e entre workers do mesmo host (WAL)
+- Expiração por idade e despejo LRU acima do limite de entradas
+- Versão do prompt/modelo na entrada: mudar INTENT_CACHE_VERSION
+  invalida o conteúdo anterior
+- Pré-aquecimento a partir de consultas históricas (arquivo de texto ou
+  tabela search_analytics_v5)
+
+Configuração via ambiente:
+- INTENT_CACHE: "sqlite" habilita o cache (padrão) ou "off"
+- INTENT_CACHE_PATH: arquivo SQLite (padrão: instance/intent_cache.sqlite3)
+- INTENT_CACHE_MAX_ENTRIES: limite de entradas (padrão: 50000)
+- INTENT_CACHE_TTL_DAYS: idade máxima de uma entrada (padrão: 90)
+- INTENT_CACHE_VERSION: versão do prompt/modelo (padrão: "gpt-4:1")
+
+Uso (pré-aquecimento):
+    python -m src.services.intent_cache consultas.txt [--db]
+"""
+
+import os
+import sys
+import json
+import time
+import sqlite3
+import logging
+import threading
+from typing import Callable, Dict, Iterable, List, Optional
+
+from src.services.text_normalizer import canonical_query_key
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_PATH = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))),
+    "instance", "intent_cache.sqlite3",
+)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS intents (
+    cache_key TEXT PRIMARY KEY,
+    query TEXT NOT NULL,
+    intent TEXT NOT NULL,
+    version TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    last_used REAL NOT NULL,
+    hits INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS idx_intents_last_used ON intents(last_used);
+"""
+
+# Consultas mais frequentes registradas pelo motor legado (intelligent_search.py)
+# Eventos amostrados pesam 1 / sample_rate (ver services.analytics_sink)
+HISTORY_SQL = """
+    SELECT query, SUM(1.0 / sample_rate) AS n
+    FROM search_analytics_v5
+    WHERE query IS NOT NULL AND source IN ('search', 'legacy')
+    GROUP BY 1
+    ORDER BY n DESC
+    LIMIT %s
+"""
+
+
+class IntentCache:
+    """
+    Cache chave semântica -> intenção (dict) em SQLite.
+
+    Uma conexão por instância, serializada por lock; o despejo roda a cada
+    ``evict_every`` gravações e reduz o cache a 90% do limite.
+    """
+
+    def __init__(self, path: str = DEFAULT_PATH, max_entries: int = 50000,
+                 ttl_days: float = 90.0, version: str = "gpt-4:1", evict_every: int = 100):
+        self.path = path
+        self.max_entries = max_entries
+        self.ttl = ttl_days * 86400
+        self.version = version
+        self.evict_every = evict_every
+        if path != ":memory:":
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=5.0,
+                                     isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(SCHEMA)
+        self._lock = threading.Lock()
+        self._puts_since_evict = 0
+        self._stats = {"hits": 0, "misses": 0, "puts": 0, "evictions": 0, "errors": 0}
+
+    @staticmethod
+    def key(query: str) -> str:
+        return canonical_query_key(query)
+
+    def get(self, query: str) -> Optional[Dict]:
+        """Intenção gravada para a consulta (ou equivalente), ou None"""
+        key = self.key(query)
+        now = time.time()
+        try:
+            with self._lock:
+                row = self._conn.execute(
+                    "SELECT intent FROM intents WHERE cache_key = ? AND version = ? AND created_at > ?",
+                    (key, self.version, now - self.ttl),
+                ).fetchone()
+                if row:
+                    self._conn.execute(
+                        "UPDATE intents SET last_used = ?, hits = hits + 1 WHERE cache_key = ?",
+                        (now, key),
+                    )
+                    self._stats["hits"] += 1
+                else:
+                    self._stats["misses"] += 1
+        except sqlite3.Error as e:
+            self._stats["errors"] += 1
+            logger.warning("Falha ao ler cache de intenções: %s", e)
+            return None
+        return json.loads(row[0]) if row else None
+
+    def put(self, query: str, intent: Dict):
+        """Grava a intenção; a primeira grafia vista fica como exemplo"""
+        now = time.time()
+        try:
+            with self._lock:
+                self._conn.execute(
+                    """
+                    INSERT INTO intents (cache_key, query, intent, version, created_at, last_used)
+                    VALUES (?, ?, ?, ?, ?, ?)
+                    ON CONFLICT(cache_key) DO UPDATE SET
+                        intent = excluded.intent,
+                        version = excluded.version,
+                        created_at = excluded.created_at,
+                        last_used = excluded.last_used
+                    """,
+                    (self.key(query), query, json.dumps(intent, ensure_ascii=False),
+                     self.version, now, now),
+                )
+                self._stats["puts"] += 1
+                self._puts_since_evict += 1
+                if self._puts_since_evict >= self.evict_every:
+                    self._puts_since_evict = 0
+                    self._evict_locked(now)
+        except sqlite3.Error as e:
+            self._stats["errors"] += 1
+            logger.warning("Falha ao gravar cache de intenções: %s", e)
+
+    def _evict_locked(self, now: float) -> int:
+        removed = self._conn.execute(
+            "DELETE FROM intents WHERE created_at <= ? OR version <> ?",
+            (now - self.ttl, self.version),
+        ).rowcount
+        count = self._conn.execute("SELECT COUNT(*) FROM intents").fetchone()[0]
+        if count > self.max_entries:
+            removed += self._conn.execute(
+                """
+                DELETE FROM intents WHERE cache_key IN (
+                    SELECT cache_key FROM intents ORDER BY last_used LIMIT ?)
+                """,
+                (count - int(self.max_entries * 0.9),),
+            ).rowcount
+        self._stats["evictions"] += removed
+        return removed
+
+    def evict(self) -> int:
+        """Remove expiradas, de outra versão e, acima do limite, as menos usadas"""
+        with self._lock:
+            return self._evict_locked(time.time())
+
+    def prewarm(self, queries: Iterable[str], analyze: Callable[[str], Dict],
+                limit: Optional[int] = None) -> int:
+        """
+        Analisa e grava as consultas ainda ausentes do cache
+
+        Args:
+            queries: Consultas históricas, da mais para a menos frequente
+            analyze: Função consulta -> intenção (dict), ex.: o GPT-4
+            limit: Máximo de análises novas
+
+        Returns:
+            int: Número de intenções gravadas
+        """
+        done = 0
+        seen = set()
+        for query in queries:
+            query = (query or "").strip()
+            key = self.key(query) if query else None
+            if not key or key in seen:
+                continue
+            seen.add(key)
+            if self.get(query) is not None:
+                continue
+            try:
+                intent = analyze(query)
+            except Exception as e:
+                logger.warning("Pré-aquecimento: falha ao analisar %r: %s", query, e)
+                continue
+            self.put(query, intent)
+            done += 1
+            if limit is not None and done >= limit:
+                break
+        return done
+
+    def __len__(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM intents").fetchone()[0]
+
+    def stats(self) -> Dict:
+        stats = dict(self._stats)
+        lookups = stats["hits"] + stats["misses"]
+        stats.update({
+            "entries": len(self),
+            "max_entries": self.max_entries,
+            "version": self.version,
+            "path": self.path,
+            "hit_rate": round(stats["hits"] / lookups, 4) if lookups else 0.0,
+        })
+        return stats
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+def load_history_file(path: str) -> List[str]:
+    """Uma consulta por linha, ou JSONL com o campo "query" """
+    queries = []
+    with open(path, encoding="utf-8") as fh:
+        for line in fh:
+            line = line.strip()
+            if not line:
+                continue
+            if line.startswith("{"):
+                try:
+                    line = json.loads(line).get("query") or ""
+                except ValueError:
+                    pass
+            queries.append(line)
+    return queries
+
+
+def load_history_db(dsn: Optional[str] = None, limit: int = 5000) -> List[str]:
+    """Consultas mais frequentes do analytics de busca (search_analytics_v5), se existir"""
+    from src.utils.db_pool import connection
+    try:
+        with connection(dsn) as conn:
+            with conn.cursor() as cur:
+                cur.execute(HISTORY_SQL, (limit,))
+                return [row[0] for row in cur.fetchall()]
+    except Exception as e:
+        logger.warning("Histórico de consultas indisponível: %s", e)
+        return []
+
+
+_cache: Optional[IntentCache] = None
+_cache_lock = threading.Lock()
+
+
+def get_intent_cache() -> Optional[IntentCache]:
+    """
+    Obtém o cache do processo, ou None se INTENT_CACHE=off
+    """
+    global _cache
+    if os.getenv("INTENT_CACHE", "sqlite").lower() != "sqlite":
+        return None
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                try:
+                    _cache = IntentCache(
+                        path=os.getenv("INTENT_CACHE_PATH") or DEFAULT_PATH,
+                        max_entries=int(os.getenv("INTENT_CACHE_MAX_ENTRIES", 50000)),
+                        ttl_days=float(os.getenv("INTENT_CACHE_TTL_DAYS", 90)),
+                        version=os.getenv("INTENT_CACHE_VERSION", "gpt-4:1"),
+                    )
+                except (ValueError, sqlite3.Error, OSError) as e:
+                    logger.warning("Cache de intenções desabilitado: %s", e)
+                    return None
+    return _cache
+
+
+if __name__ == "__main__":
+    from dotenv import load_dotenv
+    from src.models.intelligent_search_v5 import IntelligentSearchV5
+
+    load_dotenv()
+    logging.basicConfig(level=logging.INFO)
+    args = [a for a in sys.argv[1:] if not a.startswith("--")]
+    history: List[str] = []
+    for path in args:
+        history.extend(load_history_file(path))
+    if "--db" in sys.argv:
+        history.extend(load_history_db(os.getenv("DATABASE_URL")))
+    if not history:
+        print("Uso: python -m src.services.intent_cache consultas.txt [--db]")
+        sys.exit(1)
+
+    cache = get_intent_cache()
+    if cache is None:
+        print("❌ INTENT_CACHE desabilitado")
+        sys.exit(1)
+    engine = IntelligentSearchV5(os.getenv("DATABASE_URL"))
+    added = engine.warm_intent_cache(history)
+    print(f"✅ {added} intenções gravadas ({len(cache)} no cache)")
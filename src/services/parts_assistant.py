@@ -1,11 +1,19 @@
-import os, re
+import os, re, logging
 from decimal import Decimal
 
-import psycopg2
+from src.utils.db_pool import connection
+from src.utils.metrics import stage
+from src.utils.tracing import annotate, traced
+from src.services.parts_catalog import get_catalog
+from src.services.identifier_directory import resolve_identifier
+from src.services.text_normalizer import MODEL_RE, canonical_model
+
+logger = logging.getLogger(__name__)
 
 DB_DSN = os.getenv("DATABASE_URL")
 CODE_RE = re.compile(r"\b\d{4}-\d{3}-\d{4}\b")
-MODEL_RE = re.compile(r"\b([A-Z]{2}\d{2,3})\b", re.I)
+EAN_RE = re.compile(r"\b\d{8,14}\b")
+CA_RE = re.compile(r"\bCA\s*:?\s*\d[\d.]{2,}\b", re.I)
 TYPE_WORDS = {"filtro", "carburador", "silenciador", "tampa", "luva"}
 SPEC_TERMS = [
     "de ar", "do ar",
@@ -16,7 +24,7 @@ SPEC_TERMS = [
 def _conn():
     if not DB_DSN:
         raise RuntimeError("DATABASE_URL não definido no ambiente")
-    return psycopg2.connect(DB_DSN, connect_timeout=5)
+    return connection(DB_DSN)
 
 def parse_query(q: str):
     s = (q or "").strip()
@@ -25,16 +33,35 @@ def parse_query(q: str):
     if m:
         code = m.group(0)
 
+    identifier = None
+    if not code:
+        m = CA_RE.search(s) or EAN_RE.search(s)
+        if m:
+            identifier = m.group(0)
+
     model = None
     m2 = MODEL_RE.search(s)
     if m2:
-        model = m2.group(1).upper()
+        model = canonical_model(m2.group(1))
 
     low = s.lower()
     part_type = next((w for w in TYPE_WORDS if w in low), None)
     spec = next((t for t in SPEC_TERMS if t in low), None)
 
-    return {"original": q, "normalized": s, "code": code, "model": model, "type": part_type, "spec": spec}
+    return {"original": q, "normalized": s, "code": code, "identifier": identifier,
+            "model": model, "type": part_type, "spec": spec, "redirected_from": None}
+
+def _resolve_identifier(ent):
+    """Código substituído, EAN ou CA -> código vigente da peça"""
+    raw = ent["code"] or ent["identifier"]
+    if not raw:
+        return
+    hit = resolve_identifier(raw, DB_DSN)
+    if not hit or hit["source_table"] != "pecas":
+        return
+    if hit["codigo_material"] != ent["code"]:
+        ent["code"] = hit["codigo_material"]
+        ent["redirected_from"] = raw
 
 def _format_price(v):
     if v is None:
@@ -43,11 +70,21 @@ def _format_price(v):
         v = float(v)
     return f"R$ {v:,.2f}".replace(",", "X").replace(".", ",").replace("X", ".")
 
+@traced("parts.fetch")
 def _fetch(ent, limit=50):
     """
     Busca na VIEW public.pecas_public para evitar dependência de colunas internas.
     Colunas retornadas: codigo_material, descricao, preco_real, modelos
+    Com PARTS_CATALOG_ENGINE=memory, atende pelo catálogo em memória.
     """
+    catalog = get_catalog()
+    if catalog is not None:
+        try:
+            annotate(source="memory")
+            return catalog.search(ent, limit)
+        except Exception as e:
+            logger.warning("Catálogo em memória indisponível, usando SQL: %s", e)
+
     sql = """
     SELECT
       codigo_material,
@@ -64,29 +101,33 @@ def _fetch(ent, limit=50):
         params.append(ent["code"])
 
     if ent["model"]:
-        sql += " AND modelos ILIKE %s"
-        params.append(f"%{ent['model']}%")
+        sql += """ AND codigo_material IN (
+            SELECT pc.codigo_material FROM public.product_compatibility_v5 pc
+            WHERE pc.modelo_canonico = %s AND pc.source_table = 'pecas')"""
+        params.append(ent["model"])
 
     if ent["type"]:
-        sql += " AND descricao ILIKE %s"
+        sql += " AND f_unaccent(descricao) ILIKE f_unaccent(%s)"
         params.append(f"%{ent['type']}%")
 
     if ent["spec"]:
-        sql += " AND (descricao ILIKE %s OR modelos ILIKE %s)"
+        sql += " AND (f_unaccent(descricao) ILIKE f_unaccent(%s) OR f_unaccent(modelos) ILIKE f_unaccent(%s))"
         params.extend([f"%{ent['spec']}%", f"%{ent['spec']}%"])
 
     # fallback: nenhuma pista? busca ampla no texto
     if len(params) == 0 and ent["normalized"]:
-        sql += " AND (descricao ILIKE %s OR modelos ILIKE %s)"
+        sql += " AND (f_unaccent(descricao) ILIKE f_unaccent(%s) OR f_unaccent(modelos) ILIKE f_unaccent(%s))"
         params.extend([f"%{ent['normalized']}%", f"%{ent['normalized']}%"])
 
     sql += " ORDER BY preco_real NULLS LAST, codigo_material LIMIT %s"
     params.append(limit)
 
+    annotate(source="sql")
     with _conn() as conn:
         with conn.cursor() as cur:
             cur.execute(sql, params)
             rows = cur.fetchall()
+    annotate(rows=len(rows))
 
     result = []
     for codigo, desc, preco, modelos in rows:
@@ -101,8 +142,12 @@ def _fetch(ent, limit=50):
     return result
 
 def search_and_format(q: str):
-    ent = parse_query(q or "")
-    items = _fetch(ent, limit=50)
+    with stage("intent_parse"):
+        ent = parse_query(q or "")
+        _resolve_identifier(ent)
+    # Catálogo em memória ou SQL: ambos contam como a etapa de consulta
+    with stage("db_query"):
+        items = _fetch(ent, limit=50)
 
     # Nenhum resultado
     if not items:
@@ -122,13 +167,18 @@ def search_and_format(q: str):
     # Um resultado
     if len(items) == 1:
         it = items[0]
+        redirect = (
+            f"**Código informado:** {ent['redirected_from']} → {it['codigo']}\n"
+            if ent["redirected_from"] else ""
+        )
         texto = (
             "✅ **PEÇA ENCONTRADA**\n\n"
             f"**Código:** {it['codigo']}\n"
             f"**Descrição:** {it['descricao']}\n"
             f"**Valor:** {_format_price(it['preco'])}\n"
             f"**Estoque:** não informado\n"
-            f"**Compatibilidade:** {it['modelos'] or '-'}\n\n"
+            f"**Compatibilidade:** {it['modelos'] or '-'}\n"
+            f"{redirect}\n"
             f"---\n*Consulta processada: \"{q}\" → \"{ent['normalized']}\"*"
         )
         return {"ok": True, "text": texto, "items": items[:1]}
@@ -0,0 +1,362 @@
+"""
+Catálogo de Peças em Memória STIHL AI v5
+========================================
+
+Motor de consulta em memória para o caminho do assistente de peças
+(Telegram / /api/search/assistant), substituindo as varreduras ILIKE em
+``public.pecas_public`` por índices invertidos.
+
+Funcionalidades:
+- Snapshot colunar imutável, pré-ordenado por (preço NULLS LAST, código)
+- Índices invertidos: tokens da descrição, modelos canônicos e códigos
+- Carga a partir do banco (pecas_public) ou de csv_data/pecas.csv
+- Recarga atômica em segundo plano quando a fonte muda
+
+Configuração via ambiente:
+- PARTS_CATALOG_ENGINE: "memory" habilita o motor (padrão: "sql")
+- PARTS_CATALOG_SOURCE: "db" ou "csv" (padrão: db se DATABASE_URL definido)
+- PARTS_CATALOG_CSV: caminho do CSV (padrão: csv_data/pecas.csv)
+- PARTS_CATALOG_REFRESH_S: intervalo de verificação de mudanças (padrão: 300)
+
+O campo ``qtde_min`` não é carregado (ver RELEASE_NOTES).
+"""
+
+import os
+import re
+import csv
+import math
+import time
+import logging
+import threading
+from array import array
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from src.services.text_normalizer import canonical_model, extract_models, fold_text
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CSV_PATH = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))),
+    "csv_data", "pecas.csv",
+)
+
+TOKEN_RE = re.compile(r"[a-z0-9]+")
+
+FETCH_SQL = """
+    SELECT codigo_material, descricao, preco_real, COALESCE(modelos, '') AS modelos
+    FROM public.pecas_public
+"""
+
+# Contadores de escrita da tabela base: mudam a cada importação
+FINGERPRINT_SQL = """
+    SELECT COALESCE(n_tup_ins + n_tup_upd + n_tup_del, 0), n_live_tup
+    FROM pg_stat_user_tables
+    WHERE relname = 'pecas'
+"""
+
+
+class CatalogSnapshot:
+    """
+    Snapshot imutável do catálogo de peças.
+
+    As linhas ficam na ordem final de resposta, de modo que as listas de
+    ocorrências (ids crescentes) já saem ordenadas por preço e código.
+    """
+
+    __slots__ = (
+        "codes", "descs", "prices", "modelos", "desc_folded", "haystack",
+        "code_index", "token_index", "model_index", "version", "loaded_at",
+        "_substring_cache", "_lock",
+    )
+
+    def __init__(self, rows: Iterable[Tuple], version=None):
+        ordered = sorted(
+            rows,
+            key=lambda r: (r[2] is None, r[2] if r[2] is not None else 0.0, r[0]),
+        )
+        self.codes: List[str] = []
+        self.descs: List[str] = []
+        self.prices = array("d")
+        self.modelos: List[str] = []
+        self.desc_folded: List[str] = []
+        self.haystack: List[str] = []
+        self.code_index: Dict[str, int] = {}
+        token_lists: Dict[str, List[int]] = {}
+        model_lists: Dict[str, List[int]] = {}
+
+        for i, (codigo, descricao, preco, modelos) in enumerate(ordered):
+            descricao = descricao or ""
+            modelos = modelos or ""
+            desc_folded = fold_text(descricao)
+            self.codes.append(codigo)
+            self.descs.append(descricao)
+            self.prices.append(float(preco) if preco is not None else math.nan)
+            self.modelos.append(modelos)
+            self.desc_folded.append(desc_folded)
+            # Separador impede que um termo case atravessando os dois campos
+            self.haystack.append(desc_folded + "\n" + fold_text(modelos))
+            self.code_index[codigo] = i
+
+            for tok in set(TOKEN_RE.findall(desc_folded)):
+                token_lists.setdefault(tok, []).append(i)
+            for model in extract_models(modelos):
+                model_lists.setdefault(model, []).append(i)
+
+        self.token_index = {k: array("I", v) for k, v in token_lists.items()}
+        self.model_index = {k: array("I", v) for k, v in model_lists.items()}
+        self.version = version
+        self.loaded_at = time.time()
+        self._substring_cache: Dict[str, array] = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.codes)
+
+    def _ids_with_substring(self, term: str) -> array:
+        """Ids cuja descrição contém o termo (via vocabulário do índice)"""
+        cached = self._substring_cache.get(term)
+        if cached is not None:
+            return cached
+
+        words = term.split()
+        if len(words) == 1:
+            ids = set()
+            for tok, postings in self.token_index.items():
+                if term in tok:
+                    ids.update(postings)
+            result = array("I", sorted(ids))
+        else:
+            result = array("I", (i for i, d in enumerate(self.desc_folded) if term in d))
+
+        with self._lock:
+            if len(self._substring_cache) < 1024:
+                self._substring_cache[term] = result
+        return result
+
+    def _row(self, i: int) -> Dict:
+        preco = self.prices[i]
+        return {
+            "codigo": self.codes[i],
+            "descricao": self.descs[i],
+            "preco": None if math.isnan(preco) else preco,
+            "modelos": self.modelos[i],
+        }
+
+    def search(self, ent: Dict, limit: int = 50) -> List[Dict]:
+        """
+        Executa a consulta do assistente sobre o snapshot
+
+        Mesma semântica de ``parts_assistant._fetch``: filtros por código
+        exato, modelo, tipo de peça (descrição) e especificação (descrição
+        ou modelos), com busca ampla no texto quando não há pistas.
+
+        Args:
+            ent: Entidades de parse_query (code, model, type, spec, normalized)
+            limit: Número máximo de itens
+
+        Returns:
+            List[Dict]: Itens {codigo, descricao, preco, modelos}
+        """
+        candidates: Optional[Iterable[int]] = None
+
+        def narrow(current, postings):
+            if current is None:
+                return postings
+            keep = set(postings)
+            return [i for i in current if i in keep]
+
+        if ent.get("code"):
+            idx = self.code_index.get(ent["code"])
+            candidates = [idx] if idx is not None else []
+
+        if ent.get("model") and candidates != []:
+            candidates = narrow(candidates, self.model_index.get(canonical_model(ent["model"]), ()))
+
+        if ent.get("type") and candidates != []:
+            candidates = narrow(candidates, self._ids_with_substring(fold_text(ent["type"])))
+
+        term = None
+        if ent.get("spec"):
+            term = fold_text(ent["spec"])
+        elif candidates is None and ent.get("normalized"):
+            term = fold_text(ent["normalized"])
+
+        if candidates is None:
+            candidates = range(len(self.codes))
+
+        result = []
+        for i in candidates:
+            if term is not None and term not in self.haystack[i]:
+                continue
+            result.append(self._row(i))
+            if len(result) >= limit:
+                break
+        return result
+
+
+class PartsCatalog:
+    """
+    Motor de catálogo com troca atômica de snapshot.
+
+    A primeira consulta carrega o snapshot de forma síncrona; depois disso,
+    a verificação de mudanças e a recarga rodam em thread de fundo e as
+    consultas continuam atendidas pelo snapshot anterior até a troca.
+    """
+
+    def __init__(self, source: str = "csv", dsn: Optional[str] = None,
+                 csv_path: Optional[str] = None, refresh_interval: float = 300.0):
+        if source not in ("db", "csv"):
+            raise ValueError("source deve ser 'db' ou 'csv'")
+        if source == "db" and not dsn:
+            raise RuntimeError("DATABASE_URL não definido no ambiente")
+        self.source = source
+        self.dsn = dsn
+        self.csv_path = csv_path or DEFAULT_CSV_PATH
+        self.refresh_interval = refresh_interval
+
+        self._snapshot: Optional[CatalogSnapshot] = None
+        self._load_lock = threading.Lock()
+        self._last_check = 0.0
+        self._refreshing = False
+        self._stats = {"loads": 0, "load_failures": 0, "queries": 0, "last_load_ms": 0.0}
+
+    # ---- carga ----
+
+    def _fingerprint(self):
+        if self.source == "csv":
+            st = os.stat(self.csv_path)
+            return (st.st_mtime_ns, st.st_size)
+        from src.utils.db_pool import connection
+        with connection(self.dsn) as conn:
+            with conn.cursor() as cur:
+                cur.execute(FINGERPRINT_SQL)
+                row = cur.fetchone()
+        return tuple(row) if row else None
+
+    def _read_rows(self) -> List[Tuple]:
+        if self.source == "csv":
+            rows = []
+            with open(self.csv_path, encoding="utf-8", newline="") as fh:
+                for r in csv.DictReader(fh):
+                    preco = r.get("preco_real")
+                    rows.append((
+                        r["codigo_material"].strip(),
+                        r.get("descricao") or "",
+                        float(preco) if preco not in (None, "") else None,
+                        r.get("modelos") or "",
+                    ))
+            return rows
+        from src.utils.db_pool import connection
+        with connection(self.dsn) as conn:
+            with conn.cursor() as cur:
+                cur.execute(FETCH_SQL)
+                return [
+                    (codigo, desc, float(preco) if preco is not None else None, modelos)
+                    for codigo, desc, preco, modelos in cur.fetchall()
+                ]
+
+    def _load(self) -> CatalogSnapshot:
+        start = time.perf_counter()
+        try:
+            version = self._fingerprint()
+            snapshot = CatalogSnapshot(self._read_rows(), version=version)
+        except Exception:
+            self._stats["load_failures"] += 1
+            raise
+        self._snapshot = snapshot
+        self._last_check = time.monotonic()
+        self._stats["loads"] += 1
+        self._stats["last_load_ms"] = round((time.perf_counter() - start) * 1000, 2)
+        logger.info("Catálogo de peças carregado: %d itens (%s)", len(snapshot), self.source)
+        return snapshot
+
+    def reload(self) -> CatalogSnapshot:
+        """Recarrega a fonte e troca o snapshot atomicamente"""
+        with self._load_lock:
+            return self._load()
+
+    def _refresh_if_changed(self):
+        try:
+            current = self._snapshot
+            if current is None or self._fingerprint() != current.version:
+                self.reload()
+        except Exception as e:
+            logger.warning("Falha ao recarregar catálogo de peças: %s", e)
+        finally:
+            self._last_check = time.monotonic()
+            self._refreshing = False
+
+    def _maybe_refresh(self):
+        if self.refresh_interval <= 0 or self._refreshing:
+            return
+        if time.monotonic() - self._last_check < self.refresh_interval:
+            return
+        self._refreshing = True
+        threading.Thread(target=self._refresh_if_changed, name="parts-catalog-refresh",
+                         daemon=True).start()
+
+    @property
+    def snapshot(self) -> CatalogSnapshot:
+        snapshot = self._snapshot
+        if snapshot is None:
+            with self._load_lock:
+                snapshot = self._snapshot or self._load()
+        else:
+            self._maybe_refresh()
+        return snapshot
+
+    # ---- consulta ----
+
+    def search(self, ent: Dict, limit: int = 50) -> List[Dict]:
+        """Consulta o snapshot vigente (ver CatalogSnapshot.search)"""
+        snapshot = self.snapshot
+        self._stats["queries"] += 1
+        return snapshot.search(ent, limit)
+
+    def get(self, codigo: str) -> Optional[Dict]:
+        """Busca uma peça pelo código exato"""
+        snapshot = self.snapshot
+        idx = snapshot.code_index.get(codigo)
+        return snapshot._row(idx) if idx is not None else None
+
+    def stats(self) -> Dict:
+        """Estatísticas do motor (tamanho, vocabulário, cargas)"""
+        snapshot = self._snapshot
+        stats = dict(self._stats)
+        stats.update({
+            "source": self.source,
+            "items": len(snapshot) if snapshot else 0,
+            "description_tokens": len(snapshot.token_index) if snapshot else 0,
+            "models": len(snapshot.model_index) if snapshot else 0,
+            "loaded_at": snapshot.loaded_at if snapshot else None,
+        })
+        return stats
+
+
+_catalog: Optional[PartsCatalog] = None
+_catalog_lock = threading.Lock()
+
+
+def get_catalog() -> Optional[PartsCatalog]:
+    """
+    Obtém o motor do processo, ou None se PARTS_CATALOG_ENGINE != memory
+    """
+    global _catalog
+    if os.getenv("PARTS_CATALOG_ENGINE", "sql").lower() != "memory":
+        return None
+    if _catalog is None:
+        with _catalog_lock:
+            if _catalog is None:
+                dsn = os.getenv("DATABASE_URL")
+                source = os.getenv("PARTS_CATALOG_SOURCE") or ("db" if dsn else "csv")
+                try:
+                    refresh = float(os.getenv("PARTS_CATALOG_REFRESH_S", 300))
+                except ValueError:
+                    refresh = 300.0
+                _catalog = PartsCatalog(
+                    source=source,
+                    dsn=dsn,
+                    csv_path=os.getenv("PARTS_CATALOG_CSV") or None,
+                    refresh_interval=refresh,
+                )
+    return _catalog
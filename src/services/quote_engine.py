@@ -0,0 +1,308 @@
+"""
+Motor de Orçamentos em Lote STIHL AI v5
+=======================================
+
+Precifica listas de (código, quantidade) de uma só vez: uma consulta
+(= ANY) traz preço, lote mínimo, IPI e NCM de todos os itens e os
+coeficientes fiscais vêm pré-calculados do motor fiscal
+(``src.services.tax_engine``).
+
+Regras de cálculo (por item):
+- Quantidade arredondada para cima ao múltiplo do lote mínimo (qtde_min)
+- IPI: subtotal × ipi%
+- Diferencial de ICMS (tabela_dif_icms_f_cd_*): (subtotal + IPI) × taxa do
+  NCM para o grupo da UF de destino, na tabela do CD de faturamento
+- ST (subst_tributaria): base (subtotal + IPI) × (1 + MVA da UF) ×
+  alíquota interna da UF de destino, menos o ICMS próprio da operação
+
+O lote mínimo (``qtde_min``) é campo sensível (ver RELEASE_NOTES): entra
+no cálculo, mas não sai no orçamento — só a quantidade faturada.
+
+Entrada e saída em JSON (listas de dicts) ou CSV (``read_csv_lines`` e
+``iter_quote_csv``).
+
+Configuração via ambiente:
+- QUOTE_MAX_LINES: linhas por orçamento (padrão: 5000)
+- TAX_DEFAULT_CD / TAX_ENGINE_*: ver tax_engine
+"""
+
+import io
+import os
+import csv
+import math
+import time
+import logging
+import threading
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from src.services.tax_engine import (
+    ICMS_INTERNAL_RATES, PRODUCT_TABLES, TaxEngine, apply_coefficients, build_tax_engine,
+    get_tax_engine, normalize_ncm, resolve_cd,
+)
+from src.services.text_normalizer import fold_text, material_code
+
+logger = logging.getLogger(__name__)
+
+# Um único acesso para todos os códigos do orçamento
+PRODUCTS_SQL = " UNION ALL ".join(
+    f"""SELECT '{table}' AS source_table, codigo_material::TEXT AS codigo_material,
+               descricao::TEXT AS descricao, preco_real, qtde_min, ipi,
+               ncm_classif_fiscal::TEXT AS ncm
+        FROM {table} WHERE codigo_material = ANY(%(codes)s)"""
+    for table in PRODUCT_TABLES
+)
+
+CODE_HEADERS = ("codigo_material", "codigo", "cod_material", "code", "sku")
+QTY_HEADERS = ("quantidade", "qtde", "qtd", "quant", "qty", "quantity")
+
+CSV_FIELDS = (
+    "linha", "codigo_material", "descricao", "status", "quantidade_solicitada",
+    "quantidade", "lote_ajustado", "preco_unitario", "subtotal", "ipi",
+    "icms_difal", "st", "total",
+)
+
+
+class QuoteError(ValueError):
+    """Orçamento inválido (UF desconhecida, linhas demais, CSV ilegível)"""
+
+
+def normalize_code(value) -> str:
+    raw = str(value or "").strip()
+    return material_code(raw) or raw.upper()
+
+
+def parse_quantity(value) -> Optional[float]:
+    """"10", "2,5" e 3 -> número positivo; None se inválida"""
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        number = float(value)
+    else:
+        text = str(value or "").strip().replace(",", ".")
+        try:
+            number = float(text)
+        except ValueError:
+            return None
+    return number if number > 0 and math.isfinite(number) else None
+
+
+def build_quote(lines: List[Tuple[str, object]], products: Dict[str, Dict],
+                taxes: TaxEngine, uf: str, cd: str) -> Dict:
+    """
+    Calcula o orçamento sem acesso ao banco
+
+    Args:
+        lines: (código, quantidade) na ordem do pedido
+        products: código -> {descricao, preco_real, qtde_min, ipi, ncm}
+        taxes: Motor fiscal
+        uf: UF de destino
+        cd: CD de faturamento (chave de ICMS_DIF_TABLES)
+
+    Returns:
+        Dict: {"itens": [...], "resumo": {...}}
+    """
+    items = []
+    totals = dict.fromkeys(("subtotal", "ipi", "icms_difal", "st", "total"), 0.0)
+    ok = 0
+    for number, (raw_code, raw_qty) in enumerate(lines, start=1):
+        code = normalize_code(raw_code)
+        qty = parse_quantity(raw_qty)
+        product = products.get(code)
+        item = {"linha": number, "codigo_material": code,
+                "descricao": product.get("descricao") if product else None,
+                "quantidade_solicitada": raw_qty}
+        if product is None:
+            items.append({**item, "status": "nao_encontrado"})
+            continue
+        if qty is None:
+            items.append({**item, "status": "quantidade_invalida"})
+            continue
+        price = product.get("preco_real")
+        if price is None:
+            items.append({**item, "status": "sem_preco"})
+            continue
+
+        lot = product.get("qtde_min") or 1
+        quantity = math.ceil(qty / lot - 1e-9) * lot
+        subtotal = round(price * quantity, 2)
+        coefficients = taxes.coefficients(code, uf, cd)
+        if coefficients is None:
+            coefficients = taxes.coefficients_for(
+                uf, cd, product.get("ipi"), product.get("ncm"),
+                code in taxes.tables.st_codes, product.get("descricao") or "")
+        values = apply_coefficients(subtotal, coefficients)
+
+        items.append({
+            **item,
+            "status": "ok",
+            "quantidade": int(quantity) if float(quantity).is_integer() else quantity,
+            "lote_ajustado": quantity != qty,
+            "preco_unitario": round(price, 2),
+            "subtotal": subtotal,
+            "ipi": values["ipi"],
+            "icms_difal": values["icms_difal"],
+            "st": values["st"],
+            "total": values["total"],
+        })
+        ok += 1
+        for key in totals:
+            totals[key] += items[-1][key]
+
+    summary = {"uf": uf, "cd": cd, "itens": len(items), "itens_ok": ok}
+    summary.update({key: round(value, 2) for key, value in totals.items()})
+    return {"itens": items, "resumo": summary}
+
+
+def read_csv_lines(stream) -> List[Tuple[str, str]]:
+    """
+    Lê (código, quantidade) de um CSV com ou sem cabeçalho; separador
+    vírgula, ponto e vírgula ou tabulação
+
+    Raises:
+        QuoteError: Cabeçalho sem coluna de código ou de quantidade
+    """
+    text = stream.read() if hasattr(stream, "read") else stream
+    if isinstance(text, bytes):
+        text = text.decode("utf-8-sig")
+    text = text.lstrip("\ufeff")
+    if not text.strip():
+        return []
+    try:
+        dialect = csv.Sniffer().sniff(text[:4096], delimiters=",;\t")
+    except csv.Error:
+        dialect = csv.excel
+    rows = [r for r in csv.reader(io.StringIO(text), dialect) if any(c.strip() for c in r)]
+
+    code_col, qty_col = 0, 1
+    header = [fold_text(c).strip().replace(" ", "_") for c in rows[0]]
+    if len(rows[0]) < 2 or parse_quantity(rows[0][1]) is None:
+        code_col = next((i for i, h in enumerate(header) if h in CODE_HEADERS), None)
+        qty_col = next((i for i, h in enumerate(header) if h in QTY_HEADERS), None)
+        if code_col is None or qty_col is None:
+            raise QuoteError("CSV precisa das colunas de código e quantidade")
+        rows = rows[1:]
+    return [(r[code_col].strip() if len(r) > code_col else "",
+             r[qty_col].strip() if len(r) > qty_col else "") for r in rows]
+
+
+def iter_quote_csv(quote: Dict, delimiter: str = ",") -> Iterator[str]:
+    """Orçamento em CSV, linha a linha (para resposta em streaming)"""
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=CSV_FIELDS, delimiter=delimiter,
+                            extrasaction="ignore", lineterminator="\n")
+
+    def flush():
+        value = buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+        return value
+
+    writer.writeheader()
+    yield flush()
+    for item in quote["itens"]:
+        writer.writerow(item)
+        yield flush()
+    summary = quote["resumo"]
+    writer.writerow({"linha": "TOTAL", "descricao": f"UF {summary['uf']} / CD {summary['cd'].upper()}",
+                     **{k: summary[k] for k in ("subtotal", "ipi", "icms_difal", "st", "total")}})
+    yield flush()
+
+
+class QuoteEngine:
+    """
+    Orçamentos contra o banco: produtos por consulta única e coeficientes
+    fiscais do motor fiscal do processo.
+    """
+
+    def __init__(self, dsn: Optional[str] = None, max_lines: int = 5000,
+                 taxes: Optional[TaxEngine] = None):
+        self.dsn = dsn
+        self.max_lines = max_lines
+        self._taxes = taxes
+        self._lock = threading.Lock()
+        self._stats = {"quotes": 0, "lines": 0, "last_quote_ms": 0.0}
+
+    def taxes(self) -> TaxEngine:
+        """Motor fiscal injetado, o do processo, ou (TAX_ENGINE=off) um local a partir do CSV"""
+        if self._taxes is not None:
+            return self._taxes
+        engine = get_tax_engine()
+        if engine is not None:
+            return engine
+        with self._lock:
+            if self._taxes is None:
+                self._taxes = build_tax_engine("csv", default_cd=os.getenv("TAX_DEFAULT_CD", "sp").lower())
+        return self._taxes
+
+    def fetch_products(self, codes: List[str]) -> Dict[str, Dict]:
+        """Preço, lote mínimo, IPI e NCM de todos os códigos numa consulta"""
+        if not codes:
+            return {}
+        from psycopg2.extras import RealDictCursor
+        from src.utils.db_pool import connection
+        products: Dict[str, Dict] = {}
+        with connection(self.dsn, cursor_factory=RealDictCursor) as conn:
+            with conn.cursor() as cur:
+                cur.execute(PRODUCTS_SQL, {"codes": codes})
+                for row in cur.fetchall():
+                    products.setdefault(row["codigo_material"], {
+                        "descricao": row["descricao"],
+                        "preco_real": float(row["preco_real"]) if row["preco_real"] is not None else None,
+                        "qtde_min": float(row["qtde_min"]) if row["qtde_min"] else None,
+                        "ipi": float(row["ipi"]) if row["ipi"] is not None else 0.0,
+                        "ncm": normalize_ncm(row["ncm"]),
+                    })
+        return products
+
+    def resolve_cd(self, uf: str, cd: Optional[str] = None) -> str:
+        try:
+            return resolve_cd(uf, cd, self.taxes().default_cd)
+        except ValueError as e:
+            raise QuoteError(str(e))
+
+    def quote(self, lines: List[Tuple[str, object]], uf: str, cd: Optional[str] = None) -> Dict:
+        """
+        Orçamento completo para a UF de destino
+
+        Raises:
+            QuoteError: UF/CD desconhecidos ou linhas acima do limite
+        """
+        uf = (uf or "").strip().upper()
+        if uf not in ICMS_INTERNAL_RATES:
+            raise QuoteError(f"UF desconhecida: {uf or '(vazia)'}")
+        if len(lines) > self.max_lines:
+            raise QuoteError(f"Máximo de {self.max_lines} linhas por orçamento")
+        cd = self.resolve_cd(uf, cd)
+
+        start = time.perf_counter()
+        codes = sorted({normalize_code(code) for code, _ in lines if code})
+        quote = build_quote(lines, self.fetch_products(codes), self.taxes(), uf, cd)
+        elapsed = round((time.perf_counter() - start) * 1000, 2)
+        quote["resumo"]["tempo_ms"] = elapsed
+        with self._lock:
+            self._stats["quotes"] += 1
+            self._stats["lines"] += len(lines)
+            self._stats["last_quote_ms"] = elapsed
+        return quote
+
+    def stats(self) -> Dict:
+        stats = dict(self._stats)
+        taxes = self._taxes or get_tax_engine()
+        stats["taxes"] = taxes.stats() if taxes else None
+        return stats
+
+
+_engine: Optional[QuoteEngine] = None
+_engine_lock = threading.Lock()
+
+
+def get_quote_engine() -> QuoteEngine:
+    """Obtém o motor de orçamentos do processo"""
+    global _engine
+    if _engine is None:
+        with _engine_lock:
+            if _engine is None:
+                try:
+                    max_lines = int(os.getenv("QUOTE_MAX_LINES", 5000))
+                except ValueError:
+                    max_lines = 5000
+                _engine = QuoteEngine(dsn=os.getenv("DATABASE_URL"), max_lines=max_lines)
+    return _engine
@@ -0,0 +1,464 @@
+"""
+Motor Fiscal em Memória STIHL AI v5
+===================================
+
+Pré-calcula, para cada produto do catálogo, os coeficientes de IPI,
+diferencial de ICMS (tabela_dif_icms_f_cd_*) e ST (subst_tributaria) por
+UF de destino e CD de faturamento. O preço final numa UF sai de uma
+consulta a dicionário, sem acesso ao banco nem varredura de categorias.
+
+Funcionalidades:
+- NCM do produto (ncm_classif_fiscal) -> linha da tabela de diferencial;
+  NCM com mais de uma linha é desempatado pela descrição do produto
+  (uma vez, na construção)
+- Produtos com o mesmo perfil fiscal (NCM/linha, IPI, ST) compartilham os
+  coeficientes: memória proporcional ao número de perfis, não de produtos
+- ``price`` para um código e ``coefficients_for`` para dados avulsos
+  (usado pelo motor de orçamentos)
+- Construído na inicialização da app; recarga em segundo plano
+
+Cálculo, para um valor p (preço × quantidade):
+- IPI = p × ipi%
+- Diferencial de ICMS = (p + IPI) × taxa do NCM para o grupo da UF
+- ST = (p + IPI) × (1 + MVA da UF) × alíquota interna da UF − ICMS próprio
+
+Configuração via ambiente:
+- TAX_ENGINE: "memory" habilita o motor (padrão) ou "off"
+- TAX_ENGINE_SOURCE: "db" ou "csv" (padrão: db se DATABASE_URL definido)
+- TAX_DEFAULT_CD: CD de faturamento para UFs sem tabela própria (padrão: sp)
+- TAX_ENGINE_REFRESH_S: intervalo de recarga (padrão: 3600)
+"""
+
+import os
+import re
+import csv
+import time
+import logging
+import threading
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from src.services.catalog_stats import PRODUCT_CSV_DIRS, sheet_path
+from src.services.text_normalizer import fold_text, material_code
+
+logger = logging.getLogger(__name__)
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+TAX_CSV_DIR = os.path.join(ROOT_DIR, "csv_outputs_v5")
+
+# Alíquotas internas modais de ICMS (2024), usadas no cálculo da ST
+ICMS_INTERNAL_RATES = {
+    "AC": 0.19, "AL": 0.19, "AM": 0.20, "AP": 0.18, "BA": 0.205, "CE": 0.20, "DF": 0.20,
+    "ES": 0.17, "GO": 0.19, "MA": 0.22, "MG": 0.18, "MS": 0.17, "MT": 0.17, "PA": 0.19,
+    "PB": 0.20, "PE": 0.205, "PI": 0.21, "PR": 0.195, "RJ": 0.22, "RN": 0.18, "RO": 0.195,
+    "RR": 0.20, "RS": 0.17, "SC": 0.17, "SE": 0.19, "SP": 0.18, "TO": 0.20,
+}
+UFS = tuple(sorted(ICMS_INTERNAL_RATES))
+UF_INDEX = {uf: i for i, uf in enumerate(UFS)}
+
+# Saídas de S/SE (exceto ES) para N/NE/CO/ES pagam 7%; as demais, 12%
+SOUTH_SOUTHEAST = {"PR", "RS", "SC", "MG", "RJ", "SP"}
+
+# CD de faturamento -> (tabela, UF -> coluna, coluna das demais UFs)
+ICMS_DIF_TABLES = {
+    "sp": ("tabela_dif_icms_f_cd_sp",
+           {"SP": "sp", **{uf: "sc_pr_rs_mg_rj" for uf in ("SC", "PR", "RS", "MG", "RJ")}},
+           "demais"),
+    "rs": ("tabela_dif_icms_f_cd_rs",
+           {"RS": "rs", **{uf: "sc_pr_sp_mg_rj" for uf in ("SC", "PR", "SP", "MG", "RJ")}},
+           "demais"),
+    "pa": ("tabela_dif_icms_f_cd_pa", {"PA": "pa"}, "demais"),
+}
+
+PRODUCT_TABLES = (
+    "ms", "rocadeiras_e_impl", "produtos_a_bateria", "pecas", "acessorios",
+    "sabres_correntes_pinhoes_limas", "ferramentas", "epis",
+)
+
+PRODUCTS_TAX_SQL = " UNION ALL ".join(
+    f"""SELECT codigo_material::TEXT, descricao::TEXT, ipi, ncm_classif_fiscal::TEXT
+        FROM {table}"""
+    for table in PRODUCT_TABLES
+)
+
+UF_RE = re.compile(r"\b[A-Z]{2}\b")
+TOKEN_RE = re.compile(r"[a-z0-9]+")
+LABEL_STOPWORDS = {"a", "de", "do", "da", "e", "para", "com"}
+
+# (IPI, diferencial de ICMS, fator de ST sobre a base, ICMS próprio): ver apply_coefficients
+Coefficients = Tuple[float, float, float, float]
+
+
+def normalize_ncm(value) -> Optional[str]:
+    """84678100, "84678100.0" e Decimal("84678100.00") -> "84678100" """
+    if value is None or value == "":
+        return None
+    digits = str(value).strip().split(".")[0]
+    return digits if digits.isdigit() else None
+
+
+def _rate(value) -> float:
+    try:
+        return float(value) if value not in (None, "") else 0.0
+    except (TypeError, ValueError):
+        return 0.0
+
+
+def _tokens(text: str) -> set:
+    """Palavras (sem números e sem plural) para casar descrição e rótulo da planilha"""
+    return {t.rstrip("s") for t in TOKEN_RE.findall(fold_text(text or ""))
+            if not t.isdigit() and t not in LABEL_STOPWORDS}
+
+
+def interstate_rate(origin: str, destination: str) -> float:
+    if origin in SOUTH_SOUTHEAST and destination not in SOUTH_SOUTHEAST:
+        return 0.07
+    return 0.12
+
+
+def normalize_uf(uf) -> Optional[str]:
+    """UF válida em maiúsculas, ou None"""
+    uf = str(uf or "").strip().upper()
+    return uf if uf in UF_INDEX else None
+
+
+def resolve_cd(uf: str, cd: Optional[str] = None, default_cd: str = "sp") -> str:
+    """CD informado; senão o da própria UF, se houver tabela; senão o padrão"""
+    cd = (cd or "").lower() or (uf.lower() if uf.lower() in ICMS_DIF_TABLES else default_cd)
+    if cd not in ICMS_DIF_TABLES:
+        raise ValueError(f"CD desconhecido: {cd}")
+    return cd
+
+
+class TaxTables:
+    """
+    Tabelas fiscais da planilha: linhas de diferencial de ICMS por (CD, NCM)
+    e MVA de ST por grupo de UF.
+    """
+
+    def __init__(self, icms_rows: Dict[str, Iterable[Dict]], st_rows: Iterable[Dict]):
+        # cd -> ncm -> [(tokens do rótulo, coluna -> taxa)], na ordem da planilha
+        self.icms: Dict[str, Dict[str, List[Tuple[set, Dict[str, float]]]]] = {}
+        for cd, rows in icms_rows.items():
+            _, columns, default = ICMS_DIF_TABLES[cd]
+            names = set(columns.values()) | {default}
+            by_ncm: Dict[str, List] = {}
+            for row in rows:
+                ncm = normalize_ncm(row.get("classificacao_fiscal"))
+                if ncm:
+                    by_ncm.setdefault(ncm, []).append((
+                        _tokens(row.get("produto_atualizado_novembro_2023")),
+                        {name: _rate(row.get(name)) for name in names},
+                    ))
+            self.icms[cd] = by_ncm
+
+        self.st_codes: set = set()
+        self.st_internal: Dict[str, float] = {}
+        self.st_mva: Dict[str, float] = {}
+        for row in st_rows:
+            label = str(row.get("cod_material") or "").strip()
+            if material_code(label):
+                self.st_codes.add(material_code(label))
+                continue
+            # Linhas de MVA: "AC/AP/ES/.../RS" -> 0.9435; "SP e RS (Operações Internas)"
+            mva = _rate(row.get("descricao"))
+            if not label or not mva:
+                continue
+            target = self.st_internal if "intern" in fold_text(label) else self.st_mva
+            for uf in UF_RE.findall(label.upper()):
+                target.setdefault(uf, mva)
+
+    def icms_row(self, cd: str, ncm: Optional[str], description: str = "") -> Optional[int]:
+        """
+        Índice da linha do NCM que vale para o produto: a de maior
+        sobreposição com a descrição; empate (ou sem descrição) -> a primeira,
+        que na planilha é a categoria principal
+        """
+        rows = self.icms.get(cd, {}).get(ncm or "")
+        if not rows:
+            return None
+        if len(rows) == 1 or not description:
+            return 0
+        words = _tokens(description)
+        best, best_score = 0, 0
+        for i, (label, _) in enumerate(rows):
+            score = len(label & words)
+            if score > best_score:
+                best, best_score = i, score
+        return best
+
+    def icms_rate(self, cd: str, ncm: Optional[str], uf: str, row: Optional[int] = 0) -> float:
+        rows = self.icms.get(cd, {}).get(ncm or "")
+        if not rows or row is None:
+            return 0.0
+        _, columns, default = ICMS_DIF_TABLES[cd]
+        return rows[row][1].get(columns.get(uf, default), 0.0)
+
+    def mva(self, uf: str, internal: bool) -> Optional[float]:
+        if internal and uf in self.st_internal:
+            return self.st_internal[uf]
+        return self.st_mva.get(uf)
+
+    def coefficients(self, cd: str, uf: str, ipi_pct: float, ncm: Optional[str],
+                     st: bool, row: Optional[int]) -> Coefficients:
+        st_factor = own = 0.0
+        mva = self.mva(uf, uf == cd.upper()) if st else None
+        if mva is not None:
+            origin = cd.upper()
+            st_factor = (1 + mva) * ICMS_INTERNAL_RATES[uf]
+            own = ICMS_INTERNAL_RATES[uf] if uf == origin else interstate_rate(origin, uf)
+        return (ipi_pct or 0.0) / 100, self.icms_rate(cd, ncm, uf, row), st_factor, own
+
+    def stats(self) -> Dict:
+        return {
+            "icms_ncms": {cd: len(rows) for cd, rows in self.icms.items()},
+            "st_products": len(self.st_codes),
+            "st_ufs": len(self.st_mva),
+        }
+
+
+def apply_coefficients(amount: float, coefficients: Coefficients) -> Dict[str, float]:
+    """
+    IPI, diferencial, ST e total (em centavos) para o valor da mercadoria;
+    a base do diferencial e da ST é o valor + IPI já arredondado
+    """
+    ipi_rate, difal_rate, st_factor, own_rate = coefficients
+    amount = round(amount, 2)
+    ipi = round(amount * ipi_rate, 2)
+    base = amount + ipi
+    difal = round(base * difal_rate, 2)
+    st = round(max(0.0, base * st_factor - amount * own_rate), 2) if st_factor else 0.0
+    return {"ipi": ipi, "icms_difal": difal, "st": st,
+            "total": round(amount + ipi + difal + st, 2)}
+
+
+class TaxEngine:
+    """
+    Coeficientes fiscais pré-calculados por produto, UF e CD.
+
+    Cada perfil fiscal distinto guarda uma tupla por CD com os coeficientes
+    de todas as UFs (na ordem de UFS); o produto aponta para o perfil.
+    """
+
+    def __init__(self, tables: TaxTables, products: Iterable[Tuple[str, str, object, object]],
+                 default_cd: str = "sp"):
+        if default_cd not in ICMS_DIF_TABLES:
+            raise ValueError(f"CD desconhecido: {default_cd}")
+        self.tables = tables
+        self.default_cd = default_cd
+        self.built_at = time.time()
+        self._profiles: List[Dict[str, Tuple[Coefficients, ...]]] = []
+        self._profile_ids: Dict[tuple, int] = {}
+        self._products: Dict[str, int] = {}
+        self._lock = threading.Lock()
+        for code, description, ipi, ncm in products:
+            code = (code or "").strip().upper()
+            if code and code not in self._products:
+                self._products[code] = self._profile(_rate(ipi), normalize_ncm(ncm), code in tables.st_codes,
+                                                     description or "")
+
+    def _profile(self, ipi: float, ncm: Optional[str], st: bool, description: str) -> int:
+        rows = tuple(self.tables.icms_row(cd, ncm, description) for cd in ICMS_DIF_TABLES)
+        key = (ipi, ncm, st, rows)
+        pid = self._profile_ids.get(key)
+        if pid is None:
+            profile = {
+                cd: tuple(self.tables.coefficients(cd, uf, ipi, ncm, st, row) for uf in UFS)
+                for cd, row in zip(ICMS_DIF_TABLES, rows)
+            }
+            with self._lock:
+                pid = self._profile_ids.get(key)
+                if pid is None:
+                    pid = len(self._profiles)
+                    self._profiles.append(profile)
+                    self._profile_ids[key] = pid
+        return pid
+
+    def __contains__(self, code: str) -> bool:
+        return (code or "").strip().upper() in self._products
+
+    def __len__(self):
+        return len(self._products)
+
+    def coefficients(self, code: str, uf: str, cd: Optional[str] = None) -> Optional[Coefficients]:
+        """Coeficientes do produto para a UF, ou None se o produto não é conhecido"""
+        pid = self._products.get((code or "").strip().upper())
+        if pid is None or uf not in UF_INDEX:
+            return None
+        return self._profiles[pid][resolve_cd(uf, cd, self.default_cd)][UF_INDEX[uf]]
+
+    def coefficients_for(self, uf: str, cd: str, ipi: float, ncm: Optional[str],
+                         st: bool, description: str = "") -> Coefficients:
+        """Coeficientes para um produto fora do snapshot (perfil criado sob demanda)"""
+        pid = self._profile(_rate(ipi), normalize_ncm(ncm), st, description)
+        return self._profiles[pid][cd][UF_INDEX[uf]]
+
+    def price(self, code: str, unit_price: Optional[float], uf: str,
+              cd: Optional[str] = None) -> Optional[Dict]:
+        """
+        Preço final de uma unidade na UF de destino
+
+        Returns:
+            Optional[Dict]: {uf, cd, preco_final, ipi, icms_difal, st}, ou None
+            sem preço ou sem dados fiscais do produto
+        """
+        if unit_price is None:
+            return None
+        coefficients = self.coefficients(code, uf, cd)
+        if coefficients is None:
+            return None
+        values = apply_coefficients(unit_price, coefficients)
+        return {
+            "uf": uf,
+            "cd": resolve_cd(uf, cd, self.default_cd),
+            "preco_final": values["total"],
+            "ipi": values["ipi"],
+            "icms_difal": values["icms_difal"],
+            "st": values["st"],
+        }
+
+    def stats(self) -> Dict:
+        stats = self.tables.stats()
+        stats.update({
+            "products": len(self._products),
+            "profiles": len(self._profiles),
+            "default_cd": self.default_cd,
+            "built_at": self.built_at,
+        })
+        return stats
+
+
+# ---- carga ----
+
+def load_tax_tables_csv(directory: str = TAX_CSV_DIR) -> TaxTables:
+    def read(name):
+        with open(os.path.join(directory, f"{name}.csv"), encoding="utf-8", newline="") as fh:
+            return list(csv.DictReader(fh))
+
+    return TaxTables(
+        {cd: read(table) for cd, (table, _, _) in ICMS_DIF_TABLES.items()},
+        read("subst_tributaria"),
+    )
+
+
+def load_tax_tables_db(dsn: Optional[str] = None) -> TaxTables:
+    from psycopg2.extras import RealDictCursor
+    from src.utils.db_pool import connection
+    with connection(dsn, cursor_factory=RealDictCursor) as conn:
+        with conn.cursor() as cur:
+            icms = {}
+            for cd, (table, _, _) in ICMS_DIF_TABLES.items():
+                cur.execute(f"SELECT * FROM {table}")
+                icms[cd] = cur.fetchall()
+            cur.execute("SELECT * FROM subst_tributaria")
+            return TaxTables(icms, cur.fetchall())
+
+
+def load_products_csv(directories: Iterable[str] = PRODUCT_CSV_DIRS) -> List[Tuple]:
+    """(código, descrição, ipi, ncm) das planilhas exportadas em csv_data/ e csv_outputs_v5/"""
+    rows = []
+    for table in PRODUCT_TABLES:
+        path = sheet_path(table, directories)
+        if path is None:
+            logger.warning("Planilha %s.csv ausente: produtos sem perfil fiscal", table)
+            continue
+        with open(path, encoding="utf-8", newline="") as fh:
+            for r in csv.DictReader(fh):
+                rows.append((r.get("codigo_material"), r.get("descricao"),
+                             r.get("ipi"), r.get("ncm_classif_fiscal")))
+    return rows
+
+
+def load_products_db(dsn: Optional[str] = None) -> List[Tuple]:
+    from src.utils.db_pool import connection
+    with connection(dsn) as conn:
+        with conn.cursor() as cur:
+            cur.execute(PRODUCTS_TAX_SQL)
+            return cur.fetchall()
+
+
+def build_tax_engine(source: str = "csv", dsn: Optional[str] = None,
+                     default_cd: str = "sp") -> TaxEngine:
+    start = time.perf_counter()
+    if source == "db":
+        engine = TaxEngine(load_tax_tables_db(dsn), load_products_db(dsn), default_cd)
+    else:
+        engine = TaxEngine(load_tax_tables_csv(), load_products_csv(), default_cd)
+    logger.info("Motor fiscal construído: %d produtos, %d perfis (%s, %.0f ms)",
+                len(engine), len(engine._profiles), source, (time.perf_counter() - start) * 1000)
+    return engine
+
+
+_engine: Optional[TaxEngine] = None
+_engine_lock = threading.Lock()
+_refreshing = False
+
+
+def _env_float(name: str, default: float) -> float:
+    try:
+        return float(os.getenv(name, default))
+    except (TypeError, ValueError):
+        return default
+
+
+def _build_from_env() -> TaxEngine:
+    dsn = os.getenv("DATABASE_URL")
+    source = os.getenv("TAX_ENGINE_SOURCE") or ("db" if dsn else "csv")
+    default_cd = os.getenv("TAX_DEFAULT_CD", "sp").lower()
+    if source == "db":
+        try:
+            return build_tax_engine("db", dsn, default_cd)
+        except Exception as e:
+            logger.warning("Tabelas fiscais do banco indisponíveis, usando CSV: %s", e)
+    return build_tax_engine("csv", default_cd=default_cd)
+
+
+def _refresh():
+    global _engine, _refreshing
+    try:
+        _engine = _build_from_env()
+    except Exception as e:
+        logger.warning("Falha ao recarregar motor fiscal: %s", e)
+    finally:
+        _refreshing = False
+
+
+def get_tax_engine() -> Optional[TaxEngine]:
+    """
+    Obtém o motor do processo, ou None se TAX_ENGINE=off; vencido o
+    intervalo de recarga, reconstrói em segundo plano e troca o snapshot
+    """
+    global _engine, _refreshing
+    if os.getenv("TAX_ENGINE", "memory").lower() != "memory":
+        return None
+    engine = _engine
+    if engine is None:
+        with _engine_lock:
+            if _engine is None:
+                try:
+                    _engine = _build_from_env()
+                except Exception as e:
+                    logger.warning("Motor fiscal indisponível: %s", e)
+                    return None
+            return _engine
+    refresh = _env_float("TAX_ENGINE_REFRESH_S", 3600)
+    if refresh > 0 and not _refreshing and time.time() - engine.built_at > refresh:
+        _refreshing = True
+        threading.Thread(target=_refresh, name="tax-engine-refresh", daemon=True).start()
+    return engine
+
+
+def warm_tax_engine():
+    """Constrói o motor em segundo plano na inicialização da app"""
+    if os.getenv("TAX_ENGINE", "memory").lower() == "memory" and _engine is None:
+        threading.Thread(target=get_tax_engine, name="tax-engine-warm", daemon=True).start()
+
+
+def tax_engine_stats() -> Optional[Dict]:
+    """Estatísticas do motor, ou None se ainda não construído"""
+    return _engine.stats() if _engine is not None else None
+
+
+def tax_price(code: str, unit_price: Optional[float], uf: Optional[str]) -> Optional[Dict]:
+    """Atalho para as rotas: preço final na UF, ou None"""
+    engine = get_tax_engine() if uf else None
+    return engine.price(code, unit_price, uf) if engine is not None else None
@@ -0,0 +1,263 @@
+"""
+Cliente de Saída do Telegram STIHL AI v5
+========================================
+
+Envio de mensagens pela Bot API com conexão persistente e respeito aos
+limites do Telegram, usado pelas threads da fila do webhook.
+
+Funcionalidades:
+- requests.Session com keep-alive e pool de conexões do tamanho da fila
+- Token bucket global (~30 msg/s) e por chat (~1 msg/s com rajada curta)
+- Nova tentativa com backoff exponencial e jitter em erros de rede e 5xx;
+  em 429, aguarda o ``retry_after`` informado pelo Telegram
+- Métricas de latência de envio, tentativas e limitação (local e 429)
+
+Configuração via ambiente:
+- TELEGRAM_API_BASE: URL da Bot API (padrão: https://api.telegram.org)
+- TELEGRAM_GLOBAL_RATE: mensagens/s no total (padrão: 30)
+- TELEGRAM_CHAT_RATE, TELEGRAM_CHAT_BURST: mensagens/s e rajada por chat
+  (padrão: 1 e 3)
+- TELEGRAM_MAX_RETRIES: novas tentativas por mensagem (padrão: 3)
+- TELEGRAM_MAX_WAIT_S: espera máxima por limite antes de desistir (padrão: 30)
+"""
+
+import os
+import time
+import random
+import logging
+import threading
+from collections import OrderedDict, deque
+from typing import Dict, Optional
+
+import requests
+from requests.adapters import HTTPAdapter
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_API_BASE = "https://api.telegram.org"
+
+
+class TokenBucket:
+    """Token bucket seguro para threads; ``reserve`` devolve a espera necessária"""
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated = time.monotonic()
+        self._blocked_until = 0.0
+        self._lock = threading.Lock()
+
+    def reserve(self) -> float:
+        """Reserva um token e retorna quantos segundos esperar antes de usá-lo"""
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            self._tokens -= 1
+            wait = -self._tokens / self.rate if self._tokens < 0 else 0.0
+            return max(wait, self._blocked_until - now)
+
+    def block(self, seconds: float):
+        """Suspende o bucket (ex.: após 429 com retry_after)"""
+        with self._lock:
+            self._blocked_until = max(self._blocked_until, time.monotonic() + seconds)
+
+
+class TelegramClient:
+    """
+    Cliente da Bot API com sessão persistente e limitação de taxa.
+
+    ``send_message`` bloqueia a thread chamadora durante esperas de limite
+    e novas tentativas; é chamado pelas threads da fila, nunca no request.
+    """
+
+    def __init__(self, token: str, api_base: str = DEFAULT_API_BASE,
+                 global_rate: float = 30.0, chat_rate: float = 1.0, chat_burst: float = 3.0,
+                 max_retries: int = 3, max_wait: float = 30.0, timeout: float = 10.0,
+                 pool_size: int = 8, max_chats: int = 10000):
+        self.token = token
+        self.api_base = api_base.rstrip("/")
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.max_retries = max_retries
+        self.max_wait = max_wait
+        self.timeout = timeout
+        self.max_chats = max_chats
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+        self._global = TokenBucket(global_rate, max(1.0, global_rate))
+        self._chats: "OrderedDict[str, TokenBucket]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._latencies = deque(maxlen=1000)
+        self._stats = {
+            "sent": 0, "failed": 0, "retries": 0, "throttled_429": 0,
+            "throttle_waits": 0, "throttle_wait_ms_total": 0.0, "gave_up_throttled": 0,
+        }
+
+    # ---- limites ----
+
+    def _chat_bucket(self, chat_id) -> TokenBucket:
+        key = str(chat_id)
+        with self._lock:
+            bucket = self._chats.get(key)
+            if bucket is None:
+                bucket = TokenBucket(self.chat_rate, self.chat_burst)
+                self._chats[key] = bucket
+                if len(self._chats) > self.max_chats:
+                    self._chats.popitem(last=False)
+            else:
+                self._chats.move_to_end(key)
+            return bucket
+
+    def _throttle(self, chat_id) -> bool:
+        wait = max(self._chat_bucket(chat_id).reserve(), self._global.reserve())
+        if wait <= 0:
+            return True
+        if wait > self.max_wait:
+            self._count("gave_up_throttled")
+            return False
+        with self._lock:
+            self._stats["throttle_waits"] += 1
+            self._stats["throttle_wait_ms_total"] += wait * 1000
+        time.sleep(wait)
+        return True
+
+    def _count(self, name: str, n: int = 1):
+        with self._lock:
+            self._stats[name] += n
+
+    @staticmethod
+    def _backoff(attempt: int) -> float:
+        # Backoff exponencial com jitter completo: 0..min(8, 0.5 * 2^n)
+        return random.uniform(0, min(8.0, 0.5 * (2 ** attempt)))
+
+    # ---- envio ----
+
+    def call(self, method: str, chat_id, payload: Dict) -> Optional[Dict]:
+        """
+        Chama um método da Bot API com limites e novas tentativas
+
+        Returns:
+            Optional[Dict]: Resposta JSON em caso de sucesso, senão None
+        """
+        url = f"{self.api_base}/bot{self.token}/{method}"
+        for attempt in range(self.max_retries + 1):
+            if not self._throttle(chat_id):
+                logger.warning("TG %s chat=%s descartado: espera acima de %.0fs",
+                               method, chat_id, self.max_wait)
+                return None
+            if attempt:
+                self._count("retries")
+
+            start = time.monotonic()
+            try:
+                resp = self.session.post(url, json=payload, timeout=self.timeout)
+            except requests.RequestException as e:
+                logger.warning("TG %s exception (tentativa %d): %s", method, attempt + 1, e)
+                time.sleep(self._backoff(attempt))
+                continue
+            finally:
+                with self._lock:
+                    self._latencies.append((time.monotonic() - start) * 1000)
+
+            if resp.status_code == 200:
+                self._count("sent")
+                try:
+                    return resp.json()
+                except ValueError:
+                    return {}
+
+            if resp.status_code == 429:
+                self._count("throttled_429")
+                try:
+                    retry_after = float((resp.json().get("parameters") or {}).get("retry_after", 1))
+                except (ValueError, AttributeError):
+                    retry_after = 1.0
+                # Vale para o chat; a espera acontece no próximo _throttle
+                self._chat_bucket(chat_id).block(retry_after + random.uniform(0, 0.25))
+                continue
+
+            if resp.status_code >= 500:
+                logger.warning("TG %s status=%s (tentativa %d)", method, resp.status_code, attempt + 1)
+                time.sleep(self._backoff(attempt))
+                continue
+
+            # 4xx: erro do pedido (chat inexistente, bot bloqueado...), sem nova tentativa
+            logger.error("TG %s status=%s body=%s", method, resp.status_code, resp.text)
+            break
+
+        self._count("failed")
+        return None
+
+    def send_message(self, chat_id, text: str, **options) -> bool:
+        payload = {"chat_id": chat_id, "text": text}
+        payload.update(options)
+        return self.call("sendMessage", chat_id, payload) is not None
+
+    def stats(self) -> Dict:
+        with self._lock:
+            stats = dict(self._stats)
+            latencies = sorted(self._latencies)
+            chats = len(self._chats)
+
+        def pct(p):
+            return round(latencies[min(len(latencies) - 1, int(p * len(latencies)))], 2) if latencies else 0.0
+
+        stats.update({
+            "tracked_chats": chats,
+            "latency_ms_p50": pct(0.50),
+            "latency_ms_p95": pct(0.95),
+            "latency_ms_max": round(latencies[-1], 2) if latencies else 0.0,
+        })
+        return stats
+
+    def close(self):
+        self.session.close()
+
+
+_clients: Dict[str, TelegramClient] = {}
+_clients_lock = threading.Lock()
+
+
+def _env_float(name: str, default: float) -> float:
+    try:
+        return float(os.getenv(name, default))
+    except (TypeError, ValueError):
+        return default
+
+
+def get_telegram_client(token: str) -> TelegramClient:
+    """Cliente compartilhado do processo para o token informado"""
+    client = _clients.get(token)
+    if client is None:
+        with _clients_lock:
+            client = _clients.get(token)
+            if client is None:
+                client = TelegramClient(
+                    token,
+                    api_base=os.getenv("TELEGRAM_API_BASE") or DEFAULT_API_BASE,
+                    global_rate=_env_float("TELEGRAM_GLOBAL_RATE", 30),
+                    chat_rate=_env_float("TELEGRAM_CHAT_RATE", 1),
+                    chat_burst=_env_float("TELEGRAM_CHAT_BURST", 3),
+                    max_retries=int(_env_float("TELEGRAM_MAX_RETRIES", 3)),
+                    max_wait=_env_float("TELEGRAM_MAX_WAIT_S", 30),
+                    pool_size=max(4, int(_env_float("TELEGRAM_WORKERS", 4))),
+                )
+                _clients[token] = client
+    return client
+
+
+def telegram_client_stats() -> Optional[Dict]:
+    """Métricas dos clientes do processo, ou None se nenhum foi criado"""
+    with _clients_lock:
+        clients = list(_clients.values())
+    if not clients:
+        return None
+    if len(clients) == 1:
+        return clients[0].stats()
+    return {f"client_{i}": c.stats() for i, c in enumerate(clients)}
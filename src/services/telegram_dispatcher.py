@@ -0,0 +1,207 @@
+"""
+Fila de Updates do Telegram STIHL AI v5
+=======================================
+
+Desacopla o webhook do processamento: a rota valida e enfileira o update
+e responde na hora; um pool limitado de threads executa a busca e envia a
+resposta, de modo que consultas ou chamadas lentas à API do Telegram não
+prendem o worker do gunicorn nem provocam reenvios.
+
+Funcionalidades:
+- Fila limitada: cheia, ``submit`` recusa (o webhook responde 503 e o
+  Telegram reenvia depois)
+- Pool de threads de tamanho fixo, iniciado na primeira submissão
+- Métricas: profundidade da fila, pico, espera e tempo de processamento
+- Drenagem no encerramento: para de aceitar e aguarda a fila esvaziar
+  até o timeout
+
+Configuração via ambiente:
+- TELEGRAM_WORKERS: threads de processamento (padrão: 4)
+- TELEGRAM_QUEUE_MAX: capacidade da fila (padrão: 200)
+- TELEGRAM_DRAIN_TIMEOUT_S: espera máxima na drenagem (padrão: 25)
+"""
+
+import os
+import time
+import queue
+import atexit
+import logging
+import threading
+from typing import Any, Callable, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+_STOP = object()
+
+
+class UpdateDispatcher:
+    """
+    Pool de threads alimentado por uma fila limitada.
+
+    ``handler`` recebe cada item submetido; exceções são registradas e
+    contadas, sem derrubar a thread.
+    """
+
+    def __init__(self, handler: Callable[[Any], None], workers: int = 4,
+                 max_queue: int = 200, name: str = "telegram"):
+        if workers <= 0:
+            raise ValueError("workers deve ser positivo")
+        self.handler = handler
+        self.workers = workers
+        self.max_queue = max_queue
+        self.name = name
+        self._queue: "queue.Queue" = queue.Queue(maxsize=max_queue)
+        self._threads = []
+        self._lock = threading.Lock()
+        self._accepting = True
+        self._stopped = False
+        self._in_flight = 0
+        self._depth = 0
+        self._stats = {
+            "enqueued": 0, "rejected": 0, "processed": 0, "failed": 0,
+            "max_depth": 0, "wait_ms_total": 0.0, "process_ms_total": 0.0,
+            "last_process_ms": 0.0,
+        }
+
+    def _start_locked(self):
+        if self._threads:
+            return
+        for i in range(self.workers):
+            t = threading.Thread(target=self._run, name=f"{self.name}-worker-{i}", daemon=True)
+            t.start()
+            self._threads.append(t)
+
+    def submit(self, item: Any) -> bool:
+        """
+        Enfileira um item sem bloquear
+
+        Returns:
+            bool: False se a fila estiver cheia ou em drenagem
+        """
+        with self._lock:
+            if not self._accepting:
+                self._stats["rejected"] += 1
+                return False
+            self._start_locked()
+            try:
+                self._queue.put_nowait((time.monotonic(), item))
+            except queue.Full:
+                self._stats["rejected"] += 1
+                return False
+            self._depth += 1
+            self._stats["enqueued"] += 1
+            self._stats["max_depth"] = max(self._stats["max_depth"], self._depth)
+        return True
+
+    def _run(self):
+        while True:
+            entry = self._queue.get()
+            if entry is _STOP:
+                self._queue.task_done()
+                return
+            enqueued_at, item = entry
+            start = time.monotonic()
+            with self._lock:
+                self._depth -= 1
+                self._in_flight += 1
+                self._stats["wait_ms_total"] += (start - enqueued_at) * 1000
+            ok = True
+            try:
+                self.handler(item)
+            except Exception:
+                ok = False
+                logger.exception("Falha ao processar item da fila %s", self.name)
+            finally:
+                elapsed = (time.monotonic() - start) * 1000
+                with self._lock:
+                    self._in_flight -= 1
+                    self._stats["processed" if ok else "failed"] += 1
+                    self._stats["process_ms_total"] += elapsed
+                    self._stats["last_process_ms"] = round(elapsed, 2)
+                self._queue.task_done()
+
+    def drain(self, timeout: float = 25.0) -> bool:
+        """
+        Para de aceitar itens e aguarda o processamento do que está na fila
+
+        Returns:
+            bool: True se tudo foi processado dentro do timeout
+        """
+        with self._lock:
+            self._accepting = False
+            threads = list(self._threads)
+            if self._stopped or not threads:
+                return self._depth == 0 and self._in_flight == 0
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            with self._lock:
+                idle = self._queue.unfinished_tasks == 0
+            if idle:
+                break
+            time.sleep(0.05)
+        drained = self._queue.unfinished_tasks == 0
+        if drained:
+            self._stopped = True
+            for _ in threads:
+                self._queue.put(_STOP)
+        else:
+            logger.warning("Fila %s encerrada com %d itens pendentes",
+                           self.name, self._queue.unfinished_tasks)
+        return drained
+
+    def stats(self) -> Dict:
+        with self._lock:
+            stats = dict(self._stats)
+            in_flight = self._in_flight
+            depth = self._depth
+        done = stats["processed"] + stats["failed"]
+        return {
+            "queue_depth": depth,
+            "queue_capacity": self.max_queue,
+            "in_flight": in_flight,
+            "workers": self.workers,
+            "accepting": self._accepting,
+            "enqueued": stats["enqueued"],
+            "rejected": stats["rejected"],
+            "processed": stats["processed"],
+            "failed": stats["failed"],
+            "max_depth": stats["max_depth"],
+            "avg_wait_ms": round(stats["wait_ms_total"] / done, 2) if done else 0.0,
+            "avg_process_ms": round(stats["process_ms_total"] / done, 2) if done else 0.0,
+            "last_process_ms": stats["last_process_ms"],
+        }
+
+
+_dispatcher: Optional[UpdateDispatcher] = None
+_dispatcher_lock = threading.Lock()
+
+
+def _env_int(name: str, default: int) -> int:
+    try:
+        return int(os.getenv(name, default))
+    except (TypeError, ValueError):
+        return default
+
+
+def get_dispatcher(handler: Callable[[Any], None]) -> UpdateDispatcher:
+    """
+    Obtém a fila do processo, criando-a na primeira chamada (após o fork
+    dos workers do gunicorn) e registrando a drenagem no encerramento
+    """
+    global _dispatcher
+    if _dispatcher is None:
+        with _dispatcher_lock:
+            if _dispatcher is None:
+                _dispatcher = UpdateDispatcher(
+                    handler,
+                    workers=_env_int("TELEGRAM_WORKERS", 4),
+                    max_queue=_env_int("TELEGRAM_QUEUE_MAX", 200),
+                )
+                timeout = float(_env_int("TELEGRAM_DRAIN_TIMEOUT_S", 25))
+                atexit.register(_dispatcher.drain, timeout)
+    return _dispatcher
+
+
+def dispatcher_stats() -> Optional[Dict]:
+    """Métricas da fila do processo, ou None se ainda não foi criada"""
+    return _dispatcher.stats() if _dispatcher is not None else None
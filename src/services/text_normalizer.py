@@ -1,5 +1,5 @@
 import re, unicodedata
-from typing import Dict, List
+from typing import Dict, List, Optional, Tuple
 
 PART_TYPES = [
     "filtro", "carburador", "silenciador", "tampa", "luva",
@@ -22,8 +22,39 @@ SPEC_PATTERNS = [
     "de combustível", "do combustível", "de combustivel", "do combustivel",
 ]
 
+# Famílias aceitas na forma separada ("MS 250", "FS-220")
+MODEL_FAMILIES = [
+    "MS", "MSA", "MSE", "FS", "FSA", "FSE", "FR", "HT", "HTA", "HS", "HSA", "HSE",
+    "HL", "HLA", "BR", "BG", "BGA", "BGE", "SH", "SHA", "KM", "KMA", "KA", "KG",
+    "KGA", "TS", "TSA", "SR", "GR", "GTA", "BT", "WP", "MH", "RE", "REA", "RMA", "EHC",
+]
+
 CODE_RE = re.compile(r"\b\d{4}-\d{3}-\d{4}\b")
-MODEL_RE = re.compile(r"\b([A-Z]{2}\d{2,3})\b", re.I)  # MS162, FS221, FR410 etc.
+# Consulta que é só um código de material, com ou sem hífens
+MATERIAL_CODE_RE = re.compile(r"^(\d{4})[-\s.]?(\d{3})[-\s.]?(\d{4})$")
+MODEL_RE = re.compile(
+    r"\b([A-Z]{2,3}\d{2,3}[A-Z]?|(?:" + "|".join(MODEL_FAMILIES) + r")[ -]\d{2,3}[A-Z]?)\b",
+    re.I,
+)  # MS162, FS221, FR410, MS 250, FS-220 etc.
+
+# Token de modelo no texto livre das planilhas: MS250, MSA220.0, HT131-PMN
+MODEL_TOKEN_RE = re.compile(r"^([A-Z]{1,4})-?(\d{2,4})(?:\.0)?([A-Z]{0,3})(?:-[A-Z0-9]+)?$")
+MODEL_NUMBER_RE = re.compile(r"^(\d{2,4})(?:\.0)?$")
+FAMILY_RE = re.compile(r"^[A-Z]{2,4}$")
+
+# Faixa de preço no texto normalizado (sem acentos, minúsculas)
+PRICE_NUMBER = r"(\d{1,3}(?:\.\d{3})+(?:,\d{1,2})?|\d+(?:[.,]\d{1,2})?)"
+PRICE_BETWEEN_RE = re.compile(r"\bentre\s*(?:r\$\s*)?" + PRICE_NUMBER + r"\s*(?:e|a)\s*(?:r\$\s*)?" + PRICE_NUMBER)
+PRICE_MAX_RE = re.compile(r"\b(?:ate|abaixo de|menos de|no maximo|maximo)\s*(?:r\$\s*)?" + PRICE_NUMBER)
+PRICE_MIN_RE = re.compile(r"\b(?:acima de|mais de|a partir de|no minimo|minimo)\s*(?:r\$\s*)?" + PRICE_NUMBER)
+
+# Palavras sem efeito na busca, ignoradas na chave canônica
+STOPWORDS = {
+    "a", "o", "as", "os", "um", "uma", "de", "do", "da", "dos", "das", "em", "no", "na",
+    "nos", "nas", "para", "pra", "por", "com", "e", "ou", "que", "qual", "quais", "me",
+    "eu", "meu", "minha", "quero", "queria", "preciso", "procuro", "tem", "voces",
+    "gostaria", "favor", "ola", "oi", "r", "reais", "preco", "valor",
+}
 
 def _strip_accents(s: str) -> str:
     return "".join(
@@ -31,6 +62,48 @@ def _strip_accents(s: str) -> str:
         if unicodedata.category(c) != "Mn"
     )
 
+def fold_text(s: str) -> str:
+    """Minúsculas e sem acentos (equivalente ao ILIKE + unaccent)."""
+    return _strip_accents(s or "").lower()
+
+def extract_models(text: str) -> List[str]:
+    """
+    Extrai modelos canônicos de um campo livre de compatibilidade.
+
+    "MS 182 210 230" e "MS310 361 362" herdam a família do token anterior.
+    Espelha extract_models_v5() em sql_scripts/03_derived_structures_v5.sql.
+    """
+    models: List[str] = []
+    family = None
+    for tok in re.split(r"[\s;,]+", text or ""):
+        if not tok:
+            continue
+        m = MODEL_TOKEN_RE.match(tok.upper())
+        if m:
+            family = m.group(1)
+            model = m.group(1) + m.group(2) + m.group(3)
+        elif FAMILY_RE.match(tok):
+            family = tok
+            continue
+        elif family and MODEL_NUMBER_RE.match(tok):
+            model = family + MODEL_NUMBER_RE.match(tok).group(1)
+        else:
+            family = None
+            continue
+        if model not in models:
+            models.append(model)
+    return models
+
+def canonical_model(name: str) -> str:
+    """"ms 250", "MS-250" e "MS250.0" -> "MS250"."""
+    found = extract_models((name or "").upper())
+    return found[0] if found else (name or "").strip().upper()
+
+def model_search_text(model: str) -> str:
+    """"MS162" e "MSA220C" -> "ms 162" / "msa 220": forma das descrições (tsvector)."""
+    m = MODEL_TOKEN_RE.match(canonical_model(model))
+    return f"{m.group(1)} {m.group(2)}".lower() if m else fold_text(model)
+
 def normalize_input(q: str) -> str:
     s = _strip_accents(q or "").lower()
     s = re.sub(r"\s+", " ", s).strip()
@@ -38,6 +111,32 @@ def normalize_input(q: str) -> str:
     s = " ".join(fixed)
     return s
 
+def material_code(q: str) -> Optional[str]:
+    """"4134 200 0367" e "41342000367" -> "4134-200-0367"; None se não for só um código."""
+    m = MATERIAL_CODE_RE.match((q or "").strip())
+    return "-".join(m.groups()) if m else None
+
+def parse_price(value: str) -> float:
+    """"1.500,00" -> 1500.0, "49,90" -> 49.9, "250" -> 250.0"""
+    if re.fullmatch(r"\d{1,3}(?:\.\d{3})+(?:,\d{1,2})?", value):
+        value = value.replace(".", "")
+    return float(value.replace(",", "."))
+
+def extract_price_bounds(normalized: str) -> Tuple[Optional[float], Optional[float]]:
+    """Limites de preço ("ate 500", "acima de 1.000", "entre 100 e 200")."""
+    m = PRICE_BETWEEN_RE.search(normalized)
+    if m:
+        low, high = sorted((parse_price(m.group(1)), parse_price(m.group(2))))
+        return low, high
+    price_min = price_max = None
+    m = PRICE_MAX_RE.search(normalized)
+    if m:
+        price_max = parse_price(m.group(1))
+    m = PRICE_MIN_RE.search(normalized)
+    if m:
+        price_min = parse_price(m.group(1))
+    return price_min, price_max
+
 def extract_entities(q: str) -> Dict:
     original = (q or "").strip()
     normalized = normalize_input(original)
@@ -49,7 +148,7 @@ def extract_entities(q: str) -> Dict:
 
     models: List[str] = []
     for m in MODEL_RE.finditer(original.upper()):
-        models.append(m.group(1))
+        models.append(canonical_model(m.group(1)))
 
     part_type = None
     for p in PART_TYPES:
@@ -59,7 +158,7 @@ def extract_entities(q: str) -> Dict:
 
     spec = None
     for s in SPEC_PATTERNS:
-        if s in normalized:
+        if re.search(r"\b" + s + r"\b", normalized):
             spec = s.replace("oleo", "óleo").replace("combustivel", "combustível")
             break
 
@@ -71,3 +170,53 @@ def extract_entities(q: str) -> Dict:
         "part_type": part_type,
         "spec": spec,
     }
+
+def canonical_query(q: str) -> Dict:
+    """
+    Forma canônica de uma consulta, independente da grafia.
+
+    "Filtro de ar FS221", "filtro  de ar fs 221" e "filtro do ar FS-221"
+    produzem o mesmo resultado: entidades de extract_entities (código,
+    modelos, tipo de peça, especificação), limites de preço e as demais
+    palavras relevantes, sem acentos, ordenadas e sem repetição.
+    """
+    ent = extract_entities(q)
+    normalized = ent["normalized"]
+    price_min, price_max = extract_price_bounds(normalized)
+
+    rest = CODE_RE.sub(" ", normalized)
+    rest = MODEL_RE.sub(" ", rest)
+    for pattern in (PRICE_BETWEEN_RE, PRICE_MAX_RE, PRICE_MIN_RE):
+        rest = pattern.sub(" ", rest)
+    spec = _strip_accents(ent["spec"]) if ent["spec"] else None
+    if spec:
+        rest = re.sub(r"\b" + spec + r"\b", " ", rest)
+        spec = spec.split(" ", 1)[1]  # "do ar" / "de ar" -> "ar"
+    part_type = _strip_accents(ent["part_type"]) if ent["part_type"] else None
+    words = set(re.findall(r"[a-z0-9]+", rest)) - STOPWORDS
+    if part_type:
+        words.discard(part_type)
+
+    return {
+        "code": ent["code"],
+        "models": ent["models"],
+        "part_type": part_type,
+        "spec": spec,
+        "price_min": price_min,
+        "price_max": price_max,
+        "terms": sorted(words),
+    }
+
+def canonical_query_key(q: str) -> str:
+    """Chave textual estável de canonical_query(), adequada para cache."""
+    c = canonical_query(q)
+    parts = [
+        "c=" + (c["code"] or ""),
+        "m=" + ",".join(c["models"]),
+        "t=" + (c["part_type"] or ""),
+        "s=" + (c["spec"] or ""),
+        "p=" + ("" if c["price_min"] is None else f"{c['price_min']:g}")
+        + "-" + ("" if c["price_max"] is None else f"{c['price_max']:g}"),
+        "w=" + " ".join(c["terms"]),
+    ]
+    return "|".join(parts)
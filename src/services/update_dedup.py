@@ -0,0 +1,189 @@
+"""
+Supressão de Updates Duplicados do Telegram STIHL AI v5
+=======================================================
+
+O Telegram reenvia o update quando o webhook demora a responder; sem
+controle, cada reenvio repete a busca e a resposta. Este módulo guarda os
+``update_id`` já aceitos para que o webhook confirme o reenvio (200) sem
+processá-lo de novo.
+
+Funcionalidades:
+- Janela em memória (anel) dos últimos ``update_id`` vistos pelo processo
+- Registro compartilhado opcional em ``telegram_updates_v5``, para que um
+  reenvio entregue a outro worker também seja reconhecido
+- ``release`` desfaz o registro quando o update é recusado (fila cheia),
+  permitindo que o reenvio seja processado
+- Falhas do registro compartilhado não bloqueiam o webhook: a checagem
+  degrada para só memória
+- Métricas: duplicados (memória / compartilhado), aceitos, erros
+
+Configuração via ambiente:
+- TELEGRAM_DEDUP_WINDOW: tamanho do anel em memória (padrão: 4096)
+- TELEGRAM_DEDUP_STORE: "postgres" habilita o registro compartilhado
+  (padrão: "off")
+- TELEGRAM_DEDUP_TTL_S: retenção no registro compartilhado (padrão: 86400,
+  o prazo máximo em que o Telegram guarda um update)
+"""
+
+import os
+import time
+import logging
+import threading
+from collections import OrderedDict
+from typing import Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+CLAIM_SQL = """
+    INSERT INTO telegram_updates_v5 (update_id) VALUES (%s)
+    ON CONFLICT (update_id) DO NOTHING
+    RETURNING update_id
+"""
+
+RELEASE_SQL = "DELETE FROM telegram_updates_v5 WHERE update_id = %s"
+
+SWEEP_SQL = "SELECT cleanup_telegram_updates_v5(%s)"
+
+
+class PostgresUpdateStore:
+    """Registro de ``update_id`` compartilhado entre workers (telegram_updates_v5)"""
+
+    def __init__(self, dsn: Optional[str] = None, ttl: float = 86400.0,
+                 sweep_interval: float = 600.0):
+        self.dsn = dsn
+        self.ttl = ttl
+        self.sweep_interval = sweep_interval
+        self._next_sweep = time.monotonic() + sweep_interval
+
+    def _execute(self, sql: str, params=()):
+        from src.utils.db_pool import connection
+        with connection(self.dsn) as conn:
+            with conn.cursor() as cur:
+                cur.execute(sql, params)
+                return cur.fetchone() if cur.description else None
+
+    def claim(self, update_id: int) -> bool:
+        """Registra o update; False se outro worker já o registrou"""
+        if time.monotonic() >= self._next_sweep:
+            self._next_sweep = time.monotonic() + self.sweep_interval
+            self._execute(SWEEP_SQL, (int(self.ttl),))
+        return self._execute(CLAIM_SQL, (update_id,)) is not None
+
+    def release(self, update_id: int):
+        self._execute(RELEASE_SQL, (update_id,))
+
+
+class UpdateDeduplicator:
+    """
+    Janela de ``update_id`` aceitos: anel local + registro compartilhado.
+
+    ``claim`` é atômico por processo (lock) e, com o registro compartilhado,
+    entre workers (chave primária no banco).
+    """
+
+    def __init__(self, window: int = 4096, store=None, error_backoff: float = 30.0):
+        self.window = window
+        self.store = store
+        self.error_backoff = error_backoff
+        self._seen: "OrderedDict[int, None]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._store_disabled_until = 0.0
+        self._stats = {"accepted": 0, "duplicates": 0, "local_duplicates": 0,
+                       "shared_duplicates": 0, "released": 0, "store_errors": 0}
+
+    def _remember_locked(self, update_id: int):
+        self._seen[update_id] = None
+        while len(self._seen) > self.window:
+            self._seen.popitem(last=False)
+
+    def _store_available(self) -> bool:
+        return self.store is not None and time.monotonic() >= self._store_disabled_until
+
+    def _store_failed(self, action: str, error: Exception):
+        with self._lock:
+            self._stats["store_errors"] += 1
+        self._store_disabled_until = time.monotonic() + self.error_backoff
+        logger.warning("Registro de updates indisponível (%s), usando só memória por %.0fs: %s",
+                       action, self.error_backoff, error)
+
+    def claim(self, update_id: int) -> bool:
+        """
+        Registra o update como em processamento
+
+        Returns:
+            bool: True se é a primeira entrega; False se é um reenvio
+        """
+        with self._lock:
+            if update_id in self._seen:
+                self._stats["duplicates"] += 1
+                self._stats["local_duplicates"] += 1
+                return False
+            self._remember_locked(update_id)
+
+        if self._store_available():
+            try:
+                first = self.store.claim(update_id)
+            except Exception as e:
+                self._store_failed("registro", e)
+                first = True
+            if not first:
+                with self._lock:
+                    self._stats["duplicates"] += 1
+                    self._stats["shared_duplicates"] += 1
+                return False
+
+        with self._lock:
+            self._stats["accepted"] += 1
+        return True
+
+    def release(self, update_id: int):
+        """Esquece o update (não foi processado), para que o reenvio seja aceito"""
+        with self._lock:
+            self._seen.pop(update_id, None)
+            self._stats["released"] += 1
+        if self._store_available():
+            try:
+                self.store.release(update_id)
+            except Exception as e:
+                self._store_failed("liberação", e)
+
+    def stats(self) -> Dict:
+        with self._lock:
+            stats = dict(self._stats)
+            stats["window_entries"] = len(self._seen)
+        stats["window"] = self.window
+        stats["shared_store"] = self.store is not None
+        stats["shared_store_available"] = self._store_available()
+        return stats
+
+
+_dedup: Optional[UpdateDeduplicator] = None
+_dedup_lock = threading.Lock()
+
+
+def _env_int(name: str, default: int) -> int:
+    try:
+        return int(os.getenv(name, default))
+    except (TypeError, ValueError):
+        return default
+
+
+def get_deduplicator() -> UpdateDeduplicator:
+    """Obtém a janela do processo, criando-a na primeira chamada"""
+    global _dedup
+    if _dedup is None:
+        with _dedup_lock:
+            if _dedup is None:
+                store = None
+                if os.getenv("TELEGRAM_DEDUP_STORE", "off").lower() == "postgres":
+                    store = PostgresUpdateStore(
+                        os.getenv("DATABASE_URL"),
+                        ttl=_env_int("TELEGRAM_DEDUP_TTL_S", 86400),
+                    )
+                _dedup = UpdateDeduplicator(_env_int("TELEGRAM_DEDUP_WINDOW", 4096), store=store)
+    return _dedup
+
+
+def dedup_stats() -> Optional[Dict]:
+    """Métricas da janela do processo, ou None se ainda não foi criada"""
+    return _dedup.stats() if _dedup is not None else None
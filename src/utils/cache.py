@@ -0,0 +1,236 @@
+"""
+Cache de Resultados STIHL AI v5
+===============================
+
+Cache em memória limitado e seguro para uso entre threads, usado pelos
+resultados de IntelligentSearchV5.
+
+Funcionalidades:
+- Limite por número de entradas e por orçamento de bytes (estimado)
+- Despejo LRU por shard, com um lock por shard (lock striping)
+- Expiração por TTL na leitura e varredura ativa periódica das expiradas,
+  disparada tanto por get quanto por set
+- Contadores de acertos, faltas, despejos e expirações, mantidos por shard
+  sob o lock do próprio shard e somados em stats()
+
+Configuração via ambiente:
+- SEARCH_CACHE_MAX_ENTRIES (padrão: 2048)
+- SEARCH_CACHE_MAX_BYTES (padrão: 33554432, 32 MiB)
+- SEARCH_CACHE_TTL_S (padrão: 1800)
+- SEARCH_CACHE_SHARDS (padrão: 8)
+"""
+
+import os
+import sys
+import time
+import threading
+from collections import OrderedDict
+from dataclasses import fields, is_dataclass
+from typing import Any, Callable, Dict, Hashable, List, Optional
+
+
+def estimate_size(value: Any, _depth: int = 0) -> int:
+    """
+    Estimativa de memória (bytes) de um valor e do que ele contém
+
+    Percorre listas, tuplas, dicionários e dataclasses até 4 níveis; é
+    uma aproximação para o orçamento de bytes, não uma medida exata.
+    """
+    size = sys.getsizeof(value)
+    if _depth >= 4:
+        return size
+    if isinstance(value, (list, tuple, set, frozenset)):
+        size += sum(estimate_size(v, _depth + 1) for v in value)
+    elif isinstance(value, dict):
+        size += sum(estimate_size(k, _depth + 1) + estimate_size(v, _depth + 1)
+                    for k, v in value.items())
+    elif is_dataclass(value) and not isinstance(value, type):
+        size += sum(estimate_size(getattr(value, f.name), _depth + 1) for f in fields(value))
+    return size
+
+
+def _env_int(name: str, default: int) -> int:
+    try:
+        return int(os.getenv(name, default))
+    except (TypeError, ValueError):
+        return default
+
+
+def _env_float(name: str, default: float) -> float:
+    try:
+        return float(os.getenv(name, default))
+    except (TypeError, ValueError):
+        return default
+
+
+COUNTERS = ("hits", "misses", "sets", "evictions", "expirations", "rejected")
+
+
+class _Shard:
+    __slots__ = ("lock", "entries", "bytes", "counters")
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        # chave -> (valor, expira_em, tamanho); ordem = recência (fim = mais recente)
+        self.entries: "OrderedDict[Hashable, tuple]" = OrderedDict()
+        self.bytes = 0
+        # Alterados só com ``lock`` já adquirido: sem lock global no caminho quente
+        self.counters = dict.fromkeys(COUNTERS, 0)
+
+
+class ShardedLRUCache:
+    """
+    Cache LRU com TTL particionado em shards.
+
+    Cada shard recebe uma fração dos limites globais e tem seu próprio
+    lock, de modo que threads que consultam chaves diferentes raramente
+    disputam o mesmo lock. O despejo é LRU dentro do shard.
+    """
+
+    def __init__(self, max_entries: int = 2048, max_bytes: int = 32 * 1024 * 1024,
+                 ttl: float = 1800.0, shards: int = 8,
+                 sizeof: Callable[[Any], int] = estimate_size,
+                 sweep_interval: Optional[float] = None):
+        if max_entries <= 0:
+            raise ValueError("max_entries deve ser positivo")
+        shards = max(1, min(shards, max_entries))
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._sizeof = sizeof
+        self._shards = [_Shard() for _ in range(shards)]
+        self._shard_entries = max(1, max_entries // shards)
+        self._shard_bytes = max(1, max_bytes // shards) if max_bytes > 0 else 0
+        self._sweep_interval = sweep_interval if sweep_interval is not None else max(1.0, min(ttl, 60.0))
+        self._next_sweep = time.monotonic() + self._sweep_interval
+
+    @classmethod
+    def from_env(cls, prefix: str = "SEARCH_CACHE"):
+        """Instancia com limites lidos de <prefix>_MAX_ENTRIES, _MAX_BYTES, _TTL_S e _SHARDS"""
+        return cls(
+            max_entries=_env_int(f"{prefix}_MAX_ENTRIES", 2048),
+            max_bytes=_env_int(f"{prefix}_MAX_BYTES", 32 * 1024 * 1024),
+            ttl=_env_float(f"{prefix}_TTL_S", 1800.0),
+            shards=_env_int(f"{prefix}_SHARDS", 8),
+        )
+
+    def _shard(self, key: Hashable) -> _Shard:
+        return self._shards[hash(key) % len(self._shards)]
+
+    @staticmethod
+    def _drop(shard: _Shard, key: Hashable):
+        _, _, size = shard.entries.pop(key)
+        shard.bytes -= size
+
+    def _maybe_sweep(self, now: float):
+        if now >= self._next_sweep:
+            self._next_sweep = now + self._sweep_interval
+            self.purge_expired()
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        """Valor da chave, ou default se ausente ou expirada"""
+        shard = self._shard(key)
+        now = time.monotonic()
+        with shard.lock:
+            entry = shard.entries.get(key)
+            if entry is not None and entry[1] <= now:
+                self._drop(shard, key)
+                entry = None
+                shard.counters["expirations"] += 1
+            if entry is None:
+                shard.counters["misses"] += 1
+            else:
+                shard.entries.move_to_end(key)
+                shard.counters["hits"] += 1
+        self._maybe_sweep(now)
+        return default if entry is None else entry[0]
+
+    def set(self, key: Hashable, value: Any, ttl: Optional[float] = None):
+        """Armazena um valor; entradas maiores que o orçamento do shard são recusadas"""
+        now = time.monotonic()
+        size = self._sizeof(value) if self._shard_bytes else 0
+        shard = self._shard(key)
+        if self._shard_bytes and size > self._shard_bytes:
+            with shard.lock:
+                shard.counters["rejected"] += 1
+            return
+        expires_at = now + (self.ttl if ttl is None else ttl)
+        with shard.lock:
+            if key in shard.entries:
+                self._drop(shard, key)
+            shard.entries[key] = (value, expires_at, size)
+            shard.bytes += size
+            while (len(shard.entries) > self._shard_entries
+                   or (self._shard_bytes and shard.bytes > self._shard_bytes)):
+                self._drop(shard, next(iter(shard.entries)))
+                shard.counters["evictions"] += 1
+            shard.counters["sets"] += 1
+        self._maybe_sweep(now)
+
+    def delete(self, key: Hashable) -> bool:
+        shard = self._shard(key)
+        with shard.lock:
+            if key not in shard.entries:
+                return False
+            self._drop(shard, key)
+            return True
+
+    def purge_expired(self) -> int:
+        """Remove todas as entradas expiradas; retorna quantas saíram"""
+        now = time.monotonic()
+        removed = 0
+        for shard in self._shards:
+            with shard.lock:
+                expired = [k for k, (_, expires_at, _) in shard.entries.items() if expires_at <= now]
+                for key in expired:
+                    self._drop(shard, key)
+                shard.counters["expirations"] += len(expired)
+            removed += len(expired)
+        return removed
+
+    def clear(self):
+        for shard in self._shards:
+            with shard.lock:
+                shard.entries.clear()
+                shard.bytes = 0
+
+    def __len__(self):
+        return sum(len(shard.entries) for shard in self._shards)
+
+    def __contains__(self, key: Hashable) -> bool:
+        shard = self._shard(key)
+        with shard.lock:
+            entry = shard.entries.get(key)
+            return entry is not None and entry[1] > time.monotonic()
+
+    def keys(self) -> List[Hashable]:
+        result = []
+        for shard in self._shards:
+            with shard.lock:
+                result.extend(shard.entries.keys())
+        return result
+
+    def stats(self) -> Dict:
+        """Tamanho atual, limites e contadores acumulados"""
+        now = time.monotonic()
+        entries = expired = used_bytes = 0
+        counters = dict.fromkeys(COUNTERS, 0)
+        for shard in self._shards:
+            with shard.lock:
+                entries += len(shard.entries)
+                used_bytes += shard.bytes
+                expired += sum(1 for _, expires_at, _ in shard.entries.values() if expires_at <= now)
+                for name, value in shard.counters.items():
+                    counters[name] += value
+        lookups = counters["hits"] + counters["misses"]
+        counters.update({
+            "entries": entries,
+            "expired_entries": expired,
+            "bytes": used_bytes,
+            "max_entries": self.max_entries,
+            "max_bytes": self.max_bytes,
+            "shards": len(self._shards),
+            "ttl_seconds": self.ttl,
+            "hit_rate": round(counters["hits"] / lookups, 4) if lookups else 0.0,
+        })
+        return counters
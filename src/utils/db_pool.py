@@ -0,0 +1,449 @@
+"""
+Pool de Conexões PostgreSQL STIHL AI v5
+=======================================
+
+Pool de conexões único por processo, compartilhado por todos os caminhos
+de busca (assistente de peças, IntelligentSearchV5 e motor legado).
+
+Funcionalidades:
+- Dimensionamento mínimo/máximo e timeout de checkout
+- Verificação de saúde da conexão no empréstimo
+- Timeout por instrução (SET LOCAL statement_timeout)
+- Estatísticas de uso (em uso, esperas, tempo de espera)
+- ``database_health``: SELECT 1 com resultado guardado por alguns segundos,
+  executado por uma única thread de cada vez (as demais recebem o último
+  resultado)
+
+Configuração via ambiente:
+- DB_POOL_MIN, DB_POOL_MAX, DB_POOL_TIMEOUT (s), DB_POOL_MAX_IDLE (s)
+- DB_CONNECT_TIMEOUT (s), DB_STATEMENT_TIMEOUT_MS
+"""
+
+import os
+import time
+import atexit
+import logging
+import threading
+from contextlib import contextmanager
+from typing import Callable, Dict, List, Optional
+
+import psycopg2
+from psycopg2 import extensions
+
+logger = logging.getLogger(__name__)
+
+
+class PoolTimeoutError(RuntimeError):
+    """Nenhuma conexão ficou disponível dentro do timeout de checkout"""
+
+
+def _env_int(name: str, default: int) -> int:
+    try:
+        return int(os.getenv(name, default))
+    except (TypeError, ValueError):
+        return default
+
+
+def _env_float(name: str, default: float) -> float:
+    try:
+        return float(os.getenv(name, default))
+    except (TypeError, ValueError):
+        return default
+
+
+class ConnectionPool:
+    """
+    Pool limitado de conexões psycopg2, seguro para uso entre threads.
+
+    As conexões são emprestadas em modo transacional: o primeiro comando
+    de cada empréstimo é um ``SET LOCAL statement_timeout``, que serve ao
+    mesmo tempo de verificação de saúde e de limite de tempo por instrução
+    (compatível com o pooler do Supabase em modo transação).
+    """
+
+    def __init__(self, dsn: str, minconn: int = 1, maxconn: int = 10,
+                 checkout_timeout: float = 5.0, statement_timeout_ms: int = 15000,
+                 connect_timeout: int = 5, max_idle: float = 300.0,
+                 connection_factory: Callable = psycopg2.connect):
+        if maxconn < 1:
+            raise ValueError("maxconn deve ser >= 1")
+        self.dsn = dsn
+        self.minconn = max(0, min(minconn, maxconn))
+        self.maxconn = maxconn
+        self.checkout_timeout = checkout_timeout
+        self.statement_timeout_ms = statement_timeout_ms
+        self.connect_timeout = connect_timeout
+        self.max_idle = max_idle
+        self._connection_factory = connection_factory
+
+        self._cond = threading.Condition()
+        self._idle: List[tuple] = []  # pilha LIFO de (conexão, último uso)
+        self._in_use = 0
+        self._pid = os.getpid()
+        self._orphans: List = []
+
+        self._stats = {
+            'checkouts': 0,
+            'waits': 0,
+            'wait_time_total_ms': 0.0,
+            'wait_time_max_ms': 0.0,
+            'timeouts': 0,
+            'connections_created': 0,
+            'connections_discarded': 0,
+            'health_check_failures': 0,
+        }
+
+    @property
+    def name(self) -> str:
+        """Identificação do pool sem credenciais (host/banco)"""
+        try:
+            params = extensions.parse_dsn(self.dsn)
+        except Exception:
+            return 'postgres'
+        return f"{params.get('host', 'localhost')}/{params.get('dbname', '')}"
+
+    def _check_fork(self):
+        """Descarta o estado herdado de um fork (ex.: gunicorn --preload)"""
+        if os.getpid() != self._pid:
+            # Não fechar: PQfinish encerraria a sessão do processo pai.
+            self._orphans.extend(conn for conn, _ in self._idle)
+            self._idle = []
+            self._in_use = 0
+            self._pid = os.getpid()
+
+    def _open(self):
+        conn = self._connection_factory(self.dsn, connect_timeout=self.connect_timeout)
+        with self._cond:
+            self._stats['connections_created'] += 1
+        return conn
+
+    def _discard(self, conn):
+        try:
+            conn.close()
+        except Exception:
+            pass
+        with self._cond:
+            self._stats['connections_discarded'] += 1
+
+    def _prepare(self, conn, statement_timeout_ms: Optional[int]) -> bool:
+        """
+        Verifica a saúde da conexão e aplica o timeout por instrução
+
+        Qualquer erro do psycopg2 (de rede ou não, ex.: ProgrammingError de
+        uma sessão em estado inválido) reprova a conexão, que é descartada.
+        """
+        timeout = self.statement_timeout_ms if statement_timeout_ms is None else statement_timeout_ms
+        try:
+            if conn.closed:
+                return False
+            with conn.cursor() as cur:
+                cur.execute("SET LOCAL statement_timeout = %s", (int(timeout or 0),))
+            return True
+        except psycopg2.Error as e:
+            logger.warning("Conexão reprovada na verificação de saúde: %s", e)
+            return False
+
+    def acquire(self, timeout: Optional[float] = None,
+                statement_timeout_ms: Optional[int] = None):
+        """
+        Empresta uma conexão do pool
+
+        Args:
+            timeout: Tempo máximo de espera (padrão: checkout_timeout)
+            statement_timeout_ms: Timeout por instrução para este empréstimo
+
+        Returns:
+            Conexão psycopg2 pronta para uso
+        """
+        timeout = self.checkout_timeout if timeout is None else timeout
+        deadline = time.monotonic() + timeout
+        waited = False
+        wait_start = time.monotonic()
+
+        while True:
+            conn = None
+            with self._cond:
+                self._check_fork()
+                while not self._idle and self._in_use >= self.maxconn:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self._stats['timeouts'] += 1
+                        raise PoolTimeoutError(
+                            f"Timeout de {timeout:.1f}s aguardando conexão do pool ({self.maxconn} em uso)"
+                        )
+                    waited = True
+                    self._cond.wait(remaining)
+
+                if self._idle:
+                    conn, last_used = self._idle.pop()
+                    stale = (time.monotonic() - last_used) > self.max_idle
+                else:
+                    stale = False
+                self._in_use += 1
+                self._stats['checkouts'] += 1
+                if waited:
+                    wait_ms = (time.monotonic() - wait_start) * 1000
+                    self._stats['waits'] += 1
+                    self._stats['wait_time_total_ms'] += wait_ms
+                    self._stats['wait_time_max_ms'] = max(self._stats['wait_time_max_ms'], wait_ms)
+                    waited = False
+
+            try:
+                if conn is not None and stale:
+                    self._discard(conn)
+                    conn = None
+                if conn is None:
+                    conn = self._open()
+                if self._prepare(conn, statement_timeout_ms):
+                    return conn
+                with self._cond:
+                    self._stats['health_check_failures'] += 1
+                self._discard(conn)
+            except Exception:
+                self._release_slot()
+                raise
+            # Conexão inválida: libera a vaga e tenta novamente
+            self._release_slot()
+
+    def _release_slot(self):
+        with self._cond:
+            self._in_use = max(0, self._in_use - 1)
+            self._cond.notify()
+
+    def release(self, conn, discard: bool = False):
+        """
+        Devolve uma conexão ao pool
+
+        Args:
+            conn: Conexão emprestada via acquire()
+            discard: Fecha a conexão em vez de reaproveitá-la
+        """
+        if not discard and not conn.closed:
+            try:
+                if conn.get_transaction_status() != extensions.TRANSACTION_STATUS_IDLE:
+                    conn.rollback()
+            except Exception:
+                discard = True
+        if discard or conn.closed:
+            self._discard(conn)
+            self._release_slot()
+            return
+
+        with self._cond:
+            if os.getpid() != self._pid:
+                self._orphans.append(conn)
+                return
+            self._idle.append((conn, time.monotonic()))
+            self._in_use = max(0, self._in_use - 1)
+            self._reap_idle()
+            self._cond.notify()
+
+    def _reap_idle(self):
+        """Fecha conexões ociosas há mais de max_idle, preservando o mínimo"""
+        now = time.monotonic()
+        keep = []
+        expired = []
+        # _idle é LIFO: as mais antigas ficam no início da lista
+        for conn, last_used in self._idle:
+            if now - last_used > self.max_idle and len(self._idle) - len(expired) > self.minconn:
+                expired.append(conn)
+            else:
+                keep.append((conn, last_used))
+        self._idle = keep
+        for conn in expired:
+            try:
+                conn.close()
+            except Exception:
+                pass
+            self._stats['connections_discarded'] += 1
+
+    @contextmanager
+    def connection(self, cursor_factory=None, statement_timeout_ms: Optional[int] = None):
+        """
+        Context manager que empresta uma conexão e a devolve ao final
+
+        Faz commit em caso de sucesso e rollback em caso de erro. Conexões
+        com erro de rede são descartadas.
+
+        Args:
+            cursor_factory: Fábrica de cursor padrão (ex.: RealDictCursor)
+            statement_timeout_ms: Timeout por instrução para este uso
+        """
+        conn = self.acquire(statement_timeout_ms=statement_timeout_ms)
+        previous_factory = conn.cursor_factory
+        if cursor_factory is not None:
+            conn.cursor_factory = cursor_factory
+        discard = False
+        try:
+            yield conn
+            conn.commit()
+        except (psycopg2.OperationalError, psycopg2.InterfaceError):
+            discard = True
+            raise
+        except Exception:
+            try:
+                conn.rollback()
+            except Exception:
+                discard = True
+            raise
+        finally:
+            if not conn.closed:
+                conn.cursor_factory = previous_factory
+            self.release(conn, discard=discard)
+
+    def stats(self) -> Dict:
+        """
+        Obtém estatísticas do pool
+
+        Returns:
+            Dict: Tamanho, conexões em uso, esperas e tempo de espera
+        """
+        with self._cond:
+            stats = dict(self._stats)
+            stats.update({
+                'name': self.name,
+                'min_size': self.minconn,
+                'max_size': self.maxconn,
+                'in_use': self._in_use,
+                'idle': len(self._idle),
+                'size': self._in_use + len(self._idle),
+            })
+        stats['wait_time_avg_ms'] = round(stats['wait_time_total_ms'] / stats['waits'], 2) if stats['waits'] else 0.0
+        stats['wait_time_total_ms'] = round(stats['wait_time_total_ms'], 2)
+        stats['wait_time_max_ms'] = round(stats['wait_time_max_ms'], 2)
+        return stats
+
+    def closeall(self):
+        """Fecha todas as conexões ociosas do pool"""
+        with self._cond:
+            idle, self._idle = self._idle, []
+        for conn, _ in idle:
+            try:
+                conn.close()
+            except Exception:
+                pass
+
+
+# Registro de pools do processo (um por DSN)
+_pools: Dict[str, ConnectionPool] = {}
+_pools_lock = threading.Lock()
+
+
+def get_pool(dsn: Optional[str] = None) -> ConnectionPool:
+    """
+    Obtém o pool do processo para o DSN informado (padrão: DATABASE_URL)
+
+    Args:
+        dsn: String de conexão PostgreSQL
+
+    Returns:
+        ConnectionPool: Pool compartilhado
+    """
+    dsn = dsn or os.getenv('DATABASE_URL')
+    if not dsn:
+        raise RuntimeError("DATABASE_URL não definido no ambiente")
+    with _pools_lock:
+        pool = _pools.get(dsn)
+        if pool is None:
+            pool = ConnectionPool(
+                dsn,
+                minconn=_env_int('DB_POOL_MIN', 1),
+                maxconn=_env_int('DB_POOL_MAX', 10),
+                checkout_timeout=_env_float('DB_POOL_TIMEOUT', 5.0),
+                statement_timeout_ms=_env_int('DB_STATEMENT_TIMEOUT_MS', 15000),
+                connect_timeout=_env_int('DB_CONNECT_TIMEOUT', 5),
+                max_idle=_env_float('DB_POOL_MAX_IDLE', 300.0),
+            )
+            _pools[dsn] = pool
+        return pool
+
+
+def connection(dsn: Optional[str] = None, cursor_factory=None,
+               statement_timeout_ms: Optional[int] = None):
+    """Atalho para get_pool(dsn).connection(...)"""
+    return get_pool(dsn).connection(cursor_factory=cursor_factory,
+                                    statement_timeout_ms=statement_timeout_ms)
+
+
+def pool_stats() -> List[Dict]:
+    """Estatísticas de todos os pools do processo"""
+    with _pools_lock:
+        pools = list(_pools.values())
+    return [pool.stats() for pool in pools]
+
+
+_health: Dict = {}
+_health_inflight: Dict[str, threading.Event] = {}
+_health_lock = threading.Lock()
+
+
+def _check_database(dsn: str, timeout_ms: int, previous: Optional[Dict]) -> Dict:
+    start = time.monotonic()
+    try:
+        with connection(dsn, statement_timeout_ms=timeout_ms) as conn:
+            with conn.cursor() as cur:
+                cur.execute("SELECT 1")
+                cur.fetchone()
+        result = {'connected': True, 'error': None}
+    except PoolTimeoutError as e:
+        # Pool esgotado não é banco fora: mantém o último estado conhecido
+        result = {'connected': previous['connected'] if previous else None, 'error': str(e)[:200]}
+    except Exception as e:
+        result = {'connected': False, 'error': str(e)[:200]}
+    result['latency_ms'] = round((time.monotonic() - start) * 1000, 2)
+    return result
+
+
+def database_health(dsn: Optional[str] = None, ttl: float = 5.0, timeout_ms: int = 1000) -> Dict:
+    """
+    Verificação real do banco (SELECT 1), repetida no máximo a cada ``ttl`` s
+
+    Uma única thread por DSN executa a verificação, fora de _health_lock;
+    enquanto isso, as demais recebem o último resultado (ou aguardam a
+    primeira verificação). Com o pool esgotado, ``connected`` mantém o
+    último valor conhecido.
+
+    Returns:
+        Dict: connected (None sem DATABASE_URL), latency_ms e error
+    """
+    dsn = dsn or os.getenv('DATABASE_URL')
+    if not dsn:
+        return {'connected': None, 'latency_ms': None, 'error': None}
+    with _health_lock:
+        cached = _health.get(dsn)
+        if cached is not None and time.monotonic() - cached[0] < ttl:
+            return cached[1]
+        inflight = _health_inflight.get(dsn)
+        if inflight is None:
+            inflight = _health_inflight[dsn] = threading.Event()
+            owner = True
+        else:
+            owner = False
+
+    if not owner:
+        if cached is not None:
+            return cached[1]
+        inflight.wait()
+        with _health_lock:
+            return _health[dsn][1]
+
+    result = {'connected': None, 'error': 'Verificação interrompida', 'latency_ms': None}
+    try:
+        result = _check_database(dsn, timeout_ms, cached[1] if cached else None)
+    finally:
+        with _health_lock:
+            _health[dsn] = (time.monotonic(), result)
+            del _health_inflight[dsn]
+        inflight.set()
+    return result
+
+
+def close_all_pools():
+    """Fecha as conexões ociosas de todos os pools (chamado no encerramento)"""
+    with _pools_lock:
+        pools = list(_pools.values())
+    for pool in pools:
+        pool.closeall()
+
+
+atexit.register(close_all_pools)
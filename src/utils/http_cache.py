@@ -0,0 +1,129 @@
+"""
+Cache HTTP por Versão STIHL AI v5
+=================================
+
+Respostas GET que só mudam quando o catálogo muda: ETag forte derivado
+de (versão do catálogo, caminho e query string), ``Cache-Control`` para
+clientes e CDN e ``304 Not Modified`` para If-None-Match correspondente.
+
+Funcionalidades:
+- 304 sem executar a rota (nem consultar o banco)
+- Corpo da resposta 200 guardado em memória por (versão, URL): repetir a
+  mesma URL na mesma versão também não consulta o banco
+- Versão desconhecida (None): a rota responde normalmente, sem ETag
+- Rotas servidas de um snapshot em memória marcam a resposta com
+  ``snapshot_response``: snapshot de outra versão (ainda recarregando)
+  sai como ``no-store``, sem ETag e fora do cache de corpos
+
+Configuração via ambiente:
+- CATALOG_CACHE_MAX_AGE_S: max-age do Cache-Control (padrão: 300)
+- CATALOG_RESPONSE_CACHE_MAX_ENTRIES / _MAX_BYTES / _TTL_S / _SHARDS:
+  limites do cache de corpos (ver utils.cache)
+"""
+
+import os
+import hashlib
+import threading
+from functools import wraps
+from typing import Callable, Dict, Optional
+
+from flask import Response, g, make_response, request
+
+from src.utils.cache import ShardedLRUCache
+
+_responses: Optional[ShardedLRUCache] = None
+_responses_lock = threading.Lock()
+_stats = {"not_modified": 0, "served_from_memory": 0, "rendered": 0}
+_stats_lock = threading.Lock()
+
+
+def _count(name: str):
+    with _stats_lock:
+        _stats[name] += 1
+
+
+def _response_cache() -> ShardedLRUCache:
+    global _responses
+    if _responses is None:
+        with _responses_lock:
+            if _responses is None:
+                _responses = ShardedLRUCache.from_env("CATALOG_RESPONSE_CACHE")
+    return _responses
+
+
+def _max_age() -> int:
+    try:
+        return int(os.getenv("CATALOG_CACHE_MAX_AGE_S", 300))
+    except ValueError:
+        return 300
+
+
+def version_etag(version: int, path: str) -> str:
+    return hashlib.sha256(f"{version}:{path}".encode()).hexdigest()[:32]
+
+
+def _decorate(response: Response, etag: str, version: int) -> Response:
+    response.set_etag(etag)
+    response.headers["Cache-Control"] = f"public, max-age={_max_age()}, must-revalidate"
+    response.headers["X-Catalog-Version"] = str(version)
+    return response
+
+
+def snapshot_response(response: Response, version: Optional[int]) -> Response:
+    """
+    Resposta montada de dados da versão ``version`` do catálogo
+
+    Se não for a versão desta requisição (ETag), a resposta não pode ser
+    guardada sob ela: sai como no-store e catalog_versioned não a cacheia.
+    """
+    expected = g.get("catalog_version")
+    if expected is not None and version != expected:
+        response.headers["Cache-Control"] = "no-store"
+    return response
+
+
+def catalog_versioned(get_version: Callable[[], Optional[int]]):
+    """
+    Decorador de rotas GET cujo conteúdo depende só do catálogo
+
+    Args:
+        get_version: Função que devolve a versão atual do catálogo (ou None)
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            version = get_version() if request.method == "GET" else None
+            if version is None:
+                return view(*args, **kwargs)
+
+            key = request.full_path
+            etag = version_etag(version, key)
+            if request.if_none_match.contains_weak(etag):
+                _count("not_modified")
+                return _decorate(Response(status=304), etag, version)
+
+            cache = _response_cache()
+            cached = cache.get((version, key))
+            if cached is not None:
+                _count("served_from_memory")
+                body, mimetype = cached
+                return _decorate(Response(body, mimetype=mimetype), etag, version)
+
+            g.catalog_version = version
+            response = make_response(view(*args, **kwargs))
+            # Erros, 404 e snapshots de outra versão não entram no cache nem recebem ETag
+            if (response.status_code != 200 or response.is_streamed
+                    or "no-store" in response.headers.get("Cache-Control", "")):
+                return response
+            _count("rendered")
+            cache.set((version, key), (response.get_data(), response.mimetype))
+            return _decorate(response, etag, version)
+        return wrapper
+    return decorator
+
+
+def http_cache_stats() -> Dict:
+    with _stats_lock:
+        stats = dict(_stats)
+    stats["responses"] = _responses.stats() if _responses is not None else None
+    return stats
@@ -0,0 +1,303 @@
+"""
+Métricas STIHL AI v5
+====================
+
+Contadores e histogramas no formato de texto do Prometheus, expostos em
+GET /metrics (ver routes.metrics_api).
+
+Funcionalidades:
+- Acumuladores por thread: ``inc``/``observe`` só tocam o dicionário da
+  própria thread (threading.local), sem lock no caminho da requisição;
+  a leitura soma os dicionários de todas as threads na coleta
+- Threads encerradas têm os valores incorporados a um acumulador único
+  na coleta seguinte (nada se perde com o giro de threads)
+- ``stage``: cronometra uma etapa da requisição (intenção, LLM, banco,
+  formatação, envio ao Telegram) com o endpoint como rótulo
+- Coletores: funções chamadas na coleta para valores instantâneos
+  (uso do pool, profundidade de filas, taxa de acerto dos caches)
+- Métricas de requisição HTTP instaladas na app por ``install``
+"""
+
+import time
+import bisect
+import weakref
+import threading
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+# (nome, ajuda, tipo, [(rótulos, valor), ...])
+Sample = Tuple[str, str, str, List[Tuple[Dict[str, str], float]]]
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names: Sequence[str], values: Sequence, extra: str = "") -> str:
+    parts = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _number(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) and not value.is_integer() else str(int(value))
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, registry: "MetricsRegistry", name: str, help: str, labelnames: Sequence[str]):
+        self.registry = registry
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, *labels, amount: float = 1.0):
+        shard = self.registry._shard()
+        key = (self.name, labels)
+        cell = shard.get(key)
+        if cell is None:
+            shard[key] = [amount]
+        else:
+            cell[0] += amount
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, registry, name, help, labelnames, buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(registry, name, help, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, *labels):
+        shard = self.registry._shard()
+        key = (self.name, labels)
+        cell = shard.get(key)
+        if cell is None:
+            # Contagem por faixa (não cumulativa), +Inf, soma e total
+            cell = shard[key] = [0] * (len(self.buckets) + 1) + [0.0, 0]
+        cell[bisect.bisect_left(self.buckets, value)] += 1
+        cell[-2] += value
+        cell[-1] += 1
+
+    @contextmanager
+    def time(self, *labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, *labels)
+
+
+class MetricsRegistry:
+    """Métricas registradas e os acumuladores por thread"""
+
+    def __init__(self, prefix: str = "stihl"):
+        self.prefix = prefix
+        self._metrics: Dict[str, _Metric] = {}
+        self._collectors: List[Callable[[], Iterable[Sample]]] = []
+        self._local = threading.local()
+        self._shards: List[Tuple[weakref.ref, Dict]] = []
+        self._retired: Dict = {}
+        self._lock = threading.Lock()
+
+    def _shard(self) -> Dict:
+        shard = getattr(self._local, "shard", None)
+        if shard is None:
+            # Uma vez por thread: registra o dicionário para a coleta
+            shard = self._local.shard = {}
+            with self._lock:
+                self._shards.append((weakref.ref(threading.current_thread()), shard))
+        return shard
+
+    def _register(self, metric: _Metric) -> _Metric:
+        with self._lock:
+            existing = self._metrics.get(metric.name)
+            if existing is not None:
+                return existing
+            self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, help: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self._register(Counter(self, f"{self.prefix}_{name}", help, labelnames))
+
+    def histogram(self, name: str, help: str, labelnames: Sequence[str] = (),
+                  buckets: Sequence[float] = DEFAULT_BUCKETS) -> Histogram:
+        return self._register(Histogram(self, f"{self.prefix}_{name}", help, labelnames, buckets))
+
+    def add_collector(self, collector: Callable[[], Iterable[Sample]]):
+        with self._lock:
+            if collector not in self._collectors:
+                self._collectors.append(collector)
+
+    @staticmethod
+    def _merge(into: Dict, shard: Dict):
+        for key, cell in shard.items():
+            total = into.get(key)
+            if total is None:
+                into[key] = list(cell)
+            else:
+                for i, value in enumerate(cell):
+                    total[i] += value
+
+    def totals(self) -> Dict:
+        """Soma dos acumuladores de todas as threads"""
+        totals: Dict = {}
+        with self._lock:
+            alive = []
+            for ref, shard in self._shards:
+                if ref() is None or not ref().is_alive():
+                    # A thread não escreve mais: o valor vai para o acumulador único
+                    self._merge(self._retired, shard.copy())
+                else:
+                    alive.append((ref, shard))
+            self._shards = alive
+            self._merge(totals, self._retired)
+            shards = [shard for _, shard in alive]
+        for shard in shards:
+            # dict.copy/list() são atômicos sob o GIL: leitura sem travar a dona
+            self._merge(totals, {key: list(cell) for key, cell in shard.copy().items()})
+        return totals
+
+    def value(self, name: str, *labels) -> Optional[List]:
+        """Valor agregado de uma série (testes e diagnóstico)"""
+        return self.totals().get((f"{self.prefix}_{name}", labels))
+
+    def render(self) -> str:
+        """Todas as métricas no formato de texto do Prometheus (0.0.4)"""
+        totals = self.totals()
+        by_metric: Dict[str, List[Tuple[Tuple, List]]] = {}
+        for (name, labels), cell in totals.items():
+            by_metric.setdefault(name, []).append((labels, cell))
+
+        lines: List[str] = []
+        with self._lock:
+            metrics = list(self._metrics.values())
+            collectors = list(self._collectors)
+        for metric in metrics:
+            series = sorted(by_metric.get(metric.name, []), key=lambda s: tuple(map(str, s[0])))
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            for labels, cell in series:
+                if metric.kind == "counter":
+                    lines.append(f"{metric.name}{_labels(metric.labelnames, labels)} {_number(cell[0])}")
+                    continue
+                cumulative = 0
+                for bound, count in zip(metric.buckets + (float("inf"),), cell[:-2]):
+                    cumulative += count
+                    le = f'le="{_number(bound)}"'
+                    lines.append(f"{metric.name}_bucket{_labels(metric.labelnames, labels, le)} {cumulative}")
+                lines.append(f"{metric.name}_sum{_labels(metric.labelnames, labels)} {_number(cell[-2])}")
+                lines.append(f"{metric.name}_count{_labels(metric.labelnames, labels)} {cell[-1]}")
+
+        for collector in collectors:
+            try:
+                samples = list(collector())
+            except Exception as e:
+                lines.append(f"# coletor {getattr(collector, '__name__', collector)} falhou: {_escape(e)}")
+                continue
+            for name, help, kind, values in samples:
+                name = f"{self.prefix}_{name}"
+                lines.append(f"# HELP {name} {help}")
+                lines.append(f"# TYPE {name} {kind}")
+                for labels, value in values:
+                    if value is None:
+                        continue
+                    lines.append(f"{name}{_labels(list(labels), list(labels.values()))} {_number(value)}")
+        return "\n".join(lines) + "\n"
+
+
+registry = MetricsRegistry()
+
+http_requests = registry.counter(
+    "http_requests_total", "Requisições HTTP atendidas", ("endpoint", "method", "status"))
+http_duration = registry.histogram(
+    "http_request_duration_seconds", "Duração das requisições HTTP", ("endpoint",))
+stage_duration = registry.histogram(
+    "stage_duration_seconds", "Duração de cada etapa do atendimento", ("stage", "endpoint"))
+stage_errors = registry.counter(
+    "stage_errors_total", "Etapas encerradas com exceção", ("stage", "endpoint"))
+search_results = registry.counter(
+    "search_results_total", "Resultados de busca entregues por tabela de origem", ("endpoint", "source_table"))
+
+
+def current_endpoint() -> str:
+    """Endpoint da requisição atual, o vinculado à thread, ou "background" """
+    bound = getattr(_context, "endpoint", None)
+    if bound:
+        return bound
+    try:
+        from flask import has_request_context, request
+        if has_request_context():
+            return request.endpoint or "unmatched"
+    except ImportError:
+        pass
+    return "background"
+
+
+_context = threading.local()
+
+
+@contextmanager
+def bind_endpoint(endpoint: str):
+    """Rótulo de endpoint para o trabalho fora de requisição (ex.: fila do Telegram)"""
+    previous = getattr(_context, "endpoint", None)
+    _context.endpoint = endpoint
+    try:
+        yield
+    finally:
+        _context.endpoint = previous
+
+
+@contextmanager
+def stage(name: str, endpoint: Optional[str] = None):
+    """Cronometra uma etapa; exceções são contadas e propagadas"""
+    endpoint = endpoint or current_endpoint()
+    start = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        stage_errors.inc(name, endpoint)
+        raise
+    finally:
+        stage_duration.observe(time.perf_counter() - start, name, endpoint)
+
+
+def count_results(results: Iterable, endpoint: Optional[str] = None):
+    """Resultados entregues por source_table"""
+    endpoint = endpoint or current_endpoint()
+    counts: Dict[str, int] = {}
+    for result in results:
+        table = getattr(result, "source_table", None) or "desconhecida"
+        counts[table] = counts.get(table, 0) + 1
+    for table, n in counts.items():
+        search_results.inc(endpoint, table, amount=n)
+
+
+def install(app):
+    """Conta e cronometra todas as requisições da app"""
+    from flask import g, request
+
+    @app.before_request
+    def _metrics_start():
+        g._metrics_start = time.perf_counter()
+
+    @app.after_request
+    def _metrics_record(response):
+        start = g.pop("_metrics_start", None)
+        if start is not None:
+            endpoint = request.endpoint or "unmatched"
+            http_duration.observe(time.perf_counter() - start, endpoint)
+            http_requests.inc(endpoint, request.method, str(response.status_code))
+        return response
+
+    return app
@@ -0,0 +1,113 @@
+"""
+Paginação por Cursor STIHL AI v5
+================================
+
+Cursores opacos para paginação keyset: o cursor carrega os valores de
+ordenação do último item entregue e a próxima página começa logo depois
+dele (WHERE (chave) > (valores) ... LIMIT n), com o mesmo custo da
+primeira página e sem repetir itens já baixados.
+
+Funcionalidades:
+- Cursor = base64url(JSON) + assinatura HMAC truncada: o cliente não
+  monta nem altera cursores
+- Escopo: o cursor só vale para a mesma consulta/ordenação em que nasceu
+- ``page_size`` com teto, comum às rotas paginadas
+
+Configuração via ambiente:
+- PAGINATION_SECRET: chave da assinatura (padrão: SECRET_KEY; sem nenhuma
+  das duas, chave aleatória do processo: cursores não valem entre workers
+  nem após reinício)
+- PAGINATION_MAX_PAGE_SIZE: teto de itens por página (padrão: 100)
+"""
+
+import os
+import hmac
+import json
+import base64
+import hashlib
+import logging
+import secrets
+import threading
+from typing import Any, List, Optional, Sequence
+
+logger = logging.getLogger(__name__)
+
+_fallback_secret: Optional[bytes] = None
+_fallback_lock = threading.Lock()
+
+
+class CursorError(ValueError):
+    """Cursor malformado, adulterado ou de outra consulta"""
+
+
+def _secret() -> bytes:
+    global _fallback_secret
+    configured = os.getenv("PAGINATION_SECRET") or os.getenv("SECRET_KEY")
+    if configured:
+        return configured.encode()
+    if _fallback_secret is None:
+        with _fallback_lock:
+            if _fallback_secret is None:
+                logger.warning("PAGINATION_SECRET e SECRET_KEY ausentes: cursores assinados com chave "
+                               "aleatória deste processo (inválidos em outros workers e após reinício)")
+                _fallback_secret = secrets.token_bytes(32)
+    return _fallback_secret
+
+
+def _sign(payload: bytes) -> str:
+    digest = hmac.new(_secret(), payload, hashlib.sha256).digest()[:12]
+    return base64.urlsafe_b64encode(digest).decode().rstrip("=")
+
+
+def _b64decode(text: str) -> bytes:
+    return base64.urlsafe_b64decode(text + "=" * (-len(text) % 4))
+
+
+def encode_cursor(scope: str, values: Sequence[Any]) -> str:
+    """
+    Cursor opaco para os valores de ordenação do último item
+
+    Args:
+        scope: Identifica a consulta e a ordenação (ex.: "search:<chave>")
+        values: Valores da chave keyset, na ordem do ORDER BY
+    """
+    payload = json.dumps([scope, list(values)], separators=(",", ":"), ensure_ascii=False).encode()
+    return base64.urlsafe_b64encode(payload).decode().rstrip("=") + "." + _sign(payload)
+
+
+def decode_cursor(cursor: Optional[str], scope: str) -> Optional[List[Any]]:
+    """
+    Valores keyset do cursor, ou None sem cursor
+
+    Raises:
+        CursorError: Cursor inválido, adulterado ou de outro escopo
+    """
+    if not cursor:
+        return None
+    try:
+        body, signature = str(cursor).rsplit(".", 1)
+        payload = _b64decode(body)
+    except (ValueError, TypeError):
+        raise CursorError("Cursor inválido")
+    if not hmac.compare_digest(signature, _sign(payload)):
+        raise CursorError("Cursor inválido")
+    try:
+        cursor_scope, values = json.loads(payload)
+    except (ValueError, TypeError):
+        raise CursorError("Cursor inválido")
+    if cursor_scope != scope or not isinstance(values, list):
+        raise CursorError("Cursor não pertence a esta consulta")
+    return values
+
+
+def page_size(value, default: int = 20) -> int:
+    """Tamanho de página entre 1 e PAGINATION_MAX_PAGE_SIZE"""
+    try:
+        maximum = int(os.getenv("PAGINATION_MAX_PAGE_SIZE", 100))
+    except ValueError:
+        maximum = 100
+    try:
+        size = int(value) if value not in (None, "") else default
+    except (TypeError, ValueError):
+        size = default
+    return max(1, min(size, maximum))
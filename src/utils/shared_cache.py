@@ -0,0 +1,244 @@
+"""
+Cache de Dois Níveis STIHL AI v5
+================================
+
+L1 em memória (ShardedLRUCache) na frente de um L2 compartilhado em
+``query_cache_v5``, de modo que os resultados sobrevivem a reinícios e
+são aproveitados por todos os workers.
+
+Funcionalidades:
+- Leitura L1 -> L2; acerto no L2 repovoa o L1 com o TTL restante
+- Escrita em ambos os níveis (set_cached_result_v5)
+- Contagem de acertos acumulada em memória e gravada em lote
+  (record_cache_hits_v5), em vez de um UPDATE por leitura
+- Varredura periódica de cleanup_expired_cache_v5(), executada por um
+  único worker por vez (advisory lock)
+- Falhas do L2 não interrompem a busca: o cache degrada para só L1
+
+Configuração via ambiente:
+- SEARCH_CACHE_L2: "postgres" habilita o L2 (padrão: "off")
+- SEARCH_CACHE_FLUSH_S: intervalo de gravação dos acertos (padrão: 10)
+- SEARCH_CACHE_SWEEP_S: intervalo da limpeza de expirados (padrão: 300)
+"""
+
+import math
+import time
+import atexit
+import logging
+import threading
+from typing import Any, Callable, Dict, Optional
+
+from psycopg2.extras import Json
+
+from src.utils.cache import ShardedLRUCache
+
+logger = logging.getLogger(__name__)
+
+_MISSING = object()
+
+MAX_PENDING_KEYS = 10000
+
+GET_SQL = """
+    SELECT query_result, EXTRACT(EPOCH FROM expires_at - NOW())
+    FROM query_cache_v5
+    WHERE cache_key = %s AND expires_at > NOW()
+"""
+
+SET_SQL = "SELECT set_cached_result_v5(%s, %s, %s)"
+
+FLUSH_SQL = "SELECT record_cache_hits_v5(%s::VARCHAR[], %s::INTEGER[])"
+
+# Só o worker que obtiver o lock executa a limpeza neste ciclo
+SWEEP_SQL = """
+    SELECT CASE WHEN pg_try_advisory_xact_lock(hashtext('cleanup_expired_cache_v5'))
+                THEN cleanup_expired_cache_v5() END
+"""
+
+
+class TwoTierCache:
+    """
+    Cache L1 (processo) + L2 (query_cache_v5).
+
+    Os valores são gravados no L2 como JSONB: ``encode`` converte o valor
+    em algo serializável e ``decode`` faz o caminho inverso na leitura.
+    """
+
+    def __init__(self, l1: ShardedLRUCache, dsn: Optional[str] = None,
+                 namespace: str = "", encode: Callable[[Any], Any] = lambda v: v,
+                 decode: Callable[[Any], Any] = lambda v: v,
+                 flush_interval: float = 10.0, sweep_interval: float = 300.0,
+                 error_backoff: float = 30.0):
+        self.l1 = l1
+        self.dsn = dsn
+        self.namespace = namespace
+        self.ttl = l1.ttl
+        self._encode = encode
+        self._decode = decode
+        self.flush_interval = flush_interval
+        self.sweep_interval = sweep_interval
+        self.error_backoff = error_backoff
+
+        self._lock = threading.Lock()
+        self._pending_hits: Dict[str, int] = {}
+        self._l2_disabled_until = 0.0
+        self._next_sweep = time.monotonic() + sweep_interval
+        self._stop = threading.Event()
+        self._worker: Optional[threading.Thread] = None
+        self._stats = {"l2_hits": 0, "l2_misses": 0, "l2_sets": 0, "l2_errors": 0,
+                       "hit_flushes": 0, "hits_flushed": 0, "sweeps": 0, "swept_rows": 0}
+
+    # ---- infraestrutura ----
+
+    def _count(self, name: str, n: int = 1):
+        with self._lock:
+            self._stats[name] += n
+
+    def _l2_key(self, key: str) -> str:
+        return self.namespace + key
+
+    def _l2_available(self) -> bool:
+        return time.monotonic() >= self._l2_disabled_until
+
+    def _l2_failed(self, action: str, error: Exception):
+        self._count("l2_errors")
+        self._l2_disabled_until = time.monotonic() + self.error_backoff
+        logger.warning("Cache L2 indisponível (%s), usando só L1 por %.0fs: %s",
+                       action, self.error_backoff, error)
+
+    def _execute(self, sql: str, params=()):
+        from src.utils.db_pool import connection
+        with connection(self.dsn) as conn:
+            with conn.cursor() as cur:
+                cur.execute(sql, params)
+                return cur.fetchone()
+
+    def _ensure_worker(self):
+        if self._worker is not None and self._worker.is_alive():
+            return
+        with self._lock:
+            if self._worker is not None and self._worker.is_alive():
+                return
+            # Iniciado na primeira operação: sobrevive ao fork dos workers
+            self._worker = threading.Thread(target=self._run, name="query-cache-flush",
+                                            daemon=True)
+            self._worker.start()
+            atexit.register(self.close)
+
+    def _run(self):
+        while not self._stop.wait(self.flush_interval):
+            self.flush_hits()
+            if time.monotonic() >= self._next_sweep:
+                self._next_sweep = time.monotonic() + self.sweep_interval
+                self.sweep()
+
+    # ---- operações ----
+
+    def _record_hit(self, l2_key: str):
+        with self._lock:
+            self._pending_hits[l2_key] = self._pending_hits.get(l2_key, 0) + 1
+
+    def get(self, key: str, default: Any = None) -> Any:
+        """Consulta L1 e, na falta, o L2; acertos são contabilizados em lote"""
+        self._ensure_worker()
+        l2_key = self._l2_key(key)
+        value = self.l1.get(key, _MISSING)
+        if value is not _MISSING:
+            self._record_hit(l2_key)
+            return value
+        if not self._l2_available():
+            return default
+
+        try:
+            row = self._execute(GET_SQL, (l2_key,))
+        except Exception as e:
+            self._l2_failed("leitura", e)
+            return default
+        if not row:
+            self._count("l2_misses")
+            return default
+
+        payload, remaining = row
+        try:
+            value = self._decode(payload)
+        except Exception as e:
+            logger.warning("Entrada inválida no cache L2 (%s): %s", l2_key, e)
+            self._count("l2_misses")
+            return default
+        self._count("l2_hits")
+        self._record_hit(l2_key)
+        self.l1.set(key, value, ttl=min(self.ttl, float(remaining)))
+        return value
+
+    def set(self, key: str, value: Any):
+        """Grava no L1 e no L2 (TTL do L2 arredondado para cima em minutos)"""
+        self._ensure_worker()
+        self.l1.set(key, value)
+        if not self._l2_available():
+            return
+        try:
+            ttl_minutes = max(1, math.ceil(self.ttl / 60))
+            self._execute(SET_SQL, (self._l2_key(key), Json(self._encode(value)), ttl_minutes))
+            self._count("l2_sets")
+        except Exception as e:
+            self._l2_failed("escrita", e)
+
+    def flush_hits(self) -> int:
+        """Grava os acertos acumulados; em caso de falha eles são reacumulados"""
+        with self._lock:
+            pending, self._pending_hits = self._pending_hits, {}
+        if not pending or not self._l2_available():
+            if pending:
+                self._merge_pending(pending)
+            return 0
+        keys = list(pending)
+        try:
+            self._execute(FLUSH_SQL, (keys, [pending[k] for k in keys]))
+        except Exception as e:
+            self._merge_pending(pending)
+            self._l2_failed("contagem de acertos", e)
+            return 0
+        with self._lock:
+            self._stats["hit_flushes"] += 1
+            self._stats["hits_flushed"] += sum(pending.values())
+        return len(keys)
+
+    def _merge_pending(self, pending: Dict[str, int]):
+        with self._lock:
+            for key, hits in pending.items():
+                # L2 fora do ar por muito tempo: descarta contagens de chaves novas
+                if key not in self._pending_hits and len(self._pending_hits) >= MAX_PENDING_KEYS:
+                    continue
+                self._pending_hits[key] = self._pending_hits.get(key, 0) + hits
+
+    def sweep(self) -> Optional[int]:
+        """Executa cleanup_expired_cache_v5() se nenhum outro worker estiver executando"""
+        if not self._l2_available():
+            return None
+        try:
+            row = self._execute(SWEEP_SQL)
+        except Exception as e:
+            self._l2_failed("limpeza", e)
+            return None
+        removed = row[0] if row else None
+        if removed is not None:
+            with self._lock:
+                self._stats["sweeps"] += 1
+                self._stats["swept_rows"] += removed
+        return removed
+
+    def clear(self):
+        """Limpa apenas o L1 (o L2 é compartilhado com os demais workers)"""
+        self.l1.clear()
+
+    def close(self):
+        self._stop.set()
+        self.flush_hits()
+
+    def stats(self) -> Dict:
+        stats = self.l1.stats()
+        with self._lock:
+            stats.update(self._stats)
+            stats["pending_hits"] = sum(self._pending_hits.values())
+        stats["l2_enabled"] = True
+        stats["l2_available"] = self._l2_available()
+        return stats
@@ -0,0 +1,568 @@
+"""
+Rastreamento de Requisições STIHL AI v5
+=======================================
+
+Spans leves ao longo do atendimento (busca, intenção, banco, LLM, envio
+ao Telegram) para responder "onde foram os 20 segundos?".
+
+Funcionalidades:
+- ID de requisição: X-Request-ID recebido (ou gerado) devolvido na
+  resposta; ``traceparent`` (W3C) continua um trace iniciado fora
+- Contexto propagado à fila do Telegram (``current_context`` no job e
+  ``span(..., parent=ctx)`` na thread que responde)
+- ``traced``: decorador que só abre span dentro de um trace ativo (fora
+  dele, custo de uma leitura de threading.local)
+- Amostragem na origem (TRACE_SAMPLE_RATE, herdada pelo contexto), mais
+  retenção de todo trecho lento ou com erro, mesmo não amostrado
+- Últimos traces em memória para GET /api/debug/trace/<id> (cascata)
+- Exportação em segundo plano: arquivo JSON Lines ou coletor OTLP/HTTP
+  (JSON); fila cheia descarta, a requisição nunca espera
+
+Configuração via ambiente:
+- TRACING: "on" (padrão) ou "off"
+- TRACE_SAMPLE_RATE: fração dos traces iniciados aqui que é retida (padrão: 0.05)
+- TRACE_SLOW_MS: trecho acima disso é retido mesmo sem amostragem (padrão: 2000)
+- TRACE_STORE_MAX: traces mantidos em memória (padrão: 500)
+- TRACE_EXPORT: jsonl, otlp ou none (padrão: none)
+- TRACE_EXPORT_PATH: arquivo JSON Lines (padrão: instance/traces.jsonl)
+- TRACE_EXPORT_MAX_BYTES: tamanho antes do giro para .1 (padrão: 64 MiB)
+- TRACE_OTLP_ENDPOINT: coletor (padrão: http://localhost:4318/v1/traces)
+- TRACE_SERVICE_NAME: service.name no OTLP (padrão: stihl-ai)
+"""
+
+import os
+import re
+import json
+import time
+import queue
+import random
+import logging
+import functools
+import threading
+from collections import OrderedDict, namedtuple
+from contextlib import contextmanager
+from typing import Callable, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_EXPORT_PATH = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))),
+    "instance", "traces.jsonl",
+)
+
+REQUEST_ID_HEADER = "X-Request-ID"
+REQUEST_ID_RE = re.compile(r"^[A-Za-z0-9._:-]{1,64}$")
+TRACEPARENT_RE = re.compile(r"^00-([0-9a-f]{32})-([0-9a-f]{16})-([0-9a-f]{2})$")
+
+# Posição no trace distribuído: o suficiente para continuar em outra thread
+SpanContext = namedtuple("SpanContext", "trace_id span_id sampled request_id")
+
+
+def _new_id(nbytes: int) -> str:
+    return os.urandom(nbytes).hex()
+
+
+class Span:
+    """
+    Um trecho cronometrado; ``attributes`` aceita valores simples
+
+    Os spans vão para memória e exportadores: não anexe texto digitado
+    pelo usuário nem identificadores de pessoas (consulta, chat_id, IP).
+    """
+
+    __slots__ = ("name", "trace_id", "span_id", "parent_id", "sampled", "request_id",
+                 "start_ns", "duration_ms", "attributes", "error", "_t0")
+
+    def __init__(self, name: str, trace_id: str, parent_id: Optional[str], sampled: bool,
+                 request_id: Optional[str], attributes: Optional[Dict] = None):
+        self.name = name
+        self.trace_id = trace_id
+        self.span_id = _new_id(8)
+        self.parent_id = parent_id
+        self.sampled = sampled
+        self.request_id = request_id
+        self.start_ns = time.time_ns()
+        self.duration_ms: Optional[float] = None
+        self.attributes = dict(attributes or {})
+        self.error: Optional[str] = None
+        self._t0 = time.perf_counter()
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+
+    def context(self) -> SpanContext:
+        return SpanContext(self.trace_id, self.span_id, self.sampled, self.request_id)
+
+    def to_dict(self) -> Dict:
+        return {
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "request_id": self.request_id,
+            "name": self.name,
+            "start_ns": self.start_ns,
+            "duration_ms": self.duration_ms,
+            "attributes": self.attributes,
+            "error": self.error,
+        }
+
+
+class TraceStore:
+    """Últimos traces (trace_id -> spans) com busca também pelo ID de requisição"""
+
+    def __init__(self, max_traces: int = 500):
+        self.max_traces = max_traces
+        self._traces: "OrderedDict[str, List[Dict]]" = OrderedDict()
+        self._by_request: Dict[str, str] = {}
+        self._lock = threading.Lock()
+
+    def add(self, spans: List[Dict]):
+        if not spans:
+            return
+        trace_id = spans[0]["trace_id"]
+        with self._lock:
+            stored = self._traces.pop(trace_id, [])
+            stored.extend(spans)
+            self._traces[trace_id] = stored
+            for span in spans:
+                if span["request_id"]:
+                    self._by_request[span["request_id"]] = trace_id
+            while len(self._traces) > self.max_traces:
+                old_id, old = self._traces.popitem(last=False)
+                for span in old:
+                    if self._by_request.get(span["request_id"]) == old_id:
+                        del self._by_request[span["request_id"]]
+
+    def get(self, trace_or_request_id: str) -> Optional[List[Dict]]:
+        with self._lock:
+            trace_id = self._by_request.get(trace_or_request_id, trace_or_request_id)
+            spans = self._traces.get(trace_id)
+            return list(spans) if spans is not None else None
+
+    def recent(self, limit: int = 50) -> List[Dict]:
+        """Resumo dos traces mais novos primeiro"""
+        with self._lock:
+            traces = list(self._traces.items())[-limit:]
+        summary = []
+        for trace_id, spans in reversed(traces):
+            ids = {s["span_id"] for s in spans}
+            roots = [s for s in spans if s["parent_id"] not in ids]
+            first = min(roots or spans, key=lambda s: s["start_ns"])
+            summary.append({
+                "trace_id": trace_id,
+                "request_id": first["request_id"],
+                "name": first["name"],
+                "started_at": first["start_ns"] // 1_000_000,
+                "duration_ms": first["duration_ms"],
+                "spans": len(spans),
+                "errors": sum(1 for s in spans if s["error"]),
+            })
+        return summary
+
+    def __len__(self):
+        with self._lock:
+            return len(self._traces)
+
+
+def waterfall(spans: List[Dict]) -> List[Dict]:
+    """
+    Spans em ordem de cascata: cada filho logo após o pai, com
+    deslocamento desde o início do trace e profundidade
+
+    Spans cujo pai não foi retido (ex.: trecho rápido não amostrado)
+    aparecem como raízes.
+    """
+    if not spans:
+        return []
+    ids = {s["span_id"] for s in spans}
+    children: Dict[Optional[str], List[Dict]] = {}
+    for s in spans:
+        parent = s["parent_id"] if s["parent_id"] in ids else None
+        children.setdefault(parent, []).append(s)
+    origin = min(s["start_ns"] for s in spans)
+
+    rows: List[Dict] = []
+
+    def walk(parent: Optional[str], depth: int):
+        for s in sorted(children.get(parent, []), key=lambda x: x["start_ns"]):
+            row = dict(s)
+            row["offset_ms"] = round((s["start_ns"] - origin) / 1e6, 2)
+            row["depth"] = depth
+            rows.append(row)
+            walk(s["span_id"], depth + 1)
+
+    walk(None, 0)
+    return rows
+
+
+def render_waterfall(rows: List[Dict], width: int = 40) -> str:
+    """Cascata em texto: início, duração, barra proporcional e nome"""
+    if not rows:
+        return ""
+    total = max(r["offset_ms"] + (r["duration_ms"] or 0) for r in rows) or 1.0
+    lines = [f"trace {rows[0]['trace_id']}  request_id={rows[0]['request_id'] or '-'}  {total:.1f} ms"]
+    for r in rows:
+        start = int(r["offset_ms"] / total * width)
+        length = max(1, int((r["duration_ms"] or 0) / total * width))
+        bar = (" " * start + "#" * length)[:width].ljust(width)
+        flag = "  !" + r["error"] if r["error"] else ""
+        lines.append(f"{r['offset_ms']:9.1f} {r['duration_ms'] or 0:9.1f} ms |{bar}| "
+                     f"{'  ' * r['depth']}{r['name']}{flag}")
+    return "\n".join(lines) + "\n"
+
+
+class JsonLinesWriter:
+    """Um span por linha; gira para ``<path>.1`` acima de ``max_bytes``"""
+
+    def __init__(self, path: str, max_bytes: int = 64 * 1024 * 1024):
+        self.path = path
+        self.max_bytes = max_bytes
+
+    def __call__(self, spans: List[Dict]):
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        try:
+            if os.path.getsize(self.path) > self.max_bytes:
+                os.replace(self.path, self.path + ".1")
+        except OSError:
+            pass
+        with open(self.path, "a", encoding="utf-8") as fh:
+            for span in spans:
+                fh.write(json.dumps(span, ensure_ascii=False, default=str) + "\n")
+
+
+def _otlp_value(value) -> Dict:
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+
+def otlp_payload(spans: List[Dict], service_name: str = "stihl-ai") -> Dict:
+    """Corpo OTLP/HTTP em JSON (ExportTraceServiceRequest)"""
+    encoded = []
+    for s in spans:
+        attributes = dict(s["attributes"])
+        if s["request_id"]:
+            attributes["request.id"] = s["request_id"]
+        span = {
+            "traceId": s["trace_id"],
+            "spanId": s["span_id"],
+            "name": s["name"],
+            "kind": 2 if s["parent_id"] is None else 1,
+            "startTimeUnixNano": str(s["start_ns"]),
+            "endTimeUnixNano": str(s["start_ns"] + int((s["duration_ms"] or 0) * 1e6)),
+            "attributes": [{"key": k, "value": _otlp_value(v)} for k, v in attributes.items()],
+            "status": {"code": 2, "message": s["error"]} if s["error"] else {"code": 1},
+        }
+        if s["parent_id"]:
+            span["parentSpanId"] = s["parent_id"]
+        encoded.append(span)
+    return {"resourceSpans": [{
+        "resource": {"attributes": [{"key": "service.name", "value": {"stringValue": service_name}}]},
+        "scopeSpans": [{"scope": {"name": "stihl.tracing"}, "spans": encoded}],
+    }]}
+
+
+class OtlpWriter:
+    """POST dos spans para um coletor OTLP/HTTP (ex.: OpenTelemetry Collector, Jaeger)"""
+
+    def __init__(self, endpoint: str, service_name: str = "stihl-ai", timeout: float = 5.0):
+        import requests
+        self.endpoint = endpoint
+        self.service_name = service_name
+        self.timeout = timeout
+        self._session = requests.Session()
+
+    def __call__(self, spans: List[Dict]):
+        response = self._session.post(self.endpoint, json=otlp_payload(spans, self.service_name),
+                                      timeout=self.timeout)
+        response.raise_for_status()
+
+
+class TraceExporter:
+    """Fila limitada e uma thread que entrega os trechos retidos ao ``writer``"""
+
+    def __init__(self, writer: Callable[[List[Dict]], None], max_queue: int = 1000, batch_size: int = 100):
+        self.writer = writer
+        self.batch_size = batch_size
+        self._queue: "queue.Queue[List[Dict]]" = queue.Queue(maxsize=max_queue)
+        self._stats = {"exported": 0, "dropped": 0, "errors": 0}
+        self._thread = threading.Thread(target=self._run, name="trace-exporter", daemon=True)
+        self._thread.start()
+
+    def submit(self, spans: List[Dict]) -> bool:
+        try:
+            self._queue.put_nowait(spans)
+            return True
+        except queue.Full:
+            self._stats["dropped"] += len(spans)
+            return False
+
+    def _run(self):
+        while True:
+            batch = list(self._queue.get())
+            while len(batch) < self.batch_size:
+                try:
+                    batch.extend(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                self.writer(batch)
+                self._stats["exported"] += len(batch)
+            except Exception as e:
+                self._stats["errors"] += 1
+                self._stats["dropped"] += len(batch)
+                logger.warning("Falha ao exportar %d spans: %s", len(batch), e)
+
+    def stats(self) -> Dict:
+        return dict(self._stats, queue_depth=self._queue.qsize())
+
+
+class Tracer:
+    """Decide a retenção de cada trecho local e o entrega à memória e ao exportador"""
+
+    def __init__(self, sample_rate: float = 0.05, slow_ms: float = 2000.0,
+                 store: Optional[TraceStore] = None, exporter: Optional[TraceExporter] = None):
+        self.sample_rate = sample_rate
+        self.slow_ms = slow_ms
+        self.store = store or TraceStore()
+        self.exporter = exporter
+        self._stats = {"segments": 0, "kept": 0, "kept_slow": 0, "kept_error": 0}
+
+    def sample(self) -> bool:
+        return random.random() < self.sample_rate
+
+    def finish_segment(self, root: Span, spans: List[Span]):
+        """Chamado quando o span mais externo da thread termina"""
+        self._stats["segments"] += 1
+        if root.sampled:
+            reason = "kept"
+        elif any(s.error for s in spans):
+            reason = "kept_error"
+        elif root.duration_ms >= self.slow_ms:
+            reason = "kept_slow"
+        else:
+            return
+        self._stats[reason] += 1
+        records = [s.to_dict() for s in spans]
+        self.store.add(records)
+        if self.exporter is not None:
+            self.exporter.submit(records)
+
+    def stats(self) -> Dict:
+        stats = dict(self._stats, sample_rate=self.sample_rate, slow_ms=self.slow_ms,
+                     traces_in_memory=len(self.store))
+        if self.exporter is not None:
+            stats["export"] = self.exporter.stats()
+        return stats
+
+
+_local = threading.local()
+_tracer: Optional[Tracer] = None
+_tracer_lock = threading.Lock()
+
+
+def _env_int(name: str, default: int) -> int:
+    try:
+        return int(os.getenv(name, default))
+    except (TypeError, ValueError):
+        return default
+
+
+def _env_float(name: str, default: float) -> float:
+    try:
+        return float(os.getenv(name, default))
+    except (TypeError, ValueError):
+        return default
+
+
+def _build_exporter() -> Optional[TraceExporter]:
+    mode = os.getenv("TRACE_EXPORT", "none").lower()
+    if mode == "jsonl":
+        writer = JsonLinesWriter(os.getenv("TRACE_EXPORT_PATH") or DEFAULT_EXPORT_PATH,
+                                 _env_int("TRACE_EXPORT_MAX_BYTES", 64 * 1024 * 1024))
+    elif mode == "otlp":
+        writer = OtlpWriter(os.getenv("TRACE_OTLP_ENDPOINT") or "http://localhost:4318/v1/traces",
+                            os.getenv("TRACE_SERVICE_NAME") or "stihl-ai")
+    else:
+        return None
+    return TraceExporter(writer)
+
+
+def get_tracer() -> Optional[Tracer]:
+    """Obtém o tracer do processo, ou None se TRACING=off"""
+    global _tracer
+    if os.getenv("TRACING", "on").lower() == "off":
+        return None
+    if _tracer is None:
+        with _tracer_lock:
+            if _tracer is None:
+                _tracer = Tracer(
+                    sample_rate=_env_float("TRACE_SAMPLE_RATE", 0.05),
+                    slow_ms=_env_float("TRACE_SLOW_MS", 2000.0),
+                    store=TraceStore(_env_int("TRACE_STORE_MAX", 500)),
+                    exporter=_build_exporter(),
+                )
+    return _tracer
+
+
+def tracing_stats() -> Optional[Dict]:
+    """Métricas do tracer, ou None se ainda não criado"""
+    return _tracer.stats() if _tracer is not None else None
+
+
+def current_span() -> Optional[Span]:
+    stack = getattr(_local, "stack", None)
+    return stack[-1] if stack else None
+
+
+def current_context() -> Optional[SpanContext]:
+    """Contexto a levar junto com trabalho entregue a outra thread"""
+    span = current_span()
+    return span.context() if span is not None else None
+
+
+def annotate(**attributes):
+    """Acrescenta atributos ao span atual (nada fora de um trace)"""
+    span = current_span()
+    if span is not None:
+        span.set(**attributes)
+
+
+def record_error(error: BaseException):
+    """Marca o span atual com um erro tratado (o trecho passa a ser retido)"""
+    span = current_span()
+    if span is not None:
+        span.error = f"{type(error).__name__}: {error}"[:300]
+
+
+def start_span(name: str, parent: Optional[SpanContext] = None,
+               request_id: Optional[str] = None, **attributes) -> Optional[Span]:
+    """
+    Abre um span como filho do span atual da thread; sem span atual, abre
+    um trecho novo (continuando ``parent`` se informado, senão um trace novo)
+    """
+    tracer = get_tracer()
+    if tracer is None:
+        return None
+    stack = getattr(_local, "stack", None)
+    if stack is None:
+        stack = _local.stack = []
+    if stack:
+        top = stack[-1]
+        span = Span(name, top.trace_id, top.span_id, top.sampled, top.request_id, attributes)
+    elif parent is not None:
+        span = Span(name, parent.trace_id, parent.span_id, parent.sampled,
+                    request_id or parent.request_id, attributes)
+    else:
+        span = Span(name, _new_id(16), None, tracer.sample(), request_id, attributes)
+    if not stack:
+        _local.segment = []
+    stack.append(span)
+    return span
+
+
+def end_span(span: Optional[Span], error: Optional[BaseException] = None):
+    """Fecha o span; fechar o mais externo encerra o trecho da thread"""
+    if span is None:
+        return
+    span.duration_ms = round((time.perf_counter() - span._t0) * 1000, 3)
+    if error is not None and span.error is None:
+        span.error = f"{type(error).__name__}: {error}"[:300]
+    stack = getattr(_local, "stack", None) or []
+    # Spans abertos depois deste e não fechados (erro de uso) saem junto
+    while stack:
+        if stack.pop() is span:
+            break
+    segment = getattr(_local, "segment", None)
+    if segment is not None:
+        segment.append(span)
+    if not stack:
+        _local.segment = None
+        tracer = get_tracer()
+        if tracer is not None and segment:
+            tracer.finish_segment(span, segment)
+
+
+@contextmanager
+def span(name: str, parent: Optional[SpanContext] = None, **attributes):
+    s = start_span(name, parent, **attributes)
+    try:
+        yield s
+    except BaseException as e:
+        end_span(s, e)
+        raise
+    end_span(s)
+
+
+def traced(name: str):
+    """Decorador: span com o nome dado, só dentro de um trace já aberto"""
+    def decorate(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            if not getattr(_local, "stack", None):
+                return fn(*args, **kwargs)
+            with span(name):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorate
+
+
+def incoming_request_id(headers) -> Optional[str]:
+    """X-Request-ID do chamador, se for um identificador aceitável"""
+    request_id = (headers.get(REQUEST_ID_HEADER) or "").strip()
+    return request_id if REQUEST_ID_RE.match(request_id) else None
+
+
+def incoming_context(headers) -> Optional[SpanContext]:
+    """Contexto do chamador pelo cabeçalho traceparent (W3C), se houver"""
+    match = TRACEPARENT_RE.match((headers.get("traceparent") or "").strip().lower())
+    if not match:
+        return None
+    return SpanContext(match.group(1), match.group(2), bool(int(match.group(3), 16) & 1),
+                       incoming_request_id(headers))
+
+
+def install(app, exclude=("/metrics", "/api/debug/")):
+    """
+    Abre um span por requisição e devolve X-Request-ID e traceparent
+
+    Caminhos iniciados por ``exclude`` (coleta de métricas e a própria
+    consulta de traces) não são rastreados. O nome do span e ``http.route``
+    usam a regra da rota (``/product/<string:code>``), não o caminho, para
+    agrupar requisições da mesma rota; sem rota, "unmatched".
+    """
+    from flask import g, request
+
+    @app.before_request
+    def _trace_start():
+        if request.path.startswith(exclude):
+            return
+        route = request.url_rule.rule if request.url_rule is not None else "unmatched"
+        span = start_span(f"{request.method} {route}", incoming_context(request.headers),
+                          request_id=incoming_request_id(request.headers),
+                          **{"http.method": request.method, "http.route": route})
+        if span is not None:
+            # Sem ID do chamador, o próprio trace_id identifica a requisição
+            span.request_id = span.request_id or span.trace_id
+        g._trace_span = span
+
+    @app.after_request
+    def _trace_headers(response):
+        span = g.get("_trace_span")
+        if span is not None:
+            span.set(**{"http.status_code": response.status_code,
+                        "http.endpoint": request.endpoint or "unmatched"})
+            response.headers[REQUEST_ID_HEADER] = span.request_id
+            response.headers["traceparent"] = f"00-{span.trace_id}-{span.span_id}-{'01' if span.sampled else '00'}"
+        return response
+
+    @app.teardown_request
+    def _trace_end(error=None):
+        # Após o fim de respostas em streaming (NDJSON/CSV) também
+        end_span(g.pop("_trace_span", None), error)
+
+    return app
@@ -1,4 +1,8 @@
 import os, pytest
+
+# Testes não gravam o cache de intenções em instance/
+os.environ.setdefault("INTENT_CACHE", "off")
+
 from src.main import create_app
 
 @pytest.fixture(scope="session")
@@ -0,0 +1,159 @@
+import csv
+import json
+import threading
+
+import src.routes.search_api_v5 as api
+import src.services.analytics_sink as sink_mod
+from src.services.analytics_sink import AnalyticsSink, events_to_csv, search_event
+
+
+class Writer:
+    def __init__(self):
+        self.batches = []
+        self.fail = False
+        self.called = threading.Event()
+
+    def __call__(self, events):
+        self.called.set()
+        if self.fail:
+            raise RuntimeError("banco fora")
+        self.batches.append(list(events))
+
+    @property
+    def written(self):
+        return [e["query"] for batch in self.batches for e in batch]
+
+
+def test_emit_only_buffers_and_flush_writes_in_batches():
+    writer = Writer()
+    sink = AnalyticsSink(writer, batch_size=3, flush_interval=60)
+    for i in range(7):
+        assert sink.emit(search_event("search", f"q{i}", 1))
+    sink.flush()
+    assert [len(b) for b in writer.batches] == [3, 3, 1]
+    assert writer.written == [f"q{i}" for i in range(7)]
+    assert sink.stats()["written"] == 7 and sink.stats()["buffer_depth"] == 0
+    sink.close()
+
+
+def test_background_thread_flushes_full_batch():
+    writer = Writer()
+    sink = AnalyticsSink(writer, batch_size=2, flush_interval=60)
+    sink.emit(search_event("search", "a"))
+    sink.emit(search_event("search", "b"))
+    # Lote completo acorda a thread sem esperar o intervalo
+    assert writer.called.wait(5)
+    sink.close()
+    assert writer.written == ["a", "b"]
+
+
+def test_sampling_and_drop_under_load(monkeypatch):
+    writer = Writer()
+    sink = AnalyticsSink(writer, max_buffer=10, batch_size=100, flush_interval=60,
+                         high_water=0.5, min_sample_rate=0.1)
+    monkeypatch.setattr(sink_mod.random, "random", lambda: 0.0)
+    for i in range(12):
+        sink.emit(search_event("search", f"q{i}"))
+    stats = sink.stats()
+    assert stats["emitted"] == 10 and stats["dropped"] == 2
+    rates = [e["sample_rate"] for e in sink._buffer]
+    assert rates[:5] == [1.0] * 5 and all(r < 1.0 for r in rates[5:])
+
+    monkeypatch.setattr(sink_mod.random, "random", lambda: 0.99)
+    sink._take(5)
+    assert not sink.emit(search_event("search", "amostrada fora"))
+    assert sink.stats()["sampled_out"] == 1
+    sink.close()
+
+
+def test_outage_spills_and_replays(tmp_path):
+    writer = Writer()
+    spill = tmp_path / "spill.jsonl"
+    sink = AnalyticsSink(writer, batch_size=2, flush_interval=60, spill_path=str(spill))
+    writer.fail = True
+    for q in ("a", "b", "c"):
+        sink.emit(search_event("search", q))
+    sink.flush()
+    # Primeira falha inicia a espera: o resto vai direto para o disco
+    assert sink.stats()["write_errors"] == 1
+    assert [json.loads(line)["query"] for line in spill.read_text().splitlines()] == ["a", "b", "c"]
+
+    writer.fail = False
+    sink._retry_at = 0.0
+    sink.emit(search_event("search", "d"))
+    sink.flush()
+    assert writer.written == ["d", "a", "b", "c"]
+    assert not spill.exists()
+    assert sink.stats()["replayed"] == 3
+    sink.close()
+
+
+def test_spill_is_bounded(tmp_path):
+    writer = Writer()
+    writer.fail = True
+    spill = tmp_path / "spill.jsonl"
+    sink = AnalyticsSink(writer, batch_size=50, flush_interval=60,
+                         spill_path=str(spill), spill_max_bytes=600)
+    for i in range(20):
+        sink.emit(search_event("search", f"consulta {i}"))
+    sink.close()
+    stats = sink.stats()
+    assert spill.stat().st_size <= 600
+    assert stats["spilled"] + stats["spill_dropped"] == 20 and stats["spill_dropped"] > 0
+
+
+def test_events_to_csv_for_copy():
+    event = search_event("legacy", 'óleo "2T"', 3, 12.345, details={"limit": 20})
+    event["sample_rate"] = 1.0
+    row = next(csv.reader(events_to_csv([event])))
+    assert row[1:5] == ["legacy", 'óleo "2T"', "3", "12.35"]
+    assert row[5] == "" and json.loads(row[-1]) == {"limit": 20}
+
+
+def test_search_route_emits_without_writing(client, monkeypatch):
+    writer = Writer()
+    sink = AnalyticsSink(writer, flush_interval=60)
+    monkeypatch.setattr(sink_mod, "_sink", sink)
+    monkeypatch.setattr(api, "record_query", lambda *a: None)
+
+    class FakeSearch:
+        def search_page(self, query, page_size=20, cursor=None):
+            return [], None
+
+    monkeypatch.setattr(api, "search_engine", FakeSearch())
+    r = client.post("/api/search/search", json={"query": "ms 162"},
+                    headers={"User-Agent": "pytest"})
+    assert r.status_code == 200
+    assert writer.batches == []
+    event = sink._buffer[0]
+    assert (event["source"], event["query"], event["user_agent"]) == ("search", "ms 162", "pytest")
+    sink.close()
+    assert writer.written == ["ms 162"]
+
+
+def test_replay_claims_spill_once_across_sinks(tmp_path):
+    spill = tmp_path / "spill.jsonl"
+    down = Writer()
+    down.fail = True
+    # Dois workers com o mesmo arquivo de transbordo
+    first = AnalyticsSink(down, batch_size=10, flush_interval=60, spill_path=str(spill))
+    second = AnalyticsSink(Writer(), batch_size=10, flush_interval=60, spill_path=str(spill))
+    for q in ("a", "b"):
+        first.emit(search_event("search", q))
+    first.flush()
+    assert len(spill.read_text().splitlines()) == 2
+
+    # Sobra de um worker que morreu no meio da regravação
+    orphan = tmp_path / "spill.jsonl.replay-999999999.1.0"
+    orphan.write_text(json.dumps(search_event("search", "c")) + "\n")
+
+    up = Writer()
+    third = AnalyticsSink(up, batch_size=10, flush_interval=60, spill_path=str(spill))
+    third.emit(search_event("search", "d"))
+    third.flush()
+    second._replay()
+    assert sorted(up.written) == ["a", "b", "c", "d"]
+    assert second.writer.written == []
+    assert not spill.exists() and not list(tmp_path.glob("*.replay-*"))
+    for sink in (first, second, third):
+        sink.close()
@@ -0,0 +1,113 @@
+import json
+
+import pytest
+
+import src.routes.search_api_v5 as api
+import src.services.autocomplete as ac_mod
+from src.services.autocomplete import AutocompleteIndex, QueryPopularity, build_autocomplete, normalize_prefix
+
+PRODUCTS = [
+    ("motosserras", "1148-200-0249", "MS 162 Motosserra"),
+    ("motosserras", "1148-200-0244", "MS 172 Motosserra"),
+    ("acessorios", "0781-516-3300", "Óleo de corrente Magnum"),
+    ("pecas", "1123-120-1600", "Filtro de ar"),
+    ("pecas", "", "Filtro de ar"),
+]
+
+
+@pytest.fixture()
+def index():
+    return AutocompleteIndex(PRODUCTS, {"MS250": 30, "MS03": 5})
+
+
+def test_normalize_prefix():
+    assert normalize_prefix("  Óleo-de  CORRENTE ") == "oleo de corrente"
+    assert normalize_prefix("1148-200") == "1148 200"
+
+
+def test_prefix_matches_any_word(index):
+    assert [s["texto"] for s in index.suggest("corr")] == ["Óleo de corrente Magnum"]
+    assert index.suggest("oleo")[0]["codigo_material"] == "0781-516-3300"
+    # Descrições repetidas viram uma sugestão só
+    assert [s["texto"] for s in index.suggest("filt")] == ["Filtro de ar"]
+    assert index.suggest("x") == [] and index.suggest("zzz") == []
+
+
+def test_models_and_codes(index):
+    texts = [s["texto"] for s in index.suggest("ms")]
+    # Modelos antes de produtos; o mais citado primeiro; ruído ("MS 03") fora
+    assert texts[:3] == ["MS 250", "MS 162", "MS 172"]
+    assert "MS 03" not in texts
+    assert index.suggest("ms25")[0]["texto"] == "MS 250"
+    assert index.suggest("11482000249")[0] == {"texto": "1148-200-0249", "tipo": "codigo",
+                                              "codigo_material": "1148-200-0249"}
+    assert [s["texto"] for s in index.suggest("1148 200 024")] == ["1148-200-0244", "1148-200-0249"]
+
+
+def test_popularity_ranking():
+    index = AutocompleteIndex(PRODUCTS, {"MS250": 30},
+                              popularity={"MS 172": 5, "motosserra barata": 3, "ms rara": 1})
+    texts = [s["texto"] for s in index.suggest("ms")]
+    assert texts[0] == "MS 172"
+    # Consulta popular sem entrada no catálogo vira sugestão; a rara, não
+    assert index.suggest("moto")[0] == {"texto": "motosserra barata", "tipo": "consulta"}
+    assert "ms rara" not in texts
+
+
+def test_short_and_long_prefixes_agree(index):
+    # Prefixos curtos vêm do top-k pré-calculado; os longos, do bisect
+    assert index.suggest("ms", 2) == index.suggest("ms", 50)[:2]
+    assert index.suggest("ms 1", 1) == index.suggest("ms", 50)[1:2]
+
+
+def test_results_cached_per_prefix(index):
+    first = index.suggest("filtro")
+    assert index.suggest("Filtro") is first
+    assert index.stats()["cache"]["hits"] == 1
+
+
+def test_popularity_log(tmp_path):
+    log = tmp_path / "analytics.log"
+    log.write_text("\n".join([
+        "INFO Search Analytics: " + json.dumps({"query": "MS 250", "results_count": 3}),
+        json.dumps({"query": "ms-250", "results_count": 1}),
+        json.dumps({"query": "nada", "results_count": 0}),
+        "linha qualquer",
+    ]), encoding="utf-8")
+    popularity = QueryPopularity()
+    assert popularity.load_log(str(log)) == 2
+    assert popularity.snapshot() == {"ms 250": 2}
+
+
+def test_popularity_counts_distinct_clients(monkeypatch):
+    popularity = QueryPopularity()
+    monkeypatch.setattr(ac_mod, "_popularity", popularity)
+    monkeypatch.setattr(api, "emit_search_event", lambda *a: True)
+    for _ in range(5):
+        api.log_search_analytics("motosserra barata", 3, 1.0, "10.0.0.1")
+    # Páginas seguintes (com cursor) não contam de novo
+    api.log_search_analytics("motosserra barata", 3, 1.0, "10.0.0.2", first_page=False)
+    assert popularity.snapshot() == {"motosserra barata": 1}
+
+    api.log_search_analytics("motosserra barata", 3, 1.0, "10.0.0.3")
+    assert popularity.snapshot() == {"motosserra barata": 2}
+
+
+def test_csv_index_is_fast():
+    index = build_autocomplete("csv")
+    assert len(index) > 1000
+    assert index.suggest("ms 16")[0]["tipo"] == "modelo"
+    # EPIs vêm de csv_outputs_v5/
+    assert index.suggest("bota de seg")[0]["texto"].startswith("Bota de segurança")
+
+
+def test_suggest_endpoint(client, monkeypatch, index):
+    monkeypatch.setattr(ac_mod, "_index", index)
+    r = client.get("/api/search/suggest?q=ms&limit=2")
+    assert r.status_code == 200
+    j = r.get_json()
+    assert j["suggestions"] == ["MS 250", "MS 162"]
+    assert j["items"][0]["tipo"] == "modelo"
+
+    monkeypatch.setenv("SUGGEST_ENGINE", "off")
+    assert client.get("/api/search/suggest?q=ms").get_json()["suggestions"] == []
@@ -0,0 +1,82 @@
+import threading
+import time
+
+from src.utils.cache import ShardedLRUCache, estimate_size
+
+
+def test_lru_eviction_per_shard():
+    cache = ShardedLRUCache(max_entries=3, shards=1, ttl=60)
+    for key in "abc":
+        cache.set(key, key.upper())
+    assert cache.get("a") == "A"  # "a" passa a ser o mais recente
+    cache.set("d", "D")
+    assert "b" not in cache
+    assert cache.keys() == ["c", "a", "d"]
+    assert cache.stats()["evictions"] == 1
+
+
+def test_byte_budget_evicts_and_rejects_oversized():
+    cache = ShardedLRUCache(max_entries=100, max_bytes=estimate_size("x" * 100) * 2, shards=1)
+    cache.set("a", "x" * 100)
+    cache.set("b", "x" * 100)
+    cache.set("c", "x" * 100)
+    assert len(cache) == 2 and "a" not in cache
+    cache.set("big", "x" * 10000)
+    assert "big" not in cache
+    assert cache.stats()["rejected"] == 1
+
+
+def test_ttl_expiry_on_read_and_sweep(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(time, "monotonic", lambda: now[0])
+    cache = ShardedLRUCache(max_entries=10, ttl=5, shards=2, sweep_interval=10)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    now[0] += 6
+    assert cache.get("a") is None
+    assert len(cache) == 1  # "b" continua até a varredura
+    now[0] += 5
+    cache.set("c", 3)  # dispara a varredura ativa
+    assert cache.keys() == ["c"]
+    stats = cache.stats()
+    assert stats["expirations"] == 2
+    assert stats["misses"] == 1
+
+
+def test_reads_also_trigger_sweep(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(time, "monotonic", lambda: now[0])
+    cache = ShardedLRUCache(max_entries=10, ttl=5, shards=2, sweep_interval=10)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    now[0] += 11
+    assert cache.get("x") is None  # só leituras: a varredura roda mesmo assim
+    assert len(cache) == 0
+    assert cache.stats()["expirations"] == 2
+
+
+def test_falsy_values_are_hits():
+    cache = ShardedLRUCache(max_entries=4)
+    cache.set("vazio", [])
+    assert cache.get("vazio") == []
+    assert cache.stats()["hits"] == 1
+
+
+def test_concurrent_access_respects_limits():
+    cache = ShardedLRUCache(max_entries=64, shards=8)
+
+    def worker(n):
+        for i in range(2000):
+            cache.set((n, i % 100), i)
+            cache.get((n, (i * 7) % 100))
+
+    threads = [threading.Thread(target=worker, args=(n,)) for n in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    stats = cache.stats()
+    assert len(cache) <= 64
+    assert stats["hits"] + stats["misses"] == 8 * 2000
+    assert stats["sets"] == 8 * 2000
@@ -0,0 +1,127 @@
+import gzip
+import json
+from contextlib import contextmanager
+from decimal import Decimal
+
+import pytest
+
+import src.routes.catalog_api as catalog_api
+import src.utils.db_pool as db_pool
+from src.services.catalog_export import build_export_sql, gzip_stream, iter_csv, iter_ndjson, open_catalog_export
+
+ROWS = [
+    {"source_table": "pecas", "codigo_material": "0000-007-1043", "descricao": "Jogo de parafusos",
+     "preco_real": Decimal("74.97"), "modelos_compatibilidade": "MS310", "categoria_produto": "Peça",
+     "catalog_version": 3, "removido": False},
+    {"source_table": "pecas", "codigo_material": "1122-007-1000", "descricao": None,
+     "preco_real": None, "modelos_compatibilidade": None, "categoria_produto": None,
+     "catalog_version": 4, "removido": True},
+]
+
+
+class NamedCursor:
+    def __init__(self, rows):
+        self.rows = list(rows)
+        self.fetches = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def execute(self, sql, params=None):
+        self.sql, self.params = sql, params
+
+    def fetchone(self):
+        return (7,)
+
+    def fetchmany(self, size):
+        self.fetches.append(size)
+        batch, self.rows = self.rows[:size], self.rows[size:]
+        return batch
+
+
+def test_export_sql_filters():
+    sql, params = build_export_sql()
+    assert "UNION ALL" not in sql and params == {}
+    sql, params = build_export_sql("pecas", 7)
+    assert "v.catalog_version > %(since)s" in sql and "v.removed" in sql
+    assert params == {"category": "pecas", "since": 7}
+
+
+def test_rows_come_from_named_cursor_in_batches(monkeypatch):
+    cursors, executed = {}, []
+
+    class Cursor(NamedCursor):
+        def execute(self, sql, params=None):
+            executed.append(sql)
+
+    class Conn:
+        def cursor(self, name=None, cursor_factory=None):
+            cursors[name] = Cursor([{"n": i} for i in range(5)])
+            return cursors[name]
+
+    @contextmanager
+    def fake_connection(dsn=None, cursor_factory=None, statement_timeout_ms=None):
+        yield Conn()
+
+    monkeypatch.setattr(db_pool, "connection", fake_connection)
+    version, rows = open_catalog_export("postgresql://x", fetch_size=2)
+    assert version == 7
+    assert [r["n"] for r in rows] == list(range(5))
+    assert cursors["catalog_export"].fetches == [2, 2, 2, 2]
+    # Versão lida no mesmo snapshot, antes de declarar o cursor da exportação
+    assert executed[0].startswith("SET TRANSACTION ISOLATION LEVEL REPEATABLE READ")
+    assert "current_catalog_version_v5()" in executed[1]
+    assert "FROM catalog_search_mv" in executed[2]
+
+
+def test_ndjson_and_csv():
+    lines = [json.loads(l) for l in "".join(iter_ndjson(ROWS, 4)).splitlines()]
+    assert lines[0]["preco_real"] == 74.97
+    assert lines[1]["removido"] is True
+    assert lines[-1] == {"done": True, "rows": 2, "catalog_version": 4}
+
+    csv_text = "".join(iter_csv(ROWS, ";", batch=1)).splitlines()
+    assert csv_text[0].startswith("source_table;codigo_material;descricao;preco_real")
+    assert csv_text[1].startswith("pecas;0000-007-1043;Jogo de parafusos;74.97")
+    assert len(csv_text) == 3
+
+
+def test_gzip_stream_round_trip():
+    chunks = [f"linha {i}\n" for i in range(20000)]
+    compressed = b"".join(gzip_stream(chunks, min_flush=1024))
+    assert gzip.decompress(compressed).decode() == "".join(chunks)
+
+
+@pytest.fixture()
+def export_api(monkeypatch):
+    calls = {}
+
+    def fake_export(dsn, category=None, since=None):
+        calls.update(category=category, since=since)
+        return 4, iter(ROWS)
+
+    monkeypatch.setattr(catalog_api, "open_catalog_export", fake_export)
+    return calls
+
+
+def test_export_endpoint_gzip_ndjson(client, export_api):
+    r = client.get("/api/catalog/export?category=pecas&since=2", headers={"Accept-Encoding": "gzip"})
+    assert r.status_code == 200
+    assert r.headers["Content-Encoding"] == "gzip"
+    assert r.headers["X-Catalog-Version"] == "4"
+    assert r.mimetype == "application/x-ndjson"
+    lines = gzip.decompress(r.get_data()).decode().splitlines()
+    assert len(lines) == 3 and json.loads(lines[-1])["done"] is True
+    assert export_api == {"category": "pecas", "since": 2}
+
+
+def test_export_endpoint_csv_and_validation(client, export_api):
+    r = client.get("/api/catalog/export?format=csv")
+    assert r.status_code == 200 and r.mimetype == "text/csv"
+    assert "Content-Encoding" not in r.headers
+    assert r.get_data(as_text=True).splitlines()[1].startswith("pecas,0000-007-1043")
+    assert client.get("/api/catalog/export?format=xml").status_code == 400
+    assert client.get("/api/catalog/export?since=abc").status_code == 400
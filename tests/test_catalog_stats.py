@@ -0,0 +1,111 @@
+import pytest
+
+import src.services.catalog_stats as stats_mod
+import src.services.catalog_version as version_mod
+import src.utils.http_cache as http_cache
+from src.services.catalog_stats import CatalogStats, build_catalog_stats, compute_statistics
+
+ROWS = [
+    ("motosserras", "MS 162", "1199.00"),
+    ("motosserras", "MS 500i", 8999.0),
+    ("motosserras", "MS sem preço", None),
+    ("pecas", "Parafuso", 0.5),
+    ("pecas", "Vela", 50),
+    ("pecas", "Peça zerada", 0),
+    ("epis", "Luva sem preço", ""),
+]
+
+
+def test_compute_statistics_single_pass():
+    by_table = {c["source_table"]: c for c in compute_statistics(ROWS)}
+
+    ms = by_table["motosserras"]
+    assert ms["categoria"] == "Motosserras"
+    assert (ms["total_produtos"], ms["produtos_com_preco"]) == (3, 2)
+    assert (ms["preco_minimo"], ms["preco_maximo"]) == (1199.0, 8999.0)
+    assert ms["preco_medio"] == round((1199.0 + 8999.0) / 2, 2)
+    assert ms["produto_mais_caro"] == "MS 500i"
+
+    # Preço zero conta no total, não no histograma; 50 cai na faixa [50, 100)
+    pecas = by_table["pecas"]
+    assert (pecas["total_produtos"], pecas["produtos_com_preco"]) == (3, 2)
+    assert pecas["histograma"][:2] == [1, 1]
+    assert sum(pecas["histograma"]) == 2
+
+    assert by_table["epis"]["preco_medio"] is None
+
+
+def test_snapshot_responses():
+    stats = CatalogStats(compute_statistics(ROWS), version=7)
+    ranges = stats.price_ranges()
+    # Categoria sem nenhum preço fica fora das faixas, mas não das estatísticas
+    assert [r["categoria"] for r in ranges] == ["Motosserras", "Peças"]
+    assert ranges[0]["total_produtos"] == 2
+    assert ranges[0]["histograma"][-1] == {"de": 5000, "ate": None, "produtos": 1}
+    assert [c["source_table"] for c in stats.categories()][-1] == "epis"
+    assert stats.stats()["version"] == 7
+
+
+def test_csv_statistics_cover_every_product():
+    stats = build_catalog_stats("csv")
+    # As oito planilhas, de csv_data/ e de csv_outputs_v5/
+    assert len(stats) == len(stats_mod.SHEET_TABLES)
+    for category in stats.categories():
+        assert sum(band["produtos"] for band in category["histograma"]) == category["produtos_com_preco"]
+        assert category["preco_minimo"] <= category["preco_medio"] <= category["preco_maximo"]
+
+
+@pytest.fixture()
+def snapshot(monkeypatch):
+    stats = CatalogStats(compute_statistics(ROWS))
+    monkeypatch.setattr(stats_mod, "_stats", stats)
+    return stats
+
+
+def test_price_ranges_served_from_memory(client, snapshot):
+    r = client.get("/api/search/price-ranges")
+    assert r.status_code == 200
+    assert r.get_json()["price_ranges"] == snapshot.price_ranges()
+
+
+def test_catalog_stats_endpoint(client, snapshot, monkeypatch):
+    r = client.get("/api/catalog/stats")
+    assert r.status_code == 200
+    assert r.get_json()["categories"] == snapshot.categories()
+
+    monkeypatch.setenv("CATALOG_STATS", "off")
+    assert client.get("/api/catalog/stats").status_code == 503
+
+
+def test_stale_snapshot_is_not_cached_under_new_version(client, monkeypatch):
+    class Version:
+        def current(self):
+            return 8
+
+    monkeypatch.setenv("CATALOG_STATS_SOURCE", "csv")
+    monkeypatch.setattr(version_mod, "_catalog_version", Version())
+    monkeypatch.setattr(http_cache, "_responses", None)
+    monkeypatch.setattr(stats_mod, "_stats", CatalogStats(compute_statistics(ROWS), version=7))
+
+    for path in ("/api/search/price-ranges", "/api/catalog/stats"):
+        r = client.get(path)
+        assert r.status_code == 200
+        assert r.headers["Cache-Control"] == "no-store" and r.headers.get("ETag") is None
+    assert http_cache._responses.stats()["entries"] == 0
+
+    # Snapshot já na versão atual: volta a receber ETag
+    monkeypatch.setattr(stats_mod, "_stats", CatalogStats(compute_statistics(ROWS), version=8))
+    assert client.get("/api/catalog/stats").headers.get("ETag")
+
+
+def test_csv_fallback_is_not_stamped_with_db_version(monkeypatch):
+    monkeypatch.setenv("CATALOG_STATS_SOURCE", "db")
+
+    def unreachable(dsn=None):
+        raise RuntimeError("banco fora")
+
+    monkeypatch.setattr(stats_mod, "load_statistics_db", unreachable)
+    monkeypatch.setattr(stats_mod, "_retry_at", 0.0)
+    stats = stats_mod._build(9)
+    assert stats.source == "csv" and stats.version is None
+    assert stats_mod._retry_at > 0
@@ -0,0 +1,126 @@
+import threading
+
+import pytest
+
+from src.services import compatibility
+from src.services.compatibility import CompatibilityIndex
+from src.services.parts_assistant import parse_query
+from src.services.text_normalizer import canonical_model, extract_models
+
+
+@pytest.mark.parametrize("text,expected", [
+    ("MS210 MS230 MS250 Corrente Picco Micro", ["MS210", "MS230", "MS250"]),
+    ("MS 182 210 212 230 250 MSE170", ["MS182", "MS210", "MS212", "MS230", "MS250", "MSE170"]),
+    ("3 8“ 1,6mm MS310 361 362", ["MS310", "MS361", "MS362"]),
+    ("MSA 220.0 C-B", ["MSA220"]),
+    ("HT75 HT131-PMN MSAKA", ["HT75", "HT131"]),
+    ("Novos Sabres Rollomatic Super - 32 40 50 63 75cm", []),
+    (None, []),
+])
+def test_extract_models(text, expected):
+    assert extract_models(text) == expected
+
+
+@pytest.mark.parametrize("name", ["MS 250", "ms250", "MS-250", "MS250.0"])
+def test_canonical_model(name):
+    assert canonical_model(name) == "MS250"
+
+
+def test_parse_query_accepts_spaced_models():
+    assert parse_query("filtro de ar ms 250")["model"] == "MS250"
+    assert parse_query("carburador FS-220")["model"] == "FS220"
+    assert parse_query("filtro de 250 reais")["model"] is None
+
+
+@pytest.fixture(scope="module")
+def index():
+    return CompatibilityIndex.from_csv_dir()
+
+
+def test_lookup_is_exact_and_spelling_insensitive(index):
+    ms16 = index.lookup("MS 16")
+    assert ms16 == index.lookup("ms16")
+    ms162 = {codigo for _, codigo, _, _ in index.lookup("MS162")}
+    assert ms162
+    assert not ms162 & {codigo for _, codigo, _, _ in ms16 if codigo not in ms162}
+
+
+def test_lookup_spans_tables_ordered_by_price(index):
+    items = index.lookup("MS250", priced_only=True)
+    assert {"pecas", "acessorios", "sabres_correntes_pinhoes_limas"} <= {it[0] for it in items}
+    prices = [it[3] for it in items]
+    assert prices == sorted(prices)
+    only_pecas = index.lookup("MS250", source_tables=["pecas"])
+    assert only_pecas and all(it[0] == "pecas" for it in only_pecas)
+
+
+def test_lookup_page_walks_the_full_list(index):
+    full = index.lookup("MS250", priced_only=True)
+    pages, after = [], None
+    while True:
+        page = index.lookup_page("ms 250", after, 7, priced_only=True)
+        pages.extend(page)
+        if len(page) < 7:
+            break
+        last = page[-1]
+        after = [last[3], last[1], last[0]]
+    assert pages == full
+    assert index.lookup_page("MS250", [10 ** 9, "", ""], 5) == [
+        it for it in index.lookup("MS250") if it[3] is None][:5]
+
+
+@pytest.fixture
+def fresh_index(monkeypatch):
+    monkeypatch.setenv("COMPAT_INDEX_ENGINE", "memory")
+    for name, value in (("_index", None), ("_index_checked", 0.0),
+                        ("_refreshing", False), ("_retry_at", 0.0)):
+        monkeypatch.setattr(compatibility, name, value)
+
+
+def test_failed_first_load_backs_off(fresh_index, monkeypatch):
+    calls = []
+
+    def failing_from_db(dsn=None):
+        calls.append(dsn)
+        raise RuntimeError("banco fora")
+
+    monkeypatch.setattr(CompatibilityIndex, "from_db", staticmethod(failing_from_db))
+    assert compatibility.get_compatibility_index() is None
+    assert compatibility.get_compatibility_index() is None
+    assert len(calls) == 1
+
+
+def test_reload_runs_in_background_on_table_change(fresh_index, monkeypatch):
+    monkeypatch.setenv("COMPAT_INDEX_REFRESH_S", "1")
+    old = CompatibilityIndex([("MS250", "pecas", "1", "Filtro", 10.0)], version=(1, 1))
+    new = CompatibilityIndex([("MS250", "pecas", "2", "Vela", 20.0)], version=(2, 1))
+    release = threading.Event()
+    fingerprint = [(1, 1)]
+
+    def slow_from_db(dsn=None):
+        release.wait(5)
+        return new
+
+    monkeypatch.setattr(compatibility, "_index", old)
+    monkeypatch.setattr(compatibility, "_fingerprint", lambda dsn: fingerprint[0])
+    monkeypatch.setattr(CompatibilityIndex, "from_db", staticmethod(slow_from_db))
+
+    def check():
+        compatibility._index_checked = 0.0
+        got = compatibility.get_compatibility_index()
+        for t in threading.enumerate():
+            if t.name == "compat-index-refresh":
+                release.set()
+                t.join(5)
+        return got
+
+    # Sem mudança na tabela: nada é recarregado
+    assert check() is old
+    assert compatibility._index is old
+
+    # Com mudança: a chamada devolve o índice vigente sem esperar a recarga
+    fingerprint[0] = (2, 1)
+    release.clear()
+    assert check() is old
+    assert compatibility._index is new
+    assert compatibility.get_compatibility_index() is new
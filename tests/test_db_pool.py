@@ -0,0 +1,205 @@
+import threading
+from contextlib import contextmanager
+
+import psycopg2
+import pytest
+from psycopg2 import extensions
+
+from src.utils import db_pool
+from src.utils.db_pool import ConnectionPool, PoolTimeoutError, database_health
+
+
+class FakeCursor:
+    def __init__(self, conn):
+        self.conn = conn
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def execute(self, sql, params=None):
+        if self.conn.broken:
+            raise psycopg2.OperationalError("server closed the connection unexpectedly")
+        if self.conn.fail_with is not None:
+            raise self.conn.fail_with
+        self.conn.executed.append((sql, params))
+        self.conn.status = extensions.TRANSACTION_STATUS_INTRANS
+
+    def fetchone(self):
+        return (1,)
+
+
+class FakeConnection:
+    def __init__(self):
+        self.closed = 0
+        self.broken = False
+        self.fail_with = None
+        self.executed = []
+        self.commits = 0
+        self.cursor_factory = None
+        self.status = extensions.TRANSACTION_STATUS_IDLE
+
+    def cursor(self):
+        return FakeCursor(self)
+
+    def commit(self):
+        self.commits += 1
+        self.status = extensions.TRANSACTION_STATUS_IDLE
+
+    def rollback(self):
+        self.status = extensions.TRANSACTION_STATUS_IDLE
+
+    def get_transaction_status(self):
+        return self.status
+
+    def close(self):
+        self.closed = 1
+
+
+def make_pool(**kwargs):
+    created = []
+
+    def factory(dsn, **_):
+        conn = FakeConnection()
+        created.append(conn)
+        return conn
+
+    kwargs.setdefault('maxconn', 2)
+    pool = ConnectionPool("postgresql://u:p@db.local:5432/stihl", connection_factory=factory, **kwargs)
+    return pool, created
+
+
+def test_connection_is_reused_and_committed():
+    pool, created = make_pool()
+    with pool.connection() as conn:
+        first = conn
+    with pool.connection() as conn:
+        assert conn is first
+    assert len(created) == 1
+    assert first.commits == 2
+    stats = pool.stats()
+    assert stats['checkouts'] == 2
+    assert stats['in_use'] == 0
+    assert stats['idle'] == 1
+    assert stats['name'] == 'db.local/stihl'
+
+
+def test_statement_timeout_applied_on_borrow():
+    pool, created = make_pool(statement_timeout_ms=1500)
+    with pool.connection(statement_timeout_ms=250):
+        pass
+    sql, params = created[0].executed[0]
+    assert "statement_timeout" in sql
+    assert params == (250,)
+
+
+def test_checkout_timeout_when_exhausted():
+    pool, _ = make_pool(maxconn=1, checkout_timeout=0.05)
+    conn = pool.acquire()
+    with pytest.raises(PoolTimeoutError):
+        pool.acquire()
+    pool.release(conn)
+    assert pool.stats()['timeouts'] == 1
+
+
+def test_waiter_is_served_when_connection_returns():
+    pool, _ = make_pool(maxconn=1, checkout_timeout=2.0)
+    conn = pool.acquire()
+    timer = threading.Timer(0.05, pool.release, args=(conn,))
+    timer.start()
+    again = pool.acquire()
+    assert again is conn
+    stats = pool.stats()
+    assert stats['waits'] == 1
+    assert stats['wait_time_max_ms'] > 0
+
+
+def test_broken_connection_replaced_on_borrow():
+    pool, created = make_pool()
+    with pool.connection() as conn:
+        pass
+    conn.broken = True
+    with pool.connection() as fresh:
+        assert fresh is not conn
+    assert conn.closed
+    stats = pool.stats()
+    assert stats['health_check_failures'] == 1
+    assert stats['connections_created'] == 2
+
+
+def test_connection_failing_set_local_is_replaced():
+    pool, created = make_pool()
+    with pool.connection() as conn:
+        pass
+    conn.fail_with = psycopg2.ProgrammingError("current transaction is aborted")
+    with pool.connection() as fresh:
+        assert fresh is not conn
+    assert conn.closed
+    assert pool.stats()['health_check_failures'] == 1
+    assert len(created) == 2
+
+
+def test_error_rolls_back_and_returns_connection():
+    pool, _ = make_pool()
+    with pytest.raises(ValueError):
+        with pool.connection():
+            raise ValueError("boom")
+    assert pool.stats()['in_use'] == 0
+    assert pool.stats()['idle'] == 1
+
+
+DSN = "postgresql://u:p@db.local:5432/stihl"
+
+
+@pytest.fixture
+def health_state(monkeypatch):
+    monkeypatch.setattr(db_pool, '_health', {})
+    monkeypatch.setattr(db_pool, '_health_inflight', {})
+
+
+def fake_connection(checks, started=None, release=None, error=None):
+    @contextmanager
+    def connection(dsn, statement_timeout_ms=None):
+        checks.append(dsn)
+        if started is not None:
+            started.set()
+            release.wait(5)
+        if error is not None:
+            raise error
+        yield FakeConnection()
+    return connection
+
+
+def test_database_health_is_single_flight(health_state, monkeypatch):
+    checks = []
+    monkeypatch.setattr(db_pool, 'connection', fake_connection(checks))
+    assert database_health(DSN)['connected'] is True
+
+    started, release = threading.Event(), threading.Event()
+    monkeypatch.setattr(db_pool, 'connection', fake_connection(checks, started, release))
+    worker = threading.Thread(target=database_health, args=(DSN,), kwargs={'ttl': 0})
+    worker.start()
+    assert started.wait(5)
+    # Verificação em andamento: as demais chamadas não esperam pelo banco
+    assert database_health(DSN, ttl=0)['connected'] is True
+    release.set()
+    worker.join(5)
+    assert len(checks) == 2
+
+
+def test_exhausted_pool_is_not_reported_as_down(health_state, monkeypatch):
+    checks = []
+    monkeypatch.setattr(db_pool, 'connection', fake_connection(checks))
+    assert database_health(DSN)['connected'] is True
+
+    monkeypatch.setattr(db_pool, 'connection',
+                        fake_connection(checks, error=PoolTimeoutError("pool esgotado")))
+    health = database_health(DSN, ttl=0)
+    assert health['connected'] is True
+    assert "esgotado" in health['error']
+
+    monkeypatch.setattr(db_pool, 'connection',
+                        fake_connection(checks, error=psycopg2.OperationalError("recusada")))
+    assert database_health(DSN, ttl=0)['connected'] is False
@@ -0,0 +1,123 @@
+import pytest
+
+import src.routes.search_api_v5 as api
+import src.services.catalog_version as version_mod
+import src.utils.http_cache as http_cache
+from src.services.catalog_version import CatalogVersion
+
+
+class StubVersion:
+    def __init__(self, version):
+        self.version = version
+
+    def current(self):
+        return self.version
+
+    def stats(self):
+        return {"version": self.version}
+
+
+class FakeEngine:
+    def __init__(self):
+        self.calls = 0
+
+    def get_price_ranges(self):
+        self.calls += 1
+        return [{"categoria": "Peça", "preco_min": 1.0, "preco_max": 10.0}]
+
+    def search_by_code(self, code):
+        return None
+
+
+@pytest.fixture()
+def versioned(monkeypatch):
+    stub = StubVersion(7)
+    engine = FakeEngine()
+    monkeypatch.setattr(version_mod, "_catalog_version", stub)
+    monkeypatch.setattr(http_cache, "_responses", None)
+    monkeypatch.setattr(api, "search_engine", engine)
+    # price-ranges consulta o motor só sem o snapshot de estatísticas
+    monkeypatch.setenv("CATALOG_STATS", "off")
+    return stub, engine
+
+
+def test_etag_304_and_memory_cache(client, versioned):
+    stub, engine = versioned
+    r = client.get("/api/search/price-ranges")
+    assert r.status_code == 200
+    body = r.get_json()
+    etag = r.headers["ETag"]
+    assert r.headers["X-Catalog-Version"] == "7"
+    assert "max-age=" in r.headers["Cache-Control"]
+    assert engine.calls == 1
+
+    r = client.get("/api/search/price-ranges", headers={"If-None-Match": etag})
+    assert r.status_code == 304 and r.get_data() == b""
+    assert r.headers["ETag"] == etag
+
+    # Mesma versão sem If-None-Match: corpo vem da memória
+    again = client.get("/api/search/price-ranges")
+    assert again.status_code == 200 and again.get_json() == body
+    assert again.headers["ETag"] == etag
+    assert engine.calls == 1
+
+    # Nova importação: novo ETag e nova execução
+    stub.version = 8
+    r = client.get("/api/search/price-ranges", headers={"If-None-Match": etag})
+    assert r.status_code == 200 and r.headers["ETag"] != etag
+    assert engine.calls == 2
+
+
+def test_errors_are_not_cached(client, versioned):
+    r = client.get("/api/search/product/9999-999-9999")
+    assert r.status_code == 404
+    assert "ETag" not in r.headers
+
+
+def test_unknown_version_passes_through(client, monkeypatch):
+    engine = FakeEngine()
+    monkeypatch.setattr(version_mod, "_catalog_version", StubVersion(None))
+    monkeypatch.setattr(api, "search_engine", engine)
+    r = client.get("/api/search/price-ranges")
+    assert r.status_code == 200 and "ETag" not in r.headers
+
+
+def test_catalog_version_reads_at_most_once_per_ttl(monkeypatch):
+    reads = []
+    version = CatalogVersion("postgresql://x", ttl=60, error_backoff=0)
+
+    def read():
+        reads.append(1)
+        if len(reads) == 2:
+            raise RuntimeError("banco fora")
+        return 3
+
+    monkeypatch.setattr(version, "_read", read)
+    assert version.current() == 3
+    assert version.current() == 3
+    assert len(reads) == 1
+
+    version.invalidate()
+    assert version.current() == 3  # erro: mantém a última versão
+    assert version.stats()["errors"] == 1
+    assert version.current() == 3 and len(reads) == 3
+
+
+def test_database_outage_is_not_cached(client, versioned, monkeypatch):
+    import psycopg2
+    from src.models.intelligent_search_v5 import IntelligentSearchV5
+
+    engine = IntelligentSearchV5.__new__(IntelligentSearchV5)
+    calls = []
+
+    def unreachable():
+        calls.append(1)
+        raise psycopg2.OperationalError("could not connect to server")
+
+    monkeypatch.setattr(engine, "_get_db_connection", unreachable, raising=False)
+    monkeypatch.setattr(api, "search_engine", engine)
+    for _ in range(2):
+        r = client.get("/api/search/campaigns")
+        assert r.status_code == 500 and "ETag" not in r.headers
+    # Sem corpo vazio na memória: cada requisição volta ao banco
+    assert len(calls) == 2
@@ -0,0 +1,141 @@
+import threading
+
+import pytest
+
+from src.services import identifier_directory, parts_assistant
+from src.services.identifier_directory import (
+    IdentifierDirectory, build_entries, identifier_keys, normalize_barcode,
+)
+
+
+@pytest.mark.parametrize("value,expected", [
+    ("886661266555", "886661266555"),
+    ("0886661266555", "886661266555"),
+    ("886661970544.0", "886661970544"),
+    (886661970544.0, "886661970544"),
+    ("", None),
+    (0, None),
+    ("n/d", None),
+])
+def test_normalize_barcode(value, expected):
+    assert normalize_barcode(value) == expected
+
+
+def test_identifier_keys():
+    assert identifier_keys(" 0000-007-1043 ") == ["0000-007-1043"]
+    assert identifier_keys("00000071043") == ["00000071043", "0000-007-1043", "71043", "CA71043"]
+    assert identifier_keys("ca 12.345") == ["CA 12.345", "CA12345"]
+    assert identifier_keys("") == []
+
+
+def test_replacement_chain_resolves_to_last_existing_code():
+    products = [
+        ("pecas", "1111-000-0003", "0795711000001", None),
+        ("epis", "0000-884-0001", None, "CA 12.345 / 38.226"),
+    ]
+    replacements = [
+        ("1111-000-0001", "1111-000-0002"),
+        ("1111-000-0002", "1111-000-0003"),
+        ("", "1111-000-0003"),
+        ("9999-000-0001", "9999-000-0002"),
+    ]
+    directory = IdentifierDirectory(build_entries(products, replacements))
+
+    assert directory.resolve("1111-000-0001") == {
+        "source_table": "pecas", "codigo_material": "1111-000-0003", "tipo": "codigo_antigo",
+    }
+    assert directory.resolve("1111-000-0002")["codigo_material"] == "1111-000-0003"
+    assert directory.resolve("9999-000-0001") is None
+    assert directory.resolve("795711000001")["tipo"] == "ean"
+    assert directory.resolve("CA 38226")["codigo_material"] == "0000-884-0001"
+    assert directory.resolve("12345")["tipo"] == "ca"
+
+
+def test_current_code_wins_over_replacement():
+    products = [("pecas", "1111-000-0001", None, None), ("pecas", "1111-000-0002", None, None)]
+    directory = IdentifierDirectory(build_entries(products, [("1111-000-0001", "1111-000-0002")]))
+    assert directory.resolve("1111-000-0001")["tipo"] == "codigo"
+
+
+def test_directory_from_csv():
+    directory = IdentifierDirectory.from_csv_dir()
+    hit = directory.resolve("0886661266555")
+    assert hit == {"source_table": "pecas", "codigo_material": "0000-007-1043", "tipo": "ean"}
+    assert directory.resolve("00000071043")["codigo_material"] == "0000-007-1043"
+    # EPIs e cod_alterados ficam em csv_outputs_v5/
+    assert directory.resolve("CA 35186") == {"source_table": "epis", "codigo_material": "7026-883-3437", "tipo": "ca"}
+    assert directory.resolve("0000-000-0069")["tipo"] == "codigo_antigo"
+
+
+def test_assistant_redirects_identifier(monkeypatch):
+    seen = {}
+
+    def fake_fetch(ent, limit=50):
+        seen.update(ent)
+        return [{"codigo": ent["code"], "descricao": "Jogo de parafusos", "preco": 74.97, "modelos": "MS310"}]
+
+    monkeypatch.setattr(parts_assistant, "resolve_identifier", lambda raw, dsn=None: {
+        "source_table": "pecas", "codigo_material": "0000-007-1043", "tipo": "ean",
+    })
+    monkeypatch.setattr(parts_assistant, "_fetch", fake_fetch)
+
+    out = parts_assistant.search_and_format("código de barras 886661266555")
+    assert seen["code"] == "0000-007-1043"
+    assert seen["redirected_from"] == "886661266555"
+    assert "886661266555 → 0000-007-1043" in out["text"]
+
+
+@pytest.fixture
+def fresh_directory(monkeypatch):
+    monkeypatch.setenv("IDENTIFIER_DIRECTORY_ENGINE", "memory")
+    for name, value in (("_directory", None), ("_directory_checked", 0.0),
+                        ("_refreshing", False), ("_retry_at", 0.0)):
+        monkeypatch.setattr(identifier_directory, name, value)
+
+
+def test_failed_first_load_backs_off(fresh_directory, monkeypatch):
+    calls = []
+
+    def failing_from_db(dsn=None):
+        calls.append(dsn)
+        raise RuntimeError("banco fora")
+
+    monkeypatch.setattr(IdentifierDirectory, "from_db", staticmethod(failing_from_db))
+    assert identifier_directory.get_identifier_directory() is None
+    assert identifier_directory.get_identifier_directory() is None
+    assert len(calls) == 1
+
+
+def test_reload_runs_in_background_on_table_change(fresh_directory, monkeypatch):
+    monkeypatch.setenv("IDENTIFIER_DIRECTORY_REFRESH_S", "1")
+    old = IdentifierDirectory([("00000071043", "codigo", "pecas", "0000-007-1043")], version=(1, 1))
+    new = IdentifierDirectory([("00000071044", "codigo", "pecas", "0000-007-1044")], version=(2, 1))
+    release = threading.Event()
+    fingerprint = [(1, 1)]
+
+    def slow_from_db(dsn=None):
+        release.wait(5)
+        return new
+
+    monkeypatch.setattr(identifier_directory, "_directory", old)
+    monkeypatch.setattr(identifier_directory, "_fingerprint", lambda dsn: fingerprint[0])
+    monkeypatch.setattr(IdentifierDirectory, "from_db", staticmethod(slow_from_db))
+
+    def check():
+        identifier_directory._directory_checked = 0.0
+        got = identifier_directory.get_identifier_directory()
+        for t in threading.enumerate():
+            if t.name == "identifier-directory-refresh":
+                release.set()
+                t.join(5)
+        return got
+
+    # Sem mudança na tabela: nada é recarregado
+    assert check() is old
+    assert identifier_directory._directory is old
+
+    # Com mudança: a chamada devolve o diretório vigente sem esperar a recarga
+    fingerprint[0] = (2, 1)
+    release.clear()
+    assert check() is old
+    assert identifier_directory._directory is new
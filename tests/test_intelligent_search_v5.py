@@ -0,0 +1,336 @@
+import csv
+import os
+import re
+from contextlib import contextmanager
+
+import pytest
+
+import src.models.intelligent_search_v5 as engine_mod
+from src.models.intelligent_search_v5 import IntelligentSearchV5, SearchIntent
+from src.services.intent_cache import IntentCache
+from src.services.text_normalizer import fold_text
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+class RecordingCursor:
+    def __init__(self, rows):
+        self.rows = rows
+        self.executed = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def execute(self, sql, params=None):
+        self.executed.append((sql, params))
+
+    def fetchall(self):
+        return self.rows
+
+    def fetchone(self):
+        return self.rows[0] if self.rows else None
+
+
+class RecordingConnection:
+    def __init__(self, rows=()):
+        self.cur = RecordingCursor(list(rows))
+
+    def cursor(self):
+        return self.cur
+
+
+def make_engine(rows=()):
+    engine = IntelligentSearchV5("postgresql://u:p@db.local:5432/stihl")
+    conn = RecordingConnection(rows)
+
+    @contextmanager
+    def fake_connection():
+        yield conn
+
+    engine._get_db_connection = fake_connection
+    return engine, conn
+
+
+def test_database_search_queries_materialized_view():
+    row = {
+        'source_table': 'pecas', 'codigo_material': '0000-007-1043', 'descricao': 'Jogo de parafusos',
+        'preco_real': 74.97, 'modelos_compatibilidade': 'MS310', 'categoria_produto': 'Peça',
+        'relevance_score': 0.6,
+    }
+    engine, conn = make_engine([row])
+    intent = SearchIntent(search_type='PRODUCT_SEARCH', product_category='peça',
+                          price_max=100.0, keywords=['jogo', 'parafusos'])
+
+    results = engine._execute_database_search(intent, 10)
+
+    sql, params = conn.cur.executed[0]
+    assert 'FROM catalog_search_mv' in sql
+    assert 'search_vector @@' in sql
+    assert 'texto_busca LIKE' in sql
+    assert 'to_tsvector' not in sql
+    assert params == ['jogo parafusos'] * 4 + [100.0, 'peça', 10]
+    assert results[0].modelos == 'MS310'
+    assert results[0].relevance_score == 0.6
+
+
+def test_database_search_escapes_like_wildcards():
+    engine, conn = make_engine()
+    engine._execute_database_search(SearchIntent(search_type='PRODUCT_SEARCH', keywords=['100%', 'a_b']), 5)
+    sql, params = conn.cur.executed[0]
+    assert sql.count("ESCAPE '\\'") == 2
+    # tsquery recebe o texto original; o LIKE, o texto escapado
+    assert params == ['100% a_b', '100\\% a\\_b', '100% a_b', '100\\% a\\_b', 5]
+
+
+def test_database_search_without_keywords_skips_text_filter():
+    engine, conn = make_engine()
+    engine._execute_database_search(SearchIntent(search_type='PRICE_RANGE', price_min=50.0), 5)
+    sql, params = conn.cur.executed[0]
+    assert '@@' not in sql
+    assert params == [50.0, 5]
+
+
+def test_search_results_are_cached_with_counters(monkeypatch):
+    row = {
+        'source_table': 'pecas', 'codigo_material': '1122-007-1000', 'descricao': 'Filtro de ar',
+        'preco_real': 20.0, 'modelos_compatibilidade': 'MS250', 'categoria_produto': 'Peça',
+        'relevance_score': 0.4,
+    }
+    engine, conn = make_engine([row])
+    monkeypatch.setattr(engine, '_analyze_search_intent',
+                        lambda q: SearchIntent(search_type='PRODUCT_SEARCH', keywords=['filtro']))
+
+    first = engine.search('filtro', 5)
+    second = engine.search('filtro', 5)
+
+    assert second == first
+    assert len(conn.cur.executed) == 1
+    stats = engine.get_cache_stats()
+    assert stats['hits'] == 1 and stats['misses'] == 1
+    assert stats['total_entries'] == 1
+
+
+def test_database_errors_are_not_cached(monkeypatch):
+    engine, conn = make_engine()
+    monkeypatch.setattr(engine, '_analyze_search_intent',
+                        lambda q: SearchIntent(search_type='PRODUCT_SEARCH', keywords=['filtro']))
+
+    def broken(sql, params=None):
+        raise RuntimeError("server closed the connection unexpectedly")
+
+    monkeypatch.setattr(conn.cur, 'execute', broken)
+    with pytest.raises(RuntimeError):
+        engine.search('filtro', 5)
+    assert engine.get_cache_stats()['total_entries'] == 0
+
+
+def test_cache_key_is_canonical_across_spellings(monkeypatch):
+    monkeypatch.setenv('SEARCH_KEY_STATS', 'on')
+    engine, conn = make_engine()
+    engine.intent_llm_threshold = 1.0  # força o caminho do LLM
+    calls = []
+    monkeypatch.setattr(engine, '_analyze_search_intent',
+                        lambda q: calls.append(q) or SearchIntent(search_type='PRODUCT_SEARCH',
+                                                                  keywords=['filtro']))
+
+    for query in ('Filtro de ar FS221', 'filtro  de ar fs 221', 'filtro do ar FS-221', 'Filtro de ar FS221'):
+        engine.search(query, 5)
+
+    assert len(calls) == 1
+    key_stats = engine.get_cache_stats()['key_normalization']
+    assert key_stats == {'lookups': 4, 'hits': 3, 'raw_key_hits': 1,
+                         'hit_rate': 0.75, 'raw_key_hit_rate': 0.25}
+    assert engine._generate_cache_key('filtro de ar MS250', {}) != engine._generate_cache_key('filtro de ar MS260', {})
+
+
+def test_rule_based_intent_confidence():
+    engine, _ = make_engine()
+    code = engine._simple_intent_analysis('4147-141-0300')
+    model = engine._simple_intent_analysis('MS 162')
+    vague = engine._simple_intent_analysis('qual a melhor motosserra leve para cortar lenha')
+
+    assert code.keywords == ['4147-141-0300'] and code.confidence >= 0.9
+    for spelling in ('4147 141 0300', '41471410300'):
+        same = engine._simple_intent_analysis(spelling)
+        assert same.keywords == ['4147-141-0300'] and same.confidence >= engine.intent_llm_threshold
+    assert model.model_name == 'MS162' and model.search_type == 'COMPATIBILITY'
+    assert model.keywords == ['ms 162']
+    assert model.confidence >= engine.intent_llm_threshold
+    assert vague.product_category == 'motosserra'
+    assert vague.confidence < engine.intent_llm_threshold
+
+
+def test_llm_only_below_threshold(monkeypatch):
+    engine, _ = make_engine()
+    llm_calls = []
+    monkeypatch.setattr(engine, '_request_llm_intent',
+                        lambda q: llm_calls.append(q) or SearchIntent(search_type='RECOMMENDATION',
+                                                                      keywords=['motosserra']))
+
+    engine.search('4147-141-0300')
+    engine.search('Filtro de ar FS221')
+    engine.search('qual a melhor motosserra leve para cortar lenha')
+
+    assert llm_calls == ['qual a melhor motosserra leve para cortar lenha']
+    stats = engine.get_intent_stats()
+    assert stats['rule_based'] == 2 and stats['llm'] == 1
+    assert stats['served_without_llm'] == 0.6667
+
+
+def test_llm_intents_persist_by_semantic_key(monkeypatch, tmp_path):
+    path = str(tmp_path / 'intents.sqlite3')
+    engine, _ = make_engine()
+    engine.intent_cache = IntentCache(path)
+    llm_calls = []
+    monkeypatch.setattr(engine, '_request_llm_intent',
+                        lambda q: llm_calls.append(q) or SearchIntent(search_type='RECOMMENDATION',
+                                                                      product_category='motosserra',
+                                                                      keywords=['motosserra', 'leve']))
+
+    first = engine._analyze_search_intent('Qual a melhor motosserra leve para cortar lenha?')
+    engine.intent_cache.close()
+
+    # Outro processo (reinício), grafia diferente da mesma pergunta
+    restarted, _ = make_engine()
+    restarted.intent_cache = IntentCache(path)
+    monkeypatch.setattr(restarted, '_request_llm_intent', lambda q: pytest.fail('LLM chamado'))
+    again = restarted._analyze_search_intent('qual a melhor  motosserra leve pra cortar lenha')
+
+    assert llm_calls == ['Qual a melhor motosserra leve para cortar lenha?']
+    assert again == first
+    assert restarted.get_intent_stats()['intent_cache'] == 1
+
+
+def test_warm_intent_cache_skips_rule_based_queries(monkeypatch):
+    engine, _ = make_engine()
+    engine.intent_cache = IntentCache(':memory:')
+    llm_calls = []
+    monkeypatch.setattr(engine, '_request_llm_intent',
+                        lambda q: llm_calls.append(q) or SearchIntent(search_type='PRODUCT_SEARCH'))
+
+    added = engine.warm_intent_cache(['MS 162', 'motosserra leve para cortar lenha',
+                                      'Motosserra leve para cortar lenha', '4147-141-0300'])
+
+    assert added == 1
+    assert llm_calls == ['motosserra leve para cortar lenha']
+
+
+def test_search_by_codes_uses_single_query(monkeypatch):
+    monkeypatch.delenv('IDENTIFIER_DIRECTORY_ENGINE', raising=False)
+    rows = [
+        {'source_table': 'pecas', 'codigo_material': code, 'descricao': f'Peça {code}',
+         'preco_real': 10.0, 'modelos_compatibilidade': None, 'categoria_produto': 'Peça'}
+        for code in ('0000-007-1043', '1148-200-0249')
+    ]
+    engine, conn = make_engine(rows)
+
+    found = engine.search_by_codes(['1148-200-0249', '0000-007-1043'])
+
+    assert len(conn.cur.executed) == 1
+    sql, params = conn.cur.executed[0]
+    assert '= ANY(%s)' in sql
+    assert params == (['0000-007-1043', '1148-200-0249'],)
+    assert found['1148-200-0249'].descricao == 'Peça 1148-200-0249'
+    assert found['0000-007-1043'].relevance_score == 1.0
+
+
+def test_search_by_codes_logs_and_raises_database_errors(monkeypatch, caplog):
+    monkeypatch.delenv('IDENTIFIER_DIRECTORY_ENGINE', raising=False)
+    engine, conn = make_engine()
+
+    def broken(sql, params=None):
+        raise RuntimeError("statement timeout")
+
+    monkeypatch.setattr(conn.cur, 'execute', broken)
+    with caplog.at_level('ERROR', logger='src.models.intelligent_search_v5'):
+        with pytest.raises(RuntimeError):
+            engine.search_by_codes(['0000-007-1043'])
+    assert 'Erro na busca por códigos: statement timeout' in caplog.text
+
+
+def test_search_page_uses_keyset_cursor(monkeypatch):
+    rows = [{
+        'source_table': 'pecas', 'codigo_material': f'1122-007-100{i}', 'descricao': 'Filtro de ar',
+        'preco_real': 20.0 + i, 'modelos_compatibilidade': '', 'categoria_produto': 'Peça',
+        'relevance_score': 0.4,
+    } for i in range(3)]
+    engine, conn = make_engine(rows)
+    monkeypatch.setattr(engine, '_analyze_search_intent',
+                        lambda q: SearchIntent(search_type='PRODUCT_SEARCH', keywords=['filtro']))
+
+    page, cursor = engine.search_page('filtro', 2)
+    assert [r.codigo_material for r in page] == ['1122-007-1000', '1122-007-1001']
+    assert cursor
+    sql, params = conn.cur.executed[-1]
+    assert 'relevance_score <' not in sql and params[-1] == 3
+
+    conn.cur.rows = rows[2:]
+    page, next_cursor = engine.search_page('filtro', 2, cursor)
+    assert [r.codigo_material for r in page] == ['1122-007-1002']
+    assert next_cursor is None
+    sql, params = conn.cur.executed[-1]
+    assert 'relevance_score <' in sql
+    assert params[-6:] == [0.4, 0.4, 21.0, '1122-007-1001', 'pecas', 3]
+
+
+def test_search_page_rejects_cursor_from_other_query(monkeypatch):
+    from src.utils.pagination import CursorError, encode_cursor
+    engine, _ = make_engine()
+    with pytest.raises(CursorError):
+        engine.search_page('corrente', 2, encode_cursor('search:filtro', [0.4, 20.0, 'x', 'pecas']))
+
+
+def test_compatible_page_sql_keyset_on_compatibility_table(monkeypatch):
+    monkeypatch.setattr(engine_mod, 'get_compatibility_index', lambda: None)
+    rows = [{'source_table': 'sabres_correntes_pinhoes_limas', 'codigo_material': f'3003-000-000{i}',
+             'descricao': 'Sabre', 'preco_real': 100 + i} for i in range(3)]
+    engine, conn = make_engine(rows)
+
+    page, cursor = engine.get_compatible_page('MS 250', page_size=2)
+    assert [r.source_table for r in page] == ['sabres_correntes', 'sabres_correntes']
+    assert page[0].modelos == 'Componente de corte compatível'
+    sql, params = conn.cur.executed[-1]
+    assert 'FROM product_compatibility_v5' in sql and 'get_compatible_products_v5' not in sql
+    assert params == ['MS 250', 3]
+
+    engine.get_compatible_page('MS 250', page_size=2, cursor=cursor)
+    sql, params = conn.cur.executed[-1]
+    assert '(pc.preco_real, pc.codigo_material, pc.source_table) >' in sql
+    assert params == ['MS 250', '101', '3003-000-0001', 'sabres_correntes_pinhoes_limas', 3]
+
+
+class CatalogCursor(RecordingCursor):
+    """Emula o casamento do tsquery (todas as palavras) sobre csv_data/ms.csv"""
+
+    def __init__(self):
+        super().__init__([])
+        with open(os.path.join(ROOT, 'csv_data', 'ms.csv'), encoding='utf-8', newline='') as fh:
+            self.catalog = [r for r in csv.DictReader(fh) if r['codigo_material']]
+
+    def execute(self, sql, params=None):
+        super().execute(sql, params)
+        terms = [set(re.findall(r'[a-z0-9]+', p)) for p in params if isinstance(p, str)]
+        self.rows = []
+        for r in self.catalog:
+            tokens = set(re.findall(r'[a-z0-9]+', fold_text(f"{r['descricao']} {r['codigo_material']}")))
+            if any(t and t <= tokens for t in terms):
+                self.rows.append({'source_table': 'motosserras', 'codigo_material': r['codigo_material'],
+                                  'descricao': r['descricao'], 'preco_real': float(r['preco_real']),
+                                  'modelos_compatibilidade': '', 'categoria_produto': 'Motosserra',
+                                  'relevance_score': 0.6})
+
+
+def test_model_query_finds_the_machine():
+    engine, conn = make_engine()
+    conn.cur = CatalogCursor()
+
+    results = engine.search('MS 162', 5)
+
+    assert '1148-200-0249' in [r.codigo_material for r in results]
+    sql, params = conn.cur.executed[0]
+    assert 'product_compatibility_v5' in sql
+    # tsquery com a forma das descrições; modelo canônico só na compatibilidade
+    assert params == ['ms 162', 'ms 162', 'MS162', 5]
@@ -0,0 +1,48 @@
+import time
+
+from src.services.intent_cache import IntentCache, load_history_file
+
+
+def test_eviction_by_lru_age_and_version(monkeypatch):
+    cache = IntentCache(':memory:', max_entries=3, evict_every=1000)
+    for n, query in enumerate(['filtro MS250', 'filtro MS260', 'filtro MS270', 'filtro MS280']):
+        monkeypatch.setattr(time, 'time', lambda n=n: 1000.0 + n)
+        cache.put(query, {'n': n})
+    monkeypatch.setattr(time, 'time', lambda: 2000.0)
+    assert cache.get('filtro MS250') == {'n': 0}  # passa a ser a mais recente
+
+    assert cache.evict() == 2  # reduz a 90% do limite (2 entradas)
+    assert cache.get('filtro MS250') == {'n': 0}
+    assert cache.get('filtro MS280') == {'n': 3}
+    assert cache.get('filtro MS260') is None
+
+    other = IntentCache(':memory:', version='gpt-4:2')
+    other._conn = cache._conn
+    assert other.get('filtro MS250') is None  # versão diferente não é servida
+
+
+def test_expired_entries_are_not_served(monkeypatch):
+    cache = IntentCache(':memory:', ttl_days=1)
+    monkeypatch.setattr(time, 'time', lambda: 0.0)
+    cache.put('filtro de ar FS221', {'search_type': 'PRODUCT_SEARCH'})
+    monkeypatch.setattr(time, 'time', lambda: 2 * 86400.0)
+    assert cache.get('filtro do ar FS-221') is None
+    assert cache.stats()['misses'] == 1
+
+
+def test_prewarm_dedupes_and_tolerates_failures(tmp_path):
+    history = tmp_path / 'consultas.jsonl'
+    history.write_text('motosserra leve\n{"query": "Motosserra  LEVE"}\n\nerro\nroçadeira profissional\n',
+                       encoding='utf-8')
+    cache = IntentCache(':memory:')
+    analyzed = []
+
+    def analyze(query):
+        if query == 'erro':
+            raise RuntimeError('timeout')
+        analyzed.append(query)
+        return {'q': query}
+
+    assert cache.prewarm(load_history_file(str(history)), analyze) == 2
+    assert analyzed == ['motosserra leve', 'roçadeira profissional']
+    assert len(cache) == 2
@@ -0,0 +1,105 @@
+import threading
+from types import SimpleNamespace
+
+import pytest
+
+import src.routes.search_api_v5 as api
+from src.utils.metrics import MetricsRegistry, bind_endpoint, count_results, registry, stage
+
+
+def test_threads_accumulate_separately_and_survive_exit():
+    reg = MetricsRegistry(prefix="t")
+    hits = reg.counter("hits_total", "teste", ("kind",))
+
+    def work():
+        for _ in range(1000):
+            hits.inc("a")
+
+    threads = [threading.Thread(target=work) for _ in range(4)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    hits.inc("a", amount=0.5)
+    # Threads encerradas: valores incorporados ao acumulador único
+    assert reg.value("hits_total", "a") == [4000.5]
+    assert len(reg._shards) == 1
+    assert reg.value("hits_total", "a") == [4000.5]
+
+
+def test_histogram_renders_cumulative_buckets():
+    reg = MetricsRegistry(prefix="t")
+    latency = reg.histogram("latency_seconds", "teste", ("stage",), buckets=(0.1, 1.0))
+    for value in (0.05, 0.5, 0.5, 3.0):
+        latency.observe(value, "db")
+    text = reg.render()
+    assert "# TYPE t_latency_seconds histogram" in text
+    assert 't_latency_seconds_bucket{stage="db",le="0.1"} 1' in text
+    assert 't_latency_seconds_bucket{stage="db",le="1"} 3' in text
+    assert 't_latency_seconds_bucket{stage="db",le="+Inf"} 4' in text
+    assert 't_latency_seconds_count{stage="db"} 4' in text
+    assert 't_latency_seconds_sum{stage="db"} 4.05' in text
+
+
+def test_collectors_render_gauges_and_report_failures():
+    reg = MetricsRegistry(prefix="t")
+    reg.add_collector(lambda: [("queue_depth", "teste", "gauge", [({"queue": 'a"b'}, 3), ({"queue": "x"}, None)])])
+
+    def broken():
+        raise RuntimeError("fora")
+
+    reg.add_collector(broken)
+    text = reg.render()
+    assert 't_queue_depth{queue="a\\"b"} 3' in text
+    assert 'queue="x"' not in text
+    assert "# coletor broken falhou: fora" in text
+
+
+def test_stage_counts_errors_and_uses_bound_endpoint():
+    before = registry.value("stage_errors_total", "llm_call", "telegram") or [0]
+    with pytest.raises(ValueError):
+        with bind_endpoint("telegram"), stage("llm_call"):
+            raise ValueError("timeout")
+    assert registry.value("stage_errors_total", "llm_call", "telegram")[0] == before[0] + 1
+    assert registry.value("stage_duration_seconds", "llm_call", "telegram")[-1] >= 1
+
+
+def test_metrics_endpoint_exposes_requests_stages_and_results(client, monkeypatch):
+    monkeypatch.delenv("METRICS_TOKEN", raising=False)
+    monkeypatch.setattr(api, "record_query", lambda *a: None)
+    monkeypatch.setattr(api, "emit_search_event", lambda *a: True)
+
+    class FakeSearch:
+        def search_page(self, query, page_size=20, cursor=None):
+            with stage("db_query"):
+                return [SimpleNamespace(source_table="pecas", codigo_material="1", descricao="x",
+                                        preco_real=1.0, modelos="", categoria_produto=None,
+                                        relevance_score=1.0)], None
+
+    monkeypatch.setattr(api, "serialize_result", lambda r, details, uf: {"codigo": r.codigo_material})
+    monkeypatch.setattr(api, "search_engine", FakeSearch())
+    assert client.post("/api/search/search", json={"query": "filtro"}).status_code == 200
+
+    r = client.get("/metrics")
+    assert r.status_code == 200
+    assert r.content_type.startswith("text/plain; version=0.0.4")
+    text = r.get_data(as_text=True)
+    assert 'stihl_http_requests_total{endpoint="search_api_v5.intelligent_search",method="POST",status="200"}' in text
+    assert 'stihl_stage_duration_seconds_count{stage="db_query",endpoint="search_api_v5.intelligent_search"}' in text
+    assert 'stihl_stage_duration_seconds_count{stage="formatting",endpoint="search_api_v5.intelligent_search"}' in text
+    assert 'stihl_search_results_total{endpoint="search_api_v5.intelligent_search",source_table="pecas"}' in text
+    assert "# TYPE stihl_queue_depth gauge" in text
+
+
+def test_metrics_token(client, monkeypatch):
+    monkeypatch.setenv("METRICS_TOKEN", "segredo")
+    assert client.get("/metrics").status_code == 401
+    assert client.get("/metrics", headers={"Authorization": "Bearer segredo"}).status_code == 200
+
+
+def test_count_results_by_source_table():
+    results = [SimpleNamespace(source_table="pecas")] * 2 + [SimpleNamespace(source_table=None)]
+    before = registry.value("search_results_total", "teste", "pecas") or [0]
+    count_results(results, endpoint="teste")
+    assert registry.value("search_results_total", "teste", "pecas")[0] == before[0] + 2
+    assert registry.value("search_results_total", "teste", "desconhecida")[0] >= 1
@@ -0,0 +1,49 @@
+import base64
+import hashlib
+import hmac
+
+import pytest
+
+from src.utils.pagination import CursorError, decode_cursor, encode_cursor, page_size
+
+
+def test_cursor_round_trip():
+    cursor = encode_cursor("search:filtro", [0.5, 20.0, "1122-007-1000", "pecas"])
+    assert decode_cursor(cursor, "search:filtro") == [0.5, 20.0, "1122-007-1000", "pecas"]
+    assert decode_cursor(None, "search:filtro") is None
+    assert decode_cursor("", "search:filtro") is None
+
+
+def test_cursor_is_scoped_and_signed():
+    cursor = encode_cursor("compat:mem:MS250", [10.0, "0000-000-0001", "pecas"])
+    with pytest.raises(CursorError):
+        decode_cursor(cursor, "compat:mem:MS162")
+    body, signature = cursor.rsplit(".", 1)
+    tampered = encode_cursor("compat:mem:MS250", [0.0, "0000-000-0001", "pecas"]).rsplit(".", 1)[0]
+    with pytest.raises(CursorError):
+        decode_cursor(f"{tampered}.{signature}", "compat:mem:MS250")
+    for bad in ("abc", "abc.def", "!!!.x"):
+        with pytest.raises(CursorError):
+            decode_cursor(bad, "compat:mem:MS250")
+
+
+def test_missing_secret_uses_random_process_key(monkeypatch):
+    monkeypatch.delenv("PAGINATION_SECRET", raising=False)
+    monkeypatch.delenv("SECRET_KEY", raising=False)
+    cursor = encode_cursor("search:filtro", [1.0])
+    assert decode_cursor(cursor, "search:filtro") == [1.0]
+    # Uma chave conhecida (o antigo "change-me") não forja cursores
+    body = cursor.rsplit(".", 1)[0]
+    payload = base64.urlsafe_b64decode(body + "=" * (-len(body) % 4))
+    forged = base64.urlsafe_b64encode(hmac.new(b"change-me", payload, hashlib.sha256).digest()[:12])
+    with pytest.raises(CursorError):
+        decode_cursor(f"{body}.{forged.decode().rstrip('=')}", "search:filtro")
+
+
+def test_page_size_bounds(monkeypatch):
+    monkeypatch.setenv("PAGINATION_MAX_PAGE_SIZE", "50")
+    assert page_size(None, 20) == 20
+    assert page_size("10") == 10
+    assert page_size(500) == 50
+    assert page_size(0) == 1
+    assert page_size("x", 7) == 7
@@ -0,0 +1,77 @@
+import os
+import shutil
+
+import pytest
+
+from src.services.parts_assistant import parse_query
+from src.services.parts_catalog import DEFAULT_CSV_PATH, CatalogSnapshot, PartsCatalog
+from src.services.text_normalizer import extract_models
+
+
+@pytest.fixture(scope="module")
+def catalog():
+    return PartsCatalog(source="csv", refresh_interval=0)
+
+
+def test_loads_csv_without_qtde_min(catalog):
+    item = catalog.get("0000-007-1043")
+    assert item is not None
+    assert set(item) == {"codigo", "descricao", "preco", "modelos"}
+    assert catalog.stats()["items"] > 10000
+
+
+def test_code_lookup(catalog):
+    items = catalog.search(parse_query("preciso da peça 0000-007-1043"))
+    assert [it["codigo"] for it in items] == ["0000-007-1043"]
+
+
+def test_model_and_type_filters_ordered_by_price(catalog):
+    items = catalog.search(parse_query("filtro de ar MS250"), limit=50)
+    assert items
+    for it in items:
+        assert "MS250" in extract_models(it["modelos"])
+        assert "filtro" in it["descricao"].lower()
+        assert "de ar" in (it["descricao"] + "\n" + it["modelos"]).lower()
+    prices = [it["preco"] for it in items]
+    assert prices == sorted(prices)
+
+
+def test_model_token_is_exact(catalog):
+    for it in catalog.search(parse_query("MS16"), limit=500):
+        assert "MS16" in extract_models(it["modelos"])
+
+
+def test_accent_insensitive_type(catalog):
+    com = catalog.search({"normalized": "", "code": None, "model": None, "type": "válvula", "spec": None})
+    sem = catalog.search({"normalized": "", "code": None, "model": None, "type": "valvula", "spec": None})
+    assert com and com == sem
+
+
+def test_snapshot_matches_code_ties_and_nulls():
+    snap = CatalogSnapshot([
+        ("0000-000-0003", "Filtro", None, "MS250"),
+        ("0000-000-0002", "Filtro", 10.0, "MS250"),
+        ("0000-000-0001", "Filtro", 10.0, "MS250"),
+    ])
+    items = snap.search(parse_query("filtro MS250"))
+    assert [it["codigo"] for it in items] == ["0000-000-0001", "0000-000-0002", "0000-000-0003"]
+    assert items[-1]["preco"] is None
+
+
+def test_reload_swaps_snapshot(tmp_path):
+    path = tmp_path / "pecas.csv"
+    with open(DEFAULT_CSV_PATH, encoding="utf-8") as src, open(path, "w", encoding="utf-8") as dst:
+        for n, line in enumerate(src):
+            if n > 20:
+                break
+            dst.write(line)
+    catalog = PartsCatalog(source="csv", csv_path=str(path), refresh_interval=0)
+    before = catalog.snapshot
+    assert len(before) == 20
+
+    shutil.copy(DEFAULT_CSV_PATH, path)
+    os.utime(path, ns=(before.version[0] + 10**9, before.version[0] + 10**9))
+    catalog.reload()
+    assert catalog.snapshot is not before
+    assert len(catalog.snapshot) > 10000
+    assert len(before) == 20
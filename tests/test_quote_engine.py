@@ -0,0 +1,144 @@
+import pytest
+
+import src.services.quote_engine as quote_mod
+from src.services.quote_engine import QuoteEngine, QuoteError, build_quote, iter_quote_csv, read_csv_lines
+from src.services.tax_engine import TaxEngine, load_tax_tables_csv
+
+PRODUCTS = {
+    "1148-200-0249": {"descricao": "MS 162 Motosserra", "preco_real": 1199.0, "qtde_min": 1,
+                      "ipi": 5.2, "ncm": "84678100"},
+    "0000-007-1043": {"descricao": "Jogo de parafusos", "preco_real": 74.97, "qtde_min": 5,
+                      "ipi": 6.5, "ncm": "73181500"},
+    "7030-516-0000": {"descricao": "Óleo de corrente STIHL Magnum 1L", "preco_real": 40.0,
+                      "qtde_min": 12, "ipi": 0.0, "ncm": "27101932"},
+}
+
+
+@pytest.fixture(scope="module")
+def taxes():
+    # Sem produtos no snapshot: os coeficientes saem dos dados do orçamento
+    return TaxEngine(load_tax_tables_csv(), [])
+
+
+def test_tax_tables_from_spreadsheet(taxes):
+    tables = taxes.tables
+    assert tables.icms_rate("sp", "84678100", "SP") == 0.0572
+    assert tables.icms_rate("sp", "84678100", "MG") == 0.043
+    assert tables.icms_rate("sp", "84678100", "BA") == 0.072
+    assert tables.icms_rate("sp", "99999999", "BA") == 0.0
+    assert "7030-516-0000" in tables.st_codes
+    assert tables.mva("SP", internal=True) == 0.6131
+    assert tables.mva("BA", internal=False) == 0.9672
+
+
+def test_quantity_rounds_up_to_minimum_lot(taxes):
+    quote = build_quote([("0000-007-1043", "7"), ("00000071043", 10)], PRODUCTS, taxes, "SP", "sp")
+    first, second = quote["itens"]
+    assert (first["quantidade"], first["lote_ajustado"]) == (10, True)
+    assert (second["quantidade"], second["lote_ajustado"]) == (10, False)
+    assert first["subtotal"] == 749.7
+    assert first["ipi"] == 48.73
+    # qtde_min não é exposto
+    assert all("qtde_min" not in item for item in quote["itens"])
+
+
+def test_ipi_and_icms_differential(taxes):
+    item = build_quote([("1148-200-0249", 2)], PRODUCTS, taxes, "BA", "sp")["itens"][0]
+    assert item["subtotal"] == 2398.0
+    assert item["ipi"] == 124.7
+    assert item["icms_difal"] == round((2398.0 + 124.7) * 0.072, 2)
+    assert item["total"] == round(2398.0 + 124.7 + item["icms_difal"], 2)
+
+
+def test_st_for_listed_products(taxes):
+    item = build_quote([("7030-516-0000", 1)], PRODUCTS, taxes, "BA", "sp")["itens"][0]
+    # Interestadual SP -> BA: ICMS próprio de 7%
+    expected = round(480.0 * (1 + 0.9672) * 0.205 - 480.0 * 0.07, 2)
+    assert item["quantidade"] == 12
+    assert item["st"] == expected
+    assert build_quote([("1148-200-0249", 1)], PRODUCTS, taxes, "BA", "sp")["itens"][0]["st"] == 0.0
+
+
+def test_line_statuses_and_summary(taxes):
+    quote = build_quote([("1148-200-0249", 1), ("9999-999-9999", 1), ("1148-200-0249", "-2")],
+                        PRODUCTS, taxes, "SP", "sp")
+    assert [i["status"] for i in quote["itens"]] == ["ok", "nao_encontrado", "quantidade_invalida"]
+    summary = quote["resumo"]
+    assert summary["itens"] == 3 and summary["itens_ok"] == 1
+    assert summary["total"] == quote["itens"][0]["total"]
+
+
+@pytest.mark.parametrize("text", [
+    "codigo;quantidade\n1148-200-0249;3\n0000-007-1043;7\n",
+    "Código,Qtde\n1148-200-0249,3\n0000-007-1043,7\n",
+    "1148-200-0249\t3\n0000-007-1043\t7\n",
+])
+def test_read_csv_lines(text):
+    assert read_csv_lines(text) == [("1148-200-0249", "3"), ("0000-007-1043", "7")]
+
+
+def test_read_csv_requires_columns():
+    with pytest.raises(QuoteError):
+        read_csv_lines("produto,preco\nx,1\n")
+
+
+def test_quote_csv_output(taxes):
+    quote = build_quote([("1148-200-0249", 1)], PRODUCTS, taxes, "SP", "sp")
+    lines = "".join(iter_quote_csv(quote)).splitlines()
+    assert lines[0].startswith("linha,codigo_material,descricao,status")
+    assert lines[1].startswith("1,1148-200-0249,MS 162 Motosserra,ok")
+    assert lines[-1].startswith("TOTAL,")
+
+
+def test_engine_validates_uf_and_size():
+    engine = QuoteEngine(max_lines=2)
+    with pytest.raises(QuoteError):
+        engine.quote([("1148-200-0249", 1)], "XX")
+    with pytest.raises(QuoteError):
+        engine.quote([("a", 1)] * 3, "SP")
+    assert engine.resolve_cd("RS") == "rs"
+    assert engine.resolve_cd("BA") == "sp"
+
+
+@pytest.fixture()
+def quote_api(monkeypatch):
+    monkeypatch.setenv("QUOTE_API_KEY", "segredo")
+    engine = QuoteEngine()
+    monkeypatch.setattr(engine, "fetch_products",
+                        lambda codes: {c: PRODUCTS[c] for c in codes if c in PRODUCTS})
+    monkeypatch.setattr(quote_mod, "_engine", engine)
+    return engine
+
+
+def test_quote_endpoint_requires_key(client, quote_api, monkeypatch):
+    body = {"uf": "SP", "itens": [{"codigo": "1148-200-0249", "quantidade": 1}]}
+    assert client.post("/api/quote", json=body).status_code == 401
+    monkeypatch.delenv("QUOTE_API_KEY")
+    assert client.post("/api/quote", json=body, headers={"X-API-Key": "segredo"}).status_code == 503
+
+
+def test_quote_endpoint_json(client, quote_api):
+    r = client.post("/api/quote", headers={"X-API-Key": "segredo"}, json={
+        "uf": "ba", "itens": [{"codigo": "1148-200-0249", "quantidade": 2},
+                              {"codigo_material": "0000-007-1043", "qtde": 1}],
+    })
+    assert r.status_code == 200
+    j = r.get_json()
+    assert j["success"] is True
+    assert j["resumo"]["uf"] == "BA" and j["resumo"]["itens_ok"] == 2
+    assert j["itens"][1]["quantidade"] == 5
+
+
+def test_quote_endpoint_csv_in_and_out(client, quote_api):
+    r = client.post("/api/quote?uf=SP&format=csv", headers={"X-API-Key": "segredo"},
+                    data="codigo;quantidade\n1148-200-0249;1\n", content_type="text/csv")
+    assert r.status_code == 200
+    assert r.mimetype == "text/csv"
+    rows = r.get_data(as_text=True).splitlines()
+    assert rows[1].startswith("1,1148-200-0249,")
+
+
+def test_quote_endpoint_bad_uf(client, quote_api):
+    r = client.post("/api/quote", headers={"X-API-Key": "segredo"},
+                    json={"uf": "ZZ", "itens": [["1148-200-0249", 1]]})
+    assert r.status_code == 400
@@ -0,0 +1,104 @@
+import json
+import threading
+
+import pytest
+
+import src.routes.search_api_v5 as api
+from src.models.intelligent_search_v5 import SearchResult
+
+
+def result(code, descricao="Peça"):
+    return SearchResult(source_table="pecas", codigo_material=code, descricao=descricao,
+                        preco_real=10.0, modelos="", categoria_produto="Peça", relevance_score=1.0)
+
+
+class FakeEngine:
+    def __init__(self):
+        self.searches = []
+        self.code_calls = []
+        self.lock = threading.Lock()
+
+    def search(self, query, max_results=20):
+        with self.lock:
+            self.searches.append(query)
+        if "erro" in query:
+            raise RuntimeError("falha simulada")
+        return [result("1111-111-1111", query)]
+
+    def search_by_codes(self, codes):
+        self.code_calls.append(list(codes))
+        return {c: result(c) for c in codes if c != "9999-999-9999"}
+
+
+@pytest.fixture()
+def engine(monkeypatch):
+    fake = FakeEngine()
+    monkeypatch.setattr(api, "search_engine", fake)
+    return fake
+
+
+def post_batch(client, payload):
+    r = client.post("/api/search/batch", json=payload)
+    lines = [json.loads(l) for l in r.get_data(as_text=True).splitlines() if l]
+    return r, lines
+
+
+def test_batch_dedupes_and_groups_codes(client, engine):
+    r, lines = post_batch(client, {"queries": [
+        "4134-200-0367", "filtro de ar FS221", "41342000367", "Filtro  de ar fs 221",
+        "9999-999-9999", "corrente MS250",
+    ]})
+    assert r.status_code == 200
+    assert r.mimetype == "application/x-ndjson"
+
+    # Códigos resolvidos numa única chamada, sem repetição
+    assert engine.code_calls == [["4134-200-0367", "9999-999-9999"]]
+    assert sorted(engine.searches) == ["corrente MS250", "filtro de ar FS221"]
+
+    by_query = {l["query"]: l for l in lines if "query" in l}
+    assert by_query["4134-200-0367"]["positions"] == [0, 2]
+    assert by_query["4134-200-0367"]["type"] == "code"
+    assert by_query["9999-999-9999"]["total_results"] == 0
+    assert by_query["filtro de ar FS221"]["positions"] == [1, 3]
+    assert by_query["corrente MS250"]["results"][0]["descricao"] == "corrente MS250"
+
+    summary = lines[-1]
+    assert summary["done"] is True
+    assert summary["total_queries"] == 6
+    assert summary["unique_queries"] == 4
+    assert summary["code_queries"] == 2
+
+
+def test_batch_reports_per_query_errors(client, engine):
+    r, lines = post_batch(client, {"queries": ["erro de teste", "", "serra"]})
+    assert r.status_code == 200
+    errors = [l for l in lines if l.get("success") is False]
+    assert {tuple(l["positions"]) for l in errors} == {(0,), (1,)}
+    assert lines[-1]["invalid_queries"] == 1
+
+
+def test_batch_reports_database_failure_for_codes(client, engine, monkeypatch):
+    def unavailable(codes):
+        raise RuntimeError("server closed the connection unexpectedly")
+
+    monkeypatch.setattr(engine, "search_by_codes", unavailable)
+    r, lines = post_batch(client, {"queries": ["4134-200-0367", "0000-007-1043", "serra"]})
+    assert r.status_code == 200
+    by_query = {l["query"]: l for l in lines if "query" in l}
+    for code in ("4134-200-0367", "0000-007-1043"):
+        assert by_query[code]["success"] is False
+        assert by_query[code]["error"] == "Banco de dados indisponível"
+        assert "results" not in by_query[code]
+    assert by_query["serra"]["success"] is True
+
+
+@pytest.mark.parametrize("payload", [{}, {"queries": []}, {"queries": "filtro"}])
+def test_batch_requires_query_list(client, engine, payload):
+    r = client.post("/api/search/batch", json=payload)
+    assert r.status_code == 400
+
+
+def test_batch_size_limit(client, engine, monkeypatch):
+    monkeypatch.setenv("SEARCH_BATCH_MAX_QUERIES", "3")
+    r = client.post("/api/search/batch", json={"queries": ["a", "b", "c", "d"]})
+    assert r.status_code == 400
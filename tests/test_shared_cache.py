@@ -0,0 +1,93 @@
+import pytest
+
+from src.utils.cache import ShardedLRUCache
+from src.utils.shared_cache import FLUSH_SQL, GET_SQL, SET_SQL, SWEEP_SQL, TwoTierCache
+
+
+class FakeL2:
+    """query_cache_v5 em memória, respondendo às instruções de TwoTierCache"""
+
+    def __init__(self):
+        self.rows = {}
+        self.hits = {}
+        self.calls = []
+        self.fail = False
+
+    def __call__(self, sql, params=()):
+        self.calls.append(sql)
+        if self.fail:
+            raise ConnectionError("sem banco")
+        if sql == GET_SQL:
+            row = self.rows.get(params[0])
+            return (row, 600.0) if row is not None else None
+        if sql == SET_SQL:
+            self.rows[params[0]] = params[1].adapted
+            return ("",)
+        if sql == FLUSH_SQL:
+            for key, n in zip(*params):
+                self.hits[key] = self.hits.get(key, 0) + n
+            return (len(params[0]),)
+        if sql == SWEEP_SQL:
+            return (3,)
+        raise AssertionError(sql)
+
+
+def make_cache(l2, **kwargs):
+    cache = TwoTierCache(ShardedLRUCache(max_entries=16, ttl=1800), namespace="t:",
+                         flush_interval=3600, **kwargs)
+    cache._execute = l2
+    return cache
+
+
+def test_l2_shared_between_workers():
+    l2 = FakeL2()
+    worker_a, worker_b = make_cache(l2), make_cache(l2)
+    worker_a.set("k", [1, 2])
+    assert l2.rows == {"t:k": [1, 2]}
+
+    assert worker_b.get("k") == [1, 2]
+    assert worker_b.get("k") == [1, 2]  # segunda leitura vem do L1
+    assert l2.calls.count(GET_SQL) == 1
+    stats = worker_b.stats()
+    assert stats["l2_hits"] == 1 and stats["hits"] == 1
+
+
+def test_hit_counts_are_batched():
+    l2 = FakeL2()
+    cache = make_cache(l2)
+    cache.set("a", "x")
+    for _ in range(5):
+        cache.get("a")
+    assert FLUSH_SQL not in l2.calls
+    assert cache.stats()["pending_hits"] == 5
+
+    assert cache.flush_hits() == 1
+    assert l2.hits == {"t:a": 5}
+    assert l2.calls.count(FLUSH_SQL) == 1
+    assert cache.flush_hits() == 0
+
+
+def test_l2_failure_degrades_to_l1_and_keeps_hits():
+    l2 = FakeL2()
+    cache = make_cache(l2, error_backoff=60)
+    cache.set("a", "x")
+    l2.fail = True
+    assert cache.get("a") == "x"
+    assert cache.get("b", "padrao") == "padrao"
+    calls = len(l2.calls)
+    assert cache.get("c") is None  # em backoff: não consulta o banco
+    assert len(l2.calls) == calls
+    assert cache.flush_hits() == 0
+    assert cache.stats()["pending_hits"] == 1
+    assert cache.stats()["l2_errors"] == 1
+
+
+def test_sweep_reports_removed_rows():
+    cache = make_cache(FakeL2())
+    assert cache.sweep() == 3
+    assert cache.stats()["swept_rows"] == 3
+
+
+@pytest.fixture(autouse=True)
+def _stop_workers(monkeypatch):
+    monkeypatch.setattr(TwoTierCache, "_ensure_worker", lambda self: None)
@@ -0,0 +1,101 @@
+import pytest
+
+import src.routes.search_api_v5 as api
+import src.services.tax_engine as tax_mod
+from src.models.intelligent_search_v5 import SearchResult
+from src.services.tax_engine import (
+    TaxEngine, apply_coefficients, load_products_csv, load_tax_tables_csv, resolve_cd,
+)
+
+PRODUCTS = [
+    ("1148-200-0249", "MS 162 Motosserra", 5.2, "84678100"),
+    ("1148-200-0244", "MS 172 Motosserra", 5.2, "84678100.0"),
+    ("7030-516-0000", "Óleo de corrente STIHL Magnum 1L", 0.0, "27101932"),
+    ("4140-200-0000", "Implemento KA-MM motor de poda", 5.2, "84678100"),
+]
+
+
+@pytest.fixture(scope="module")
+def engine():
+    return TaxEngine(load_tax_tables_csv(), PRODUCTS)
+
+
+def test_products_share_profiles(engine):
+    stats = engine.stats()
+    assert stats["products"] == 4
+    # As duas motosserras (mesmo NCM, IPI e linha) usam o mesmo perfil
+    assert stats["profiles"] == 3
+    assert "11482000249" not in engine and "1148-200-0249" in engine
+
+
+def test_price_matches_quote_rules(engine):
+    price = engine.price("1148-200-0249", 1199.0, "BA")
+    assert price["cd"] == "sp"
+    assert price["ipi"] == round(1199.0 * 0.052, 2)
+    assert price["icms_difal"] == round((1199.0 + price["ipi"]) * 0.072, 2)
+    assert price["st"] == 0.0
+    assert price["preco_final"] == round(1199.0 + price["ipi"] + price["icms_difal"], 2)
+    # UF com tabela própria fatura pelo próprio CD
+    assert engine.price("1148-200-0249", 1199.0, "RS")["cd"] == "rs"
+
+
+def test_st_product(engine):
+    price = engine.price("7030-516-0000", 40.0, "BA")
+    assert price["st"] == round(40.0 * (1 + 0.9672) * 0.205 - 40.0 * 0.07, 2)
+
+
+def test_ncm_row_chosen_by_description(engine):
+    tables = engine.tables
+    assert tables.icms_row("sp", "84678100", "MS 162 Motosserra") == 0
+    assert tables.icms_row("sp", "84678100", "Implemento KA motopoda") != 0
+    assert tables.icms_row("sp", "99999999", "qualquer") is None
+
+
+def test_unknown_product_or_price(engine):
+    assert engine.price("9999-999-9999", 10.0, "SP") is None
+    assert engine.price("1148-200-0249", None, "SP") is None
+    assert engine.coefficients("1148-200-0249", "XX") is None
+
+
+def test_coefficients_for_matches_snapshot(engine):
+    assert engine.coefficients_for("BA", "sp", 5.2, "84678100", False, "MS 162 Motosserra") \
+        == engine.coefficients("1148-200-0249", "BA")
+
+
+def test_resolve_cd_and_rounding():
+    assert resolve_cd("PA") == "pa"
+    assert resolve_cd("BA", default_cd="rs") == "rs"
+    with pytest.raises(ValueError):
+        resolve_cd("BA", "xx")
+    assert apply_coefficients(100.0, (0.1, 0.0, 0.0, 0.0))["total"] == 110.0
+
+
+@pytest.fixture()
+def search_api(monkeypatch, engine):
+    class FakeSearch:
+        def search_page(self, query, page_size=20, cursor=None):
+            return [SearchResult(source_table="ms", codigo_material="1148-200-0249",
+                                 descricao="MS 162 Motosserra", preco_real=1199.0, modelos="",
+                                 categoria_produto="Motosserra", relevance_score=1.0)], None
+
+    monkeypatch.setattr(api, "search_engine", FakeSearch())
+    monkeypatch.setattr(tax_mod, "_engine", engine)
+    monkeypatch.setattr(api, "log_search_analytics", lambda *a, **k: None)
+
+
+def test_search_with_uf(client, search_api, engine):
+    r = client.post("/api/search/search", json={"query": "ms 162", "uf": "ba"})
+    assert r.status_code == 200
+    result = r.get_json()["results"][0]
+    assert result["preco_uf"] == engine.price("1148-200-0249", 1199.0, "BA")
+
+    plain = client.post("/api/search/search", json={"query": "ms 162"}).get_json()["results"][0]
+    assert "preco_uf" not in plain
+
+    assert client.post("/api/search/search", json={"query": "ms 162", "uf": "ZZ"}).status_code == 400
+
+
+def test_csv_products_include_every_sheet():
+    codes = {row[0] for row in load_products_csv()}
+    # Ferramenta e EPI: planilhas exportadas em csv_outputs_v5/
+    assert {"0000-850-1300", "7026-883-3437"} <= codes
@@ -0,0 +1,139 @@
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from src.services.telegram_client import TelegramClient, TokenBucket
+
+
+class FakeBotAPI:
+    """Bot API local: responde em sequência os status programados em ``script``"""
+
+    def __init__(self):
+        self.script = []
+        self.requests = []
+        self.ports = set()
+        api = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+                api.requests.append((self.path, json.loads(body or b"{}")))
+                api.ports.add(self.client_address[1])
+                status, payload = api.script.pop(0) if api.script else (200, {"ok": True, "result": {}})
+                data = json.dumps(payload).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}"
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+@pytest.fixture()
+def bot_api():
+    api = FakeBotAPI()
+    yield api
+    api.close()
+
+
+def make_client(api, **kw):
+    kw.setdefault("chat_rate", 100.0)
+    kw.setdefault("chat_burst", 100.0)
+    return TelegramClient("TEST", api_base=api.url, timeout=5, **kw)
+
+
+def test_send_message_reuses_connection(bot_api):
+    client = make_client(bot_api)
+    for i in range(5):
+        assert client.send_message(42, f"msg {i}")
+
+    assert [p for p, _ in bot_api.requests] == ["/botTEST/sendMessage"] * 5
+    assert bot_api.requests[0][1] == {"chat_id": 42, "text": "msg 0"}
+    # Keep-alive: todas as mensagens pela mesma conexão
+    assert len(bot_api.ports) == 1
+    stats = client.stats()
+    assert stats["sent"] == 5 and stats["failed"] == 0
+    assert stats["latency_ms_max"] >= stats["latency_ms_p50"] > 0
+
+
+def test_429_honors_retry_after(bot_api):
+    bot_api.script = [(429, {"ok": False, "error_code": 429, "parameters": {"retry_after": 1}})]
+    client = make_client(bot_api)
+
+    start = time.monotonic()
+    assert client.send_message(42, "oi")
+    assert time.monotonic() - start >= 1.0
+
+    stats = client.stats()
+    assert stats["throttled_429"] == 1
+    assert stats["retries"] == 1
+    assert stats["sent"] == 1
+    assert len(bot_api.requests) == 2
+
+
+def test_5xx_retried_then_gives_up(bot_api):
+    bot_api.script = [(502, {"ok": False})] * 3
+    client = make_client(bot_api, max_retries=2)
+
+    assert not client.send_message(42, "oi")
+    stats = client.stats()
+    assert stats["retries"] == 2 and stats["failed"] == 1
+    assert len(bot_api.requests) == 3
+
+
+def test_4xx_not_retried(bot_api):
+    bot_api.script = [(403, {"ok": False, "description": "bot was blocked by the user"})]
+    client = make_client(bot_api)
+
+    assert not client.send_message(42, "oi")
+    assert client.stats()["retries"] == 0
+    assert len(bot_api.requests) == 1
+
+
+def test_per_chat_bucket_throttles(bot_api):
+    client = make_client(bot_api, chat_rate=10.0, chat_burst=1.0)
+
+    start = time.monotonic()
+    for _ in range(3):
+        assert client.send_message(1, "x")
+    # Rajada de 1 e 10 msg/s: a 2ª e a 3ª esperam ~0,1s cada
+    assert time.monotonic() - start >= 0.18
+    assert client.stats()["throttle_waits"] == 2
+
+    # Outro chat tem bucket próprio
+    start = time.monotonic()
+    assert client.send_message(2, "x")
+    assert time.monotonic() - start < 0.1
+
+
+def test_gives_up_when_wait_exceeds_limit(bot_api):
+    client = make_client(bot_api, chat_rate=0.01, chat_burst=1.0, max_wait=1.0)
+
+    assert client.send_message(7, "x")
+    assert not client.send_message(7, "x")
+    assert client.stats()["gave_up_throttled"] == 1
+    assert len(bot_api.requests) == 1
+
+
+def test_token_bucket_reserve():
+    bucket = TokenBucket(rate=2.0, capacity=2.0)
+    assert bucket.reserve() == 0.0
+    assert bucket.reserve() == 0.0
+    assert bucket.reserve() == pytest.approx(0.5, abs=0.05)
+    bucket.block(3.0)
+    assert bucket.reserve() >= 2.9
@@ -0,0 +1,162 @@
+import threading
+import time
+
+import pytest
+
+import src.routes.telegram_webhook as tg
+import src.services.telegram_dispatcher as dispatcher_mod
+import src.services.update_dedup as dedup_mod
+from src.services.telegram_dispatcher import UpdateDispatcher
+from src.services.update_dedup import UpdateDeduplicator
+
+
+def update(text, chat_id=42, update_id=1):
+    return {"update_id": update_id, "message": {"chat": {"id": chat_id}, "text": text}}
+
+
+@pytest.fixture()
+def telegram_env(monkeypatch):
+    monkeypatch.setenv("TELEGRAM_BOT_TOKEN", "123:abc")
+    monkeypatch.delenv("TELEGRAM_SECRET_TOKEN", raising=False)
+    monkeypatch.delenv("TELEGRAM_WEBHOOK_SECRET", raising=False)
+    sent = []
+    monkeypatch.setattr(tg, "_send_message", lambda token, chat_id, text: sent.append((chat_id, text)))
+    monkeypatch.setattr(dispatcher_mod, "_dispatcher", None)
+    monkeypatch.setattr(dedup_mod, "_dedup", None)
+    yield sent
+    if dispatcher_mod._dispatcher is not None:
+        dispatcher_mod._dispatcher.drain(5)
+
+
+def test_webhook_returns_before_search_runs(client, telegram_env, monkeypatch):
+    release = threading.Event()
+
+    def slow_search(text):
+        release.wait(5)
+        return {"text": f"resposta para {text}"}
+
+    monkeypatch.setattr(tg, "search_and_format", slow_search)
+    r = client.post("/bot/telegram/webhook", json=update("filtro de ar FS221"))
+    assert r.status_code == 200
+    assert r.get_json() == {"ok": True, "queued": True}
+    assert telegram_env == []
+
+    release.set()
+    assert dispatcher_mod._dispatcher.drain(5)
+    assert telegram_env == [(42, "resposta para filtro de ar FS221")]
+    assert client.get("/bot/telegram/webhook/health").get_json()["queue"]["processed"] == 1
+
+
+def test_full_queue_answers_503(client, telegram_env, monkeypatch):
+    started, release = threading.Event(), threading.Event()
+
+    def blocking_search(text):
+        started.set()
+        release.wait(5)
+        return {"text": text}
+
+    monkeypatch.setattr(tg, "search_and_format", blocking_search)
+    monkeypatch.setattr(dispatcher_mod, "_dispatcher",
+                        UpdateDispatcher(tg._process_update, workers=1, max_queue=1))
+
+    post = lambda i: client.post("/bot/telegram/webhook", json=update(f"q{i}", update_id=i))
+    codes = [post(0).status_code]
+    assert started.wait(5)  # único worker ocupado
+    codes += [post(1).status_code, post(2).status_code]
+    release.set()
+
+    assert codes == [200, 200, 503]
+    assert dispatcher_mod._dispatcher.stats()["rejected"] == 1
+    # O update recusado não fica marcado: o reenvio do Telegram é aceito
+    deadline = time.monotonic() + 5
+    while dispatcher_mod._dispatcher.stats()["processed"] < 2 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert post(2).status_code == 200
+
+
+def test_redelivered_update_is_not_processed_twice(client, telegram_env, monkeypatch):
+    calls = []
+    monkeypatch.setattr(tg, "search_and_format", lambda text: calls.append(text) or {"text": text})
+
+    first = client.post("/bot/telegram/webhook", json=update("serra MS 250", update_id=77))
+    again = client.post("/bot/telegram/webhook", json=update("serra MS 250", update_id=77))
+    assert first.get_json() == {"ok": True, "queued": True}
+    assert again.status_code == 200
+    assert again.get_json() == {"ok": True, "duplicate": True}
+
+    assert dispatcher_mod._dispatcher.drain(5)
+    assert calls == ["serra MS 250"]
+    assert len(telegram_env) == 1
+    dedup = client.get("/bot/telegram/webhook/health").get_json()["dedup"]
+    assert dedup["duplicates"] == 1 and dedup["accepted"] == 1
+
+
+class FakeStore:
+    """Registro compartilhado em memória (o papel de telegram_updates_v5)"""
+
+    def __init__(self, fail=False):
+        self.ids = set()
+        self.fail = fail
+
+    def claim(self, update_id):
+        if self.fail:
+            raise RuntimeError("banco fora do ar")
+        if update_id in self.ids:
+            return False
+        self.ids.add(update_id)
+        return True
+
+    def release(self, update_id):
+        self.ids.discard(update_id)
+
+
+def test_shared_store_catches_redelivery_to_other_worker():
+    store = FakeStore()
+    worker_a = UpdateDeduplicator(window=8, store=store)
+    worker_b = UpdateDeduplicator(window=8, store=store)
+
+    assert worker_a.claim(10)
+    assert not worker_b.claim(10)
+    assert worker_b.stats()["shared_duplicates"] == 1
+
+    worker_a.release(10)
+    assert worker_b.claim(11) and not worker_a.claim(11)
+
+
+def test_window_forgets_oldest_ids():
+    dedup = UpdateDeduplicator(window=3)
+    for i in range(5):
+        assert dedup.claim(i)
+    assert not dedup.claim(4)
+    assert dedup.claim(0)  # saiu da janela
+    assert dedup.stats()["window_entries"] == 3
+
+
+def test_store_errors_fall_back_to_memory():
+    dedup = UpdateDeduplicator(store=FakeStore(fail=True), error_backoff=60)
+    assert dedup.claim(1)
+    assert not dedup.claim(1)
+    stats = dedup.stats()
+    assert stats["store_errors"] == 1 and not stats["shared_store_available"]
+
+
+def test_drain_finishes_queue_and_rejects_new_items():
+    done = []
+    release = threading.Event()
+    d = UpdateDispatcher(lambda item: release.wait(5) and done.append(item), workers=2, max_queue=10)
+    for i in range(5):
+        assert d.submit(i)
+    release.set()
+
+    assert d.drain(5)
+    assert sorted(done) == [0, 1, 2, 3, 4]
+    assert not d.submit(99)
+    stats = d.stats()
+    assert stats["queue_depth"] == 0 and stats["processed"] == 5 and stats["rejected"] == 1
+
+
+def test_handler_errors_are_counted():
+    d = UpdateDispatcher(lambda item: 1 / 0, workers=1)
+    d.submit("x")
+    assert d.drain(5)
+    assert d.stats()["failed"] == 1
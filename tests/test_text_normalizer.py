@@ -0,0 +1,70 @@
+import pytest
+
+from src.services.text_normalizer import (
+    canonical_query, canonical_query_key, extract_price_bounds, material_code, model_search_text,
+)
+
+
+@pytest.mark.parametrize("query", [
+    "Filtro de ar FS221",
+    "filtro  de ar fs 221",
+    "filtro do ar FS-221",
+    "FITRO DO AR fs221",
+])
+def test_spellings_share_canonical_key(query):
+    assert canonical_query_key(query) == canonical_query_key("filtro de ar FS221")
+
+
+def test_canonical_query_fields():
+    c = canonical_query("Pistão MS 250 até R$ 1.500,00 para uso profissional")
+    assert c == {
+        "code": None,
+        "models": ["MS250"],
+        "part_type": "pistao",
+        "spec": None,
+        "price_min": None,
+        "price_max": 1500.0,
+        "terms": ["profissional", "uso"],
+    }
+
+
+def test_distinct_queries_keep_distinct_keys():
+    keys = {canonical_query_key(q) for q in (
+        "filtro de ar MS250", "filtro de ar MS260", "filtro de óleo MS250",
+        "motosserra leve", "motosserra potente", "motosserra até 1000",
+    )}
+    assert len(keys) == 6
+
+
+@pytest.mark.parametrize("text,bounds", [
+    ("ate r$ 500", (None, 500.0)),
+    ("acima de 1.000", (1000.0, None)),
+    ("entre 200 e 100 reais", (100.0, 200.0)),
+    ("abaixo de 49,90", (None, 49.9)),
+    ("motosserra ms250", (None, None)),
+])
+def test_price_bounds(text, bounds):
+    assert extract_price_bounds(text) == bounds
+
+
+def test_spec_requires_whole_words():
+    c = canonical_query("motosserra para poda de árvores")
+    assert c["spec"] is None
+    assert "arvores" in c["terms"]
+
+
+@pytest.mark.parametrize("query,code", [
+    ("4134-200-0367", "4134-200-0367"),
+    (" 41342000367 ", "4134-200-0367"),
+    ("4134 200 0367", "4134-200-0367"),
+    ("filtro 4134-200-0367", None),
+    ("MS 250", None),
+])
+def test_material_code(query, code):
+    assert material_code(query) == code
+
+
+def test_model_search_text():
+    assert model_search_text("MS162") == "ms 162"
+    assert model_search_text("MSA 220 C") == "msa 220"
+    assert model_search_text("fs-220") == "fs 220"
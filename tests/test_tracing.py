@@ -0,0 +1,173 @@
+import json
+import threading
+
+import pytest
+
+import src.routes.search_api_v5 as api
+import src.routes.telegram_webhook as tg
+import src.services.telegram_dispatcher as dispatcher_mod
+import src.services.update_dedup as dedup_mod
+import src.utils.tracing as tracing
+from src.utils.tracing import (
+    JsonLinesWriter, TraceExporter, Tracer, TraceStore, otlp_payload, render_waterfall, span, traced, waterfall,
+)
+
+AUTH = {"Authorization": "Bearer segredo"}
+
+
+@pytest.fixture()
+def tracer(monkeypatch):
+    monkeypatch.delenv("TRACING", raising=False)
+    monkeypatch.setenv("METRICS_TOKEN", "segredo")
+    t = Tracer(sample_rate=1.0, slow_ms=10_000, store=TraceStore(10))
+    monkeypatch.setattr(tracing, "_tracer", t)
+    return t
+
+
+@traced("fake.db")
+def fake_db(fail=False):
+    if fail:
+        raise RuntimeError("timeout")
+    return 3
+
+
+def test_spans_nest_and_traced_is_noop_outside_a_trace(tracer):
+    assert fake_db() == 3
+    assert len(tracer.store) == 0
+
+    with span("root") as root:
+        fake_db()
+        with span("child"):
+            fake_db()
+    spans = tracer.store.get(root.trace_id)
+    by_name = {}
+    for s in spans:
+        by_name.setdefault(s["name"], []).append(s)
+    assert by_name["root"][0]["parent_id"] is None
+    assert by_name["child"][0]["parent_id"] == root.span_id
+    assert sorted(s["parent_id"] for s in by_name["fake.db"]) == sorted([root.span_id, by_name["child"][0]["span_id"]])
+
+    rows = waterfall(spans)
+    assert [(r["name"], r["depth"]) for r in rows] == [("root", 0), ("fake.db", 1), ("child", 1), ("fake.db", 2)]
+    assert "    fake.db" in render_waterfall(rows)
+
+
+def test_unsampled_segments_kept_only_when_slow_or_failed(tracer):
+    tracer.sample_rate = 0.0
+    with span("rapido") as fast:
+        fake_db()
+    assert tracer.store.get(fast.trace_id) is None
+
+    with pytest.raises(RuntimeError):
+        with span("falha") as failed:
+            fake_db(fail=True)
+    errors = [s["error"] for s in tracer.store.get(failed.trace_id)]
+    assert "RuntimeError: timeout" in errors
+
+    tracer.slow_ms = 0
+    with span("lento") as slow:
+        pass
+    assert tracer.store.get(slow.trace_id) is not None
+    assert tracer.stats()["kept_error"] == 1 and tracer.stats()["kept_slow"] == 1
+
+
+def test_search_request_waterfall_by_request_id(client, tracer, monkeypatch):
+    monkeypatch.setattr(api, "record_query", lambda *a: None)
+    monkeypatch.setattr(api, "emit_search_event", lambda *a: True)
+
+    class FakeSearch:
+        @traced("search.search_page")
+        def search_page(self, query, page_size=20, cursor=None):
+            fake_db()
+            return [], None
+
+    monkeypatch.setattr(api, "search_engine", FakeSearch())
+    r = client.post("/api/search/search", json={"query": "filtro"}, headers={"X-Request-ID": "req-123"})
+    assert r.status_code == 200
+    assert r.headers["X-Request-ID"] == "req-123"
+    trace_id = r.headers["traceparent"].split("-")[1]
+
+    view = client.get("/api/debug/trace/req-123", headers=AUTH).get_json()
+    assert view["trace_id"] == trace_id
+    assert [(s["name"], s["depth"]) for s in view["spans"]] == [
+        ("POST /api/search/search", 0), ("search.search_page", 1), ("fake.db", 2)]
+    assert view["spans"][0]["attributes"]["http.status_code"] == 200
+
+    text = client.get(f"/api/debug/trace/{trace_id}?format=text", headers=AUTH).get_data(as_text=True)
+    assert text.startswith(f"trace {trace_id}  request_id=req-123")
+    assert client.get("/api/debug/traces", headers=AUTH).get_json()["traces"][0]["request_id"] == "req-123"
+    assert client.get("/api/debug/trace/nao-existe", headers=AUTH).status_code == 404
+
+
+def test_debug_views_closed_without_token(client, tracer, monkeypatch):
+    assert client.get("/api/debug/traces").status_code == 401
+    monkeypatch.delenv("METRICS_TOKEN")
+    assert client.get("/api/debug/traces").status_code == 403
+    assert client.get("/api/debug/trace/qualquer").status_code == 403
+
+
+def test_traceparent_continues_caller_trace(client, tracer):
+    parent = "00-" + "a" * 32 + "-" + "b" * 16 + "-01"
+    r = client.get("/api/search/health", headers={"traceparent": parent})
+    assert r.headers["traceparent"].startswith("00-" + "a" * 32 + "-")
+    # Sem X-Request-ID, o trace_id identifica a requisição
+    assert r.headers["X-Request-ID"] == "a" * 32
+    root = tracer.store.get("a" * 32)[0]
+    assert root["parent_id"] == "b" * 16
+
+
+def test_span_named_after_route_rule(client, tracer, monkeypatch):
+    monkeypatch.setattr(api, "current_catalog_version", lambda: None)
+    monkeypatch.setattr(api, "search_engine", type("Engine", (), {"search_by_code": lambda self, code: None})())
+    r = client.get("/api/search/product/0000-007-1043")
+    assert r.status_code == 404
+    root = tracer.store.get(r.headers["X-Request-ID"])[0]
+    assert root["name"] == "GET /api/search/product/<string:code>"
+    assert root["attributes"]["http.route"] == "/api/search/product/<string:code>"
+
+    r = client.delete("/api/search/product/0000-007-1043")
+    assert r.status_code == 405
+    root = tracer.store.get(r.headers["X-Request-ID"])[0]
+    assert root["name"] == "DELETE unmatched"
+    assert root["attributes"]["http.route"] == "unmatched"
+
+
+def test_telegram_worker_continues_webhook_trace(client, tracer, monkeypatch):
+    monkeypatch.setenv("TELEGRAM_BOT_TOKEN", "123:abc")
+    monkeypatch.delenv("TELEGRAM_SECRET_TOKEN", raising=False)
+    monkeypatch.delenv("TELEGRAM_WEBHOOK_SECRET", raising=False)
+    monkeypatch.setattr(dispatcher_mod, "_dispatcher", None)
+    monkeypatch.setattr(dedup_mod, "_dedup", None)
+    sent = threading.Event()
+    monkeypatch.setattr(tg, "get_telegram_client", lambda token: type(
+        "Client", (), {"send_message": lambda self, *a, **k: sent.set()})())
+    monkeypatch.setattr(tg, "search_and_format", lambda text: {"text": str(fake_db())})
+
+    r = client.post("/bot/telegram/webhook", json={"update_id": 7, "message": {"chat": {"id": 1}, "text": "oi"}})
+    assert r.status_code == 200
+    assert dispatcher_mod._dispatcher.drain(5) and sent.is_set()
+
+    spans = tracer.store.get(r.headers["X-Request-ID"])
+    names = [row["name"] for row in waterfall(spans)]
+    assert names == ["POST /bot/telegram/webhook", "telegram.process_update", "fake.db", "telegram.send_message"]
+    assert len({s["trace_id"] for s in spans}) == 1
+
+
+def test_exporters(tmp_path):
+    record = {"trace_id": "a" * 32, "span_id": "b" * 16, "parent_id": None, "request_id": "r1",
+              "name": "GET /x", "start_ns": 1_000, "duration_ms": 2.5, "attributes": {"rows": 3},
+              "error": "RuntimeError: x"}
+    path = tmp_path / "traces.jsonl"
+    JsonLinesWriter(str(path))([record, record])
+    assert [json.loads(line)["name"] for line in path.read_text().splitlines()] == ["GET /x", "GET /x"]
+
+    encoded = otlp_payload([record])["resourceSpans"][0]["scopeSpans"][0]["spans"][0]
+    assert encoded["endTimeUnixNano"] == str(1_000 + 2_500_000)
+    assert {"key": "rows", "value": {"intValue": "3"}} in encoded["attributes"]
+    assert encoded["status"] == {"code": 2, "message": "RuntimeError: x"}
+    assert "parentSpanId" not in encoded
+
+    batches, done = [], threading.Event()
+    exporter = TraceExporter(lambda spans: (batches.append(spans), done.set()), max_queue=2)
+    assert exporter.submit([record])
+    assert done.wait(5) and batches == [[record]]